@@ -0,0 +1,207 @@
+"""Benchmark of the numpy and arrow dtype backends (--metadata dtype_backend arrow)
+
+Fetched rows of a wide VARCHAR heavy result (strings, decimals, ints,
+DIFF columns) are converted, checked by the diff, rendered to html and
+exported to xlsx and parquet in both modes
+
+    python benchmarks/bench_dtype_backend.py [--rows 200000] [--repeat 3]
+
+Time of every stage, memory of the result (df.memory_usage deep) and the
+peaks of the fetch are printed: python allocations (tracemalloc) and the
+arrow memory pool (the arrow buffers are allocated outside of
+tracemalloc). The diff results of the modes must be the same.
+"""
+
+import argparse
+import decimal
+import gc
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pyarrow as pa
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT_DIR)
+
+# pylint: disable=wrong-import-position
+from lib.continuous_data_testing.arrow_types import DTYPE_BACKEND_ARROW  # noqa: E402
+from lib.continuous_data_testing.arrow_types import rows_to_table  # noqa: E402
+from lib.continuous_data_testing.arrow_types import table_to_df  # noqa: E402
+from lib.continuous_data_testing.diff import apply_diff_by_column_name  # noqa: E402
+from lib.continuous_data_testing.html_report import df_to_html  # noqa: E402
+from lib.continuous_data_testing.utils import df_to_native_types  # noqa: E402
+from lib.continuous_data_testing.utils import get_df_test_index  # noqa: E402
+from lib.continuous_data_testing.utils import write_test_results_to_excel  # noqa: E402
+from lib.continuous_data_testing.utils import write_test_results_to_parquet  # noqa: E402
+
+import pandas as pd  # noqa: E402  pylint: disable=wrong-import-order
+
+BACKENDS = ("numpy", DTYPE_BACKEND_ARROW)
+
+# xlsx export of the whole result takes minutes in both modes
+XLSX_ROWS = 10_000
+
+TEST_ID = "test_run_sql[bench.sql]"
+
+
+def make_rows(rows, string_cols=10, decimal_cols=4, int_cols=4, diff_cols=2,
+              density=0.01, seed=0):
+    """rows as fetched by the driver (tuples of python values) and the keys"""
+
+    rng = np.random.default_rng(seed)
+
+    columns = {}
+
+    for i in range(string_cols):
+        columns[f"NAME_{i}"] = [f"customer name {v} / segment {v % 7}"
+                                for v in rng.integers(0, 10 ** 6, rows)]
+
+    for i in range(decimal_cols):
+        columns[f"AMOUNT_{i}"] = [decimal.Decimal(int(v)).scaleb(-2)
+                                  for v in rng.integers(0, 10 ** 8, rows)]
+
+    for i in range(int_cols):
+        columns[f"ID_{i}"] = [int(v) for v in rng.integers(0, 10 ** 9, rows)]
+
+    for i in range(diff_cols):
+        violations = rng.random(rows) < density
+        columns[f"DIFF_{i}"] = [float(v) for v in np.where(violations,
+                                                           rng.normal(0, 10, rows), 0.0)]
+
+    return list(zip(*columns.values())), list(columns)
+
+
+def fetch(rows, keys, backend):
+    """result as the runner converts it"""
+
+    if backend == DTYPE_BACKEND_ARROW:
+        return df_to_native_types(table_to_df(rows_to_table(rows, keys)), backend)
+
+    return df_to_native_types(pd.DataFrame(rows, columns=keys))
+
+
+def run_stages(rows, keys, backend, work_dir):
+    """{stage: seconds}, result"""
+
+    times = {}
+
+    t1_start = time.perf_counter()
+    df = fetch(rows, keys, backend)
+    times["fetch"] = time.perf_counter() - t1_start
+
+    df.attrs = {"config-file": "bench.sql"}
+
+    t1_start = time.perf_counter()
+    apply_diff_by_column_name(df)
+    times["diff"] = time.perf_counter() - t1_start
+
+    t1_start = time.perf_counter()
+    df_to_html(df)
+    times["html"] = time.perf_counter() - t1_start
+
+    df_xlsx = df.head(XLSX_ROWS)
+    df_xlsx.attrs = df.attrs
+
+    t1_start = time.perf_counter()
+    write_test_results_to_excel(get_df_test_index({TEST_ID: df_xlsx}), {TEST_ID: df_xlsx},
+                                os.path.join(work_dir, f"bench_{backend}.xlsx"))
+    times["xlsx"] = time.perf_counter() - t1_start
+
+    t1_start = time.perf_counter()
+    write_test_results_to_parquet(get_df_test_index({TEST_ID: df}), {TEST_ID: df},
+                                  os.path.join(work_dir, f"parquet_{backend}"))
+    times["parquet"] = time.perf_counter() - t1_start
+
+    return times, df
+
+
+def measure(rows, keys, backend, work_dir, repeat):
+    """median stage times, result memory and peaks [MiB]"""
+
+    stage_times = []
+
+    for _ in range(repeat):
+        gc.collect()
+        times, df = run_stages(rows, keys, backend, work_dir)
+        stage_times.append(times)
+
+    result_mib = df.memory_usage(index=False, deep=True).sum() / 1024 / 1024
+    diff_summary = df.attrs.get("diff_summary_list")
+
+    del df
+    gc.collect()
+
+    # fresh statistics of the arrow allocations
+    default_pool = pa.default_memory_pool()
+    pool = pa.proxy_memory_pool(default_pool)
+    pa.set_memory_pool(pool)
+
+    tracemalloc.start()
+    try:
+        fetch(rows, keys, backend)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        pa.set_memory_pool(default_pool)
+
+    medians = {stage: statistics.median(times[stage] for times in stage_times)
+               for stage in stage_times[0]}
+
+    return {"times": medians,
+            "result_mib": result_mib,
+            "peak_mib": peak / 1024 / 1024,
+            "arrow_mib": pool.max_memory() / 1024 / 1024,
+            "diff_summary": diff_summary}
+
+
+def main():
+    """run benchmark"""
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rows, keys = make_rows(args.rows)
+
+    results = {}
+
+    with tempfile.TemporaryDirectory(prefix="bench_dtype_backend_") as work_dir:
+        for backend in BACKENDS:
+            results[backend] = measure(rows, keys, backend, work_dir, args.repeat)
+
+    stages = list(results[BACKENDS[0]]["times"])
+
+    print(f"{args.rows:,} rows x {len(keys)} columns")
+    print(f"{'backend':<10}" + "".join(f"{stage + ' [s]':>13}" for stage in stages)
+          + f"{'result [MiB]':>15}{'py peak [MiB]':>15}{'arrow [MiB]':>13}")
+
+    for backend, result in results.items():
+        print(f"{backend:<10}" + "".join(f"{result['times'][stage]:>13.3f}" for stage in stages)
+              + f"{result['result_mib']:>15.1f}{result['peak_mib']:>15.1f}"
+              + f"{result['arrow_mib']:>13.1f}")
+
+    numpy_result, arrow_result = results["numpy"], results[DTYPE_BACKEND_ARROW]
+
+    memory_ratio = numpy_result["result_mib"] / arrow_result["result_mib"]
+    time_ratio = ((numpy_result["times"]["fetch"] + numpy_result["times"]["diff"])
+                  / (arrow_result["times"]["fetch"] + arrow_result["times"]["diff"]))
+
+    print(f"arrow result memory {memory_ratio:.1f}x smaller, fetch + diff {time_ratio:.1f}x faster")
+
+    same_diff = numpy_result["diff_summary"] == arrow_result["diff_summary"]
+
+    print(f"same diff result: {same_diff}")
+
+    return 0 if same_diff else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,489 @@
+"""Benchmark of the diff, conversion, discovery and export hot paths
+
+    apply_diff_by_column_name     wide / tall frames, DIFF columns count and
+                                  violation density, string DIFF columns
+    df_to_native_types            fetched object columns (decimal, string)
+    get_files                     directory with 10k .sql / .yml files
+    get_df_test_index             index of many test results
+    render_template               2k multi-KB sql templates (metadata patterns
+                                  and placeholders), compiled once, rendered
+    write_test_results_to_excel   xlsx report
+    SnowflakeTestRunner           run_test + diff against the local sqlite
+                                  engine (snapshot replay, replay_engine_url)
+
+Median time, throughput and peak memory (tracemalloc) of every case are
+compared with the stored baseline
+
+    python benchmarks/bench_hot_paths.py [--case diff] [--repeat 3] [--scale 1]
+    python benchmarks/bench_hot_paths.py --update-baseline
+
+Exit code 1 if a case is slower or uses more memory than the baseline
+over the tolerance. The baseline is machine specific, update it on the
+machine running the benchmark job.
+"""
+
+import argparse
+import decimal
+import gc
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT_DIR)
+
+# pylint: disable=wrong-import-position
+from lib.continuous_data_testing.diff import apply_diff_by_column_name  # noqa: E402
+from lib.continuous_data_testing.snowflake_test_runner import SnowflakeTestRunner  # noqa: E402
+from lib.continuous_data_testing.templating import render_template  # noqa: E402
+from lib.continuous_data_testing.utils import df_to_native_types  # noqa: E402
+from lib.continuous_data_testing.utils import get_df_test_index  # noqa: E402
+from lib.continuous_data_testing.utils import get_files  # noqa: E402
+from lib.continuous_data_testing.utils import write_test_results_to_excel  # noqa: E402
+
+DEFAULT_BASELINE_FILE = os.path.join(ROOT_DIR, "benchmarks", "bench_hot_paths_baseline.json")
+
+# allowed slowdown / memory growth over the baseline
+DEFAULT_TIME_TOLERANCE = 0.5
+DEFAULT_MEMORY_TOLERANCE = 0.2
+
+# very short cases are noisy, slowdown under this is ignored [s]
+MIN_TIME_DELTA = 0.01
+
+
+#########################################
+# Synthetic data
+#########################################
+
+def make_frame(rows, cols, diff_cols=1, density=0.01, string_cols=0,
+               decimal_cols=0, string_diff=False, seed=0):
+    """test result frame
+
+    cols float value columns, diff_cols DIFF columns with density of
+    violations (non zero values), string and decimal (object) columns
+    """
+
+    rng = np.random.default_rng(seed)
+
+    data = {}
+
+    for i in range(cols):
+        data[f"VALUE_{i}"] = rng.normal(1000, 100, rows)
+
+    for i in range(string_cols):
+        data[f"NAME_{i}"] = pd.array([f"name {v}" for v in rng.integers(0, 1000, rows)],
+                                     dtype="string")
+
+    for i in range(decimal_cols):
+        data[f"AMOUNT_{i}"] = [decimal.Decimal(int(v)).scaleb(-2)
+                               for v in rng.integers(0, 10 ** 8, rows)]
+
+    for i in range(diff_cols):
+        violations = rng.random(rows) < density
+
+        if string_diff:
+            data[f"DIFF_{i}"] = pd.array(np.where(violations, "changed", "0"), dtype="string")
+        else:
+            data[f"DIFF_{i}"] = np.where(violations, rng.normal(0, 10, rows), 0.0)
+
+    return pd.DataFrame(data)
+
+
+def make_fetched_frame(rows, cols, seed=0):
+    """frame as fetched from the connector: object columns of decimal,
+    string, int and float values
+    """
+
+    rng = np.random.default_rng(seed)
+
+    data = {}
+
+    for i in range(cols):
+        values = rng.integers(0, 10 ** 8, rows)
+
+        if i % 4 == 0:
+            data[f"AMOUNT_{i}"] = [decimal.Decimal(int(v)).scaleb(-2) for v in values]
+        elif i % 4 == 1:
+            data[f"NAME_{i}"] = [f"name {v}" for v in values]
+        elif i % 4 == 2:
+            data[f"ID_{i}"] = pd.Series([int(v) for v in values], dtype="object")
+        else:
+            data[f"DIFF_{i}"] = pd.Series([float(v) / 100 for v in values], dtype="object")
+
+    return pd.DataFrame(data)
+
+
+def make_test_results(tests, rows, cols, density=0.01):
+    """{test id: result} with attrs as set by the runner and the diff"""
+
+    test_results = {}
+
+    for i in range(tests):
+        df = make_frame(rows, cols, diff_cols=2, density=density, string_cols=1, seed=i)
+        df.attrs = {"sql": f"SELECT *\n\n  FROM BENCH_{i}\n\tWHERE 1 = 1",
+                    "description": f"benchmark test {i}\nsecond line\nthird line",
+                    "rowcount": rows,
+                    "config-file": f"bench_{i}.yml"}
+        apply_diff_by_column_name(df)
+
+        test_results[f"test_run_sql[bench_{i}.yml]"] = df
+
+    return test_results
+
+
+def make_test_tree(test_dir, files, pair_ratio=0.1):
+    """directory with .sql / .yml test files, pair_ratio of the yml files
+    have the .sql with the same name, plus the directory default yml
+    """
+
+    os.makedirs(test_dir, exist_ok=True)
+
+    pair_every = max(1, round(1 / pair_ratio))
+
+    for i in range(files):
+
+        if i % 2 == 0:
+            file_name = f"test_{i}.sql"
+        elif (i // 2) % pair_every == 0:
+            # yml of the previous sql, the sql is skipped
+            file_name = f"test_{i - 1}.yml"
+        else:
+            file_name = f"test_{i}.yml"
+
+        with open(os.path.join(test_dir, file_name), "w", encoding="utf8") as f:
+            f.write("SELECT 1 AS DIFF\n")
+
+    with open(os.path.join(test_dir, os.path.basename(test_dir) + ".yml"),
+              "w", encoding="utf8") as f:
+        f.write("data-test:\n  diff_by_column_name:\n    limit: 0\n")
+
+
+def make_runner_tree(test_dir, db_file, tests, rows, density=0.01):
+    """yml tests selecting from the sqlite table of the local engine"""
+
+    os.makedirs(test_dir, exist_ok=True)
+
+    df = make_frame(rows * tests, 8, diff_cols=2, density=density, string_cols=1)
+    df.insert(0, "TEST_NO", np.arange(rows * tests) // rows)
+
+    with sqlite3.connect(db_file) as conn:
+        df.to_sql("BENCH_DATA", conn, index=False, if_exists="replace")
+        conn.execute("CREATE INDEX BENCH_DATA_TEST_NO ON BENCH_DATA (TEST_NO)")
+
+    for i in range(tests):
+        with open(os.path.join(test_dir, f"bench_{i}.yml"), "w", encoding="utf8") as f:
+            f.write(f"description: benchmark test {i}\n"
+                    + "sql: |\n"
+                    + f"  SELECT * FROM BENCH_DATA WHERE TEST_NO = {i}\n")
+
+
+#########################################
+# Cases
+#
+# case(scale, work_dir) -> (run, units, unit name)
+#########################################
+
+def case_diff_wide(scale, _work_dir):
+    """diff: 10k rows x 200 columns, 20 DIFF columns"""
+
+    df = make_frame(10_000 * scale, 180, diff_cols=20, density=0.01,
+                    string_cols=10, decimal_cols=0)
+
+    def run():
+        df.attrs = {}
+        apply_diff_by_column_name(df)
+
+    return run, df.shape[0] * df.shape[1], "cells"
+
+
+def case_diff_tall(scale, _work_dir):
+    """diff: 1M rows x 10 columns, 2 DIFF columns"""
+
+    df = make_frame(1_000_000 * scale, 8, diff_cols=2, density=0.001)
+
+    def run():
+        df.attrs = {}
+        apply_diff_by_column_name(df)
+
+    return run, df.shape[0] * df.shape[1], "cells"
+
+
+def case_diff_dense(scale, _work_dir):
+    """diff: 200k rows, 5 DIFF columns, 50 % violations"""
+
+    df = make_frame(200_000 * scale, 5, diff_cols=5, density=0.5)
+
+    def run():
+        df.attrs = {}
+        apply_diff_by_column_name(df)
+
+    return run, df.shape[0] * df.shape[1], "cells"
+
+
+def case_diff_string(scale, _work_dir):
+    """diff: 200k rows, 3 string DIFF columns, decimal columns"""
+
+    df = make_frame(200_000 * scale, 5, diff_cols=3, density=0.01,
+                    decimal_cols=2, string_diff=True)
+
+    def run():
+        df.attrs = {}
+        apply_diff_by_column_name(df)
+
+    return run, df.shape[0] * df.shape[1], "cells"
+
+
+def case_native_types(scale, _work_dir):
+    """df_to_native_types: 100k rows x 20 object columns"""
+
+    df = make_fetched_frame(100_000 * scale, 20)
+
+    def run():
+        df_to_native_types(df)
+
+    return run, df.shape[0] * df.shape[1], "cells"
+
+
+def case_get_files(scale, work_dir):
+    """get_files: 10k .sql / .yml files"""
+
+    test_dir = os.path.join(work_dir, "get_files")
+    files = 10_000 * scale
+    make_test_tree(test_dir, files)
+
+    def run():
+        get_files(["*.sql", "*.yml"], test_dir)
+
+    return run, files, "files"
+
+
+def case_test_index(scale, _work_dir):
+    """get_df_test_index: 5k test results"""
+
+    test_results = make_test_results(5_000 * scale, 10, 3)
+
+    def run():
+        get_df_test_index(test_results)
+
+    return run, len(test_results), "tests"
+
+
+def case_render(scale, _work_dir):
+    """render_template: 2k sql templates x 5 KB, 3 metadata patterns, matrix values"""
+
+    metadata = {"business_date": {"pattern": "1900-01-01", "repl": "business_date"},
+                "region": {"pattern": "'XX'", "repl": "region"},
+                "limit": {"pattern": r"\bLIMX\b", "repl": "limit"}}
+
+    body = "\n".join(f"select col_{i}, sum(amount_{i}) over (partition by key_{i}) "
+                     + f"from fact_{i} join dim_{i} on a = b" for i in range(60))
+
+    templates = [f"-- test {i}\nselect to_date('1900-01-01') as business_date, 'XX' as region\n"
+                 + "from t where x < LIMX and y = 'XX' and z = '${param:MARKET}'\n" + body
+                 for i in range(2_000 * scale)]
+
+    params_list = [{"BUSINESS_DATE": date, "REGION": "'EU'", "LIMIT": 10, "MARKET": "M1"}
+                   for date in ("2024-01-31", "2024-02-29")]
+
+    def run():
+        for params in params_list:
+            for template in templates:
+                render_template(template, params, metadata)
+
+    return run, len(templates) * len(params_list), "renders"
+
+
+def case_excel(scale, work_dir):
+    """write_test_results_to_excel: 20 tests x 1k rows"""
+
+    test_results = make_test_results(20 * scale, 1_000, 6, density=0.05)
+    index_df = get_df_test_index(test_results)
+    output_xlsx = os.path.join(work_dir, "bench.xlsx")
+
+    def run():
+        write_test_results_to_excel(index_df, test_results, output_xlsx)
+
+    return run, sum(len(df) for df in test_results.values()), "rows"
+
+
+def case_runner(scale, work_dir):
+    """SnowflakeTestRunner: 100 tests x 1k rows on the local sqlite engine"""
+
+    test_dir = os.path.join(work_dir, "runner")
+    db_file = os.path.join(work_dir, "runner.sqlite")
+    tests = 100 * scale
+    make_runner_tree(test_dir, db_file, tests, 1_000)
+
+    metadata = {"snapshot_mode": "replay",
+                "snapshot_dir": os.path.join(work_dir, "no_snapshots"),
+                "replay_engine_url": "sqlite:///" + db_file}
+
+    test_files = get_files("*.yml", test_dir)
+
+    def run():
+        with SnowflakeTestRunner(metadata=metadata, env={}) as t:
+            for test_file in test_files:
+                df = t.run_test(test_file)
+                apply_diff_by_column_name(df)
+
+                if df.attrs.get("rowcount") != 1_000:
+                    raise RuntimeError(f"{test_file}: {df.attrs.get('error_msg')}")
+
+    return run, tests, "tests"
+
+
+CASES = {"diff_wide": case_diff_wide,
+         "diff_tall": case_diff_tall,
+         "diff_dense": case_diff_dense,
+         "diff_string": case_diff_string,
+         "native_types": case_native_types,
+         "get_files": case_get_files,
+         "test_index": case_test_index,
+         "render": case_render,
+         "excel": case_excel,
+         "runner": case_runner}
+
+
+#########################################
+# Measurement
+#########################################
+
+def measure(run, repeat):
+    """median time [s] and peak memory [MiB] of the run"""
+
+    times = []
+
+    for _ in range(repeat):
+        gc.collect()
+        t1_start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - t1_start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return statistics.median(times), peak / 1024 / 1024
+
+
+def compare(result, baseline, time_tolerance, memory_tolerance):
+    """list of regressions of the case over the baseline"""
+
+    if not baseline:
+        return []
+
+    regressions = []
+
+    if (result["seconds"] > baseline["seconds"] * (1 + time_tolerance)
+            and result["seconds"] - baseline["seconds"] > MIN_TIME_DELTA):
+        regressions.append(f"time {result['seconds']:.3f} s > {baseline['seconds']:.3f} s")
+
+    if result["peak_mib"] > baseline["peak_mib"] * (1 + memory_tolerance):
+        regressions.append(f"memory {result['peak_mib']:.1f} MiB > {baseline['peak_mib']:.1f} MiB")
+
+    return regressions
+
+
+def load_baseline(baseline_file):
+    """stored baseline {case: {seconds, peak_mib, ...}}"""
+
+    if not os.path.isfile(baseline_file):
+        return {}
+
+    with open(baseline_file, "r", encoding="utf8") as f:
+        return json.load(f).get("cases", {})
+
+
+def save_baseline(baseline_file, results, scale):
+    """store the results as the new baseline"""
+
+    with open(baseline_file, "w", encoding="utf8") as f:
+        json.dump({"python": platform.python_version(),
+                   "pandas": pd.__version__,
+                   "machine": platform.machine(),
+                   "scale": scale,
+                   "cases": results}, f, indent=2)
+        f.write("\n")
+
+
+def main():
+    """run benchmark"""
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--case", action="append", choices=list(CASES),
+                        help="case to run, all by default")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scale", type=int, default=1,
+                        help="data size multiplier, baseline is compared only for the same scale")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_FILE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--time-tolerance", type=float, default=DEFAULT_TIME_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=DEFAULT_MEMORY_TOLERANCE)
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline) if args.scale == 1 else {}
+
+    results = {}
+    failed = []
+
+    print(f"{'case':<14}{'median [s]':>12}{'throughput':>22}{'peak [MiB]':>12}"
+          + f"{'vs baseline':>13}  status")
+
+    with tempfile.TemporaryDirectory(prefix="bench_hot_paths_") as work_dir:
+
+        for case_name in args.case or CASES:
+
+            run, units, unit_name = CASES[case_name](args.scale, work_dir)
+
+            seconds, peak_mib = measure(run, args.repeat)
+
+            result = {"seconds": round(seconds, 4),
+                      "peak_mib": round(peak_mib, 2),
+                      "throughput": round(units / seconds, 1),
+                      "unit": unit_name}
+            results[case_name] = result
+
+            regressions = compare(result, baseline.get(case_name),
+                                  args.time_tolerance, args.memory_tolerance)
+
+            if regressions:
+                failed.append(case_name)
+
+            ratio = (f"{seconds / baseline[case_name]['seconds']:.2f}x"
+                     if baseline.get(case_name) else "-")
+
+            print(f"{case_name:<14}{seconds:>12.3f}{units / seconds:>16,.0f} {unit_name:<5}"
+                  + f"{peak_mib:>12.1f}{ratio:>13}  "
+                  + ("; ".join(regressions) if regressions else "OK"))
+
+    if args.update_baseline:
+        stored = load_baseline(args.baseline) | results
+        save_baseline(args.baseline, stored, args.scale)
+        print(f"baseline saved: {args.baseline}")
+        return 0
+
+    if failed:
+        print(f"FAILED: {', '.join(failed)}")
+        return 1
+
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""Import time benchmark of the plugin
+
+Plugin import (conftest, test runner, diff) must not load the heavy
+modules (pandas, sqlalchemy, snowflake connector, ...), they are loaded
+on the first real use.
+
+    python benchmarks/bench_import.py [--budget 0.3] [--repeat 5]
+
+Exit code 1 if the median import time is over the budget or a heavy
+module is loaded.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PLUGIN_MODULES = ["lib.continuous_data_testing.conftest",
+                  "lib.continuous_data_testing.snowflake_test_runner",
+                  "lib.continuous_data_testing.diff",
+                  "lib.continuous_data_testing.baseline"]
+
+# sub modules are in sys.modules only if the module is really loaded
+HEAVY_MODULES = ["pandas.core", "sqlalchemy.engine", "snowflake.connector",
+                 "snowflake.sqlalchemy", "tomlkit.api", "importlib_metadata._meta",
+                 "pyarrow.lib", "numpy.linalg"]
+
+DEFAULT_BUDGET = 0.3
+
+IMPORT_SCRIPT = """
+import json, sys, time
+t1_start = time.perf_counter()
+import pytest
+t2_pytest = time.perf_counter()
+for module in {modules}:
+    __import__(module)
+t3_plugin = time.perf_counter()
+print(json.dumps({{"pytest": t2_pytest - t1_start, "plugin": t3_plugin - t2_pytest,
+                  "loaded": [m for m in {heavy} if m in sys.modules]}}))
+"""
+
+
+def run_import():
+    """import the plugin in a new interpreter"""
+
+    script = IMPORT_SCRIPT.format(modules=PLUGIN_MODULES, heavy=HEAVY_MODULES)
+
+    output = subprocess.run([sys.executable, "-c", script], cwd=ROOT_DIR,
+                            capture_output=True, text=True, check=True).stdout
+
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    """run benchmark"""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET,
+                        help="plugin import budget in seconds")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = [run_import() for _ in range(args.repeat)]
+
+    plugin_time = statistics.median(res["plugin"] for res in results)
+    pytest_time = statistics.median(res["pytest"] for res in results)
+    loaded = sorted({m for res in results for m in res["loaded"]})
+
+    print(f"pytest import:  {pytest_time:.3f} s")
+    print(f"plugin import:  {plugin_time:.3f} s (budget {args.budget:.3f} s)")
+    print(f"heavy modules loaded: {', '.join(loaded) or '-'}")
+
+    if plugin_time > args.budget or loaded:
+        print("FAILED")
+        return 1
+
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""Simulated warehouse for the adaptive concurrency controller
+
+The warehouse runs `capacity` queries at once, the other queries are
+queued (queued time is reported like QUEUED_OVERLOAD_TIME). During the
+outage every query fails with the warehouse error. Client threads (more
+than the controller max limit) submit queries through the controller.
+
+    python benchmarks/sim_concurrency.py [--capacity 6] [--clients 32]
+
+Checks:
+    steady limit is around the warehouse capacity (not flooding, not timid)
+    the circuit breaker opens during the outage, queries fail fast
+    the breaker closes and the limit recovers after the outage
+
+Exit code 1 if a check fails.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT_DIR)
+
+# pylint: disable=wrong-import-position
+from lib.continuous_data_testing.concurrency import BREAKER_CLOSED  # noqa: E402
+from lib.continuous_data_testing.concurrency import CircuitBreaker  # noqa: E402
+from lib.continuous_data_testing.concurrency import CircuitOpenError  # noqa: E402
+from lib.continuous_data_testing.concurrency import ConcurrencyController  # noqa: E402
+
+
+class WarehouseError(Exception):
+    """warehouse error with the connector error code and SQLSTATE"""
+
+    errno = 606
+    sqlstate = "57P03"
+
+    def __init__(self):
+        super().__init__("000606 (57P03): Warehouse 'SIM_WH' cannot be resumed")
+
+
+class SimulatedWarehouse:
+    """warehouse with the fixed number of running queries, the other
+    queries are queued (first in, first out)
+    """
+
+    def __init__(self, capacity, execution_time):
+
+        self.capacity = capacity
+        self.execution_time = execution_time
+        self.outage = False
+        self.submitted = 0
+        self.submitted_in_outage = 0
+
+        self.running = 0
+
+        self._queue = deque()
+        self._lock = threading.Condition()
+
+    def run_query(self):
+        """run query, returns (queued_time, execution_time) or raises WarehouseError"""
+
+        with self._lock:
+            self.submitted += 1
+            if self.outage:
+                self.submitted_in_outage += 1
+
+        if self.outage:
+            time.sleep(self.execution_time / 10)
+            raise WarehouseError()
+
+        t1_submitted = time.monotonic()
+
+        with self._lock:
+            ticket = object()
+            self._queue.append(ticket)
+
+            while self._queue[0] is not ticket or self.running >= self.capacity:
+                self._lock.wait()
+
+            self._queue.popleft()
+            self.running += 1
+            self._lock.notify_all()
+
+        t2_started = time.monotonic()
+
+        try:
+            time.sleep(self.execution_time)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self._lock.notify_all()
+
+        return t2_started - t1_submitted, self.execution_time
+
+
+def client(controller, warehouse, stop, stats):
+    """submit queries until stopped"""
+
+    while not stop.is_set():
+
+        try:
+            slot = controller.acquire()
+        except CircuitOpenError:
+            stats["fail_fast"] += 1
+            time.sleep(warehouse.execution_time / 10)
+            continue
+
+        try:
+            queued_time, execution_time = warehouse.run_query()
+            controller.release(slot, queued_time=queued_time, execution_time=execution_time)
+            stats["completed"] += 1
+
+        except WarehouseError as e:
+            controller.release(slot, error=e)
+            stats["failed"] += 1
+
+
+def sample_limit(controller, stop, samples):
+    """record the limit"""
+
+    while not stop.is_set():
+        samples.append((time.monotonic(), controller.limit, controller.breaker.state))
+        time.sleep(0.005)
+
+
+def main():
+    """run simulation"""
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--capacity", type=int, default=6)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--execution-time", type=float, default=0.02)
+    parser.add_argument("--phase", type=float, default=2.0, help="phase duration [s]")
+    args = parser.parse_args()
+
+    warehouse = SimulatedWarehouse(args.capacity, args.execution_time)
+
+    controller = ConcurrencyController(
+        initial=1, min_limit=1, max_limit=args.clients,
+        queue_threshold=args.execution_time / 2,
+        breaker=CircuitBreaker(threshold=3, reset_timeout=args.phase / 10))
+
+    stop = threading.Event()
+    stats = {"completed": 0, "failed": 0, "fail_fast": 0}
+    samples = []
+
+    threads = [threading.Thread(target=client, args=(controller, warehouse, stop, stats),
+                                daemon=True) for _ in range(args.clients)]
+    threads.append(threading.Thread(target=sample_limit, args=(controller, stop, samples),
+                                    daemon=True))
+
+    for thread in threads:
+        thread.start()
+
+    # steady, outage, recovery
+    t1_start = time.monotonic()
+    time.sleep(args.phase)
+    t2_outage = time.monotonic()
+    warehouse.outage = True
+    time.sleep(args.phase / 2)
+    t3_recovery = time.monotonic()
+    warehouse.outage = False
+    stats_before_recovery = dict(stats)
+    time.sleep(args.phase)
+    t4_end = time.monotonic()
+
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    def limits(t_from, t_to):
+        return [limit for t, limit, _ in samples if t_from <= t < t_to] or [0]
+
+    # second half of the phase, the limit has converged
+    steady_limit = statistics.median(limits((t1_start + t2_outage) / 2, t2_outage))
+    recovery_limit = statistics.median(limits((t3_recovery + t4_end) / 2, t4_end))
+    outage_states = {state for t, _, state in samples if t2_outage <= t < t3_recovery}
+
+    # queries reaching the warehouse in the outage: threshold + one trial per reset
+    max_outage_queries = 3 + args.clients + (args.phase / 2) / (args.phase / 10) + 1
+
+    checks = {
+        f"steady limit {steady_limit:.1f} around capacity {args.capacity}":
+            args.capacity / 2 <= steady_limit <= args.capacity * 2,
+        f"breaker opened in the outage ({', '.join(sorted(outage_states))})":
+            "open" in outage_states,
+        f"queries in the outage {warehouse.submitted_in_outage} <= {max_outage_queries:.0f}":
+            warehouse.submitted_in_outage <= max_outage_queries,
+        f"fail fast {stats_before_recovery['fail_fast']} > 0":
+            stats_before_recovery["fail_fast"] > 0,
+        f"breaker closed after the outage ({controller.breaker.state})":
+            controller.breaker.state == BREAKER_CLOSED,
+        f"recovery limit {recovery_limit:.1f} around capacity {args.capacity}":
+            args.capacity / 2 <= recovery_limit <= args.capacity * 2,
+    }
+
+    print(f"completed {stats['completed']}, failed {stats['failed']}, "
+          + f"fail fast {stats['fail_fast']}, submitted {warehouse.submitted}")
+
+    for check, passed in checks.items():
+        print(f"{'OK    ' if passed else 'FAILED'} {check}")
+
+    return 0 if all(checks.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
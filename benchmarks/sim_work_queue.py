@@ -0,0 +1,184 @@
+"""Simulated multi-node run: static shards vs the shared work queue
+
+Test durations are heavy tailed and mispredicted (the shards are
+balanced by the predicted durations). Worker processes on this host
+run the tests by sleeping: with the static shards every worker runs its
+shard, with the work queue (lib.continuous_data_testing.work_queue,
+longest predicted first) the idle worker leases the next test. In the second queue run one worker
+dies in the middle of its test, the test is taken over after the lease
+timeout.
+
+    python benchmarks/sim_work_queue.py [--workers 4] [--tests 60] [--scale 0.2]
+
+Checks:
+    makespan of the work queue is not worse than the static shards
+    every test is done when a worker dies (its test is taken over)
+
+Exit code 1 if a check fails.
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT_DIR)
+
+# pylint: disable=wrong-import-position
+from lib.continuous_data_testing.work_queue import STATE_DONE  # noqa: E402
+from lib.continuous_data_testing.work_queue import LeaseKeeper  # noqa: E402
+from lib.continuous_data_testing.work_queue import WorkQueue  # noqa: E402
+
+LEASE_TIMEOUT = 1.0
+
+
+def make_tests(tests, seed=0):
+    """[(test_file, predicted, actual duration)], lognormal durations,
+    the prediction is off by up to 4x"""
+
+    rng = random.Random(seed)
+
+    res = []
+
+    for i in range(tests):
+        actual = rng.lognormvariate(0, 1)
+        predicted = actual * rng.uniform(0.25, 4)
+        res.append((f"test_{i:03d}.sql", predicted, actual))
+
+    return res
+
+
+def get_shards(tests, workers):
+    """longest predicted first to the least loaded shard"""
+
+    shards = [[] for _ in range(workers)]
+    loads = [0.0] * workers
+
+    for test in sorted(tests, key=lambda test: -test[1]):
+        i = loads.index(min(loads))
+        shards[i].append(test)
+        loads[i] += test[1]
+
+    return shards
+
+
+def run_shard(shard, scale):
+    """static shard worker"""
+
+    for _, _, actual in shard:
+        time.sleep(actual * scale)
+
+
+def run_worker(db_file, worker, durations, scale, die_after, finished):
+    """work queue worker, dies in the middle of the test after die_after tests,
+    finish times of the tests are put to the finished queue"""
+
+    work_queue = WorkQueue(db_file, lease_timeout=LEASE_TIMEOUT)
+
+    done = 0
+
+    for task_key, _ in work_queue.iter_leases(worker):
+
+        if done == die_after:
+            # killed, the lease is not renewed and not completed
+            os._exit(1)  # pylint: disable=protected-access
+
+        with LeaseKeeper(work_queue, task_key, worker):
+            time.sleep(durations[task_key] * scale)
+
+        work_queue.complete(task_key, worker, None, True)
+        finished.put(time.time())
+        done += 1
+
+
+def run_processes(target, args_list):
+    """seconds until all processes finished"""
+
+    start = time.time()
+
+    processes = [multiprocessing.Process(target=target, args=args) for args in args_list]
+
+    for process in processes:
+        process.start()
+
+    for process in processes:
+        process.join()
+
+    return time.time() - start
+
+
+def run_queue(tests, durations, workers, scale, die_after=None):
+    """seconds until the last test finished (the idle workers poll for
+    the leases of the others), tasks of the run with the work queue"""
+
+    with tempfile.TemporaryDirectory(prefix="sim_work_queue_") as work_dir:
+
+        db_file = os.path.join(work_dir, "run.sqlite")
+
+        work_queue = WorkQueue(db_file, lease_timeout=LEASE_TIMEOUT)
+        work_queue.load([(test_file, test_file) for test_file, _, _ in tests],
+                        os.path.join(work_dir, "spill"),
+                        durations={test_file: predicted for test_file, predicted, _ in tests})
+
+        finished = multiprocessing.Queue()
+
+        start = time.time()
+
+        run_processes(run_worker, [(db_file, f"w{i}", durations, scale,
+                                    die_after if i == workers - 1 else None, finished)
+                                   for i in range(workers)])
+
+        finish_times = []
+        while not finished.empty():
+            finish_times.append(finished.get())
+
+        return max(finish_times) - start, work_queue.get_tasks()
+
+
+def main():
+    """run simulation"""
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--tests", type=int, default=60)
+    parser.add_argument("--scale", type=float, default=0.2, help="seconds per duration unit")
+    args = parser.parse_args()
+
+    tests = make_tests(args.tests)
+    durations = {test_file: actual for test_file, _, actual in tests}
+
+    static_time = run_processes(run_shard, [(shard, args.scale)
+                                            for shard in get_shards(tests, args.workers)])
+
+    queue_time, _ = run_queue(tests, durations, args.workers, args.scale)
+
+    # the last worker dies after 2 tests
+    failover_time, tasks = run_queue(tests, durations, args.workers, args.scale, die_after=2)
+
+    ideal_time = sum(durations.values()) * args.scale / args.workers
+
+    print(f"{args.tests} tests, {args.workers} workers, ideal {ideal_time:.2f} s")
+    print(f"static shards  {static_time:8.2f} s")
+    print(f"work queue     {queue_time:8.2f} s")
+    print(f"work queue     {failover_time:8.2f} s   (one worker died, lease {LEASE_TIMEOUT} s)")
+
+    all_done = all(task["state"] == STATE_DONE and task["condition"] for task in tasks)
+    taken_over = sum(1 for task in tasks if task["attempts"] > 1)
+
+    print(f"all tests done: {all_done}, taken over after the lease: {taken_over}")
+
+    ok = all_done and taken_over == 1 and queue_time <= static_time
+
+    print("OK" if ok else "FAILED")
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""Arrow-backed results
+
+    --metadata dtype_backend arrow
+
+The result is fetched into a pyarrow table (snowflake connector
+fetch_arrow_all, the rows of the other drivers column by column) and
+kept in pd.ArrowDtype columns: the strings are not python objects, the
+nulls are validity bitmaps. The snapshot and baseline parquet files are
+read without the conversion.
+
+The DIFF columns are checked by the Arrow compute kernels, the html
+report formats only the bounded rows, the xlsx and parquet exports write
+the Arrow columns. Decimals are converted to double like the default
+(numpy) mode.
+"""
+
+from __future__ import annotations
+
+import decimal
+import logging
+
+from .lazy import lazy_import
+
+# heavy modules are loaded on the first use
+pd = lazy_import("pandas")
+pa = lazy_import("pyarrow")
+pc = lazy_import("pyarrow.compute")
+pq = lazy_import("pyarrow.parquet")
+
+DTYPE_BACKEND_ARROW = "arrow"
+
+
+def get_dtype_backend(params: dict):
+    """dtype backend arrow or None (numpy, pandas nullable types)"""
+
+    dtype_backend = str((params or {}).get('DTYPE_BACKEND', '') or '').casefold()
+
+    if dtype_backend in (DTYPE_BACKEND_ARROW, "pyarrow"):
+        return DTYPE_BACKEND_ARROW
+
+    return None
+
+
+def is_arrow_series(series: pd.Series):
+    """arrow-backed column"""
+
+    return isinstance(series.dtype, pd.ArrowDtype)
+
+
+def get_arrow_array(series: pd.Series):
+    """chunked array of the arrow-backed column (no copy)"""
+
+    # arrow protocol of the extension array
+    return series.array.__arrow_array__()
+
+
+def to_arrow_array(values):
+    """arrow array of the python values, strings if the types are mixed"""
+
+    first_value = next((value for value in values if value is not None), None)
+
+    if isinstance(first_value, decimal.Decimal):
+        # decimal inference is slow, decimals are converted to double anyway
+        try:
+            return pa.array([None if value is None else float(value) for value in values],
+                            type=pa.float64())
+
+        except (TypeError, ValueError):
+            pass
+
+    try:
+        array = pa.array(values, from_pandas=True)
+
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        array = pa.array([None if value is None else str(value) for value in values],
+                         type=pa.string())
+
+    if pa.types.is_decimal(array.type):
+        array = pc.cast(array, pa.float64())
+
+    return array
+
+
+def table_to_df(table: pa.Table):
+    """dataframe of arrow columns (no copy of the buffers)"""
+
+    columns = [pc.cast(column, pa.float64()) if pa.types.is_decimal(column.type) else column
+               for column in table.columns]
+
+    if any(pa.types.is_null(column.type) for column in columns):
+        # all values null, the type is not known
+        columns = [column.cast(pa.string()) if pa.types.is_null(column.type) else column
+                   for column in columns]
+
+    table = pa.Table.from_arrays(columns, names=table.column_names)
+
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def rows_to_table(rows, keys):
+    """arrow table of the rows (sqlalchemy rows, tuples)"""
+
+    keys = list(keys)
+
+    if not rows:
+        return pa.Table.from_arrays([pa.array([], type=pa.string()) for _ in keys], names=keys)
+
+    return pa.Table.from_arrays([to_arrow_array(list(values)) for values in zip(*rows)],
+                                names=keys)
+
+
+def fetch_arrow_table(resultset):
+    """arrow table of the sqlalchemy result, the snowflake connector
+    returns the arrow batches of the result without python rows"""
+
+    keys = list(resultset.keys())
+
+    fetch_arrow_all = getattr(getattr(resultset, "cursor", None), "fetch_arrow_all", None)
+
+    if fetch_arrow_all is not None:
+        try:
+            table = fetch_arrow_all()
+
+            # no rows
+            if table is None:
+                return rows_to_table([], keys)
+
+            return table.rename_columns(keys)
+
+        except NotImplementedError as e:
+            # result format json
+            logging.debug("fetch_arrow_all not supported %s", str(e))
+
+    return rows_to_table(resultset.all(), keys)
+
+
+def read_parquet(parquet_file, dtype_backend=None):
+    """parquet file (snapshot, baseline), arrow columns without the conversion"""
+
+    if dtype_backend == DTYPE_BACKEND_ARROW:
+        return table_to_df(pq.read_table(parquet_file))
+
+    return pd.read_parquet(parquet_file)
+
+
+def df_to_arrow_types(df: pd.DataFrame):
+    """dataframe with arrow columns (results of the other sources)"""
+
+    if all(is_arrow_series(df.iloc[:, i]) for i in range(df.shape[1])):
+        return df
+
+    arrays = []
+
+    for i in range(df.shape[1]):
+
+        series = df.iloc[:, i]
+
+        if is_arrow_series(series):
+            arrays.append(get_arrow_array(series))
+            continue
+
+        try:
+            arrays.append(pa.Array.from_pandas(series))
+
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            arrays.append(to_arrow_array(series.astype(object).tolist()))
+
+    df_arrow = table_to_df(pa.Table.from_arrays(arrays, names=[str(col) for col in df.columns]))
+
+    df_arrow.columns = df.columns
+    df_arrow.index = df.index
+
+    return df_arrow
+
+
+def get_max_str_len(series: pd.Series):
+    """length of the longest value as string (xlsx column width), arrow
+    columns without python strings"""
+
+    if is_arrow_series(series):
+        try:
+            array = get_arrow_array(series)
+            if not (pa.types.is_string(array.type) or pa.types.is_large_string(array.type)):
+                array = pc.cast(array, pa.string())
+
+            return pc.max(pc.utf8_length(array)).as_py() or 0
+
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            pass
+
+    return series.astype(str).str.len().max()
+
+
+def get_diff_mask(series: pd.Series, limit):
+    """differences of the arrow DIFF column (compute kernels): abs() > limit,
+    strings not empty and not '0', nulls are not differences
+
+    Returns:
+        numpy array: bool mask
+    """
+
+    array = get_arrow_array(series)
+
+    if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+        mask = pc.and_(pc.not_equal(array, ""), pc.not_equal(array, "0"))
+
+    else:
+        mask = pc.greater(pc.abs(array), limit)
+
+    return pc.fill_null(mask, False).to_numpy()
@@ -0,0 +1,405 @@
+"""Module providing golden baseline (regression) tests.
+
+Blessed result is stored next to the test file
+
+    <test>.baseline.parquet     result
+    <test>.baseline.json        per column and per chunk content hashes
+
+data-test:
+    baseline:
+      key: [id]                 # optional, rows are aligned by the key columns
+      chunk_size: 10000
+
+Hashes are compared first, row level (key aligned) diff is done only
+for the chunks with different hashes. Rebaseline
+
+    pytest <dir> --metadata baseline_mode bless
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import math
+import os
+from datetime import datetime
+
+from .arrow_types import get_dtype_backend
+from .arrow_types import read_parquet
+from .config_model import get_config
+from .lazy import lazy_import
+from .utils import df_to_export
+from .utils import df_to_native_types
+
+# heavy modules are loaded on the first use
+pd = lazy_import("pandas")
+
+BASELINE_BLESS = "bless"
+
+DEFAULT_CHUNK_SIZE = 10000
+
+# row number is the key if there are no key columns
+ROW_KEY_COLUMN = "__row__"
+
+
+def get_baseline_filename(df: pd.DataFrame):
+    """baseline file name without extension, None if there is no test file"""
+
+    config_file = df.attrs.get("config-file") or df.attrs.get("sql-file")
+
+    if not config_file:
+        return None
+
+    baseline_file = os.path.splitext(config_file)[0]
+
+    if df.attrs.get("matrix_id"):
+        matrix_id = "".join(c if c.isalnum() or c in "-_=" else "_"
+                            for c in str(df.attrs.get("matrix_id")))
+        baseline_file = baseline_file + "." + matrix_id
+
+    return baseline_file + ".baseline"
+
+
+def get_normalized_series(series: pd.Series):
+    """values as strings, the same for numpy, nullable and arrow dtypes"""
+
+    return series.astype(object).where(series.notna(), None).astype(str)
+
+
+def get_series_hash(series: pd.Series):
+    """content hash of the column"""
+
+    row_hash = pd.util.hash_pandas_object(
+        get_normalized_series(series), index=False)
+
+    return hashlib.sha256(row_hash.values.tobytes()).hexdigest()
+
+
+def get_row_hashes(df: pd.DataFrame):
+    """hash of every row"""
+
+    df_normalized = pd.DataFrame(
+        {str(col): get_normalized_series(df[col]) for col in df.columns}, index=df.index)
+
+    return pd.util.hash_pandas_object(df_normalized, index=False)
+
+
+def get_key_frame(df: pd.DataFrame, key_columns):
+    """normalized key columns, row number if there is no key"""
+
+    if not key_columns:
+        return pd.DataFrame({ROW_KEY_COLUMN: [str(i) for i in range(len(df))]}, index=df.index)
+
+    return pd.DataFrame(
+        {col: get_normalized_series(df[col]) for col in key_columns}, index=df.index)
+
+
+def get_chunk_ids(df: pd.DataFrame, key_columns, chunk_count):
+    """chunk of every row, hash partitioning by the key"""
+
+    key_hash = pd.util.hash_pandas_object(
+        get_key_frame(df, key_columns), index=False)
+
+    return key_hash % chunk_count
+
+
+def get_chunk_hashes(df: pd.DataFrame, chunk_ids: pd.Series, chunk_count):
+    """order independent hash of every chunk: row count and sum of row hashes"""
+
+    row_hashes = get_row_hashes(df)
+
+    res = {}
+    for chunk_id in range(chunk_count):
+        chunk_hashes = row_hashes[chunk_ids == chunk_id].to_numpy()
+        # uint64 sum wraps around
+        res[str(chunk_id)] = f"{len(chunk_hashes)}:{int(chunk_hashes.sum(dtype='uint64'))}"
+
+    return res
+
+
+def get_baseline_hashes(df: pd.DataFrame, key_columns, chunk_size):
+    """per column and per chunk hashes"""
+
+    chunk_count = max(1, math.ceil(len(df) / chunk_size))
+    chunk_ids = get_chunk_ids(df, key_columns, chunk_count)
+
+    return {"columns": [str(col) for col in df.columns],
+            "rowcount": len(df),
+            "key": list(key_columns or []),
+            "chunk_count": chunk_count,
+            "column_hashes": {str(col): get_series_hash(df[col]) for col in df.columns},
+            "chunk_hashes": get_chunk_hashes(df, chunk_ids, chunk_count)}
+
+
+def save_baseline(baseline_file, df: pd.DataFrame, key_columns, chunk_size):
+    """bless the result"""
+
+    df_baseline = df_to_export(df.copy(deep=False))
+    # parquet metadata needs json types
+    df_baseline.attrs = {}
+    df_baseline.to_parquet(baseline_file + ".parquet", index=False)
+
+    baseline_hashes = get_baseline_hashes(df, key_columns, chunk_size)
+    baseline_hashes["blessed"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    baseline_hashes["query_id"] = df.attrs.get("query_id")
+
+    with open(baseline_file + ".json", mode='w', encoding="UTF8") as f:
+        json.dump(baseline_hashes, f, indent=2)
+
+    logging.info("baseline saved: %s", baseline_file)
+
+
+def load_baseline_hashes(baseline_file):
+    """baseline hashes, None if there is no baseline"""
+
+    if not os.path.isfile(baseline_file + ".json"):
+        return None
+
+    with open(baseline_file + ".json", 'r', encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_changed(cur_values: pd.Series, base_values: pd.Series):
+    """changed values, the numbers are compared by the value (the blessed
+    40.0 is read back from the parquet as 40)"""
+
+    if pd.api.types.is_numeric_dtype(cur_values) and pd.api.types.is_numeric_dtype(base_values):
+        equal = (cur_values == base_values).astype("boolean").fillna(False) | \
+            (cur_values.isna() & base_values.isna())
+
+        return (~equal).to_numpy(dtype=bool)
+
+    return (get_normalized_series(cur_values) != get_normalized_series(base_values)).to_numpy()
+
+
+def get_chunk_diff(df_chunk: pd.DataFrame, df_key_chunk: pd.DataFrame,
+                   df_base_chunk: pd.DataFrame, df_base_key_chunk: pd.DataFrame, key_columns):
+    """key aligned diff of the chunk
+
+    Returns:
+        tuple: ({column: [df index]}, {column: [current - baseline]}, missing rows)
+    """
+
+    key_cols = list(df_key_chunk.columns)
+
+    df_cur = df_key_chunk.assign(__index__=df_chunk.index)
+    df_base = df_base_key_chunk.assign(__base_index__=df_base_chunk.index)
+
+    df_merge = df_cur.merge(df_base, on=key_cols, how="outer", indicator=True)
+
+    diff_indexes = {}
+    diff_values = {}
+
+    # rows not in the baseline, key columns are marked
+    added = df_merge[df_merge["_merge"] == "left_only"]["__index__"]
+    for col in (key_columns or [df_chunk.columns[0]]):
+        if len(added):
+            diff_indexes.setdefault(col, []).extend(added.astype(int).to_list())
+
+    missing = int((df_merge["_merge"] == "right_only").sum())
+
+    df_both = df_merge[df_merge["_merge"] == "both"]
+
+    cur_index = df_both["__index__"].astype(int).to_list()
+    base_index = df_both["__base_index__"].astype(int).to_list()
+
+    for col in df_chunk.columns:
+
+        if col in (key_columns or []) or col not in df_base_chunk.columns:
+            continue
+
+        cur_values = df_chunk[col].loc[cur_index].reset_index(drop=True)
+        base_values = df_base_chunk[col].loc[base_index].reset_index(drop=True)
+
+        changed = get_changed(cur_values, base_values)
+
+        if changed.any():
+            diff_indexes.setdefault(col, []).extend(
+                [idx for idx, flag in zip(cur_index, changed) if flag])
+
+            if pd.api.types.is_numeric_dtype(cur_values) and pd.api.types.is_numeric_dtype(base_values):
+                diff_values.setdefault(col, []).extend(
+                    (cur_values[changed] - base_values[changed]).dropna().to_list())
+
+    return diff_indexes, diff_values, missing
+
+
+def apply_baseline(df: pd.DataFrame, params=None, colorize=True):
+    """
+    compare result with the blessed baseline
+
+    Mismatches are added to the diff attributes (see apply_diff_by_column_name)
+    df.attrs["diff_col_names_list"]
+    df.attrs["diff_col_iloc_list"]
+    df.attrs["diff_summary_list"]
+    """
+
+    baseline_config = get_config(df.attrs).baseline
+
+    if baseline_config is None:
+        return
+
+    # there were errors
+    if df.attrs.get("error_msg") and not df.attrs.get("condition"):
+        return
+
+    baseline_file = get_baseline_filename(df)
+
+    if not baseline_file:
+        logging.error("baseline: there is no test file")
+        return
+
+    key_columns = list(baseline_config.key)
+
+    chunk_size = baseline_config.chunk_size or DEFAULT_CHUNK_SIZE
+
+    params = params or {}
+
+    t1_start = datetime.now()
+
+    if str(params.get('BASELINE_MODE', '')).casefold() == BASELINE_BLESS:
+        save_baseline(baseline_file, df, key_columns, chunk_size)
+        df.attrs["baseline"] = "blessed"
+        return
+
+    baseline_hashes = load_baseline_hashes(baseline_file)
+
+    if baseline_hashes is None:
+        df.attrs["condition"] = False
+        df.attrs["error_msg"] = ("No baseline: " + baseline_file
+                                 + ", run with --metadata baseline_mode bless")
+        return
+
+    column_hashes = {str(col): get_series_hash(df[col]) for col in df.columns}
+
+    # fast path, the same content
+    if ([str(col) for col in df.columns] == baseline_hashes["columns"]
+            and len(df) == baseline_hashes["rowcount"]
+            and column_hashes == baseline_hashes["column_hashes"]):
+
+        df.attrs["baseline"] = "hash match"
+        logging.info("baseline hash match: %s %s",
+                     baseline_file, str(datetime.now() - t1_start))
+        return
+
+    chunk_count = baseline_hashes["chunk_count"]
+
+    dtype_backend = get_dtype_backend(params)
+    df_base = df_to_native_types(read_parquet(baseline_file + ".parquet", dtype_backend),
+                                 dtype_backend)
+
+    missing_key_columns = [col for col in key_columns
+                           if col not in df.columns or col not in df_base.columns]
+    if missing_key_columns:
+        df.attrs["condition"] = False
+        df.attrs["error_msg"] = "Baseline key columns not found: " + \
+            ", ".join(missing_key_columns)
+        return
+
+    df_key = get_key_frame(df, key_columns)
+    df_base_key = get_key_frame(df_base, key_columns)
+
+    chunk_ids = get_chunk_ids(df, key_columns, chunk_count)
+    chunk_hashes = get_chunk_hashes(df, chunk_ids, chunk_count)
+    base_chunk_ids = get_chunk_ids(df_base, key_columns, chunk_count)
+
+    diff_indexes = {}
+    diff_values = {}
+    missing = 0
+    diff_chunks = 0
+
+    for chunk_id in range(chunk_count):
+
+        if chunk_hashes[str(chunk_id)] == baseline_hashes["chunk_hashes"].get(str(chunk_id)):
+            continue
+
+        diff_chunks = diff_chunks + 1
+
+        chunk_diff_indexes, chunk_diff_values, chunk_missing = get_chunk_diff(
+            df[chunk_ids == chunk_id], df_key[chunk_ids == chunk_id],
+            df_base[base_chunk_ids == chunk_id], df_base_key[base_chunk_ids == chunk_id],
+            key_columns)
+
+        for col, indexes in chunk_diff_indexes.items():
+            diff_indexes.setdefault(col, []).extend(indexes)
+        for col, values in chunk_diff_values.items():
+            diff_values.setdefault(col, []).extend(values)
+        missing = missing + chunk_missing
+
+    logging.info("baseline diff chunks: %s of %s",
+                 str(diff_chunks), str(chunk_count))
+
+    columns_added = [col for col in df.columns if str(
+        col) not in baseline_hashes["columns"]]
+    columns_removed = [col for col in baseline_hashes["columns"]
+                       if col not in [str(c) for c in df.columns]]
+
+    for col in columns_added:
+        diff_indexes[col] = df.index.to_list()
+
+    diff_col_names_list = list(df.attrs.get("diff_col_names_list", []))
+    diff_col_iloc_list = list(df.attrs.get("diff_col_iloc_list", []))
+    diff_colorize_column_indexes = dict(
+        df.attrs.get("diff_colorize_column_indexes", {}))
+    diff_index_list_sample = list(df.attrs.get("diff_index_list_sample", []))
+    diff_summary_list = list(df.attrs.get("diff_summary_list", []))
+
+    for i, col in enumerate(df.columns):
+
+        indexes = sorted(set(diff_indexes.get(col, [])))
+
+        if not indexes:
+            continue
+
+        if col not in diff_col_names_list:
+            diff_col_names_list.append(col)
+            diff_col_iloc_list.append(i)
+
+        diff_index_list_sample.extend(indexes[:5])
+
+        if colorize:
+            diff_colorize_column_indexes[col] = indexes
+
+        values = diff_values.get(col, [])
+
+        diff_summary_list.append({"column name": f"{col} (baseline)",
+                                  "diff min": min(values) if values else None,
+                                  "diff max": max(values) if values else None,
+                                  "diff records": len(indexes),
+                                  "total records": df.shape[0],
+                                  "diff [%]": round(100*len(indexes)/df.shape[0], 2)})
+
+    if missing:
+        diff_summary_list.append({"column name": "rows missing (baseline)",
+                                  "diff min": None,
+                                  "diff max": None,
+                                  "diff records": missing,
+                                  "total records": baseline_hashes["rowcount"],
+                                  "diff [%]": round(100*missing/max(1, baseline_hashes["rowcount"]), 2)})
+
+    df.attrs["diff_col_names_list"] = diff_col_names_list
+    df.attrs["diff_col_iloc_list"] = diff_col_iloc_list
+    df.attrs["diff_colorize_column_indexes"] = diff_colorize_column_indexes
+    df.attrs["diff_index_list_sample"] = list(set(diff_index_list_sample))
+    df.attrs["diff_summary_list"] = diff_summary_list
+
+    baseline_msg_list = []
+    if diff_indexes:
+        baseline_msg_list.append(
+            "columns: " + ", ".join(str(col) for col in diff_indexes))
+    if missing:
+        baseline_msg_list.append(f"rows missing: {missing}")
+    if columns_removed:
+        baseline_msg_list.append(
+            "columns removed: " + ", ".join(columns_removed))
+
+    df.attrs["baseline"] = "diff" if baseline_msg_list else "row match"
+
+    if baseline_msg_list:
+        df.attrs["condition"] = False
+        error_msg = "!!! Baseline differs, " + "; ".join(baseline_msg_list)
+        df.attrs["error_msg"] = (df.attrs.get("error_msg") + "\n" + error_msg
+                                 if df.attrs.get("error_msg") else error_msg)
+
+    logging.info('Baseline time: %s', (datetime.now() - t1_start))
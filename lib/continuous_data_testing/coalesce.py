@@ -0,0 +1,373 @@
+"""Coalescing of small tests into a single warehouse request
+
+Compatible tests (the same connection, the same session statements)
+with the yml tag
+
+    coalesce: true
+
+or the metadata COALESCE true are run as one multi-statement request,
+one statement per test
+
+    SELECT * FROM (<test sql>) LIMIT <coalesce-max-rows + 1>;
+
+Every statement returns its own result set, the tests keep their
+columns (order, types, also without rows). Other drivers (local engine)
+run the statements one by one on the same connection.
+
+The tests of the group are claimed by the first test, the other tests
+take their results (or wait for them). A failed request or a test with
+more rows runs separately, the group is not built again.
+"""
+
+from __future__ import annotations
+
+import copy
+import logging
+import threading
+
+from .arrow_types import DTYPE_BACKEND_ARROW
+from .arrow_types import get_dtype_backend
+from .arrow_types import rows_to_table
+from .arrow_types import table_to_df
+from .config_model import get_config
+from .lazy import lazy_import
+from .utils import df_to_native_types
+from .utils import is_true
+
+# heavy modules are loaded on the first use
+pd = lazy_import("pandas")
+sqlalchemy = lazy_import("sqlalchemy")
+
+# tests with more rows are run separately
+DEFAULT_COALESCE_MAX_ROWS = 100
+
+# max number of tests in a single request
+DEFAULT_COALESCE_BATCH_SIZE = 100
+
+_lock = threading.Lock()
+
+# test files collected and not yet run
+_pending_test_files: dict = {}
+
+# test files claimed by a group, results not yet taken, test_file -> CoalesceGroup
+_groups: dict = {}
+
+# pending test file -> (fingerprint, sql_formatted), None if not coalesced;
+# loaded once by the first leader, the next leaders look it up
+_fingerprints: dict = {}
+
+
+class CoalesceGroup:
+    """request of the coalesced tests"""
+
+    def __init__(self, test_file):
+
+        self.test_file = test_file
+        self.done = threading.Event()
+        # test_file -> df, None: the test runs separately
+        self.results = {}
+
+
+def register_test_files(test_files):
+    """register collected test files, candidates for coalescing"""
+
+    with _lock:
+        for test_file in test_files:
+            if test_file:
+                _pending_test_files[test_file] = True
+                _fingerprints.pop(test_file, None)
+
+        logging.debug("coalesce pending tests: %s", str(len(_pending_test_files)))
+
+
+def unregister_test_file(test_file):
+    """test file is run"""
+
+    with _lock:
+        _pending_test_files.pop(test_file, None)
+        _fingerprints.pop(test_file, None)
+
+
+def reset_coalesce():
+    """new session, pending tests and results not taken are released"""
+
+    with _lock:
+        _pending_test_files.clear()
+        _groups.clear()
+        _fingerprints.clear()
+
+
+def is_coalesce_test(sql_formatted: dict, params: dict):
+    """coalesce tag in yml or COALESCE metadata"""
+
+    # temporary tables are created for a single test
+    config = get_config(sql_formatted)
+
+    if config.matrix_batch or sql_formatted.get('shared-datasets-used'):
+        return False
+
+    # snapshots are saved per test, coalesced groups depend on the selected tests
+    if params.get('SNAPSHOT_MODE'):
+        return False
+
+    if config.coalesce is not None:
+        return config.coalesce
+
+    return is_true(params.get('COALESCE', False))
+
+
+def get_coalesce_fingerprint(runner, sql_formatted: dict):
+    """tests with the same connection and session statements can be coalesced"""
+
+    session_list = list(runner.get_sql_from_params(sql_formatted))
+    session_list.extend(sql_formatted.get('session', None) or [])
+
+    return (runner.connection_name, tuple(session_list))
+
+
+def get_pending_fingerprint(runner, test_file):
+    """fingerprint and sql_formatted of the pending test, None if the test
+    is not coalesced; the test config is loaded once per pending test"""
+
+    with _lock:
+        if test_file in _fingerprints:
+            return _fingerprints[test_file]
+
+    sql_formatted, _, _ = runner.get_test_config(test_file)
+
+    entry = None
+
+    if (sql_formatted and sql_formatted.get('sql')
+            and is_coalesce_test(sql_formatted, runner.params)):
+        entry = (get_coalesce_fingerprint(runner, sql_formatted), sql_formatted)
+
+    with _lock:
+        # run meanwhile, not kept
+        if test_file in _pending_test_files:
+            _fingerprints.setdefault(test_file, entry)
+
+    return entry
+
+
+def get_coalesce_statements(sql_list, max_rows):
+    """statements of the multi-statement request, one per test"""
+
+    return [f"SELECT * FROM (\n{sql.strip().rstrip(';')}\n) LIMIT {max_rows + 1}"
+            for sql in sql_list]
+
+
+def get_cursor_df(cursor, dialect, dtype_backend=None):
+    """current result set of the DBAPI cursor, the column names like sqlalchemy
+    (snowflake case insensitive names in lowercase)"""
+
+    columns = [column[0] for column in cursor.description or []]
+
+    if getattr(dialect, "requires_name_normalize", False):
+        columns = [dialect.normalize_name(column) for column in columns]
+
+    fetch_arrow_all = getattr(cursor, "fetch_arrow_all", None)
+
+    if dtype_backend == DTYPE_BACKEND_ARROW and fetch_arrow_all is not None:
+        table = fetch_arrow_all()
+
+        # no rows
+        if table is None:
+            table = rows_to_table([], columns)
+
+        return table_to_df(table.rename_columns(columns))
+
+    return pd.DataFrame(cursor.fetchall(), columns=columns)
+
+
+def fetch_result_sets(conn, statements, dtype_backend=None):
+    """result sets of the statements in one request (snowflake multi-statement),
+    other drivers run the statements one by one
+
+    Raises:
+        sqlalchemy.exc.DBAPIError: the request failed
+    """
+
+    cursor = conn.connection.cursor()
+
+    res = []
+
+    try:
+        if hasattr(cursor, "nextset") and hasattr(cursor, "fetch_arrow_all"):
+            sql = ";\n".join(statements)
+
+            cursor.execute(sql, num_statements=len(statements))
+
+            while True:
+                res.append(get_cursor_df(cursor, conn.dialect, dtype_backend))
+
+                if len(res) >= len(statements) or not cursor.nextset():
+                    break
+        else:
+            for sql in statements:
+                cursor.execute(sql)
+                res.append(get_cursor_df(cursor, conn.dialect, dtype_backend))
+
+    except conn.dialect.dbapi.Error as e:
+        # like the errors of conn.execute
+        raise sqlalchemy.exc.DBAPIError.instance(
+            sql, None, e, conn.dialect.dbapi.Error, dialect=conn.dialect) from e
+
+    finally:
+        cursor.close()
+
+    if len(res) != len(statements):
+        raise sqlalchemy.exc.InvalidRequestError(
+            f"coalesce: {len(res)} result sets of {len(statements)} statements")
+
+    return res
+
+
+def split_coalesce_result(df_group: pd.DataFrame, result_sets: dict, max_rows,
+                          dtype_backend=None):
+    """results of the tests {test_file: df}, None if the test has more rows
+    than max_rows
+
+    result_sets: {test_file: df}
+    """
+
+    res = {}
+
+    for test_file, df in result_sets.items():
+
+        if len(df) > max_rows:
+            logging.info("coalesce: %s has more than %s rows",
+                         test_file, str(max_rows))
+            res[test_file] = None
+            continue
+
+        df = df_to_native_types(df, dtype_backend)
+
+        df.attrs = copy.deepcopy(df_group.attrs)
+        df.attrs["rowcount"] = len(df)
+        df.attrs["coalesced"] = len(result_sets)
+
+        res[test_file] = df
+
+    return res
+
+
+def get_coalesce_group(runner, test_file, sql_formatted, batch_size):
+    """pending tests compatible with the test, not claimed by another group
+
+    Returns:
+        dict: {test_file: sql_formatted}
+    """
+
+    fingerprint = get_coalesce_fingerprint(runner, sql_formatted)
+
+    group = {test_file: sql_formatted}
+
+    with _lock:
+        candidates = [pending_test_file for pending_test_file in _pending_test_files
+                      if pending_test_file != test_file and pending_test_file not in _groups]
+
+    for pending_test_file in candidates:
+
+        if len(group) >= batch_size:
+            break
+
+        entry = get_pending_fingerprint(runner, pending_test_file)
+
+        if entry is not None and entry[0] == fingerprint:
+            group[pending_test_file] = entry[1]
+
+    return group
+
+
+def claim_group(test_file, group: dict):
+    """claim the tests of the group not run or claimed meanwhile, the
+    others are removed from the group
+
+    Returns:
+        CoalesceGroup: request of the claimed tests, None if no test is claimed
+    """
+
+    coalesce_group = CoalesceGroup(test_file)
+
+    with _lock:
+        for key in list(group):
+            if key == test_file:
+                continue
+
+            if key in _groups or key not in _pending_test_files:
+                del group[key]
+            else:
+                _groups[key] = coalesce_group
+
+    return coalesce_group if len(group) > 1 else None
+
+
+def run_group(runner, test_file, group: dict, coalesce_group: CoalesceGroup, max_rows):
+    """run the request of the group, results of the tests to coalesce_group.results"""
+
+    sql_formatted = group[test_file]
+
+    statements = get_coalesce_statements([val.get('sql') for val in group.values()], max_rows)
+
+    sql_group = dict(sql_formatted)
+    sql_group['sql'] = ";\n".join(statements)
+    sql_group['coalesce-statements'] = statements
+
+    result_sets = []
+
+    df_group = runner.run_sql(sql_formatted=sql_group, result_sets=result_sets)
+
+    if df_group.attrs.get("error_msg") or len(result_sets) != len(group):
+        # one wrong query fails all, the tests run separately
+        logging.error("coalesce error, tests run separately: %s",
+                      df_group.attrs.get("error_msg"))
+        coalesce_group.results = {key: None for key in group}
+        return
+
+    # only the results, sql and config of every test is added by the test
+    for key in sql_group:
+        df_group.attrs.pop(key, None)
+
+    coalesce_group.results = split_coalesce_result(
+        df_group, dict(zip(group, result_sets)), max_rows, get_dtype_backend(runner.params))
+
+
+def run_coalesced(runner, test_file, sql_formatted, sql_file=None, dry_run=False):
+    """run test coalesced with other pending compatible tests"""
+
+    with _lock:
+        coalesce_group = _groups.pop(test_file, None)
+
+    if coalesce_group is None and not dry_run and runner.engine and sql_formatted.get('sql'):
+
+        max_rows = int(sql_formatted.get('coalesce-max-rows')
+                       or runner.params.get('COALESCE_MAX_ROWS') or DEFAULT_COALESCE_MAX_ROWS)
+        batch_size = int(runner.params.get('COALESCE_BATCH_SIZE')
+                         or DEFAULT_COALESCE_BATCH_SIZE)
+
+        group = get_coalesce_group(runner, test_file, sql_formatted, batch_size)
+        coalesce_group = claim_group(test_file, group) if len(group) > 1 else None
+
+        if coalesce_group is not None:
+            logging.info("coalesce: %s tests", str(len(group)))
+
+            try:
+                run_group(runner, test_file, group, coalesce_group, max_rows)
+
+            finally:
+                coalesce_group.done.set()
+
+    if coalesce_group is not None:
+        # the request of the group, run by the first test of the group
+        coalesce_group.done.wait()
+
+        df = coalesce_group.results.get(test_file)
+
+        if df is not None:
+            df.attrs.update(sql_formatted)
+
+            runner.log_df_info(df, f"coalesced: {df.attrs.get('coalesced')} tests")
+
+            return df
+
+    return runner.run_sql(sql_formatted=sql_formatted, sql_file=sql_file, dry_run=dry_run)
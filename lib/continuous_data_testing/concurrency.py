@@ -0,0 +1,334 @@
+"""Adaptive concurrency of the queries and circuit breaker
+
+In-flight queries of one connection and warehouse are limited by the
+AIMD controller: the limit grows by one per limit of successful queries
+(additive increase) and is halved (multiplicative decrease) when a query
+is queued in the warehouse, fails or times out.
+
+    --metadata concurrency_initial 4     initial limit
+    --metadata concurrency_min 1
+    --metadata concurrency_max 16
+    --metadata queue_threshold 1         queued time [s] signaling overload,
+                                         needs --metadata query_stats true
+
+Repeated connection or warehouse errors (classified by the error code
+and the SQLSTATE of the connector error, not by the error of the test
+sql) open the circuit breaker, the next queries fail fast without
+connecting. After the reset time one
+trial query is let through (half open), the breaker is closed when it
+succeeds.
+
+    --metadata breaker_threshold 3       consecutive errors opening the breaker
+    --metadata breaker_reset 30          open time [s]
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import deque
+
+from .lazy import lazy_import
+
+# heavy modules are loaded on the first use
+sqlalchemy = lazy_import("sqlalchemy")
+
+DEFAULT_CONCURRENCY_INITIAL = 4
+DEFAULT_CONCURRENCY_MIN = 1
+DEFAULT_CONCURRENCY_MAX = 16
+DEFAULT_QUEUE_THRESHOLD = 1.0
+
+DEFAULT_BREAKER_THRESHOLD = 3
+DEFAULT_BREAKER_RESET = 30.0
+
+# multiplicative decrease of the limit
+DECREASE_FACTOR = 0.5
+
+# results in the error rate
+ERROR_RATE_WINDOW = 20
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half-open"
+
+# connection or warehouse errors (not the errors of the test sql):
+# SQLSTATE class 08 connection exception, 57P03 cannot connect now
+BREAKER_SQLSTATE_CLASSES = ("08",)
+BREAKER_SQLSTATES = ("57P03",)
+# 000606 no active warehouse, connector connection errors (failed to
+# connect, connection closed, failed to request, server error, timeout)
+BREAKER_ERRNOS = (606, 250001, 250002, 250003, 250005, 251011)
+# 390xxx authentication and session errors (e.g. token expired)
+BREAKER_ERRNO_RANGE = range(390000, 391000)
+
+# controller of (connection name, warehouse)
+_controllers: dict = {}
+_controllers_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """circuit breaker is open, the query is not submitted"""
+
+
+def get_error_message(error):
+    """error message without the sql of the sqlalchemy error"""
+
+    if error is None:
+        return None
+
+    return str(error).split("\n[SQL:", maxsplit=1)[0]
+
+
+def get_error_codes(error):
+    """errno and sqlstate of the connector error (also wrapped by sqlalchemy)"""
+
+    orig = getattr(error, "orig", None) or error
+
+    errno = getattr(orig, "errno", None)
+
+    try:
+        errno = int(errno) if errno is not None else None
+    except (TypeError, ValueError):
+        errno = None
+
+    return errno, getattr(orig, "sqlstate", None)
+
+
+def is_breaker_error(error):
+    """connection or warehouse error, the exception of the failed query
+    (the error message of the test is not classified)"""
+
+    if not isinstance(error, BaseException):
+        return False
+
+    if isinstance(error, sqlalchemy.exc.TimeoutError):
+        # pool checkout timeout, the client waits, not the backend
+        return False
+
+    if isinstance(error, (sqlalchemy.exc.DisconnectionError, ConnectionError, TimeoutError)):
+        # network error
+        return True
+
+    if getattr(error, "connection_invalidated", False):
+        return True
+
+    errno, sqlstate = get_error_codes(error)
+
+    if sqlstate and (str(sqlstate)[:2] in BREAKER_SQLSTATE_CLASSES
+                     or str(sqlstate) in BREAKER_SQLSTATES):
+        return True
+
+    return errno is not None and (errno in BREAKER_ERRNOS or errno in BREAKER_ERRNO_RANGE)
+
+
+class CircuitBreaker:
+    """fail fast after repeated connection or warehouse errors"""
+
+    def __init__(self, threshold=DEFAULT_BREAKER_THRESHOLD, reset_timeout=DEFAULT_BREAKER_RESET,
+                 clock=time.monotonic):
+
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self._trial_running = False
+
+    def before_call(self):
+        """raise CircuitOpenError if the call is not allowed, called under the lock"""
+
+        if self.state == BREAKER_OPEN:
+
+            if self.clock() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError(f"Circuit open: {self.failures} errors, "
+                                       + f"last: {self.last_error}")
+
+            self.state = BREAKER_HALF_OPEN
+            logging.info("circuit half open")
+
+        if self.state == BREAKER_HALF_OPEN:
+
+            if self._trial_running:
+                raise CircuitOpenError(f"Circuit half open, last error: {self.last_error}")
+
+            self._trial_running = True
+
+    def on_success(self):
+        """successful call"""
+
+        if self.state != BREAKER_CLOSED:
+            logging.info("circuit closed")
+
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self._trial_running = False
+
+    def on_failure(self, error):
+        """connection or warehouse error"""
+
+        self.failures += 1
+        self.last_error = get_error_message(error)
+        self._trial_running = False
+
+        if self.state == BREAKER_HALF_OPEN or self.failures >= self.threshold:
+
+            if self.state != BREAKER_OPEN:
+                logging.error("circuit open: %s errors, last: %s",
+                              str(self.failures), self.last_error)
+
+            self.state = BREAKER_OPEN
+            self.opened_at = self.clock()
+
+
+class ConcurrencySlot:
+    """acquired query slot"""
+
+    def __init__(self, started):
+        self.started = started
+
+
+class ConcurrencyController:
+    """AIMD limit of the in-flight queries with the circuit breaker"""
+
+    def __init__(self, initial=DEFAULT_CONCURRENCY_INITIAL, min_limit=DEFAULT_CONCURRENCY_MIN,
+                 max_limit=DEFAULT_CONCURRENCY_MAX, queue_threshold=DEFAULT_QUEUE_THRESHOLD,
+                 breaker: CircuitBreaker = None, clock=time.monotonic):
+
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.queue_threshold = queue_threshold
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self.clock = clock
+
+        self.in_flight = 0
+        self.last_decrease = None
+        self.results = deque(maxlen=ERROR_RATE_WINDOW)
+
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """wait for the free slot, CircuitOpenError if the breaker is open
+
+        Returns:
+            ConcurrencySlot: slot to release
+        """
+
+        with self._condition:
+
+            while True:
+                # fail fast, also the waiting queries
+                self.breaker.before_call()
+
+                if self.in_flight < int(self.limit) or self.breaker.state == BREAKER_HALF_OPEN:
+                    break
+
+                self._condition.wait(timeout=1.0)
+
+            self.in_flight += 1
+
+            return ConcurrencySlot(self.clock())
+
+    def release(self, slot: ConcurrencySlot, error=None, queued_time=None,
+                execution_time=None, timed_out=False):
+        """release the slot and adapt the limit
+
+        error: exception of the failed query (or the error message)
+        queued_time, execution_time in seconds
+        """
+
+        with self._condition:
+
+            self.in_flight -= 1
+
+            self.results.append(error is not None or timed_out)
+
+            # error of the test sql does not change the limit, the warehouse is fine
+            breaker_error = is_breaker_error(error)
+
+            if breaker_error:
+                self.breaker.on_failure(error)
+            else:
+                self.breaker.on_success()
+
+            overloaded = timed_out or breaker_error or (
+                queued_time is not None and queued_time > self.queue_threshold)
+
+            if overloaded:
+                # one decrease per window, queries started before the last
+                # decrease do not decrease again
+                if self.last_decrease is None or slot.started >= self.last_decrease:
+                    self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+                    self.last_decrease = self.clock()
+                    logging.info("concurrency decreased: %s (queued %s, execution %s, error %s)",
+                                 str(int(self.limit)), str(queued_time), str(execution_time),
+                                 get_error_message(error))
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            if self.breaker.state == BREAKER_OPEN:
+                # waiting queries fail fast
+                self._condition.notify_all()
+            else:
+                # wake only the waiters for the free slots (no thundering herd)
+                self._condition.notify(max(1, int(self.limit) - self.in_flight))
+
+    def get_error_rate(self):
+        """error rate of the last results"""
+
+        with self._condition:
+            return sum(self.results) / len(self.results) if self.results else 0.0
+
+    def get_info(self):
+        """state of the controller"""
+
+        return {"limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "error_rate": self.get_error_rate(),
+                "breaker": self.breaker.state}
+
+
+def get_concurrency_max(params: dict):
+    """ceiling of the in-flight queries (also the size of the engine pool)"""
+
+    return int((params or {}).get('CONCURRENCY_MAX') or DEFAULT_CONCURRENCY_MAX)
+
+
+def get_controller(connection_name, warehouse=None, params: dict = None):
+    """controller of the connection and warehouse, created with the params
+    of the first runner
+    """
+
+    params = params or {}
+
+    key = (connection_name, warehouse)
+
+    with _controllers_lock:
+
+        if key not in _controllers:
+
+            breaker = CircuitBreaker(
+                threshold=int(params.get('BREAKER_THRESHOLD') or DEFAULT_BREAKER_THRESHOLD),
+                reset_timeout=float(params.get('BREAKER_RESET') or DEFAULT_BREAKER_RESET))
+
+            _controllers[key] = ConcurrencyController(
+                initial=int(params.get('CONCURRENCY_INITIAL') or DEFAULT_CONCURRENCY_INITIAL),
+                min_limit=int(params.get('CONCURRENCY_MIN') or DEFAULT_CONCURRENCY_MIN),
+                max_limit=get_concurrency_max(params),
+                queue_threshold=float(params.get('QUEUE_THRESHOLD') or DEFAULT_QUEUE_THRESHOLD),
+                breaker=breaker)
+
+            logging.debug("concurrency controller: %s", str(key))
+
+        return _controllers[key]
+
+
+def reset_controllers():
+    """remove all controllers (end of the session)"""
+
+    with _controllers_lock:
+        _controllers.clear()
@@ -0,0 +1,453 @@
+"""Test configuration model, parsed and validated once per test
+
+The yml (merged with the directory default yml) is parsed when the test
+is loaded, the hot paths read plain attributes
+
+    config = get_config(df.attrs)
+    config.diff.limit, config.diff.colorize, config.baseline, config.debug
+
+data-test may be a dict or a list of dicts:
+
+    data-test:
+        diff_by_column_name:
+          limit: 0.1
+          colorize: true
+          profile: true              sketches of the failed DIFF columns
+        baseline:
+          key: [id]
+    depends-on: [row_count.yml]      run only if the upstream tests passed
+    smoke:                           smoke run (--metadata smoke true)
+        sample: 10
+        limit: 1000
+
+Invalid configurations raise ConfigError, the plugin reports them at the
+collection (pytest.UsageError), not in the middle of the run.
+"""
+
+from __future__ import annotations
+
+import functools
+import logging
+import numbers
+import os
+import re
+from dataclasses import dataclass
+
+from .lazy import lazy_import
+from .utils import get_default_yaml_filename
+from .utils import split_matrix_test_file
+
+# heavy modules are loaded on the first use
+yaml = lazy_import("yaml")
+
+CONFIG_KEY = "test_config"
+
+DEFAULT_SMOKE_LIMIT = 1000
+
+# SAMPLE (10), SAMPLE (1000 ROWS)
+SAMPLE_ROWS_PATTERN = re.compile(r"^\d+\s+rows$", re.IGNORECASE)
+
+TRUE_VALUES = ("true", "yes", "y", "1")
+FALSE_VALUES = ("false", "no", "n", "0", "")
+
+
+class ConfigError(ValueError):
+    """invalid test configuration"""
+
+
+@dataclass(frozen=True)
+class DiffConfig:
+    """data-test/diff_by_column_name"""
+
+    # values of the DIFF columns with abs() > limit are differences
+    limit: float = 0.0
+    # None: the caller decides
+    colorize: bool | None = None
+    # sketches of the failed DIFF columns
+    profile: bool = False
+
+
+@dataclass(frozen=True)
+class BaselineConfig:
+    """data-test/baseline"""
+
+    key: tuple = ()
+    # None: baseline default
+    chunk_size: int | None = None
+
+
+@dataclass(frozen=True)
+class SmokeConfig:
+    """smoke (sampled) run of the test"""
+
+    # percent or "<n> rows", None: no sampling
+    sample: str | None = None
+    # sampled tables, all tables if empty
+    tables: tuple = ()
+    seed: int | None = None
+    # outer row cap, None: no cap
+    limit: int | None = DEFAULT_SMOKE_LIMIT
+
+
+@dataclass(frozen=True)
+class DataTestConfig:
+    """validated test configuration"""
+
+    config_file: str | None = None
+    description: str = ""
+    debug: bool = False
+    timeout: float | None = None
+    # None: COALESCE metadata decides
+    coalesce: bool | None = None
+    matrix_batch: bool = False
+    # upstream test files (relative to the yml), the test runs only if they passed
+    depends_on: tuple = ()
+    diff: DiffConfig = DiffConfig()
+    baseline: BaselineConfig | None = None
+    # None: full run
+    smoke: SmokeConfig | None = None
+
+
+DEFAULT_CONFIG = DataTestConfig()
+
+
+def to_bool(value, name):
+    """yml bool (also the string values)"""
+
+    if isinstance(value, bool):
+        return value
+
+    if isinstance(value, numbers.Integral):
+        return bool(value)
+
+    if isinstance(value, str):
+        if value.strip().casefold() in TRUE_VALUES:
+            return True
+        if value.strip().casefold() in FALSE_VALUES:
+            return False
+
+    raise ConfigError(f"{name}: bool expected, got {value!r}")
+
+
+def to_number(value, name, minimum=0, positive=False):
+    """yml number (also the string values), int is kept"""
+
+    if isinstance(value, bool):
+        raise ConfigError(f"{name}: number expected, got {value!r}")
+
+    if isinstance(value, str):
+        try:
+            value = float(value) if any(c in value for c in ".eE") else int(value)
+        except ValueError:
+            raise ConfigError(f"{name}: number expected, got {value!r}") from None
+
+    if not isinstance(value, numbers.Real) or value != value:
+        raise ConfigError(f"{name}: number expected, got {value!r}")
+
+    if value < minimum or (positive and value <= 0):
+        raise ConfigError(f"{name}: {'> 0' if positive else f'>= {minimum}'} expected, "
+                          + f"got {value!r}")
+
+    return value
+
+
+def to_str_list(value, name):
+    """str or list of str"""
+
+    if isinstance(value, str):
+        return (value,)
+
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return tuple(value)
+
+    raise ConfigError(f"{name}: str or list of str expected, got {value!r}")
+
+
+def get_section(data: dict, name):
+    """section of the config, dict or list of dicts (merged)"""
+
+    section = data.get(name)
+
+    if section is None:
+        return {}
+
+    if isinstance(section, list):
+        merged = {}
+        for item in section:
+            if not isinstance(item, dict):
+                raise ConfigError(f"{name}: dict items expected, got {item!r}")
+            merged.update(item)
+        return merged
+
+    if not isinstance(section, dict):
+        raise ConfigError(f"{name}: dict expected, got {section!r}")
+
+    return section
+
+
+def parse_diff_config(data_test: dict, params: dict):
+    """data-test/diff_by_column_name, profile defaults to DIFF_PROFILE"""
+
+    section = get_section(data_test, "diff_by_column_name")
+
+    limit = section.get("limit")
+    colorize = section.get("colorize")
+    profile = section.get("profile", params.get("DIFF_PROFILE"))
+
+    return DiffConfig(
+        limit=0.0 if limit is None else to_number(limit, "diff_by_column_name/limit"),
+        colorize=None if colorize is None else to_bool(colorize, "diff_by_column_name/colorize"),
+        profile=False if profile is None else to_bool(profile, "diff_by_column_name/profile"))
+
+
+def parse_baseline_config(data_test: dict):
+    """data-test/baseline, None without baseline"""
+
+    if "baseline" not in data_test:
+        return None
+
+    section = data_test.get("baseline")
+
+    # baseline: true
+    if section is None or isinstance(section, bool):
+        return BaselineConfig() if section in (None, True) else None
+
+    section = get_section(data_test, "baseline")
+
+    key = section.get("key")
+    chunk_size = section.get("chunk_size")
+
+    if chunk_size is not None:
+        chunk_size = to_number(chunk_size, "baseline/chunk_size", positive=True)
+        if not isinstance(chunk_size, numbers.Integral):
+            raise ConfigError(f"baseline/chunk_size: int expected, got {chunk_size!r}")
+
+    return BaselineConfig(key=() if key is None else to_str_list(key, "baseline/key"),
+                          chunk_size=chunk_size)
+
+
+def to_sample(value, name):
+    """SAMPLE percent (0, 100] or "<n> rows\""""
+
+    if isinstance(value, str) and SAMPLE_ROWS_PATTERN.match(value.strip()):
+        return " ".join(value.split()).upper()
+
+    value = to_number(value, name, positive=True)
+
+    if value > 100:
+        raise ConfigError(f"{name}: percent <= 100 or \"<n> rows\" expected, got {value!r}")
+
+    return str(value)
+
+
+def parse_smoke_config(sql_formatted: dict, params: dict):
+    """smoke, None if it is not the smoke run or the test is excluded
+    (smoke: false), the defaults are SMOKE_SAMPLE and SMOKE_LIMIT"""
+
+    if not to_bool(params.get("SMOKE") or False, "smoke"):
+        return None
+
+    section = sql_formatted.get("smoke")
+
+    # smoke: false
+    if section is not None and not isinstance(section, (dict, list)):
+        if not to_bool(section, "smoke"):
+            return None
+        section = None
+
+    section = get_section({"smoke": section}, "smoke")
+
+    sample = section.get("sample", params.get("SMOKE_SAMPLE"))
+    tables = section.get("tables")
+    seed = section.get("seed")
+    limit = section.get("limit", params.get("SMOKE_LIMIT") or DEFAULT_SMOKE_LIMIT)
+
+    if seed is not None:
+        seed = to_number(seed, "smoke/seed")
+        if not isinstance(seed, numbers.Integral):
+            raise ConfigError(f"smoke/seed: int expected, got {seed!r}")
+
+    if limit not in (None, ""):
+        limit = to_number(limit, "smoke/limit")
+        if not isinstance(limit, numbers.Integral):
+            raise ConfigError(f"smoke/limit: int expected, got {limit!r}")
+
+    return SmokeConfig(sample=None if sample in (None, "") else to_sample(sample, "smoke/sample"),
+                       tables=() if tables is None else to_str_list(tables, "smoke/tables"),
+                       seed=seed,
+                       limit=limit or None)
+
+
+def validate_sections(sql_formatted: dict):
+    """keys used by the runner (session, metadata, matrix, shared datasets)"""
+
+    session = sql_formatted.get("session")
+    if session is not None and (not isinstance(session, list)
+                                or not all(isinstance(stmt, str) for stmt in session)):
+        raise ConfigError(f"session: list of statements expected, got {session!r}")
+
+    metadata = sql_formatted.get("metadata")
+    if metadata is not None:
+        if not isinstance(metadata, dict):
+            raise ConfigError(f"metadata: dict expected, got {metadata!r}")
+
+        for key, value in metadata.items():
+            if not isinstance(value, dict) or not isinstance(value.get("pattern"), str) \
+                    or not isinstance(value.get("repl"), str):
+                raise ConfigError(f"metadata/{key}: pattern and repl expected, got {value!r}")
+
+    matrix = sql_formatted.get("matrix")
+    if matrix is not None:
+        if not isinstance(matrix, dict) or not matrix:
+            raise ConfigError(f"matrix: dict expected, got {matrix!r}")
+
+        for key, values in matrix.items():
+            if values is None or values == [] or isinstance(values, dict):
+                raise ConfigError(f"matrix/{key}: values expected, got {values!r}")
+
+    shared_datasets = sql_formatted.get("shared-datasets")
+    if shared_datasets is not None:
+        if not isinstance(shared_datasets, dict) or \
+                not all(isinstance(sql, str) for sql in shared_datasets.values()):
+            raise ConfigError(f"shared-datasets: dict of sql expected, got {shared_datasets!r}")
+
+    for key in ("sql", "sql-file", "description", "warehouse"):
+        if sql_formatted.get(key) is not None and not isinstance(sql_formatted[key], str):
+            raise ConfigError(f"{key}: str expected, got {sql_formatted[key]!r}")
+
+
+def parse_test_config(sql_formatted: dict, params: dict = None):
+    """validated configuration of the test (yml merged with the default yml),
+    params (uppercase keys) are the defaults of the metadata switches
+
+    Returns:
+        DataTestConfig: configuration
+    """
+
+    if not isinstance(sql_formatted, dict):
+        raise ConfigError(f"yml: dict expected, got {sql_formatted!r}")
+
+    config_file = sql_formatted.get("config-file")
+
+    try:
+        validate_sections(sql_formatted)
+
+        data_test = get_section(sql_formatted, "data-test")
+
+        timeout = sql_formatted.get("timeout")
+        coalesce = sql_formatted.get("coalesce")
+
+        return DataTestConfig(
+            config_file=config_file,
+            description=sql_formatted.get("description") or "",
+            debug=to_bool(sql_formatted.get("debug") or False, "debug"),
+            timeout=None if timeout in (None, "") else to_number(timeout, "timeout",
+                                                                  positive=True),
+            coalesce=None if coalesce is None else to_bool(coalesce, "coalesce"),
+            matrix_batch=to_bool(sql_formatted.get("matrix-batch") or False, "matrix-batch"),
+            depends_on=() if sql_formatted.get("depends-on") is None else
+            to_str_list(sql_formatted.get("depends-on"), "depends-on"),
+            diff=parse_diff_config(data_test, params or {}),
+            baseline=parse_baseline_config(data_test),
+            smoke=parse_smoke_config(sql_formatted, params or {}))
+
+    except ConfigError as e:
+        raise ConfigError(f"{config_file or 'test'}: {e}") from None
+
+
+def get_config(attrs: dict):
+    """configuration of the result (df.attrs) or sql_formatted, parsed if
+    the test was not loaded by the runner"""
+
+    if not attrs:
+        return DEFAULT_CONFIG
+
+    config = attrs.get(CONFIG_KEY)
+
+    if isinstance(config, DataTestConfig):
+        return config
+
+    return parse_test_config(attrs)
+
+
+@functools.lru_cache(maxsize=1024)
+def read_yaml(yml_file, mtime_ns):  # pylint: disable=unused-argument
+    """yml content, cached until the file is changed"""
+
+    with open(yml_file, "r", encoding="utf-8") as f:
+        try:
+            return yaml.full_load(f)
+
+        except yaml.YAMLError as e:
+            raise ConfigError(f"{yml_file}: {e}") from None
+
+
+def load_yaml(yml_file):
+    """yml content (dict)"""
+
+    data = read_yaml(yml_file, os.stat(yml_file).st_mtime_ns)
+
+    if data is None:
+        return {}
+
+    if not isinstance(data, dict):
+        raise ConfigError(f"{yml_file}: dict expected, got {type(data).__name__}")
+
+    return data
+
+
+def load_test_config(test_file, params: dict = None):
+    """configuration of the test file (matrix test id), the yml merged with
+    the directory default yml like the runner, params (uppercase keys) are
+    the defaults of the metadata switches (smoke, DIFF_PROFILE)
+
+    Returns:
+        DataTestConfig: configuration
+    """
+
+    config_file, _ = split_matrix_test_file(test_file)
+
+    data = {}
+
+    if config_file.endswith(".yml"):
+        data = dict(load_yaml(config_file))
+
+    default_yml_file = get_default_yaml_filename(config_file)
+
+    if default_yml_file and os.path.abspath(default_yml_file) != os.path.abspath(config_file):
+        for key, value in load_yaml(default_yml_file).items():
+            data.setdefault(key, value)
+
+    data["config-file"] = config_file
+
+    return parse_test_config(data, params)
+
+
+def validate_test_files(test_files, params: dict = None):
+    """configuration errors of the test files with the run params
+
+    Returns:
+        list: error messages
+    """
+
+    errors = []
+
+    # matrix combinations share the config file
+    config_files = dict.fromkeys(split_matrix_test_file(test_file)[0]
+                                 for test_file in test_files if test_file)
+
+    for test_file in config_files:
+
+        try:
+            load_test_config(test_file, params)
+
+        except ConfigError as e:
+            errors.append(str(e))
+
+        except OSError as e:
+            errors.append(f"{test_file}: {e}")
+
+    if errors:
+        logging.error("invalid test configuration: %s", "; ".join(errors))
+
+    return errors
@@ -1,19 +1,316 @@
 """conftest for pytest"""
 
+from __future__ import annotations
+
+import contextlib
 import os
 import logging
 from datetime import datetime
 
-import pandas as pd
 
-import pytest_html
 import pytest
 
 # needed file in the directory  __init__.py
+from .lazy import lazy_import
 from .utils import get_df_test_index
 from .utils import write_test_results_to_excel
+from .utils import write_test_results_to_parquet
 from .utils import safe_df_result
-from .utils import get_dict_by_path
+from .coalesce import register_test_files
+from .coalesce import reset_coalesce
+from .shared_datasets import register_shared_references
+from .shared_datasets import reset_shared_datasets
+from .concurrency import reset_controllers
+from .config_model import get_config
+from .config_model import validate_test_files
+from .dependencies import DependencyError
+from .dependencies import build_dag
+from .dependencies import get_skip_reason
+from .dependencies import get_skipped_result
+from .dependencies import get_topological_order
+from .dependencies import is_passed
+from .engine_pool import dispose_engines
+from .preflight import is_preflight
+from .preflight import reset_preflight
+from .preflight import run_preflight
+from .single_flight import reset_single_flight
+from .engine_pool import warm_up_engine
+from .snapshot import SNAPSHOT_REPLAY
+from .snapshot import get_snapshot_mode
+from .utils import is_true
+from .html_report import DEFAULT_LAZY_MAX_ROWS
+from .html_report import DEFAULT_MAX_COLS
+from .html_report import DEFAULT_MAX_ROWS
+from .html_report import HTML_EXTRAS_LAZY
+from .html_report import LAZY_LOADER_SCRIPT
+from .html_report import df_to_html
+from .html_report import get_lazy_html
+from .html_report import write_fragment
+from .run_history import DEFAULT_REGRESSION_THRESHOLD
+from .run_history import DEFAULT_REGRESSION_WINDOW
+from .run_history import get_regressions
+from .run_history import get_run_history_db
+from .run_history import get_test_durations
+from .run_history import save_run
+from .selection import RunSelection
+from .selection import SelectionError
+from .snowflake_test_runner import SnowflakeTestRunner
+from .snowflake_test_runner import reset_matrix_batches
+from .work_queue import DEFAULT_LEASE_TIMEOUT
+from .work_queue import DEFAULT_SPILL_DIR
+from .work_queue import DEFAULT_WAIT
+from .work_queue import ROLE_COORDINATOR
+from .work_queue import LeaseKeeper
+from .work_queue import WorkQueue
+from .work_queue import get_task_key
+from .work_queue import get_worker_id
+from .work_queue import spill_result
+
+# heavy modules are loaded on the first use
+pd = lazy_import("pandas")
+pytest_html = lazy_import("pytest_html")
+
+
+def get_item_test_file(item):
+    """test file parameter of the test item"""
+
+    callspec = getattr(item, "callspec", None)
+
+    if callspec:
+        return callspec.params.get("test_file", None)
+
+    return None
+
+
+def get_config_metadata(config):
+    """pytest-metadata (--metadata key value) of the session"""
+
+    try:
+        from pytest_metadata.plugin import metadata_key
+        return config.stash.get(metadata_key, {})
+
+    except ImportError:
+        return getattr(config, "_metadata", {})
+
+
+def get_config_params(config):
+    """environment and metadata parameters with uppercase keys (like SnowflakeTestRunner)"""
+
+    params = dict(os.environ) | dict(get_config_metadata(config) or {})
+
+    return {str(k).upper(): v for k, v in params.items()}
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_configure(config):
+    """start connection in the background, it overlaps with the collection"""
+
+    params = get_config_params(config)
+
+    if (params.get('CONNECTION_NAME') and is_true(params.get('PRECONNECT', True))
+            and get_snapshot_mode(params) != SNAPSHOT_REPLAY
+            and not config.option.collectonly):
+        warm_up_engine(params.get('CONNECTION_NAME'), params)
+
+
+# after -k, -m and --deselect: only the tests of the run are registered
+@pytest.hookimpl(trylast=True)
+def pytest_collection_modifyitems(session, config, items):
+    """validate the test configurations, select the tests (--metadata select),
+    register collected test files"""
+
+    test_files = [get_item_test_file(item) for item in items]
+
+    # invalid yml fails the collection, not the run (smoke, DIFF_PROFILE of the run)
+    config_errors = validate_test_files(test_files, get_config_params(config))
+
+    if config_errors:
+        raise pytest.UsageError("invalid test configuration:\n" + "\n".join(config_errors))
+
+    try:
+        run_selection = RunSelection(get_config_params(config))
+
+        if run_selection.is_enabled():
+            selected, _ = run_selection.select(
+                [(item.nodeid, get_item_test_file(item)) for item in items])
+
+            selected = set(selected)
+            deselected = [item for item in items if item.nodeid not in selected]
+
+            if deselected:
+                # last results are reused in the report
+                config.hook.pytest_deselected(items=deselected)
+                items[:] = [item for item in items if item.nodeid in selected]
+                test_files = [get_item_test_file(item) for item in items]
+
+    except SelectionError as e:
+        raise pytest.UsageError(str(e)) from None
+
+    config.stash["run_selection"] = run_selection
+
+    try:
+        dag = build_dag(test_files)
+        order = get_topological_order(test_files, dag)
+
+    except DependencyError as e:
+        raise pytest.UsageError(str(e)) from None
+
+    if any(dag.values()):
+        # upstream tests first (depends-on), the other items stay in place
+        position = {test_file: i for i, test_file in enumerate(order)}
+        data_items = iter(sorted((item for item in items if get_item_test_file(item)),
+                                 key=lambda item: position[get_item_test_file(item)]))
+
+        items[:] = [next(data_items) if get_item_test_file(item) else item for item in items]
+        test_files = [get_item_test_file(item) for item in items]
+
+    config.stash["dependencies"] = dag
+    config.stash["dependency_outcomes"] = {}
+
+    params = get_config_params(config)
+
+    if params.get('WORK_QUEUE') and not config.option.collectonly:
+
+        work_queue = WorkQueue(params.get('WORK_QUEUE'),
+                               lease_timeout=params.get('LEASE_TIMEOUT') or DEFAULT_LEASE_TIMEOUT)
+
+        if str(params.get('WORK_QUEUE_ROLE') or '').casefold() == ROLE_COORDINATOR:
+            tests = [(get_task_key(get_item_test_file(item), config.rootpath), item.nodeid)
+                     for item in items if get_item_test_file(item)]
+
+            # a test is leased when its upstream tests passed
+            dag_keys = {get_task_key(test_file, config.rootpath):
+                        [get_task_key(upstream, config.rootpath) for upstream in upstream_list]
+                        for test_file, upstream_list in dag.items()}
+
+            # longest first by the run history of the workers
+            htmlpath = config.getoption('htmlpath', None)
+            run_history_db = get_run_history_db(params, os.path.dirname(htmlpath or ''))
+
+            # the manifest of the run, the workers run the tests
+            work_queue.load(tests, params.get('SPILL_DIR') or DEFAULT_SPILL_DIR,
+                            durations=get_test_durations(
+                                run_history_db, [test_id for _, test_id in tests])
+                            if run_history_db else {},
+                            dag=dag_keys)
+
+            config.hook.pytest_deselected(items=list(items))
+            items[:] = []
+            config.stash["work_queue_coordinator"] = True
+            return
+
+        # tests are leased in pytest_runtestloop
+        config.stash["work_queue"] = work_queue
+
+    register_test_files(test_files)
+    register_shared_references(test_files)
+
+    # the workers lease the tests one by one, no pre-flight of all tests
+    if is_preflight(params) and not config.option.collectonly \
+            and config.stash.get("work_queue", None) is None:
+        # EXPLAIN of the selected tests, invalid tests fail without the execution
+        with SnowflakeTestRunner(env=params) as runner:
+            run_preflight(runner, test_files)
+
+
+def pytest_runtest_setup(item):
+    """skip the test if an upstream test (depends-on) failed in this session"""
+
+    test_file = get_item_test_file(item)
+    upstream_list = item.config.stash.get("dependencies", {}).get(test_file)
+
+    if not upstream_list:
+        return
+
+    outcomes = item.config.stash.get("dependency_outcomes", {})
+
+    # not run by this process (work queue worker) is not a failure, the
+    # queue leases the test only when its upstream tests passed
+    failed = [upstream for upstream in upstream_list if outcomes.get(upstream) is False]
+
+    if failed:
+        item.stash["result"] = get_skipped_result(test_file, failed)
+        pytest.skip(get_skip_reason(failed))
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtestloop(session: pytest.Session):
+    """worker of the work queue, runs the leased tests and spills the results"""
+
+    work_queue: WorkQueue = session.config.stash.get("work_queue", None)
+
+    if work_queue is None:
+        return None
+
+    params = get_config_params(session.config)
+
+    spill_dir = work_queue.wait_loaded(params.get('WORK_QUEUE_WAIT') or DEFAULT_WAIT)
+
+    if not spill_dir:
+        raise session.Failed(f"work queue {work_queue.db_file} not loaded by the coordinator")
+
+    worker = get_worker_id(params)
+
+    # the tests not collected by the worker are left to the other workers
+    items = {get_task_key(get_item_test_file(item), session.config.rootpath): item
+             for item in session.items if get_item_test_file(item)}
+
+    run_items = []
+
+    task_keys = set(items)
+    leases = work_queue.iter_leases(worker, task_keys)
+    task = next(leases, None)
+
+    while task is not None:
+
+        task_key = task[0]
+        item = items[task_key]
+
+        # the next test is leased ahead, the fixtures shared with it (module,
+        # session) are kept; None (no test to lease now) tears down all
+        task = work_queue.lease(worker, task_keys)
+        nextitem = items[task[0]] if task else None
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(LeaseKeeper(work_queue, task_key, worker))
+
+            if task:
+                stack.enter_context(LeaseKeeper(work_queue, task[0], worker))
+
+            item.config.hook.pytest_runtest_protocol(item=item, nextitem=nextitem)
+
+        run_items.append(item)
+
+        spill_result(work_queue, spill_dir, task_key, worker, item.stash.get("result", None))
+
+        if session.shouldfail or session.shouldstop:
+            if task:
+                work_queue.release(task[0], worker)
+
+            if session.shouldfail:
+                raise session.Failed(session.shouldfail)
+
+            raise session.Interrupted(session.shouldstop)
+
+        if task is None:
+            task = next(leases, None)
+
+    # the xlsx and the html of the worker have only its tests
+    session.items = run_items
+
+    return True
+
+
+def pytest_unconfigure(config):
+    """dispose pooled engines, session temporary tables are dropped"""
+
+    dispose_engines()
+    reset_controllers()
+    reset_single_flight()
+    reset_preflight()
+    reset_coalesce()
+    reset_matrix_batches()
+    reset_shared_datasets()
 
 
 def pytest_html_results_table_header(cells):
@@ -58,6 +355,13 @@ def pytest_runtest_makereport(item):
     outcome = yield
     report = outcome.get_result()
 
+    test_file = get_item_test_file(item)
+
+    if test_file and (report.when == "call" or (report.when == "setup" and not report.passed)):
+        # upstream outcome of the dependent tests
+        item.config.stash.get("dependency_outcomes", {})[test_file] = \
+            report.passed and is_passed(item.stash.get("result", None))
+
     extra = getattr(report, "extra", [])
 
     if "request" in item.funcargs.keys():
@@ -85,6 +389,10 @@ def pytest_runtest_makereport(item):
 
                             report.rowcount = str(
                                 df_result.attrs.get("rowcount", ""))
+
+                            # smoke run, the rows of the sampled inputs
+                            if df_result.attrs.get("sampled"):
+                                report.rowcount = report.rowcount + " (sampled)"
                             report.queryid = str(
                                 df_result.attrs.get("query_id", ""))
 
@@ -92,6 +400,16 @@ def pytest_runtest_makereport(item):
                                 report.description = str(
                                     df_result.attrs.get("description"))
 
+                            params = get_config_params(request.config)
+
+                            html_max_rows = int(params.get(
+                                'HTML_MAX_ROWS') or DEFAULT_MAX_ROWS)
+                            html_max_cols = int(params.get(
+                                'HTML_MAX_COLS') or DEFAULT_MAX_COLS)
+
+                            html_lazy = str(params.get('HTML_EXTRAS', '')).casefold() \
+                                == HTML_EXTRAS_LAZY
+
                             if df_result.attrs.get("diff_summary_list"):
                                 logging.debug("diff_summary_list %s", str(
                                     df_result.attrs.get("diff_summary_list")))
@@ -99,13 +417,9 @@ def pytest_runtest_makereport(item):
                                 df_summary = pd.DataFrame(
                                     df_result.attrs.get("diff_summary_list"))
 
-                                df_summary = df_summary.style.format(
-                                    thousands=" ", decimal=",", precision=2)
+                                df_summary_html = df_to_html(
+                                    df_summary, max_rows=html_max_rows, max_cols=html_max_cols)
 
-                                df_summary_html = df_summary.to_html(index=False,
-                                                                     index_names=False,
-                                                                     border=1,
-                                                                     na_rep='NA')
                                 extra.append(pytest_html.extras.html(
                                     f"<span style='color:black'>{df_summary_html}</span>"))
 
@@ -113,25 +427,68 @@ def pytest_runtest_makereport(item):
                                 extra.append(
                                     pytest_html.extras.html("<p></p>"))
 
+                            if df_result.attrs.get("diff_profile_list"):
+
+                                # sketches of the failed DIFF columns
+                                df_profile_html = df_to_html(
+                                    pd.DataFrame(df_result.attrs.get("diff_profile_list")),
+                                    max_rows=html_max_rows, max_cols=html_max_cols)
+
+                                extra.append(pytest_html.extras.html(
+                                    f"<span style='color:black'>{df_profile_html}</span>"))
+
+                                extra.append(
+                                    pytest_html.extras.html("<p></p>"))
+
                             if df_result.attrs.get("diff_index_list_sample"):
 
                                 logging.debug("diff_index_list_sample %s", str(
                                     df_result.attrs.get("diff_index_list_sample")))
 
-                                df_diff = df_result.filter(
-                                    items=df_result.attrs.get(
-                                        "diff_index_list_sample"),
-                                    axis="index")
-
-                                df_diff = df_diff.style.format(
-                                    thousands=" ", decimal=",", precision=2)
-
-                                extra.append(
-                                    pytest_html.extras.html(
+                                if html_lazy:
+                                    # all diff rows, paginated in the report
+                                    diff_index_list = sorted(set(
+                                        index for indexes in df_result.attrs.get(
+                                            "diff_colorize_column_indexes", {}).values()
+                                        for index in indexes)) \
+                                        or df_result.attrs.get("diff_index_list_sample")
+
+                                    df_diff = df_result.filter(
+                                        items=diff_index_list, axis="index")
+
+                                    report_name = os.path.basename(
+                                        htmlpath).replace('.html', '')
+                                    fragment_dir_name = report_name + "_extras"
+
+                                    fragment_file = write_fragment(
+                                        os.path.join(os.path.dirname(
+                                            htmlpath), fragment_dir_name),
+                                        item.nodeid + ":diff", df_diff,
+                                        max_rows=int(params.get('HTML_LAZY_MAX_ROWS')
+                                                     or DEFAULT_LAZY_MAX_ROWS),
+                                        max_cols=html_max_cols)
+
+                                    extra.append(pytest_html.extras.html(
                                         "<span style='color:black'>"
-                                        + f"{df_diff.to_html(index=False, border=1, na_rep='NA')}"
+                                        + get_lazy_html(f"{fragment_dir_name}/{fragment_file}",
+                                                        "Diff rows", len(df_diff))
                                         + "</span>"))
 
+                                    request.config.stash["html_lazy_loader"] = True
+
+                                else:
+                                    df_diff = df_result.filter(
+                                        items=df_result.attrs.get(
+                                            "diff_index_list_sample"),
+                                        axis="index")
+
+                                    extra.append(
+                                        pytest_html.extras.html(
+                                            "<span style='color:black'>"
+                                            + df_to_html(df_diff, max_rows=html_max_rows,
+                                                         max_cols=html_max_cols)
+                                            + "</span>"))
+
                                 # extra line
                                 extra.append(
                                     pytest_html.extras.html("<p></p>"))
@@ -148,6 +505,25 @@ def pytest_runtest_makereport(item):
 def pytest_sessionfinish(session: pytest.Session):
     """session finish - save xlsx file"""
 
+    run_selection: RunSelection = session.config.stash.get("run_selection", None)
+
+    if run_selection is not None and run_selection.is_enabled():
+        try:
+            run_selection.save({item.nodeid: item.stash.get("result", None)
+                                for item in session.items})
+
+        except Exception as e:
+            logging.error("selection state error %s", str(e))
+
+        # all tests reused, nothing to run is not an error
+        if session.exitstatus == pytest.ExitCode.NO_TESTS_COLLECTED and run_selection.reused:
+            session.exitstatus = pytest.ExitCode.OK
+
+    # tests loaded into the work queue
+    if session.exitstatus == pytest.ExitCode.NO_TESTS_COLLECTED and \
+            session.config.stash.get("work_queue_coordinator", None):
+        session.exitstatus = pytest.ExitCode.OK
+
     if session.config.pluginmanager.hasplugin('html'):
         htmlpath = session.config.getoption('htmlpath')
 
@@ -194,17 +570,15 @@ def pytest_sessionfinish(session: pytest.Session):
 
                 test_results_dict[session_item.nodeid] = df_result
 
-                logging.debug("yml debug %s", get_dict_by_path(
-                    df_result.attrs, '/debug'))
+                debug = get_config(df_result.attrs).debug
+
+                logging.debug("yml debug %s", debug)
 
-                if get_dict_by_path(df_result.attrs, '/debug'):
+                if debug:
                     safe_df_result(session_item.name, report_dir, df_result)
 
                     logging.info("df_result put into the %s", str(report_dir))
 
-                logging.debug("yml debug DONE %s", get_dict_by_path(
-                    df_result.attrs, '/debug'))
-
             else:
 
                 df_result = pd.DataFrame()
@@ -218,6 +592,28 @@ def pytest_sessionfinish(session: pytest.Session):
 
         logging.debug("test_results_dict: %s", str(test_results_dict.keys()))
 
+        params = get_config_params(session.config)
+
+        run_history_db = get_run_history_db(params, report_dir)
+
+        if test_results_dict and run_history_db:
+
+            try:
+                run_id = save_run(run_history_db, test_results_dict)
+
+                session.config.stash["run_history_regressions"] = get_regressions(
+                    run_history_db, run_id,
+                    threshold=float(params.get('REGRESSION_THRESHOLD')
+                                    or DEFAULT_REGRESSION_THRESHOLD),
+                    window=int(params.get('REGRESSION_WINDOW') or DEFAULT_REGRESSION_WINDOW))
+
+            except Exception as e:
+                logging.error("run history error %s", str(e))
+
+        if run_selection is not None:
+            # unselected tests with the last result, marked as reused
+            test_results_dict = run_selection.merge_reused(test_results_dict)
+
         if test_results_dict and not os.path.isfile(output_xlsx):
 
             df_index = get_df_test_index(test_results_dict)
@@ -229,11 +625,50 @@ def pytest_sessionfinish(session: pytest.Session):
             session.config.stash["output_xlsx"] = output_xlsx
             session.config.stash["href_output_xlsx"] = href_output_xlsx
 
+            if params.get('PARQUET_DIR'):
+                write_test_results_to_parquet(
+                    df_index, test_results_dict, params.get('PARQUET_DIR'))
+
+                logging.info("Parquet directory: %s", params.get('PARQUET_DIR'))
+
 
 @pytest.hookimpl(trylast=True)
 def pytest_html_results_summary(postfix, session: pytest.Session):
     """pytest_html_results_summary"""
 
+    if session.config.stash.get("html_lazy_loader", None):
+
+        postfix.extend([LAZY_LOADER_SCRIPT])
+
+        # to run it only once
+        del session.config.stash["html_lazy_loader"]
+
+    if is_true(get_config_params(session.config).get('SMOKE')):
+
+        postfix.extend(["<p><b>Smoke run</b>: the results are computed on sampled or row "
+                        + "limited inputs (Sampled column of the xlsx index)</p>"])
+
+    run_selection: RunSelection = session.config.stash.get("run_selection", None)
+
+    if run_selection is not None and run_selection.reused:
+
+        df_reused = get_df_test_index(run_selection.reused)
+
+        postfix.extend([f"<p><b>Reused results</b> ({len(df_reused)} tests not selected)</p>"])
+        postfix.extend([df_to_html(df_reused[["Test name", "Diff result", "Reused",
+                                              "Error message"]], max_rows=len(df_reused))])
+
+    if session.config.stash.get("run_history_regressions", None):
+
+        df_regressions = pd.DataFrame(
+            session.config.stash.get("run_history_regressions", None))
+
+        postfix.extend(["<p><b>Performance regressions</b></p>"])
+        postfix.extend([df_to_html(df_regressions, max_rows=len(df_regressions))])
+
+        # to run it only once
+        del session.config.stash["run_history_regressions"]
+
     if session.config.stash.get("href_output_xlsx", None):
 
         href_output_xlsx = session.config.stash.get("href_output_xlsx", None)
@@ -0,0 +1,244 @@
+"""Test dependencies, the test runs only if its upstream tests passed
+
+    depends-on: row_count_parity.yml
+    depends-on: [row_count_parity.yml, keys.yml#REGION=EU]
+
+The paths are relative to the yml, a matrix yml stands for all its
+combinations. The depends-on of the directory default yml applies to
+every test of the directory (the upstream test itself is skipped).
+Upstream tests not in the run (-k, the selection) are ignored.
+
+The DAG of the tests is built at the collection: the tests run in the
+topological order (the collection order otherwise), a cycle is a
+collection error. The dependents of a failed (or skipped) test are
+skipped without the query, the result is marked with the reason
+(df.attrs["skipped"], Diff result "Skipped" in the report).
+
+The parallel runs (SnowflakeTestRunner.run_tests, the service, the
+notebook api) run the independent branches in parallel, a test starts
+when all its upstream tests are finished. The work queue records the DAG,
+a test is leased when its upstream tests passed on any worker.
+"""
+
+from __future__ import annotations
+
+import heapq
+import logging
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+
+from .config_model import ConfigError
+from .config_model import load_test_config
+from .lazy import lazy_import
+from .utils import get_basename_from_testname
+from .utils import split_matrix_test_file
+
+# heavy modules are loaded on the first use
+pd = lazy_import("pandas")
+
+
+class DependencyError(ValueError):
+    """dependency cycle"""
+
+
+def get_file_key(config_file):
+    """key of the config file, the same for the relative and absolute paths"""
+
+    return os.path.normcase(os.path.abspath(config_file))
+
+
+def get_depends_on(test_file):
+    """upstream references of the test [(file key, matrix id or None)]"""
+
+    try:
+        depends_on = load_test_config(test_file).depends_on
+
+    except (ConfigError, OSError) as e:
+        # reported by the configuration validation
+        logging.debug("depends-on %s error %s", test_file, str(e))
+        return []
+
+    config_dir = os.path.dirname(split_matrix_test_file(test_file)[0])
+
+    res = []
+
+    for upstream in depends_on:
+        upstream_file, matrix_id = split_matrix_test_file(upstream.strip())
+        res.append((get_file_key(os.path.join(config_dir, upstream_file)), matrix_id))
+
+    return res
+
+
+def build_dag(test_files):
+    """upstream tests of every test of the run
+
+    Returns:
+        dict: {test_file: [upstream test files]}
+    """
+
+    test_files = list(dict.fromkeys(test_file for test_file in test_files if test_file))
+
+    # file key -> [(matrix id, test file)]
+    by_file = {}
+
+    for test_file in test_files:
+        config_file, matrix_id = split_matrix_test_file(test_file)
+        by_file.setdefault(get_file_key(config_file), []).append((matrix_id, test_file))
+
+    dag = {}
+
+    for test_file in test_files:
+
+        upstream_list = []
+
+        for file_key, matrix_id in get_depends_on(test_file):
+
+            matched = [upstream for upstream_matrix_id, upstream in by_file.get(file_key, [])
+                       if matrix_id is None or upstream_matrix_id == matrix_id]
+
+            if not matched:
+                logging.info("depends-on %s: %s not in the run", test_file, file_key)
+
+            upstream_list.extend(upstream for upstream in matched
+                                 if upstream != test_file and upstream not in upstream_list)
+
+        dag[test_file] = upstream_list
+
+    return dag
+
+
+def get_cycle(dag: dict, remaining):
+    """tests of a cycle among the tests not ordered"""
+
+    test_file = next(iter(remaining))
+    path = []
+
+    while test_file not in path:
+        path.append(test_file)
+        test_file = next(upstream for upstream in dag[test_file] if upstream in remaining)
+
+    return path[path.index(test_file):] + [test_file]
+
+
+def get_topological_order(test_files, dag: dict):
+    """test files, the upstream tests first, the collection order otherwise
+
+    Raises:
+        DependencyError: cycle of the dependencies
+    """
+
+    test_files = list(dict.fromkeys(test_file for test_file in test_files if test_file))
+
+    position = {test_file: i for i, test_file in enumerate(test_files)}
+
+    waiting = {test_file: len(dag.get(test_file, ())) for test_file in test_files}
+    dependents = {}
+
+    for test_file in test_files:
+        for upstream in dag.get(test_file, ()):
+            dependents.setdefault(upstream, []).append(test_file)
+
+    ready = [position[test_file] for test_file in test_files if not waiting[test_file]]
+    heapq.heapify(ready)
+
+    order = []
+
+    while ready:
+        test_file = test_files[heapq.heappop(ready)]
+        order.append(test_file)
+
+        for dependent in dependents.get(test_file, ()):
+            waiting[dependent] -= 1
+            if not waiting[dependent]:
+                heapq.heappush(ready, position[dependent])
+
+    if len(order) < len(test_files):
+        remaining = {test_file for test_file in test_files if waiting[test_file]}
+        raise DependencyError("depends-on cycle: " + " -> ".join(get_cycle(dag, remaining)))
+
+    return order
+
+
+def is_passed(df):
+    """upstream passed, the result without the diff passes without an error"""
+
+    if not isinstance(df, pd.DataFrame):
+        return False
+
+    return bool(df.attrs.get("condition", not df.attrs.get("error_msg")))
+
+
+def get_skip_reason(failed_upstream):
+    """reason of the skipped dependent"""
+
+    names = [get_basename_from_testname(upstream) or upstream for upstream in failed_upstream]
+
+    return f"skipped: upstream failed {', '.join(names)}"
+
+
+def get_skipped_result(test_file, failed_upstream):
+    """result of the skipped dependent, no query"""
+
+    df = pd.DataFrame()
+
+    df.attrs["skipped"] = get_skip_reason(failed_upstream)
+    df.attrs["error_msg"] = df.attrs["skipped"]
+    df.attrs["condition"] = False
+    df.attrs["config-file"] = split_matrix_test_file(test_file)[0]
+
+    return df
+
+
+def iter_dag_results(executor, test_files, run_test_file):
+    """run the tests in the executor, a test is submitted when its upstream
+    tests are finished, dependents of the failed tests are skipped; yields
+    (test_file, df) as the tests finish"""
+
+    dag = build_dag(test_files)
+    order = get_topological_order(test_files, dag)
+
+    waiting = {test_file: len(dag[test_file]) for test_file in order}
+    dependents = {}
+
+    for test_file in order:
+        for upstream in dag[test_file]:
+            dependents.setdefault(upstream, []).append(test_file)
+
+    ready = deque(test_file for test_file in order if not waiting[test_file])
+    passed = {}
+    futures = {}
+
+    def finish(test_file, df):
+        passed[test_file] = is_passed(df)
+
+        for dependent in dependents.get(test_file, ()):
+            waiting[dependent] -= 1
+            if not waiting[dependent]:
+                ready.append(dependent)
+
+    while True:
+
+        while ready:
+            test_file = ready.popleft()
+            failed = [upstream for upstream in dag[test_file] if not passed[upstream]]
+
+            if failed:
+                df = get_skipped_result(test_file, failed)
+                logging.info("%s %s", test_file, df.attrs["skipped"])
+                finish(test_file, df)
+                yield test_file, df
+            else:
+                futures[executor.submit(run_test_file, test_file)] = test_file
+
+        if not futures:
+            return
+
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            test_file = futures.pop(future)
+            df = future.result()
+            finish(test_file, df)
+            yield test_file, df
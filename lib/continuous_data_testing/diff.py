@@ -1,15 +1,22 @@
 
 """Module providing a function for difference dataframe data."""
 
+from __future__ import annotations
+
 import logging
 from datetime import datetime
 
-import pandas as pd
+from .arrow_types import get_diff_mask
+from .arrow_types import is_arrow_series
+from .config_model import get_config
+from .lazy import lazy_import
+from .sketches import profile_column
 
-from .utils import get_dict_by_path
+# heavy modules are loaded on the first use
+pd = lazy_import("pandas")
 
 
-def apply_diff_by_column_name(df: pd.DataFrame, colorize=True):
+def apply_diff_by_column_name(df: pd.DataFrame, colorize=True, profile=None):
     """
     apply_diff columns with name DIFF != 0
 
@@ -17,30 +24,33 @@ def apply_diff_by_column_name(df: pd.DataFrame, colorize=True):
     df.attrs["diff_col_names_list"] 
     df.attrs["diff_col_iloc_list"] 
     df.attrs["diff_index_list"] 
+
+    profile (default yml profile / DIFF_PROFILE) sketches of the failed columns
+    df.attrs["diff_profile_list"]
+    df.attrs["diff_sketches"]
     """
 
     # data-test:
     #     diff_by_column_name:
     #       limit: 0.1
 
-    diff_limit = get_dict_by_path(
-        df.attrs, '/data-test/diff_by_column_name/limit')
-    diff_colorize = get_dict_by_path(
-        df.attrs, '/data-test/diff_by_column_name/colorize')
+    diff_config = get_config(df.attrs).diff
+
+    diff_colorize = diff_config.colorize
 
-    logging.info("YML colorize: %s", str(get_dict_by_path(
-        df.attrs, '/data-test/diff_by_column_name/colorize')))
+    logging.info("YML colorize: %s", diff_colorize)
 
     if not diff_colorize:
         diff_colorize = colorize
-        logging.info("colorize : %s", str(colorize))
+        logging.info("colorize : %s", colorize)
 
-    if diff_limit and str(diff_limit).isnumeric():
-        diff_limit_int = int(diff_limit)
-    else:
-        diff_limit_int = 0.0
+    # fractional limits e.g. 0.1
+    diff_limit_int = diff_config.limit
 
-    logging.info("diff_limit: %s %s", diff_limit, str(diff_limit_int))
+    if profile is None:
+        profile = diff_config.profile
+
+    logging.info("diff_limit: %s", diff_limit_int)
 
     t1_start = datetime.now()
 
@@ -52,6 +62,8 @@ def apply_diff_by_column_name(df: pd.DataFrame, colorize=True):
     diff_index_list_sample = list()
     diff_colorize_column_indexes = {}
     diff_summary_list = list()
+    diff_profile_list = list()
+    diff_sketches = {}
 
     for i, col in diff_cols:
 
@@ -59,8 +71,14 @@ def apply_diff_by_column_name(df: pd.DataFrame, colorize=True):
 
         df_diff = pd.DataFrame()
 
+        if is_arrow_series(df_col):
+
+            # compute kernels on the arrow buffers, only the column is filtered
+            logging.debug("Column type is arrow: %s %s", col, df_col.dtype)
+            df_diff = df_col[get_diff_mask(df_col, diff_limit_int)].to_frame()
+
         # if column is a string
-        if isinstance(df_col.dtype, pd.StringDtype):
+        elif isinstance(df_col.dtype, pd.StringDtype):
 
             logging.info("Column type is string: %s %s", col, df_col.dtype)
             df_diff = df.where(df_col.notnull()).where(df_col != '').where(
@@ -102,6 +120,12 @@ def apply_diff_by_column_name(df: pd.DataFrame, colorize=True):
                                           "diff records": df_diff.shape[0],
                                           "total records": df.shape[0],
                                           "diff [%]": round(100*df_diff.shape[0]/df.shape[0], 2)})
+
+                if profile:
+                    column_profile = profile_column(df_col, diff_limit_int)
+                    diff_profile_list.append(column_profile.get_summary(str(col)))
+                    diff_sketches[str(col)] = column_profile.to_dict()
+
                 logging.info("%s done", df_col.name)
 
     # create uniq index list
@@ -121,6 +145,10 @@ def apply_diff_by_column_name(df: pd.DataFrame, colorize=True):
     df.attrs["diff_index_list_sample"] = diff_index_list_sample
     df.attrs["diff_summary_list"] = diff_summary_list
 
+    if profile:
+        df.attrs["diff_profile_list"] = diff_profile_list
+        df.attrs["diff_sketches"] = diff_sketches
+
     # there were no erros
     if "error_msg" not in df.attrs.keys():
         df.attrs["condition"] = len(diff_col_names_list) == 0
@@ -0,0 +1,304 @@
+"""Pooled sqlalchemy engines, one engine per connection name
+
+Engines (and connections in the engine pool) are kept for the whole
+session, so the session temporary tables and the authentication are reused
+by the tests. Engines are disposed at the end of the session.
+
+Connection can be established in the background (warm_up_engine) when the
+plugin is configured, the first test waits for it and gets the already
+authenticated connection from the pool.
+
+The session of the test (session statements of the yml, the warehouse of
+the yml or of the pre-flight routing) is reset when the connection is
+returned to the pool (track_session): the warehouse, the database and the
+schema and the role are restored, the variables and the session
+parameters are unset. A connection with a session not restorable (other
+statements) is reconnected on the next checkout.
+"""
+
+import logging
+import re
+import threading
+
+from .concurrency import get_concurrency_max
+from .lazy import lazy_import
+from .utils import get_url_from_connection_name
+
+# heavy modules are loaded on the first use
+sqlalchemy = lazy_import("sqlalchemy")
+
+# snowflake connector token caching (externalbrowser / SSO and MFA),
+# repeated runs in one notebook session skip the authentication
+DEFAULT_CONNECT_ARGS = {"client_store_temporary_credential": True,
+                        "client_request_mfa_token": True}
+
+# connection info keys: context of the connection before the first test
+# session, session statements of the test (reset on the checkin)
+SESSION_DEFAULTS_KEY = "session_defaults"
+SESSION_CHANGES_KEY = "session_changes"
+
+SESSION_CONTEXT = ("ROLE", "WAREHOUSE", "DATABASE", "SCHEMA")
+
+# pool connections over the concurrency ceiling: the other warehouses of
+# the connection, the pre-flight, the metadata queries
+DEFAULT_POOL_OVERFLOW = 10
+
+LEADING_COMMENTS_PATTERN = re.compile(r"^(?:\s+|/\*.*?\*/|--[^\n]*(?:\n|$))*", re.DOTALL)
+QUOTED_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+USE_PATTERN = re.compile(r"^USE\s+(?:(ROLE|WAREHOUSE|DATABASE|SCHEMA)\b|(SECONDARY\b))?",
+                         re.IGNORECASE)
+SET_PATTERN = re.compile(r"^SET\s+(?:\(([^)]*)\)|([A-Za-z_$][\w$]*))\s*=", re.IGNORECASE)
+ALTER_SESSION_SET_PATTERN = re.compile(r"^ALTER\s+SESSION\s+SET\s+(.*)$",
+                                       re.IGNORECASE | re.DOTALL)
+PARAMETER_PATTERN = re.compile(r"([A-Za-z_]\w*)\s*=")
+
+_engines: dict = {}
+_engines_lock = threading.Lock()
+
+# connection name -> warm up thread
+_warm_up_threads: dict = {}
+
+
+def wait_warm_up(connection_name):
+    """wait for the background connection of the connection name"""
+
+    warm_up_thread = _warm_up_threads.get(connection_name)
+
+    if warm_up_thread and warm_up_thread is not threading.current_thread():
+        logging.debug("wait for warm up: %s", connection_name)
+        warm_up_thread.join()
+
+
+def get_engine(connection_name, params: dict = None):
+    """get pooled engine for the connection name, the pool holds the
+    in-flight queries of the concurrency ceiling (CONCURRENCY_MAX of the
+    params creating the engine) without waiting for the checkout"""
+
+    wait_warm_up(connection_name)
+
+    with _engines_lock:
+
+        if connection_name not in _engines:
+
+            logging.debug("create engine: %s", connection_name)
+
+            connection_url = get_url_from_connection_name(connection_name)
+            _engines[connection_name] = sqlalchemy.create_engine(
+                connection_url, connect_args=dict(DEFAULT_CONNECT_ARGS),
+                pool_size=get_concurrency_max(params), max_overflow=DEFAULT_POOL_OVERFLOW)
+
+            # the next test does not inherit the session of the previous test
+            sqlalchemy.event.listen(_engines[connection_name], "reset", reset_session)
+
+        return _engines[connection_name]
+
+
+def quote_identifier(name):
+    """quoted name of the CURRENT_* functions (case sensitive)"""
+
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def get_session_defaults(conn):
+    """role, warehouse, database and schema of the connection, None if unknown"""
+
+    try:
+        row = conn.execute(sqlalchemy.text(
+            "SELECT CURRENT_ROLE(), CURRENT_WAREHOUSE(), CURRENT_DATABASE(), CURRENT_SCHEMA()")
+        ).first()
+
+    except sqlalchemy.exc.SQLAlchemyError as e:
+        logging.error("session defaults error %s", str(e))
+        return None
+
+    return dict(zip(SESSION_CONTEXT, row)) if row else None
+
+
+def track_session(conn, session_list, warehouse=None):
+    """session statements of the test (and its warehouse) are reset when
+    the connection is returned to the pool, call before the statements"""
+
+    changes = list(session_list or [])
+
+    if warehouse:
+        changes.append(f"USE WAREHOUSE {warehouse}")
+
+    if not changes:
+        return
+
+    if SESSION_DEFAULTS_KEY not in conn.info:
+        conn.info[SESSION_DEFAULTS_KEY] = get_session_defaults(conn)
+
+    conn.info.setdefault(SESSION_CHANGES_KEY, []).extend(changes)
+
+
+def get_reset_statements(changes, defaults):
+    """statements restoring the session before the changes, None if the
+    session is not restorable (the connection is reconnected)
+
+    ALTER SESSION UNSET restores the user (account) default of the parameter
+    """
+
+    context = set()
+    variables = []
+    parameters = []
+
+    for stmt in changes:
+        stmt = LEADING_COMMENTS_PATTERN.sub("", str(stmt), count=1).strip().rstrip(';')
+
+        if not stmt:
+            continue
+
+        m = USE_PATTERN.match(stmt)
+        if m:
+            if m.group(2):
+                # USE SECONDARY ROLES
+                return None
+
+            # USE <database>[.<schema>]
+            kind = (m.group(1) or "DATABASE").upper()
+            context.add(kind)
+            if kind == "DATABASE":
+                context.add("SCHEMA")
+            continue
+
+        m = SET_PATTERN.match(stmt)
+        if m:
+            names = m.group(1).split(",") if m.group(1) is not None else [m.group(2)]
+            variables.extend(name.strip() for name in names if name.strip())
+            continue
+
+        m = ALTER_SESSION_SET_PATTERN.match(stmt)
+        if m:
+            parameters.extend(PARAMETER_PATTERN.findall(QUOTED_PATTERN.sub("''", m.group(1))))
+            continue
+
+        return None
+
+    if context and (not defaults or any(defaults.get(kind) is None for kind in context)):
+        # e.g. no default warehouse, it can not be unset
+        return None
+
+    statements = []
+
+    for kind in SESSION_CONTEXT:
+        if kind not in context:
+            continue
+
+        if kind == "SCHEMA":
+            statements.append("USE SCHEMA " + quote_identifier(defaults["DATABASE"]) + "."
+                              + quote_identifier(defaults["SCHEMA"]))
+        else:
+            statements.append(f"USE {kind} " + quote_identifier(defaults[kind]))
+
+    if variables:
+        statements.append(f"UNSET ({', '.join(dict.fromkeys(variables))})")
+
+    if parameters:
+        statements.append(f"ALTER SESSION UNSET {', '.join(dict.fromkeys(parameters))}")
+
+    return statements
+
+
+def reset_session(dbapi_connection, connection_record, _reset_state):
+    """pool reset event, restore the session changed by the test"""
+
+    changes = connection_record.info.pop(SESSION_CHANGES_KEY, None)
+
+    if not changes:
+        return
+
+    statements = get_reset_statements(changes, connection_record.info.get(SESSION_DEFAULTS_KEY))
+
+    if statements is None:
+        logging.info("session not restorable, reconnect: %s", str(changes))
+        # the next checkout gets a new session
+        connection_record.invalidate(soft=True)
+        return
+
+    cursor = dbapi_connection.cursor()
+
+    try:
+        for stmt in statements:
+            cursor.execute(stmt)
+            logging.debug("session reset: %s", stmt)
+
+    except Exception as e:
+        logging.error("session reset error %s", str(e))
+        connection_record.invalidate(e, soft=True)
+
+    finally:
+        cursor.close()
+
+
+def warm_up(connection_name, params: dict = None):
+    """create engine and authenticated connection, connection is returned to the pool"""
+
+    try:
+        engine = get_engine(connection_name, params)
+
+        with engine.connect():
+            logging.info("warm up connected: %s", connection_name)
+
+    except Exception as e:
+        # the first test reports the connection error
+        logging.error("warm up %s error %s", connection_name, str(e))
+
+
+def warm_up_engine(connection_name, params: dict = None):
+    """start connection in the background thread"""
+
+    if not connection_name or connection_name in _warm_up_threads:
+        return
+
+    warm_up_thread = threading.Thread(target=warm_up, args=(connection_name, params),
+                                      name=f"warm-up-{connection_name}", daemon=True)
+    _warm_up_threads[connection_name] = warm_up_thread
+    warm_up_thread.start()
+
+    logging.debug("warm up started: %s", connection_name)
+
+
+def ping_engine(connection_name):
+    """keep the pooled connection alive (idle watch mode), the engine is
+    not created
+
+    Returns:
+        bool: ping succeeded
+    """
+
+    with _engines_lock:
+        engine = _engines.get(connection_name)
+
+    if engine is None:
+        return False
+
+    try:
+        with engine.connect() as conn:
+            conn.execute(sqlalchemy.text("select 1"))
+
+        logging.debug("ping: %s", connection_name)
+
+        return True
+
+    except Exception as e:
+        logging.error("ping %s error %s", connection_name, str(e))
+
+        return False
+
+
+def dispose_engines():
+    """dispose all pooled engines"""
+
+    for connection_name in list(_warm_up_threads):
+        wait_warm_up(connection_name)
+
+    _warm_up_threads.clear()
+
+    with _engines_lock:
+
+        for connection_name, engine in _engines.items():
+            engine.dispose()
+            logging.debug("engine dispose: %s", connection_name)
+
+        _engines.clear()
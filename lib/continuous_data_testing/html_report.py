@@ -0,0 +1,235 @@
+"""Fast HTML rendering of the report tables
+
+Values are escaped and formatted directly (no DataFrame.style) with
+bounded rows and columns.
+
+Report mode lazy (--metadata html_extras lazy) writes the detail tables
+as compressed json fragments next to the report
+
+    <report>_extras/<hash of the test and table>.json.gz
+
+the tables are loaded and paginated when the row is expanded.
+Browsers do not fetch file:// urls, serve the report directory
+e.g. python -m http.server
+
+Standalone report (watch mode, no pytest-html) is written by
+write_html_report, the file is replaced atomically.
+"""
+
+from __future__ import annotations
+
+import decimal
+import gzip
+import hashlib
+import html
+import json
+import numbers
+import os
+import tempfile
+
+from .lazy import lazy_import
+
+# heavy modules are loaded on the first use
+pd = lazy_import("pandas")
+
+HTML_EXTRAS_LAZY = "lazy"
+
+DEFAULT_MAX_ROWS = 50
+DEFAULT_MAX_COLS = 30
+
+# rows written to the lazy fragment
+DEFAULT_LAZY_MAX_ROWS = 1000
+
+# rows per page of the lazy table
+LAZY_PAGE_SIZE = 50
+
+NA_REP = "NA"
+
+# added once to the report summary, the lazy tables are loaded on click
+LAZY_LOADER_SCRIPT = """
+<script>
+document.addEventListener('click', async (event) => {
+  const button = event.target.closest('.cdt-lazy button')
+  if (!button) return
+  const lazy = button.closest('.cdt-lazy')
+  const content = lazy.querySelector('.cdt-lazy-content')
+  if (!lazy.cdtData) {
+    try {
+      const response = await fetch(lazy.dataset.src)
+      const stream = response.body.pipeThrough(new DecompressionStream('gzip'))
+      lazy.cdtData = JSON.parse(await new Response(stream).text())
+    } catch (e) {
+      content.textContent = 'Cannot load ' + lazy.dataset.src + ': ' + e
+      return
+    }
+    lazy.cdtPage = 0
+  }
+  if (button.dataset.page === 'next') lazy.cdtPage += 1
+  if (button.dataset.page === 'prev') lazy.cdtPage -= 1
+  const data = lazy.cdtData
+  const pageSize = parseInt(lazy.dataset.pageSize)
+  const pages = Math.max(1, Math.ceil(data.rows.length / pageSize))
+  lazy.cdtPage = Math.min(Math.max(lazy.cdtPage, 0), pages - 1)
+  const escape = (v) => String(v).replace(/[&<>"']/g,
+    (c) => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c]))
+  const rows = data.rows.slice(lazy.cdtPage * pageSize, (lazy.cdtPage + 1) * pageSize)
+  content.innerHTML = '<table border="1"><thead><tr>'
+    + data.columns.map((c) => '<th>' + escape(c) + '</th>').join('')
+    + '</tr></thead><tbody>'
+    + rows.map((r) => '<tr>' + r.map((v) => '<td>' + escape(v) + '</td>').join('') + '</tr>').join('')
+    + '</tbody></table>'
+    + '<button data-page="prev">&lt;</button> page ' + (lazy.cdtPage + 1) + ' / ' + pages
+    + ' <button data-page="next">&gt;</button>'
+})
+</script>
+"""
+
+
+def format_value(value):
+    """format value: thousands " ", decimal ",", precision 2"""
+
+    if value is None or value is pd.NA or value is pd.NaT:
+        return NA_REP
+
+    if isinstance(value, bool):
+        return str(value)
+
+    if isinstance(value, numbers.Integral):
+        return f"{value:,}".replace(",", " ")
+
+    if isinstance(value, (numbers.Real, decimal.Decimal)):
+        if value != value:  # nan
+            return NA_REP
+        return f"{value:,.2f}".replace(",", " ").replace(".", ",")
+
+    return str(value)
+
+
+def get_formatted_rows(df: pd.DataFrame, max_rows, max_cols):
+    """formatted (not escaped) header and rows of the bounded dataframe"""
+
+    df_bounded = df.iloc[:max_rows, :max_cols]
+
+    columns = [str(col) for col in df_bounded.columns]
+    rows = [[format_value(value) for value in row]
+            for row in df_bounded.itertuples(index=False, name=None)]
+
+    return columns, rows
+
+
+def df_to_html(df: pd.DataFrame, max_rows=DEFAULT_MAX_ROWS, max_cols=DEFAULT_MAX_COLS):
+    """dataframe to html table, values are escaped"""
+
+    columns, rows = get_formatted_rows(df, max_rows, max_cols)
+
+    html_list = ['<table border="1" class="dataframe"><thead><tr>']
+    html_list.extend(f"<th>{html.escape(col)}</th>" for col in columns)
+    html_list.append("</tr></thead><tbody>")
+
+    for row in rows:
+        html_list.append("<tr>")
+        html_list.extend(f"<td>{html.escape(value)}</td>" for value in row)
+        html_list.append("</tr>")
+
+    html_list.append("</tbody></table>")
+
+    (df_rows, df_cols) = df.shape
+
+    if df_rows > max_rows or df_cols > max_cols:
+        html_list.append(f"<p>{min(df_rows, max_rows)} of {df_rows} rows, "
+                         + f"{min(df_cols, max_cols)} of {df_cols} columns</p>")
+
+    return "".join(html_list)
+
+
+def write_fragment(fragment_dir, name, df: pd.DataFrame,
+                   max_rows=DEFAULT_LAZY_MAX_ROWS, max_cols=DEFAULT_MAX_COLS):
+    """write formatted table to the compressed json fragment
+
+    Returns:
+        str: fragment file name
+    """
+
+    os.makedirs(fragment_dir, exist_ok=True)
+
+    columns, rows = get_formatted_rows(df, max_rows, max_cols)
+
+    fragment_file = hashlib.md5(name.encode("utf-8")).hexdigest()[:16] + ".json.gz"
+
+    with gzip.open(os.path.join(fragment_dir, fragment_file), "wt", encoding="utf-8") as f:
+        json.dump({"columns": columns, "rows": rows, "rowcount": len(df)}, f)
+
+    return fragment_file
+
+
+def get_lazy_html(src, title, rowcount, page_size=LAZY_PAGE_SIZE):
+    """placeholder of the lazy table"""
+
+    return (f"<div class='cdt-lazy' data-src='{html.escape(src, quote=True)}'"
+            + f" data-page-size='{page_size}'>"
+            + f"<button>{html.escape(title)} ({rowcount} rows)</button>"
+            + "<div class='cdt-lazy-content'></div></div>")
+
+
+def get_report_html(df_index: pd.DataFrame, test_results: dict, title="Test report",
+                    max_rows=DEFAULT_MAX_ROWS, max_cols=DEFAULT_MAX_COLS, refresh=None):
+    """standalone html report: results index and the diff summary and diff
+    rows of the tests, refresh [s] reloads the page in the browser
+    """
+
+    html_list = ["<!DOCTYPE html><html><head><meta charset='utf-8'>"]
+
+    if refresh:
+        html_list.append(f"<meta http-equiv='refresh' content='{int(refresh)}'>")
+
+    html_list.append(f"<title>{html.escape(title)}</title></head><body>")
+    html_list.append(f"<h1>{html.escape(title)}</h1>")
+    html_list.append(df_to_html(df_index.drop(columns=["SQL statement"], errors="ignore"),
+                                max_rows=len(df_index), max_cols=max_cols))
+
+    for test_id, df_result in test_results.items():
+
+        if not df_result.attrs.get("diff_summary_list") and not df_result.attrs.get("error_msg"):
+            continue
+
+        test_name = df_result.attrs.get("test_name") or test_id
+
+        html_list.append(f"<details><summary>{html.escape(str(test_name))}</summary>")
+
+        if df_result.attrs.get("error_msg"):
+            html_list.append(f"<pre>{html.escape(str(df_result.attrs.get('error_msg')))}</pre>")
+
+        if df_result.attrs.get("diff_summary_list"):
+            html_list.append(df_to_html(pd.DataFrame(df_result.attrs.get("diff_summary_list")),
+                                        max_rows=max_rows, max_cols=max_cols))
+
+        if df_result.attrs.get("diff_profile_list"):
+            html_list.append("<p></p>" + df_to_html(
+                pd.DataFrame(df_result.attrs.get("diff_profile_list")),
+                max_rows=max_rows, max_cols=max_cols))
+
+        if df_result.attrs.get("diff_index_list_sample"):
+            df_diff = df_result.filter(items=df_result.attrs.get("diff_index_list_sample"),
+                                       axis="index")
+            html_list.append("<p></p>" + df_to_html(df_diff, max_rows=max_rows, max_cols=max_cols))
+
+        html_list.append("</details>")
+
+    html_list.append("</body></html>")
+
+    return "".join(html_list)
+
+
+def write_html_report(output_html, df_index: pd.DataFrame, test_results: dict, **kwargs):
+    """write the standalone html report, the file is replaced atomically
+    (the browser never reloads a half written report)
+    """
+
+    report_dir = os.path.dirname(os.path.abspath(output_html))
+    os.makedirs(report_dir, exist_ok=True)
+
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=report_dir,
+                                     suffix=".html.tmp", delete=False) as f:
+        f.write(get_report_html(df_index, test_results, **kwargs))
+
+    os.replace(f.name, output_html)
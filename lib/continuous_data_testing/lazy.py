@@ -0,0 +1,67 @@
+"""Lazy import of heavy modules
+
+pandas, sqlalchemy, ... are loaded on the first attribute access,
+not when the plugin is imported (--collect-only, -k filtering).
+
+    pd = lazy_import("pandas")
+    pc = lazy_import("pyarrow.compute")
+
+A sub module is not looked up at the lazy_import (find_spec of a dotted
+name imports the parent package), only its top level package is; the
+sub module is imported with its parent on the first attribute access.
+
+The module is imported under the lock, tests run in parallel threads
+(run_tests, service) can touch the module for the first time at once.
+"""
+
+import importlib
+import importlib.util
+import sys
+import threading
+import types
+
+_lazy_import_lock = threading.RLock()
+
+
+class LazyModule(types.ModuleType):
+    """module proxy, the module is imported on the first attribute access"""
+
+    def __init__(self, name):
+
+        super().__init__(name)
+        self.__dict__["_lazy_module"] = None
+
+    def __getattr__(self, attr):
+
+        module = self.__dict__["_lazy_module"]
+
+        if module is None:
+            with _lazy_import_lock:
+
+                module = self.__dict__["_lazy_module"]
+
+                if module is None:
+                    module = importlib.import_module(self.__name__)
+
+                    # next attribute access without __getattr__
+                    self.__dict__.update(module.__dict__)
+                    self.__dict__["_lazy_module"] = module
+
+        return getattr(module, attr)
+
+
+def lazy_import(name):
+    """module loaded on the first attribute access"""
+
+    with _lazy_import_lock:
+
+        if name in sys.modules:
+            return sys.modules[name]
+
+        # find_spec of a sub module would import the parent package
+        package = name.partition(".")[0]
+
+        if importlib.util.find_spec(package) is None:
+            raise ModuleNotFoundError(f"No module named '{package}'", name=package)
+
+        return LazyModule(name)
@@ -0,0 +1,211 @@
+"""Pre-flight of the selected tests, EXPLAIN before the execution
+
+    --metadata preflight true
+    --metadata preflight_workers 8           concurrent EXPLAIN statements
+    --metadata warehouse_heavy LARGE_WH      warehouse of the heavy tests
+    --metadata warehouse_light SMALL_WH      warehouse of the light tests
+    --metadata heavy_bytes 10GB              estimated bytes of a heavy test
+    --metadata heavy_partitions 1000         estimated partitions of a heavy test
+
+The rendered sql of every selected test is compiled with
+
+    EXPLAIN USING TABULAR <sql>
+
+concurrently before the run (no warehouse is needed). A test that does
+not compile fails immediately, without queueing in the warehouse. The
+estimated bytes and partitions (GlobalStats of the plan) route the test
+to the heavy or the light warehouse, USE WAREHOUSE of the session
+(get_sql_from_params). The warehouse of the yml wins
+
+    warehouse: REPORTING_WH
+
+Tests with shared datasets (temporary tables created by the test) and
+tests not compiled (connection error) run without the pre-flight.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from .engine_pool import track_session
+from .lazy import lazy_import
+from .utils import is_true
+
+# heavy modules are loaded on the first use
+sqlalchemy = lazy_import("sqlalchemy")
+
+DEFAULT_PREFLIGHT_WORKERS = 8
+DEFAULT_HEAVY_BYTES = 10 * 1024 ** 3
+
+BYTES_PATTERN = re.compile(r"^\s*(\d+(?:\.\d*)?)\s*([KMGTP]?)I?B?\s*$", re.IGNORECASE)
+BYTES_UNITS = "KMGTP"
+
+GLOBAL_STATS = "GlobalStats"
+
+_lock = threading.Lock()
+
+# test_file -> PreflightResult of the session
+_preflight_results: dict = {}
+
+
+@dataclass(frozen=True)
+class PreflightResult:
+    """compiled plan of the test"""
+
+    # compilation error, the test fails without the execution
+    error: str | None = None
+    bytes_assigned: int | None = None
+    partitions_assigned: int | None = None
+    partitions_total: int | None = None
+    # routed warehouse, None: default WAREHOUSE
+    warehouse: str | None = None
+
+
+def is_preflight(params: dict):
+    """pre-flight enabled"""
+
+    return is_true(params.get('PREFLIGHT', False))
+
+
+def parse_bytes(value):
+    """bytes of 1000000, 10GB, 1.5 TiB"""
+
+    if value in (None, ""):
+        return None
+
+    m = BYTES_PATTERN.match(str(value))
+
+    if not m:
+        raise ValueError(f"heavy_bytes: bytes expected, got {value!r}")
+
+    unit = m.group(2).upper()
+
+    return int(float(m.group(1)) * 1024 ** (BYTES_UNITS.index(unit) + 1 if unit else 0))
+
+
+def get_plan_stats(rows):
+    """bytes, partitions assigned and total of the EXPLAIN USING TABULAR rows"""
+
+    for row in rows:
+        # snowflake sqlalchemy returns case insensitive names in lowercase
+        row = {str(key).casefold(): val for key, val in row.items()}
+
+        if row.get("operation") == GLOBAL_STATS:
+            return (row.get("bytesassigned"), row.get("partitionsassigned"),
+                    row.get("partitionstotal"))
+
+    return None, None, None
+
+
+def get_warehouse(params: dict, bytes_assigned, partitions_assigned):
+    """heavy or light warehouse of the estimate, None if not configured"""
+
+    heavy_bytes = parse_bytes(params.get('HEAVY_BYTES')) or DEFAULT_HEAVY_BYTES
+    heavy_partitions = params.get('HEAVY_PARTITIONS')
+
+    heavy = ((bytes_assigned or 0) >= heavy_bytes
+             or (heavy_partitions not in (None, "")
+                 and (partitions_assigned or 0) >= int(heavy_partitions)))
+
+    return params.get('WAREHOUSE_HEAVY' if heavy else 'WAREHOUSE_LIGHT') or None
+
+
+def explain_test(runner, test_file):
+    """pre-flight of the test, None if the test is not compiled"""
+
+    sql_formatted, _, _ = runner.get_test_config(test_file)
+
+    if not sql_formatted or not sql_formatted.get('sql'):
+        return None
+
+    # temporary tables do not exist before the test
+    if sql_formatted.get('shared-datasets-used'):
+        return None
+
+    session_list = list(runner.get_sql_from_params())
+    session_list.extend(sql_formatted.get('session', None) or [])
+
+    with runner.engine.connect() as conn:
+        try:
+            track_session(conn, sql_formatted.get('session', None))
+
+            for stmt in session_list:
+                conn.execute(sqlalchemy.text(stmt))
+
+            rows = conn.execute(sqlalchemy.text(
+                "EXPLAIN USING TABULAR " + sql_formatted['sql'].strip().rstrip(';'))
+            ).mappings().all()
+
+        except sqlalchemy.exc.ProgrammingError as e:
+            # compilation error of the test sql
+            return PreflightResult(error=f"pre-flight: {e}")
+
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            logging.error("pre-flight %s error %s", test_file, str(e))
+            return None
+
+    bytes_assigned, partitions_assigned, partitions_total = get_plan_stats(rows)
+
+    return PreflightResult(
+        bytes_assigned=bytes_assigned,
+        partitions_assigned=partitions_assigned,
+        partitions_total=partitions_total,
+        warehouse=get_warehouse(runner.params, bytes_assigned, partitions_assigned))
+
+
+def run_preflight(runner, test_files):
+    """compile the tests concurrently, results are kept for the run
+
+    Returns:
+        dict: {test_file: PreflightResult}
+    """
+
+    if not is_preflight(runner.params) or not runner.engine:
+        return {}
+
+    test_files = [test_file for test_file in test_files if test_file]
+
+    workers = int(runner.params.get('PREFLIGHT_WORKERS') or DEFAULT_PREFLIGHT_WORKERS)
+
+    def explain(test_file):
+        try:
+            return explain_test(runner, test_file)
+
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error("pre-flight %s error %s", test_file, str(e))
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers),
+                            thread_name_prefix="cdt-preflight") as executor:
+        results = {test_file: result for test_file, result
+                   in zip(test_files, executor.map(explain, test_files))
+                   if result is not None}
+
+    with _lock:
+        _preflight_results.update(results)
+
+    logging.info("pre-flight: %s tests, %s failed, %s heavy", str(len(results)),
+                 str(sum(1 for result in results.values() if result.error)),
+                 str(sum(1 for result in results.values()
+                         if result.warehouse and result.warehouse
+                         == runner.params.get('WAREHOUSE_HEAVY'))))
+
+    return results
+
+
+def get_preflight_result(test_file):
+    """pre-flight of the test, None if not compiled"""
+
+    with _lock:
+        return _preflight_results.get(test_file)
+
+
+def reset_preflight():
+    """new session"""
+
+    with _lock:
+        _preflight_results.clear()
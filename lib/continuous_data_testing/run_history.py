@@ -0,0 +1,250 @@
+"""Local run history (sqlite) with query performance regression detection
+
+Per test metrics of every run (timings, rowcount, query id, bytes scanned,
+diff result) are saved, when the history is turned on, to
+
+    --metadata run_history true         <report dir>/run_history.sqlite
+    --metadata run_history_db <file>    the shared file (work queue durations)
+
+keyed by the test id and the sql hash. The history is off by default, a
+report directory (e.g. a CI artifact) does not collect a database. Tests
+with query_time, fetch_time, rowcount or bytes_scanned over the rolling
+baseline (median of the last runs of the same sql, failed queries are
+skipped) are flagged
+
+    --metadata regression_threshold 0.5             +50% over the baseline
+    --metadata regression_window 10                 last runs in the baseline
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import sqlite3
+import statistics
+from datetime import datetime
+from datetime import timedelta
+
+from .utils import is_true
+
+RUN_HISTORY_FILE = "run_history.sqlite"
+
+DEFAULT_REGRESSION_THRESHOLD = 0.5
+DEFAULT_REGRESSION_WINDOW = 10
+
+# metric -> min absolute change to be a regression (noise)
+REGRESSION_METRICS = {"query_time": 1.0,
+                      "fetch_time": 1.0,
+                      "rowcount": 1,
+                      "bytes_scanned": 1024 * 1024}
+
+CREATE_TABLES = """
+CREATE TABLE IF NOT EXISTS run (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_ts TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS test_metrics (
+    run_id INTEGER NOT NULL REFERENCES run(run_id),
+    test_id TEXT NOT NULL,
+    sql_hash TEXT,
+    query_id TEXT,
+    connection_time REAL,
+    query_time REAL,
+    fetch_time REAL,
+    rowcount INTEGER,
+    bytes_scanned INTEGER,
+    condition INTEGER,
+    error_msg TEXT
+);
+CREATE INDEX IF NOT EXISTS test_metrics_test ON test_metrics (test_id, sql_hash, run_id);
+"""
+
+
+def get_run_history_db(params: dict, report_dir):
+    """run history file of the run, None if the history is off (RUN_HISTORY
+    not set: on with RUN_HISTORY_DB)"""
+
+    run_history = params.get('RUN_HISTORY')
+
+    if not (is_true(run_history) if run_history not in (None, '')
+            else params.get('RUN_HISTORY_DB')):
+        return None
+
+    return params.get('RUN_HISTORY_DB') or os.path.join(report_dir or '', RUN_HISTORY_FILE)
+
+
+def get_seconds(value):
+    """timedelta (or number) in seconds"""
+
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    return None
+
+
+def get_sql_hash(sql):
+    """hash of the test sql"""
+
+    if not sql:
+        return None
+
+    return hashlib.sha256(str(sql).encode("utf-8")).hexdigest()[:32]
+
+
+def get_test_metrics(test_id, attrs: dict):
+    """metrics of the test result"""
+
+    rowcount = attrs.get("rowcount")
+    bytes_scanned = attrs.get("bytes_scanned")
+
+    return {"test_id": test_id,
+            "sql_hash": get_sql_hash(attrs.get("sql")),
+            "query_id": str(attrs.get("query_id")) if attrs.get("query_id") else None,
+            "connection_time": get_seconds(attrs.get("connection_time")),
+            "query_time": get_seconds(attrs.get("query_time")),
+            "fetch_time": get_seconds(attrs.get("fetch_time")),
+            "rowcount": int(rowcount) if rowcount not in (None, "") else None,
+            "bytes_scanned": int(bytes_scanned) if bytes_scanned not in (None, "") else None,
+            "condition": 1 if attrs.get("condition") else 0,
+            "error_msg": str(attrs.get("error_msg")) if attrs.get("error_msg") else None}
+
+
+def connect(db_file):
+    """connect and create tables"""
+
+    db_dir = os.path.dirname(db_file)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+
+    conn = sqlite3.connect(db_file)
+    conn.executescript(CREATE_TABLES)
+
+    return conn
+
+
+def save_run(db_file, test_results: dict):
+    """save metrics of the run
+
+    test_results: {test_id: df}
+
+    Returns:
+        int: run_id
+    """
+
+    conn = connect(db_file)
+
+    try:
+        with conn:
+            run_id = conn.execute("INSERT INTO run (run_ts) VALUES (?)",
+                                  (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),)).lastrowid
+
+            metrics_list = [get_test_metrics(test_id, df_result.attrs)
+                            for test_id, df_result in test_results.items()]
+
+            conn.executemany(
+                "INSERT INTO test_metrics (run_id, test_id, sql_hash, query_id, connection_time,"
+                + " query_time, fetch_time, rowcount, bytes_scanned, condition, error_msg)"
+                + " VALUES (:run_id, :test_id, :sql_hash, :query_id, :connection_time,"
+                + " :query_time, :fetch_time, :rowcount, :bytes_scanned, :condition, :error_msg)",
+                [metrics | {"run_id": run_id} for metrics in metrics_list])
+
+    finally:
+        conn.close()
+
+    logging.info("run history: %s run_id %s", db_file, str(run_id))
+
+    return run_id
+
+
+def get_test_durations(db_file, test_ids, window=DEFAULT_REGRESSION_WINDOW):
+    """median query and fetch time [s] of the last runs, tests without
+    the history are missing
+
+    Returns:
+        dict: {test id: seconds}
+    """
+
+    if not os.path.isfile(db_file):
+        return {}
+
+    conn = connect(db_file)
+
+    res = {}
+
+    try:
+        for test_id in test_ids:
+
+            history = conn.execute(
+                "SELECT query_time, fetch_time FROM test_metrics WHERE test_id = ?"
+                + " AND query_time IS NOT NULL ORDER BY run_id DESC LIMIT ?",
+                (test_id, window)).fetchall()
+
+            if history:
+                res[test_id] = statistics.median(query_time + (fetch_time or 0)
+                                                 for query_time, fetch_time in history)
+
+    finally:
+        conn.close()
+
+    return res
+
+
+def get_regressions(db_file, run_id, threshold=DEFAULT_REGRESSION_THRESHOLD,
+                    window=DEFAULT_REGRESSION_WINDOW):
+    """metrics of the run over the rolling baseline, tests without
+    query_time (query error) are skipped
+
+    Returns:
+        list: [{test id, metric, value, baseline, change [%]}]
+    """
+
+    conn = connect(db_file)
+
+    res = []
+
+    try:
+        current = conn.execute(
+            "SELECT test_id, sql_hash, " + ", ".join(REGRESSION_METRICS)
+            + " FROM test_metrics WHERE run_id = ? AND query_time IS NOT NULL", (run_id,)).fetchall()
+
+        for row in current:
+
+            test_id, sql_hash = row[0], row[1]
+
+            history = conn.execute(
+                "SELECT " + ", ".join(REGRESSION_METRICS)
+                + " FROM test_metrics WHERE test_id = ? AND sql_hash IS ? AND run_id < ?"
+                + " AND query_time IS NOT NULL ORDER BY run_id DESC LIMIT ?",
+                (test_id, sql_hash, run_id, window)).fetchall()
+
+            if not history:
+                continue
+
+            for i, (metric, min_change) in enumerate(REGRESSION_METRICS.items()):
+
+                value = row[2 + i]
+                history_values = [h[i] for h in history if h[i] is not None]
+
+                if value is None or not history_values:
+                    continue
+
+                baseline = statistics.median(history_values)
+
+                if value - baseline >= min_change and value > baseline * (1 + threshold):
+                    res.append({"test id": test_id,
+                                "metric": metric,
+                                "value": value,
+                                "baseline": baseline,
+                                "change [%]": round(100 * (value - baseline) / baseline, 2)
+                                if baseline else None})
+
+    finally:
+        conn.close()
+
+    logging.info("run history regressions: %s", str(len(res)))
+
+    return res
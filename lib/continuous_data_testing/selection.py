@@ -0,0 +1,388 @@
+"""Smart test selection, only the failed, changed or impacted tests are run
+
+    --metadata select failed               failed (or not run) in the last run
+    --metadata select changed              changed since the last pass
+    --metadata select git:origin/main      test files changed since the git ref
+    --metadata select failed,changed       union of the modes
+    --metadata selection_dir <dir>         default .test_selection
+
+The fingerprint of a test is the hash of the test file, the sql of the
+yml, the directory default yml and the parameters used by the test (the
+names found in the files, the connection, warehouse and session
+variable, the smoke run). The fingerprints, the results and the condition of every run
+are saved to the selection directory (state.json, results/<key>.parquet
+and .json).
+
+The unselected tests are deselected, their last result is carried into
+the xlsx index and the html report, marked as reused
+(df.attrs["reused"] = time of the run). A test without a saved result
+is always run, the first run with the selection runs all tests.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import subprocess
+import tempfile
+from datetime import datetime
+
+from .arrow_types import get_dtype_backend
+from .arrow_types import read_parquet
+from .lazy import lazy_import
+from .sketches import to_native
+from .utils import df_to_export
+from .utils import df_to_native_types
+from .utils import get_test_config_files
+from .utils import MATRIX_SEPARATOR
+from .utils import get_test_fingerprint
+from .utils import split_matrix_test_file
+
+# heavy modules are loaded on the first use
+pd = lazy_import("pandas")
+
+SELECT_FAILED = "failed"
+SELECT_CHANGED = "changed"
+SELECT_GIT = "git"
+
+DEFAULT_SELECTION_DIR = ".test_selection"
+STATE_FILE = "state.json"
+RESULTS_DIR = "results"
+
+# parameters of the session, always part of the fingerprint
+SESSION_PARAMS = ("CONNECTION_NAME", "WAREHOUSE", "SESSION_VARIABLE", "SMOKE", "SMOKE_SAMPLE",
+                  "SMOKE_LIMIT")
+
+# parameters of the selection, never part of the fingerprint (select is in every sql)
+SELECTION_PARAMS = ("SELECT", "SELECTION_DIR")
+
+# result attributes carried to the next run (report)
+RESULT_ATTRS = ["condition", "error_msg", "description", "config-file", "sql", "test_name",
+                "rowcount", "query_id", "matrix_id", "diff_col_names_list",
+                "diff_col_iloc_list", "diff_colorize_column_indexes", "diff_index_list_sample",
+                "diff_summary_list", "diff_profile_list", "sampled"]
+
+IDENTIFIER_PATTERN = re.compile(r"[a-z0-9_]+")
+
+
+class SelectionError(ValueError):
+    """invalid selection (mode, git ref)"""
+
+
+def get_selection_modes(params: dict):
+    """selection modes {mode: argument}, empty without the selection"""
+
+    modes = {}
+
+    for mode in str(params.get('SELECT', '') or '').split(","):
+
+        mode, _, argument = mode.strip().partition(":")
+        mode = mode.casefold()
+
+        if not mode:
+            continue
+
+        if mode not in (SELECT_FAILED, SELECT_CHANGED, SELECT_GIT):
+            raise SelectionError(f"select: unknown mode {mode!r}, {SELECT_FAILED}, "
+                                 + f"{SELECT_CHANGED} or {SELECT_GIT}:<ref> expected")
+
+        if mode == SELECT_GIT and not argument:
+            raise SelectionError("select: git:<ref> expected")
+
+        modes[mode] = argument.strip()
+
+    return modes
+
+
+def get_selection_dir(params: dict):
+    """directory of the selection state and the results"""
+
+    return params.get('SELECTION_DIR', None) or DEFAULT_SELECTION_DIR
+
+
+def get_state_key(test_file):
+    """key of the test in the state, the test file path does not depend on
+    the pytest rootdir (node ids do)"""
+
+    config_file, matrix_id = split_matrix_test_file(test_file)
+
+    state_key = os.path.normcase(os.path.abspath(config_file))
+
+    return state_key + MATRIX_SEPARATOR + matrix_id if matrix_id else state_key
+
+
+def get_result_key(state_key):
+    """file name of the saved result"""
+
+    return hashlib.sha256(state_key.encode("utf-8")).hexdigest()[:32]
+
+
+def get_selection_fingerprint(test_file, params: dict):
+    """hash of the test configuration files and the parameters used by the
+    test, None if the test file does not exist"""
+
+    fingerprint = get_test_fingerprint(test_file)
+
+    if fingerprint is None:
+        return None
+
+    identifiers = set(IDENTIFIER_PATTERN.findall(test_file.casefold()))
+
+    for config_file in get_test_config_files(test_file):
+        try:
+            with open(config_file, 'r', encoding="utf-8", errors="replace") as f:
+                identifiers.update(IDENTIFIER_PATTERN.findall(f.read().casefold()))
+
+        except OSError:
+            pass
+
+    used_params = sorted((key, str(value)) for key, value in params.items()
+                         if key not in SELECTION_PARAMS
+                         and (key in SESSION_PARAMS or key.casefold() in identifiers))
+
+    return hashlib.sha256((fingerprint + json.dumps(used_params)).encode("utf-8")
+                          ).hexdigest()[:32]
+
+
+def get_git_changed_files(git_ref, cwd=None):
+    """absolute paths of the files changed since the git ref (committed,
+    not committed and untracked files)"""
+
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True,
+                                  text=True, encoding="utf-8").stdout
+
+        except (OSError, subprocess.CalledProcessError) as e:
+            stderr = getattr(e, "stderr", None) or str(e)
+            raise SelectionError(f"select git:{git_ref}: {stderr.strip()}") from None
+
+    top_level = git("rev-parse", "--show-toplevel").strip()
+
+    changed = git("diff", "--name-only", git_ref, "--").splitlines()
+    changed.extend(git("ls-files", "--others", "--exclude-standard", "--full-name",
+                       top_level).splitlines())
+
+    return {os.path.normcase(os.path.abspath(os.path.join(top_level, file)))
+            for file in changed if file}
+
+
+def load_state(selection_dir):
+    """{state key: state of the last run}"""
+
+    state_file = os.path.join(selection_dir, STATE_FILE)
+
+    if not os.path.isfile(state_file):
+        return {}
+
+    try:
+        with open(state_file, 'r', encoding="utf-8") as f:
+            return json.load(f)
+
+    except (OSError, ValueError) as e:
+        logging.error("selection state error %s %s", state_file, str(e))
+        return {}
+
+
+def save_state(selection_dir, state: dict):
+    """replace the state file"""
+
+    os.makedirs(selection_dir, exist_ok=True)
+
+    with tempfile.NamedTemporaryFile("w", dir=selection_dir, suffix=".tmp", delete=False,
+                                     encoding="utf-8") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+
+    os.replace(f.name, os.path.join(selection_dir, STATE_FILE))
+
+
+def save_result(selection_dir, state_key, df: pd.DataFrame):
+    """result (parquet) and the report attributes (json)"""
+
+    results_dir = os.path.join(selection_dir, RESULTS_DIR)
+    os.makedirs(results_dir, exist_ok=True)
+
+    result_file = os.path.join(results_dir, get_result_key(state_key))
+
+    df_result = df_to_export(df.copy(deep=False))
+    df_result.attrs = {}
+    df_result.to_parquet(result_file + ".parquet", index=False)
+
+    attrs = {attr: df.attrs.get(attr) for attr in RESULT_ATTRS if attr in df.attrs}
+
+    with open(result_file + ".json", mode='w', encoding="UTF8") as f:
+        json.dump(attrs, f, default=to_native)
+
+    return get_result_key(state_key)
+
+
+def load_result(selection_dir, result_key, dtype_backend=None):
+    """saved result with the report attributes, None if there is no result"""
+
+    result_file = os.path.join(selection_dir, RESULTS_DIR, result_key)
+
+    if not os.path.isfile(result_file + ".parquet") or not os.path.isfile(result_file + ".json"):
+        return None
+
+    try:
+        df = df_to_native_types(read_parquet(result_file + ".parquet", dtype_backend),
+                                dtype_backend)
+
+        with open(result_file + ".json", 'r', encoding="utf-8") as f:
+            attrs = json.load(f)
+
+    except (OSError, ValueError) as e:
+        logging.error("selection result error %s %s", result_file, str(e))
+        return None
+
+    df.attrs = attrs
+
+    return df
+
+
+class RunSelection:
+    """select the tests of the run, save the state after the run"""
+
+    def __init__(self, params: dict, cwd=None):
+
+        self.params = params
+        self.modes = get_selection_modes(params)
+        self.selection_dir = get_selection_dir(params)
+        self.dtype_backend = get_dtype_backend(params)
+        self.cwd = cwd
+
+        self.state = load_state(self.selection_dir) if self.modes else {}
+
+        # test id -> state key, fingerprint of the selected tests
+        self.fingerprints = {}
+
+        # test id -> reused result of the unselected tests
+        self.reused = {}
+
+        # collection order
+        self.test_ids = []
+
+    def is_enabled(self):
+        """selection mode set"""
+
+        return bool(self.modes)
+
+    def is_selected(self, test_state, test_file, fingerprint, git_changed):
+        """test is run"""
+
+        # nothing to reuse
+        if not test_state or not test_state.get("result"):
+            return True
+
+        if SELECT_FAILED in self.modes and not test_state.get("condition"):
+            return True
+
+        if SELECT_CHANGED in self.modes and fingerprint != test_state.get("passed_fingerprint"):
+            return True
+
+        if git_changed is not None:
+            config_files = {os.path.normcase(os.path.abspath(file))
+                            for file in get_test_config_files(test_file)}
+            if config_files & git_changed:
+                return True
+
+        return False
+
+    def select(self, tests):
+        """split (test id, test file) pairs into the selected and the
+        unselected test ids, results of the unselected tests are loaded
+
+        Returns:
+            tuple: selected test ids, unselected test ids
+        """
+
+        selected = []
+        unselected = []
+
+        self.test_ids = [test_id for test_id, _ in tests]
+
+        git_changed = None
+        if SELECT_GIT in self.modes:
+            git_changed = get_git_changed_files(self.modes[SELECT_GIT], self.cwd)
+
+        for test_id, test_file in tests:
+
+            # not a data test
+            if not test_file:
+                selected.append(test_id)
+                continue
+
+            state_key = get_state_key(test_file)
+            test_state = self.state.get(state_key)
+            fingerprint = get_selection_fingerprint(test_file, self.params)
+
+            if not self.is_selected(test_state, test_file, fingerprint, git_changed):
+
+                df = load_result(self.selection_dir, test_state["result"], self.dtype_backend)
+
+                if df is not None:
+                    df.attrs["reused"] = test_state.get("run_ts")
+                    self.reused[test_id] = df
+                    unselected.append(test_id)
+                    continue
+
+            self.fingerprints[test_id] = (state_key, fingerprint)
+            selected.append(test_id)
+
+        logging.info("selection %s: %s selected, %s reused", ",".join(self.modes),
+                     str(len(selected)), str(len(unselected)))
+
+        return selected, unselected
+
+    def merge_reused(self, test_results: dict):
+        """results of the run and the reused results in the collection order"""
+
+        if not self.reused:
+            return test_results
+
+        merged = {test_id: test_results[test_id] if test_id in test_results
+                  else self.reused[test_id]
+                  for test_id in self.test_ids
+                  if test_id in test_results or test_id in self.reused}
+
+        # not collected by the selection
+        merged.update(test_results)
+
+        return merged
+
+    def save(self, test_results: dict):
+        """save the state and the results of the run {test id: df}"""
+
+        run_ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        for test_id, df in test_results.items():
+
+            if test_id not in self.fingerprints:
+                continue
+
+            state_key, fingerprint = self.fingerprints[test_id]
+
+            test_state = self.state.setdefault(state_key, {})
+            test_state["result"] = None
+
+            # no result (error, not run), the test is run next time
+            condition = isinstance(df, pd.DataFrame) and bool(df.attrs.get("condition"))
+
+            if isinstance(df, pd.DataFrame):
+                try:
+                    test_state["result"] = save_result(self.selection_dir, state_key, df)
+
+                except Exception as e:
+                    logging.error("selection result not saved %s %s", test_id, str(e))
+
+            test_state["fingerprint"] = fingerprint
+            test_state["condition"] = condition
+            test_state["run_ts"] = run_ts
+
+            if condition:
+                test_state["passed_fingerprint"] = fingerprint
+
+        save_state(self.selection_dir, self.state)
@@ -0,0 +1,508 @@
+"""Long-running test service with warm pools and the on-demand run API
+
+    python -m lib.continuous_data_testing.service --connection-name dev \\
+        --metadata warehouse DEV_WH --port 8765 --report-dir reports
+
+The service keeps the pooled engines (authenticated connections), the
+test manifests of the directories and the concurrency controller warm,
+a run pays only the queries. Local http API (127.0.0.1 by default):
+
+    GET  /health                   status, engines, cached manifests
+    POST /run                      {"tests": ["sample_test", "sample_test/dual_1.sql"],
+                                    "k": "dual", "max_rows": 10, "report": true}
+                                   json lines, one per test as it finishes,
+                                   the last line is the summary with the artifacts
+    GET  /artifacts/<run>/<file>   report artifacts (xlsx)
+    POST /shutdown
+
+    curl -N -X POST localhost:8765/run -d '{"tests": ["sample_test"]}'
+
+Runs are serialized, tests of one run are run in parallel within the
+concurrency limit.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import unquote
+
+from .baseline import apply_baseline
+from .coalesce import register_test_files
+from .coalesce import reset_coalesce
+from .concurrency import reset_controllers
+from .dependencies import iter_dag_results
+from .diff import apply_diff_by_column_name
+from .engine_pool import dispose_engines
+from .engine_pool import warm_up_engine
+from .lazy import lazy_import
+from .run_history import DEFAULT_REGRESSION_THRESHOLD
+from .run_history import DEFAULT_REGRESSION_WINDOW
+from .run_history import get_regressions
+from .run_history import get_run_history_db
+from .run_history import get_seconds
+from .run_history import save_run
+from .shared_datasets import register_shared_references
+from .shared_datasets import reset_shared_datasets
+from .preflight import reset_preflight
+from .preflight import run_preflight
+from .single_flight import reset_single_flight
+from .snapshot import SNAPSHOT_REPLAY
+from .snapshot import get_snapshot_mode
+from .snowflake_test_runner import SnowflakeTestRunner
+from .snowflake_test_runner import reset_matrix_batches
+from .utils import get_basename_from_testname
+from .utils import get_df_test_index
+from .utils import get_test_files
+from .utils import is_true
+from .utils import split_matrix_test_file
+from .utils import write_test_results_to_excel
+
+# heavy modules are loaded on the first use
+pd = lazy_import("pandas")
+
+TEST_PATTERN = ["*.sql", "*.yml"]
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_REPORT_DIR = "reports"
+
+# rows of the result in the streamed event
+DEFAULT_EVENT_MAX_ROWS = 10
+
+# directory -> (signature, test files)
+_manifests: dict = {}
+_manifests_lock = threading.Lock()
+
+
+def get_test_id(test_file):
+    """test id like the pytest node id, the test name is the basename"""
+
+    return f"test_run_sql[{test_file}]"
+
+
+def get_manifest_signature(directory):
+    """names and modification times of the test files of the directory"""
+
+    with os.scandir(directory) as entries:
+        return tuple(sorted((entry.name, entry.stat().st_mtime_ns) for entry in entries
+                            if entry.name.endswith((".sql", ".yml"))))
+
+
+def get_manifest(directory):
+    """test files of the directory (matrix expanded), cached until a test
+    file of the directory is added, removed or changed
+    """
+
+    signature = get_manifest_signature(directory)
+
+    with _manifests_lock:
+
+        cached = _manifests.get(os.path.abspath(directory))
+
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        test_files = get_test_files(TEST_PATTERN, directory)
+        _manifests[os.path.abspath(directory)] = (signature, test_files)
+
+        logging.info("manifest %s: %s tests", directory, str(len(test_files)))
+
+        return test_files
+
+
+def get_selected_test_files(selection, keyword=None):
+    """test files of the selection (directories, test files, matrix test
+    ids), keyword filters the test files (substring)
+    """
+
+    if isinstance(selection, str):
+        selection = [selection]
+
+    res = []
+
+    for item in selection or []:
+
+        if os.path.isdir(item):
+            res.extend(get_manifest(item))
+            continue
+
+        config_file, matrix_id = split_matrix_test_file(item)
+
+        if matrix_id is None and os.path.isfile(config_file):
+            # matrix yml is expanded by the manifest of the directory
+            manifest = [test_file for test_file in get_manifest(os.path.dirname(config_file) or ".")
+                        if os.path.abspath(split_matrix_test_file(test_file)[0])
+                        == os.path.abspath(config_file)]
+            res.extend(manifest or [item])
+        else:
+            res.append(item)
+
+    if keyword:
+        res = [test_file for test_file in res if keyword in test_file]
+
+    # uniq, keep the order
+    return list(dict.fromkeys(res))
+
+
+def run_test_file(runner: SnowflakeTestRunner, test_file):
+    """run test, apply diff and baseline (like the test function of the suite)"""
+
+    try:
+        df = runner.run_test(test_file)
+
+        if df is None:
+            df = pd.DataFrame()
+            df.attrs["error_msg"] = f"Test not found: {test_file}"
+            df.attrs["condition"] = False
+
+        apply_diff_by_column_name(df)
+        apply_baseline(df, runner.params)
+
+    except Exception as e:
+        logging.error("test %s error %s", test_file, str(e))
+        df = pd.DataFrame()
+        df.attrs["error_msg"] = str(e)
+        df.attrs["condition"] = False
+
+    return df
+
+
+def iter_test_results(runner: SnowflakeTestRunner, test_files):
+    """run tests in parallel within the concurrency limit, yields
+    (test_file, df) as the tests finish
+    """
+
+    if not test_files:
+        return
+
+    # results of the previous run are not shared
+    reset_coalesce()
+    reset_matrix_batches()
+    reset_shared_datasets()
+    reset_single_flight()
+    reset_preflight()
+
+    register_test_files(test_files)
+    register_shared_references(test_files)
+
+    # EXPLAIN before the run (--metadata preflight true)
+    run_preflight(runner, test_files)
+
+    with ThreadPoolExecutor(max_workers=runner.get_controller().max_limit,
+                            thread_name_prefix="cdt-test") as executor:
+
+        # a test starts when its upstream tests (depends-on) are finished
+        yield from iter_dag_results(executor, test_files,
+                                    lambda test_file: run_test_file(runner, test_file))
+
+
+def get_result_event(test_file, df: pd.DataFrame, max_rows=DEFAULT_EVENT_MAX_ROWS):
+    """json event of the test result"""
+
+    event = {"event": "result",
+             "test": test_file,
+             "test_name": get_basename_from_testname(get_test_id(test_file)),
+             "condition": bool(df.attrs.get("condition")),
+             "error_msg": df.attrs.get("error_msg"),
+             "description": df.attrs.get("description"),
+             "rowcount": df.attrs.get("rowcount"),
+             "query_id": df.attrs.get("query_id"),
+             "connection_time": get_seconds(df.attrs.get("connection_time")),
+             "query_time": get_seconds(df.attrs.get("query_time")),
+             "fetch_time": get_seconds(df.attrs.get("fetch_time")),
+             "diff_summary": df.attrs.get("diff_summary_list", [])}
+
+    if max_rows and not df.empty:
+        event["columns"] = [str(col) for col in df.columns]
+        event["rows"] = json.loads(df.head(max_rows).to_json(
+            orient="values", date_format="iso", default_handler=str))
+
+    return event
+
+
+class TestService:
+    """warm pools, manifests and the run of the selected tests"""
+
+    def __init__(self, connection_name=None, metadata=None, report_dir=DEFAULT_REPORT_DIR):
+
+        self.connection_name = connection_name
+        self.metadata = dict(metadata or {})
+        self.report_dir = report_dir
+        self.started = datetime.now()
+        self.runs = 0
+
+        self._run_lock = threading.Lock()
+
+    def get_runner(self):
+        """runner with the pooled engine"""
+
+        return SnowflakeTestRunner(connection_name=self.connection_name,
+                                   metadata=self.metadata, env=dict(os.environ))
+
+    def get_params(self):
+        """parameters with uppercase keys (like SnowflakeTestRunner)"""
+
+        params = dict(os.environ) | self.metadata
+
+        if self.connection_name:
+            params['CONNECTION_NAME'] = self.connection_name
+
+        return {str(k).upper(): v for k, v in params.items()}
+
+    def start(self):
+        """connect in the background"""
+
+        params = self.get_params()
+
+        if params.get('CONNECTION_NAME') and get_snapshot_mode(params) != SNAPSHOT_REPLAY:
+            warm_up_engine(params.get('CONNECTION_NAME'), params)
+
+    def close(self):
+        """dispose pooled engines"""
+
+        dispose_engines()
+        reset_controllers()
+        reset_single_flight()
+        reset_preflight()
+        reset_coalesce()
+        reset_matrix_batches()
+        reset_shared_datasets()
+
+    def get_health(self):
+        """service status"""
+
+        with _manifests_lock:
+            manifests = {directory: len(test_files)
+                         for directory, (_, test_files) in _manifests.items()}
+
+        return {"status": "ok",
+                "started": self.started.strftime("%Y-%m-%d %H:%M:%S"),
+                "connection_name": self.connection_name,
+                "runs": self.runs,
+                "manifests": manifests}
+
+    def write_report(self, run_name, test_results: dict):
+        """xlsx report and run history of the run
+
+        Returns:
+            tuple: (artifacts, regressions)
+        """
+
+        params = self.get_params()
+
+        run_dir = os.path.join(self.report_dir, run_name)
+        os.makedirs(run_dir, exist_ok=True)
+
+        regressions = []
+
+        run_history_db = get_run_history_db(params, self.report_dir)
+
+        if run_history_db:
+
+            try:
+                run_id = save_run(run_history_db, test_results)
+
+                regressions = get_regressions(
+                    run_history_db, run_id,
+                    threshold=float(params.get('REGRESSION_THRESHOLD')
+                                    or DEFAULT_REGRESSION_THRESHOLD),
+                    window=int(params.get('REGRESSION_WINDOW') or DEFAULT_REGRESSION_WINDOW))
+
+            except Exception as e:
+                logging.error("run history error %s", str(e))
+
+        output_xlsx = os.path.join(run_dir, "report.xlsx")
+        write_test_results_to_excel(get_df_test_index(test_results), test_results, output_xlsx)
+
+        logging.info("XLSX file: %s", output_xlsx)
+
+        return [f"{run_name}/report.xlsx"], regressions
+
+    def run(self, selection, keyword=None, max_rows=DEFAULT_EVENT_MAX_ROWS, report=True):
+        """run the selected tests, yields result events as the tests finish
+        and the summary event
+        """
+
+        with self._run_lock:
+
+            t1_start = time.perf_counter()
+
+            self.runs += 1
+            run_name = datetime.now().strftime("%Y%m%d_%H%M%S_") + str(self.runs)
+
+            test_files = get_selected_test_files(selection, keyword)
+
+            test_results = {}
+
+            for test_file, df in iter_test_results(self.get_runner(), test_files):
+                test_results[test_file] = df
+
+                yield get_result_event(test_file, df, max_rows)
+
+            # report in the selection order
+            test_results = {get_test_id(test_file): test_results[test_file]
+                            for test_file in test_files}
+
+            artifacts, regressions = [], []
+
+            if report and test_results:
+                try:
+                    artifacts, regressions = self.write_report(run_name, test_results)
+                except Exception as e:
+                    logging.error("report error %s", str(e))
+
+            passed = sum(1 for df in test_results.values() if df.attrs.get("condition"))
+
+            yield {"event": "summary",
+                   "run": run_name,
+                   "tests": len(test_results),
+                   "passed": passed,
+                   "failed": len(test_results) - passed,
+                   "duration": round(time.perf_counter() - t1_start, 3),
+                   "artifacts": [f"/artifacts/{artifact}" for artifact in artifacts],
+                   "regressions": regressions}
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """http api of the test service"""
+
+    server_version = "cdt-service"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logging.info("service: " + format, *args)
+
+    def send_json(self, status, data):
+        """json response"""
+
+        body = json.dumps(data, default=str).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """health and artifacts"""
+
+        service: TestService = self.server.service
+
+        if self.path == "/health":
+            self.send_json(200, service.get_health())
+            return
+
+        if self.path.startswith("/artifacts/"):
+
+            report_dir = os.path.realpath(service.report_dir)
+            artifact = os.path.realpath(os.path.join(
+                report_dir, unquote(self.path[len("/artifacts/"):])))
+
+            if not artifact.startswith(report_dir + os.sep) or not os.path.isfile(artifact):
+                self.send_json(404, {"error": "artifact not found"})
+                return
+
+            with open(artifact, "rb") as f:
+                body = f.read()
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Disposition",
+                             f'attachment; filename="{os.path.basename(artifact)}"')
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """run and shutdown"""
+
+        service: TestService = self.server.service
+
+        if self.path == "/shutdown":
+            self.send_json(200, {"status": "shutdown"})
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return
+
+        if self.path != "/run":
+            self.send_json(404, {"error": "not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            self.send_json(400, {"error": f"wrong request: {e}"})
+            return
+
+        if not request.get("tests"):
+            self.send_json(400, {"error": "no tests"})
+            return
+
+        # streamed json lines, the connection is closed at the end
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+
+        for event in service.run(request.get("tests"), keyword=request.get("k"),
+                                 max_rows=int(request.get("max_rows", DEFAULT_EVENT_MAX_ROWS)),
+                                 report=is_true(request.get("report", True))):
+            self.wfile.write(json.dumps(event, default=str).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+def serve(service: TestService, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """run the http api until shutdown"""
+
+    server = ThreadingHTTPServer((host, port), ServiceRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+
+    service.start()
+
+    logging.info("service: http://%s:%s", host, str(server.server_address[1]))
+
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        logging.info("service interrupted")
+
+    finally:
+        server.server_close()
+        service.close()
+
+
+def main(argv=None):
+    """command line"""
+
+    parser = argparse.ArgumentParser(description="continuous data testing service")
+    parser.add_argument("--connection-name", default=None)
+    parser.add_argument("--metadata", nargs=2, action="append", default=[],
+                        metavar=("KEY", "VALUE"), help="like pytest --metadata")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--report-dir", default=DEFAULT_REPORT_DIR)
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level)
+
+    service = TestService(connection_name=args.connection_name,
+                          metadata=dict(args.metadata), report_dir=args.report_dir)
+
+    serve(service, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
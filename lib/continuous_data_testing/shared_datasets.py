@@ -0,0 +1,244 @@
+"""Shared datasets materialized once per session as temporary tables
+
+Directory default yml (<dir>/<dir>.yml) declares named datasets
+
+    shared-datasets:
+        FACT_SNAPSHOT: |
+            select * from fact qualify row_number() over (...) = 1
+
+and tests reference them by name ${shared:FACT_SNAPSHOT}.
+
+A temporary table is created lazily, when the first test referencing it
+runs on the pooled connection, and dropped when the last collected test
+referencing it is done (also failed, or with the result of the single
+flight). A table counted down on another connection is dropped by the
+next test on its connection. Remaining tables are dropped with the session.
+In the smoke run the dataset is created from the sampled (row limited)
+inputs, the test reads the table without sampling it again.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+
+from .config_model import CONFIG_KEY
+from .lazy import lazy_import
+from .smoke import get_smoke_sql
+from .templating import get_basename
+from .templating import render_template
+from .utils import get_default_yaml_filename
+from .utils import split_matrix_test_file
+
+# heavy modules are loaded on the first use
+yaml = lazy_import("yaml")
+sqlalchemy = lazy_import("sqlalchemy")
+
+SHARED_DATASET_PATTERN = re.compile(r"\$\{shared:([A-Za-z0-9_]+)\}")
+
+# connection info key, {temporary table: create sql} created on the connection
+CONNECTION_INFO_KEY = "shared_datasets"
+
+# prefix of the temporary tables (not sampled by the smoke run of the test)
+SHARED_TABLE_PREFIX = "CDT_SHARED_"
+
+_shared_lock = threading.Lock()
+
+# temporary table -> references (config file, matrix id) of the collected
+# tests not yet run, a test released twice is counted once
+_shared_refcount: dict = {}
+
+# temporary tables not used by the next tests, dropped on their connections
+_unused_tables: set = set()
+
+
+def reset_shared_datasets():
+    """new run, the references are registered again"""
+
+    with _shared_lock:
+        _shared_refcount.clear()
+        _unused_tables.clear()
+
+
+def get_reference_key(config_file, matrix_id=None):
+    """reference of the test, the same for the relative and absolute paths"""
+
+    return os.path.normcase(os.path.abspath(config_file or "")), matrix_id
+
+
+def get_shared_table_name(default_yml_file, name):
+    """temporary table name for the dataset of the default yml"""
+
+    file_hash = hashlib.md5(
+        (os.path.abspath(default_yml_file) + ":" + name).encode("utf-8")).hexdigest()
+
+    return f"{SHARED_TABLE_PREFIX}{name.upper()}_{file_hash[:8].upper()}"
+
+
+def get_shared_dataset_names(sql):
+    """dataset names referenced by sql"""
+
+    if not sql:
+        return []
+
+    return list(dict.fromkeys(SHARED_DATASET_PATTERN.findall(sql)))
+
+
+def replace_shared_datasets(sql, default_yml_file):
+    """replace ${shared:NAME} with temporary table names"""
+
+    return SHARED_DATASET_PATTERN.sub(
+        lambda m: get_shared_table_name(default_yml_file, m.group(1)), sql)
+
+
+def get_test_file_sql(test_file):
+    """raw sql of the test file (sql or yml with sql or sql-file tag)"""
+
+    config_file, _ = split_matrix_test_file(test_file)
+
+    if not config_file or not os.path.isfile(config_file):
+        return None
+
+    with open(config_file, 'r', encoding="utf-8") as f:
+        content = f.read()
+
+    if not config_file.endswith(".yml"):
+        return content
+
+    yaml_data = yaml.full_load(content)
+
+    if not isinstance(yaml_data, dict):
+        return None
+
+    sql = yaml_data.get('sql', '') or ''
+
+    if yaml_data.get('sql-file'):
+        sql_file = os.path.join(os.path.dirname(config_file),
+                                render_template(str(yaml_data['sql-file']),
+                                                basename=get_basename(config_file)))
+        if os.path.isfile(sql_file):
+            with open(sql_file, 'r', encoding="utf-8") as f:
+                sql = f.read()
+
+    return sql
+
+
+def register_shared_references(test_files):
+    """count collected tests referencing every shared dataset"""
+
+    refcount = {}
+
+    for test_file in test_files:
+
+        try:
+            sql = get_test_file_sql(test_file)
+        except Exception as e:
+            logging.error("shared datasets %s error %s", test_file, str(e))
+            continue
+
+        names = get_shared_dataset_names(sql)
+
+        if names:
+            config_file, matrix_id = split_matrix_test_file(test_file)
+            default_yml_file = get_default_yaml_filename(config_file)
+
+            for name in names:
+                table_name = get_shared_table_name(default_yml_file or "", name)
+                refcount.setdefault(table_name, set()).add(
+                    get_reference_key(config_file, matrix_id))
+
+    with _shared_lock:
+        for table_name, references in refcount.items():
+            _shared_refcount.setdefault(table_name, set()).update(references)
+            _unused_tables.discard(table_name)
+
+    logging.debug("shared datasets refcount: %s", str(refcount))
+
+
+def get_shared_datasets(sql_formatted: dict):
+    """datasets used by the test {table_name: sql}"""
+
+    definitions = sql_formatted.get('shared-datasets', None) or {}
+    default_yml_file = sql_formatted.get('default-config-file', None) or ""
+
+    res = {}
+
+    for name in sql_formatted.get('shared-datasets-used', None) or []:
+
+        if name not in definitions:
+            raise ValueError(f"Shared dataset not defined: {name}")
+
+        res[get_shared_table_name(default_yml_file, name)] = definitions[name]
+
+    return res
+
+
+def materialize_shared_datasets(conn, sql_formatted: dict):
+    """create temporary tables used by the test if not created on the connection,
+    sampled in the smoke run (recreated if the smoke config of the test differs)"""
+
+    created = conn.info.setdefault(CONNECTION_INFO_KEY, {})
+
+    config = sql_formatted.get(CONFIG_KEY, None)
+
+    for table_name, sql in get_shared_datasets(sql_formatted).items():
+
+        sql, _ = get_smoke_sql(sql.strip().rstrip(';'), config.smoke if config else None)
+
+        if created.get(table_name) == sql:
+            logging.debug("shared dataset exists: %s", table_name)
+            continue
+
+        conn.execute(
+            sqlalchemy.text(f"CREATE OR REPLACE TEMPORARY TABLE {table_name} AS\n{sql}"))
+        created[table_name] = sql
+
+        logging.info("shared dataset created: %s", table_name)
+
+
+def release_shared_datasets(conn, sql_formatted: dict, matrix_ids=None):
+    """test is done (conn None: without the query), drop temporary tables
+    of the connection not used by the next tests; matrix_ids: the
+    combinations of the batched matrix query, else the test itself"""
+
+    config_file = sql_formatted.get('config-file', None)
+
+    if matrix_ids is None:
+        matrix_ids = [sql_formatted.get('matrix_id', None)]
+
+    references = {get_reference_key(config_file, matrix_id) for matrix_id in matrix_ids}
+
+    with _shared_lock:
+        for table_name in get_shared_datasets(sql_formatted):
+
+            # not registered tables are kept till the end of the session
+            if table_name not in _shared_refcount:
+                continue
+
+            _shared_refcount[table_name].difference_update(references)
+
+            if not _shared_refcount[table_name]:
+                del _shared_refcount[table_name]
+                _unused_tables.add(table_name)
+
+        if conn is None:
+            return
+
+        created = conn.info.setdefault(CONNECTION_INFO_KEY, {})
+        unused = [table_name for table_name in created if table_name in _unused_tables]
+
+    for table_name in unused:
+
+        del created[table_name]
+
+        # the temporary tables are gone with the invalidated session
+        if conn.invalidated:
+            continue
+
+        try:
+            conn.execute(sqlalchemy.text(f"DROP TABLE IF EXISTS {table_name}"))
+            logging.info("shared dataset dropped: %s", table_name)
+
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            logging.error("shared dataset %s drop error %s", table_name, str(e))
@@ -0,0 +1,178 @@
+"""Single-flight deduplication of identical queries in a session
+
+Tests rendered to the same sql with the same session statements, the
+same connection and warehouse (and the same timeout) share one
+execution: the first test runs the query, the tests started meanwhile
+wait for its result, the later tests take the kept result
+
+    --metadata single_flight false     every test runs its own query
+    --metadata single_flight_max_results 64
+                                       kept results (least recently used
+                                       evicted), 0: shared only with the
+                                       tests waiting for the query
+
+Every test gets its own copy of the result: the attrs are copied, the
+column data is shared (shallow copy, not copy-on-write). The diff and
+the baseline of the test only set the attrs of its copy, the test has
+its own report entry; an in-place change of the values would be seen by
+the other copies. The copies are marked df.attrs["single_flight"] with
+the test that ran the query.
+
+Transient errors (open circuit breaker, timeout) are not shared, the
+waiting tests run the query themselves.
+"""
+
+from __future__ import annotations
+
+import copy
+import logging
+import threading
+
+from .config_model import get_config
+from .lazy import lazy_import
+from .shared_datasets import release_shared_datasets
+from .utils import is_true
+
+# heavy modules are loaded on the first use
+pd = lazy_import("pandas")
+
+DEFAULT_MAX_RESULTS = 64
+
+_lock = threading.Lock()
+
+# fingerprint -> Flight, running and kept (the least recently used first)
+_flights: dict = {}
+
+
+class Flight:
+    """execution of the query shared by the tests"""
+
+    def __init__(self, test_file):
+
+        self.test_file = test_file
+        self.done = threading.Event()
+        # result without the attributes of the test, None if not shared
+        self.df = None
+
+
+def is_single_flight(params: dict):
+    """single-flight enabled (default)"""
+
+    return is_true(params.get('SINGLE_FLIGHT', True))
+
+
+def get_max_results(params: dict):
+    """number of the kept results"""
+
+    max_results = params.get('SINGLE_FLIGHT_MAX_RESULTS')
+
+    if max_results in (None, ''):
+        return DEFAULT_MAX_RESULTS
+
+    try:
+        return max(int(max_results), 0)
+    except ValueError:
+        logging.error("wrong single_flight_max_results: %s", str(max_results))
+        return DEFAULT_MAX_RESULTS
+
+
+def evict_results(max_results):
+    """drop the least recently used kept results over max_results, the
+    running flights and the waiting tests (they hold the flight) are kept"""
+
+    kept = [fingerprint for fingerprint, flight in _flights.items() if flight.df is not None]
+
+    for fingerprint in kept[:max(len(kept) - max_results, 0)]:
+        del _flights[fingerprint]
+
+
+def get_single_flight_fingerprint(runner, sql_formatted: dict):
+    """tests with the same fingerprint return the same result"""
+
+    # USE WAREHOUSE of the test
+    session_list = list(runner.get_sql_from_params(sql_formatted))
+    session_list.extend(sql_formatted.get('session', None) or [])
+
+    return (runner.connection_name, tuple(session_list),
+            sql_formatted.get('sql', '').strip(), get_config(sql_formatted).timeout)
+
+
+def get_shared_result(df: pd.DataFrame, sql_formatted: dict):
+    """result of the query without the attributes of the test, None if the
+    error is transient"""
+
+    if df.attrs.get("circuit_open") or df.attrs.get("timed_out"):
+        return None
+
+    df_shared = df.copy(deep=False)
+    df_shared.attrs = copy.deepcopy({key: val for key, val in df.attrs.items()
+                                     if key not in sql_formatted})
+
+    return df_shared
+
+
+def copy_shared_result(flight: Flight, sql_formatted: dict):
+    """copy of the shared result with the attributes of the test"""
+
+    df = flight.df.copy(deep=False)
+    df.attrs = copy.deepcopy(flight.df.attrs)
+    df.attrs.update(sql_formatted)
+    df.attrs["single_flight"] = flight.test_file
+
+    return df
+
+
+def run_single_flight(runner, test_file, sql_formatted: dict, run_query):
+    """result of run_query() shared by the tests with the same fingerprint"""
+
+    fingerprint = get_single_flight_fingerprint(runner, sql_formatted)
+
+    with _lock:
+        flight = _flights.get(fingerprint)
+        leader = flight is None
+
+        if leader:
+            flight = _flights[fingerprint] = Flight(test_file)
+
+        elif flight.df is not None:
+            # recently used
+            _flights[fingerprint] = _flights.pop(fingerprint)
+
+    if leader:
+        try:
+            df = run_query()
+            flight.df = get_shared_result(df, sql_formatted)
+
+        finally:
+            with _lock:
+                if flight.df is None:
+                    # the next test runs the query again
+                    _flights.pop(fingerprint, None)
+                else:
+                    evict_results(get_max_results(runner.params))
+
+            flight.done.set()
+
+        return df
+
+    flight.done.wait()
+
+    if flight.df is None:
+        return run_query()
+
+    df = copy_shared_result(flight, sql_formatted)
+
+    # the test used the shared datasets through the result
+    if sql_formatted.get('shared-datasets-used'):
+        release_shared_datasets(None, sql_formatted)
+
+    runner.log_df_info(df, f"single flight: result of {flight.test_file}")
+
+    return df
+
+
+def reset_single_flight():
+    """new session, the kept results are released"""
+
+    with _lock:
+        _flights.clear()
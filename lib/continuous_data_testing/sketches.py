@@ -0,0 +1,400 @@
+"""Fixed-memory sketches of the DIFF columns
+
+    data-test:
+        diff_by_column_name:
+          profile: true                 (or --metadata diff_profile true)
+
+The failed DIFF columns are profiled in a single pass, chunk by chunk
+(streaming): rows and nulls of the column, distribution of the
+differences. Every sketch has the fixed size, the chunks update it in
+place (to_dict / from_dict serialize it):
+
+    QuantileSketch    log buckets with the relative accuracy (DDSketch),
+                      quantiles and the histogram, at most max_bins buckets
+    TopKSketch        frequent values (Misra-Gries), at most capacity counters
+    ColumnProfile     rows, nulls, differences: min, max, quantiles, top values
+
+    df.attrs["diff_profile_list"]   summary rows (html extras, xlsx index)
+    df.attrs["diff_sketches"]       {column: ColumnProfile.to_dict()}
+"""
+
+from __future__ import annotations
+
+import math
+import numbers
+
+from .lazy import lazy_import
+
+# heavy modules are loaded on the first use
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+DEFAULT_MAX_BINS = 512
+DEFAULT_TOP_K_CAPACITY = 32
+
+# rows of the profiled chunk
+PROFILE_CHUNK_ROWS = 100_000
+
+TOP_VALUES = 5
+HISTOGRAM_BINS = 10
+HISTOGRAM_BARS = "▁▂▃▄▅▆▇█"
+
+PROFILE_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def to_native(value):
+    """json value of the numpy / decimal / other value"""
+
+    if value is None or isinstance(value, (bool, str)):
+        return value
+
+    if isinstance(value, numbers.Integral):
+        return int(value)
+
+    if isinstance(value, numbers.Real):
+        return float(value)
+
+    return str(value)
+
+
+class QuantileSketch:
+    """quantiles with the relative accuracy, log buckets (DDSketch), the
+    lowest buckets are collapsed above max_bins
+    """
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY, max_bins=DEFAULT_MAX_BINS):
+
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+
+        # bucket index -> count
+        self.positive: dict = {}
+        self.negative: dict = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add_to_store(self, store: dict, values):
+        """count values (> 0) into the buckets"""
+
+        if not len(values):
+            return
+
+        indexes = np.ceil(np.log(values) / self.log_gamma).astype("int64")
+        keys, counts = np.unique(indexes, return_counts=True)
+
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            store[key] = store.get(key, 0) + count
+
+        self.collapse(store)
+
+    def collapse(self, store: dict):
+        """merge the lowest buckets (values near zero) over max_bins"""
+
+        if len(store) <= self.max_bins:
+            return
+
+        keys = sorted(store)
+        collapse_keys = keys[:len(keys) - self.max_bins + 1]
+        target = collapse_keys[-1]
+
+        store[target] = sum(store.pop(key) for key in collapse_keys)
+
+    def update(self, values):
+        """add numeric values (numpy array, nan excluded)"""
+
+        values = np.asarray(values, dtype="float64")
+        values = values[np.isfinite(values)]
+
+        if not len(values):
+            return
+
+        self.count += len(values)
+        self.zero_count += int(np.count_nonzero(values == 0))
+
+        self.add_to_store(self.positive, values[values > 0])
+        self.add_to_store(self.negative, -values[values < 0])
+
+        value_min, value_max = float(values.min()), float(values.max())
+        self.min = value_min if self.min is None else min(self.min, value_min)
+        self.max = value_max if self.max is None else max(self.max, value_max)
+
+    def get_value(self, key):
+        """representative value of the bucket"""
+
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def iter_buckets(self):
+        """(value, count) in the ascending order"""
+
+        for key in sorted(self.negative, reverse=True):
+            yield -self.get_value(key), self.negative[key]
+
+        if self.zero_count:
+            yield 0.0, self.zero_count
+
+        for key in sorted(self.positive):
+            yield self.get_value(key), self.positive[key]
+
+    def quantile(self, q):
+        """value of the quantile q (0..1), None if empty"""
+
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        cumulative = 0
+
+        for value, count in self.iter_buckets():
+            cumulative += count
+            if cumulative > rank:
+                # bounded by the exact min / max
+                return min(max(value, self.min), self.max)
+
+        return self.max
+
+    def histogram(self, bins=HISTOGRAM_BINS):
+        """counts of the equal width bins between min and max"""
+
+        if self.count == 0:
+            return []
+
+        counts = [0] * bins
+        width = (self.max - self.min) / bins
+
+        for value, count in self.iter_buckets():
+            i = int((value - self.min) / width) if width else 0
+            counts[min(max(i, 0), bins - 1)] += count
+
+        return counts
+
+    def to_dict(self):
+        """json serializable sketch"""
+
+        return {"relative_accuracy": self.relative_accuracy, "max_bins": self.max_bins,
+                "positive": [[key, count] for key, count in sorted(self.positive.items())],
+                "negative": [[key, count] for key, count in sorted(self.negative.items())],
+                "zero_count": self.zero_count, "count": self.count,
+                "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """sketch from to_dict"""
+
+        sketch = cls(data["relative_accuracy"], data["max_bins"])
+        sketch.positive = {key: count for key, count in data["positive"]}
+        sketch.negative = {key: count for key, count in data["negative"]}
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        sketch.min = data["min"]
+        sketch.max = data["max"]
+
+        return sketch
+
+
+class TopKSketch:
+    """frequent values (Misra-Gries), counts are lower bounds, values with
+    the frequency > rows / capacity are kept
+    """
+
+    def __init__(self, capacity=DEFAULT_TOP_K_CAPACITY):
+
+        self.capacity = capacity
+        self.counters: dict = {}
+
+    def reduce(self):
+        """keep capacity counters, decrement by the first dropped count"""
+
+        if len(self.counters) <= self.capacity:
+            return
+
+        counts = sorted(self.counters.values(), reverse=True)
+        decrement = counts[self.capacity]
+
+        self.counters = {value: count - decrement for value, count in self.counters.items()
+                         if count > decrement}
+
+    def update(self, values: pd.Series):
+        """add the values (nulls excluded)"""
+
+        value_counts = values.value_counts(dropna=True, sort=False)
+
+        if len(value_counts) > self.capacity:
+            # summary of the chunk, the error stays within rows / capacity
+            largest = value_counts.nlargest(self.capacity + 1)
+            decrement = largest.iloc[-1]
+            value_counts = largest[largest > decrement] - decrement
+
+        for value, count in zip(value_counts.index.tolist(), value_counts.tolist()):
+            value = to_native(value)
+            self.counters[value] = self.counters.get(value, 0) + int(count)
+
+        self.reduce()
+
+    def top(self, k=TOP_VALUES):
+        """[(value, count)] most frequent first"""
+
+        return sorted(self.counters.items(), key=lambda item: (-item[1], str(item[0])))[:k]
+
+    def to_dict(self):
+        """json serializable sketch"""
+
+        return {"capacity": self.capacity,
+                "counters": [[value, count] for value, count in self.top(self.capacity)]}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """sketch from to_dict"""
+
+        sketch = cls(data["capacity"])
+        sketch.counters = {value: count for value, count in data["counters"]}
+
+        return sketch
+
+
+class ColumnProfile:
+    """rows and nulls of the column, quantiles (numeric) and top values of
+    the differences (abs() > limit, strings not empty and not '0')
+    """
+
+    def __init__(self, numeric=True, limit=0.0):
+
+        self.numeric = numeric
+        self.limit = limit
+        self.rows = 0
+        self.nulls = 0
+        self.diffs = 0
+        self.quantiles = QuantileSketch() if numeric else None
+        self.top_values = TopKSketch()
+
+    def get_differences(self, not_null: pd.Series):
+        """difference values of the not null values"""
+
+        if self.numeric:
+            values = pd.to_numeric(not_null, errors="coerce")
+            return values[values.abs() > self.limit]
+
+        values = not_null.astype("string")
+        return values[(values != '') & (values != '0')]
+
+    def update(self, values: pd.Series):
+        """add the chunk of the column"""
+
+        not_null = values.dropna()
+
+        self.rows += len(values)
+        self.nulls += len(values) - len(not_null)
+
+        differences = self.get_differences(not_null)
+
+        self.diffs += len(differences)
+
+        if self.quantiles is not None:
+            self.quantiles.update(differences.to_numpy(dtype="float64", na_value=np.nan))
+
+        self.top_values.update(differences)
+
+    def get_summary(self, column_name):
+        """summary row (report)"""
+
+        summary = {"column name": column_name,
+                   "rows": self.rows,
+                   "diff records": self.diffs,
+                   "null [%]": round(100 * self.nulls / self.rows, 2) if self.rows else 0.0}
+
+        if self.quantiles is not None and self.quantiles.count:
+            summary["min"] = self.quantiles.min
+            for q in PROFILE_QUANTILES:
+                summary[f"p{round(q * 100)}"] = self.quantiles.quantile(q)
+            summary["max"] = self.quantiles.max
+            summary["histogram"] = get_sparkline(self.quantiles.histogram())
+
+        summary["top values"] = ", ".join(f"{value} ({count})"
+                                          for value, count in self.top_values.top())
+
+        return summary
+
+    def to_dict(self):
+        """json serializable profile"""
+
+        return {"numeric": self.numeric, "limit": self.limit,
+                "rows": self.rows, "nulls": self.nulls, "diffs": self.diffs,
+                "quantiles": self.quantiles.to_dict() if self.quantiles is not None else None,
+                "top_values": self.top_values.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """profile from to_dict"""
+
+        profile = cls(numeric=data["numeric"], limit=data["limit"])
+        profile.rows = data["rows"]
+        profile.nulls = data["nulls"]
+        profile.diffs = data["diffs"]
+
+        if data.get("quantiles"):
+            profile.quantiles = QuantileSketch.from_dict(data["quantiles"])
+
+        profile.top_values = TopKSketch.from_dict(data["top_values"])
+
+        return profile
+
+
+def get_sparkline(counts):
+    """histogram as the bar characters"""
+
+    if not counts or not max(counts):
+        return ""
+
+    top = max(counts)
+
+    return "".join(HISTOGRAM_BARS[min(len(HISTOGRAM_BARS) - 1,
+                                      math.ceil(count / top * len(HISTOGRAM_BARS)) - 1)]
+                   if count else " " for count in counts)
+
+
+def is_numeric_column(values: pd.Series):
+    """numeric column (bool excluded)"""
+
+    return pd.api.types.is_numeric_dtype(values.dtype) and \
+        not pd.api.types.is_bool_dtype(values.dtype)
+
+
+def profile_column(values: pd.Series, limit=0.0, chunk_rows=PROFILE_CHUNK_ROWS):
+    """profile of the column computed chunk by chunk"""
+
+    profile = ColumnProfile(numeric=is_numeric_column(values), limit=limit)
+
+    for start in range(0, len(values), chunk_rows):
+        profile.update(values.iloc[start:start + chunk_rows])
+
+    return profile
+
+
+def get_profile_text(profile_list):
+    """compact text of the profile summary rows (xlsx index)"""
+
+    lines = []
+
+    for summary in profile_list or []:
+
+        parts = [f"{summary['column name']}:"]
+
+        for key in ("min", "p50", "p90", "p99", "max"):
+            if summary.get(key) is not None:
+                parts.append(f"{key} {summary[key]:.4g}")
+
+        parts.append(f"diff {summary['diff records']} null {summary['null [%]']}%")
+
+        if summary.get("top values"):
+            parts.append(f"top {summary['top values']}")
+
+        if summary.get("histogram"):
+            parts.append(summary["histogram"])
+
+        lines.append(" ".join(parts))
+
+    return "\n".join(lines)
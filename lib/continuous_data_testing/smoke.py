@@ -0,0 +1,249 @@
+"""Smoke mode, the rendered sql reads sampled or row limited inputs
+
+    --metadata smoke true              smoke run (pre-merge checks)
+    --metadata smoke_sample 10         default SAMPLE percent, no sampling by default
+    --metadata smoke_limit 1000        default outer row cap
+
+    smoke:
+        sample: 10                     SAMPLE (10) on the tables, or "1000 rows"
+        tables: [fact_sales]           sampled tables, all tables by default
+        seed: 42                       SEED (42), the same sample every run
+        limit: 5000                    outer row cap, 0 no cap
+
+    smoke: false                       full query also in the smoke run
+
+The tables after FROM / JOIN (also comma separated) are sampled, the
+names of the CTEs, subqueries, table functions, DUAL, stages, the shared
+datasets (sampled at the creation) and FROM inside the function calls
+(EXTRACT, TRIM, ...) are skipped. The string
+literals and comments are not changed. The row cap wraps the query
+
+    SELECT * FROM (<sql>) LIMIT <n>
+
+The sampled sides of a reconciliation differ, sample only the tables
+where the result does not depend on the volume (or use only the cap).
+The results are labelled (df.attrs["sampled"]) in the xlsx index and
+the html report.
+"""
+
+from __future__ import annotations
+
+import re
+
+# string literals and comments are masked
+MASK_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'|--[^\n]*|//[^\n]*|/\*.*?\*/", re.DOTALL)
+
+IDENTIFIER = r'(?:"[^"]+"|[A-Za-z_][A-Za-z0-9_$]*)'
+TABLE_PATTERN = re.compile(IDENTIFIER + r"(?:\s*\.\s*" + IDENTIFIER + r"){0,2}")
+ALIAS_PATTERN = re.compile(r"\s+(?:AS\s+)?(" + IDENTIFIER + ")", re.IGNORECASE)
+
+FROM_PATTERN = re.compile(r"\b(FROM|JOIN)\b", re.IGNORECASE)
+CTE_PATTERN = re.compile(r"(?:\bWITH(?:\s+RECURSIVE)?|,)\s*(" + IDENTIFIER + r")\s*"
+                         + r"(?:\([^()]*\)\s*)?AS\s*\(", re.IGNORECASE)
+WORD_BEFORE_PATTERN = re.compile(r"([A-Za-z_][A-Za-z0-9_]*)\s*$")
+SPACE_PATTERN = re.compile(r"\s*")
+
+# FROM inside the function call is not a table
+FUNCTIONS_WITH_FROM = {"extract", "trim", "substring", "substr", "position", "overlay",
+                       "date_part"}
+
+# words after the table, not an alias
+KEYWORDS = {"where", "join", "inner", "left", "right", "full", "outer", "cross", "natural",
+            "on", "using", "group", "order", "having", "qualify", "limit", "union", "intersect",
+            "except", "minus", "window", "sample", "tablesample", "pivot", "unpivot",
+            "match_recognize", "lateral", "changes", "at", "before", "connect", "start",
+            "fetch", "offset", "as", "asof", "select", "from", "with", "and", "or", "then",
+            "when", "else", "end", "set", "values"}
+
+NOT_TABLES = {"dual", "table", "lateral", "unnest", "flatten", "generator"}
+
+# temporary tables of the shared datasets, sampled when they are created
+NOT_TABLE_PREFIXES = ("cdt_shared_",)
+
+
+def mask_sql(sql):
+    """sql with the literals and comments replaced by spaces (the same positions)"""
+
+    return MASK_PATTERN.sub(lambda m: " " * len(m.group(0)), sql)
+
+
+def get_identifier_name(identifier):
+    """last part of the (dotted, quoted) name, casefolded"""
+
+    name = re.split(r"\s*\.\s*", identifier)[-1]
+
+    return name.strip('"').casefold()
+
+
+def get_cte_names(masked_sql):
+    """names of the common table expressions"""
+
+    return {get_identifier_name(m.group(1)) for m in CTE_PATTERN.finditer(masked_sql)}
+
+
+def get_enclosing_call(masked_sql, position):
+    """name of the function call enclosing the position, None outside of a call"""
+
+    depth = 0
+
+    for i in range(position - 1, -1, -1):
+
+        char = masked_sql[i]
+
+        if char == ")":
+            depth += 1
+
+        elif char == "(":
+            if depth == 0:
+                m = WORD_BEFORE_PATTERN.search(masked_sql[:i])
+                return m.group(1).casefold() if m else None
+            depth -= 1
+
+    return None
+
+
+def get_sample_clause(sample, seed=None):
+    """SAMPLE (10) or SAMPLE (1000 ROWS), SEED (seed)"""
+
+    clause = f"SAMPLE ({str(sample).upper()})"
+
+    if seed is not None:
+        clause = clause + f" SEED ({int(seed)})"
+
+    return clause
+
+
+def get_sampled_tables(sql, tables=()):
+    """positions after the table (and the alias) of the sampled tables
+
+    Returns:
+        list: (insert position, table name)
+    """
+
+    masked_sql = mask_sql(sql)
+
+    cte_names = get_cte_names(masked_sql)
+    selected = {get_identifier_name(table) for table in tables}
+    selected_full = {re.sub(r'\s+', '', table).strip().casefold() for table in tables}
+
+    res = []
+
+    for m in FROM_PATTERN.finditer(masked_sql):
+
+        if m.group(1).casefold() == "from":
+            previous = WORD_BEFORE_PATTERN.search(masked_sql[:m.start()])
+            # IS DISTINCT FROM
+            if previous and previous.group(1).casefold() == "distinct":
+                continue
+
+            if get_enclosing_call(masked_sql, m.start()) in FUNCTIONS_WITH_FROM:
+                continue
+
+        position = m.end()
+
+        # FROM a, b
+        while True:
+
+            table = TABLE_PATTERN.match(masked_sql,
+                                        SPACE_PATTERN.match(masked_sql, position).end())
+            if not table:
+                break
+
+            table_name = table.group(0)
+            end = table.end()
+
+            # function, table function
+            if masked_sql[end:].lstrip().startswith("("):
+                break
+
+            # alias
+            alias = ALIAS_PATTERN.match(masked_sql, end)
+            if alias and alias.group(1).casefold() not in KEYWORDS:
+                end = alias.end()
+
+            name = get_identifier_name(table_name)
+
+            if (name not in cte_names and name not in NOT_TABLES
+                    and not name.startswith(NOT_TABLE_PREFIXES)
+                    and table_name.casefold() not in KEYWORDS
+                    and (not tables or name in selected
+                         or re.sub(r'\s+', '', table_name).casefold() in selected_full)):
+                res.append((end, table_name))
+
+            position = SPACE_PATTERN.match(masked_sql, end).end()
+
+            if not masked_sql.startswith(",", position):
+                break
+
+            position = position + 1
+
+            # FROM a, (subquery)
+            if masked_sql[position:].lstrip().startswith("("):
+                break
+
+    return res
+
+
+def sample_sql(sql, sample, tables=(), seed=None):
+    """sql with SAMPLE after the tables (and the aliases)"""
+
+    clause = get_sample_clause(sample, seed)
+
+    res = sql
+
+    # from the end, the positions are not moved
+    for position, _ in reversed(get_sampled_tables(sql, tables)):
+        res = res[:position] + " " + clause + res[position:]
+
+    return res
+
+
+def strip_trailing_sql(sql):
+    """sql without the trailing semicolons and comments (select 1; -- done)"""
+
+    # only the comments are masked, the literal at the end is kept
+    masked_sql = MASK_PATTERN.sub(
+        lambda m: m.group(0) if m.group(0).startswith("'") else " " * len(m.group(0)), sql)
+
+    end = len(masked_sql.rstrip())
+
+    while end and masked_sql[end - 1] == ";":
+        end = len(masked_sql[:end - 1].rstrip())
+
+    return sql[:end].strip()
+
+
+def limit_sql(sql, limit):
+    """outer row cap"""
+
+    sql = strip_trailing_sql(sql)
+
+    # new line closes the line comment at the end
+    return f"SELECT * FROM (\n{sql}\n) LIMIT {int(limit)}"
+
+
+def get_smoke_sql(sql, smoke_config):
+    """sampled or row limited sql and the label, the sql without the smoke run
+
+    Returns:
+        tuple: sql, label (None if not changed)
+    """
+
+    if not sql or smoke_config is None:
+        return sql, None
+
+    labels = []
+
+    if smoke_config.sample:
+        sampled_tables = get_sampled_tables(sql, smoke_config.tables)
+
+        if sampled_tables:
+            sql = sample_sql(sql, smoke_config.sample, smoke_config.tables, smoke_config.seed)
+            labels.append(get_sample_clause(smoke_config.sample, smoke_config.seed) + " "
+                          + ", ".join(dict.fromkeys(table for _, table in sampled_tables)))
+
+    if smoke_config.limit:
+        sql = limit_sql(sql, smoke_config.limit)
+        labels.append(f"LIMIT {smoke_config.limit}")
+
+    return sql, "; ".join(labels) or None
@@ -0,0 +1,139 @@
+"""Snapshot record / replay of the query results
+
+    --metadata snapshot_mode record   save results to the snapshot directory
+    --metadata snapshot_mode replay   serve results from the snapshot directory
+    --metadata snapshot_dir <dir>     default .snapshots
+    --metadata replay_engine_url sqlite:///local.db
+                                      run queries without snapshot on
+                                      the local engine (sqlite, duckdb)
+
+Snapshot key is the hash of the rendered sql and the session statements.
+Result is saved to <key>.parquet, sql, session and result attributes
+to <key>.yml. Replay does not need the snowflake connector.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+from datetime import datetime
+
+from .lazy import lazy_import
+from .arrow_types import DTYPE_BACKEND_ARROW
+from .arrow_types import fetch_arrow_table
+from .arrow_types import read_parquet
+from .arrow_types import table_to_df
+from .utils import df_to_export
+from .utils import df_to_native_types
+
+# heavy modules are loaded on the first use
+pd = lazy_import("pandas")
+yaml = lazy_import("yaml")
+sqlalchemy = lazy_import("sqlalchemy")
+
+SNAPSHOT_RECORD = "record"
+SNAPSHOT_REPLAY = "replay"
+
+DEFAULT_SNAPSHOT_DIR = ".snapshots"
+
+# result attributes saved with the snapshot
+SNAPSHOT_ATTRS = ["query_id", "rowcount", "description", "config-file"]
+
+
+def get_snapshot_mode(params: dict):
+    """snapshot mode record, replay or None"""
+
+    snapshot_mode = str(params.get('SNAPSHOT_MODE', '') or '').casefold()
+
+    if snapshot_mode in (SNAPSHOT_RECORD, SNAPSHOT_REPLAY):
+        return snapshot_mode
+
+    return None
+
+
+def get_snapshot_dir(params: dict):
+    """snapshot directory"""
+
+    return params.get('SNAPSHOT_DIR', None) or DEFAULT_SNAPSHOT_DIR
+
+
+def get_snapshot_key(sql, session_list):
+    """hash of the sql and the session statements"""
+
+    content = "\n".join(list(session_list or []) + [sql or ""])
+
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
+
+def save_snapshot(snapshot_dir, key, df: pd.DataFrame, sql, session_list):
+    """save result (parquet) and metadata (yml)"""
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    snapshot_file = os.path.join(snapshot_dir, key)
+
+    df_snapshot = df_to_export(df.copy(deep=False))
+    # attrs are saved to yml, parquet metadata needs json types
+    df_snapshot.attrs = {}
+    df_snapshot.to_parquet(snapshot_file + ".parquet", index=False)
+
+    snapshot_meta = {attr: df.attrs.get(attr) for attr in SNAPSHOT_ATTRS
+                     if df.attrs.get(attr) is not None}
+    snapshot_meta["sql"] = sql
+    snapshot_meta["session"] = list(session_list or [])
+    snapshot_meta["recorded"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    with open(snapshot_file + ".yml", mode='w', encoding="UTF8") as f:
+        yaml.safe_dump(snapshot_meta, f, allow_unicode=True)
+
+    logging.info("snapshot saved: %s", snapshot_file)
+
+
+def load_snapshot(snapshot_dir, key, dtype_backend=None):
+    """load result with attributes, None if there is no snapshot"""
+
+    snapshot_file = os.path.join(snapshot_dir, key)
+
+    if not os.path.isfile(snapshot_file + ".parquet"):
+        logging.info("snapshot not found: %s", snapshot_file)
+        return None
+
+    df = df_to_native_types(read_parquet(snapshot_file + ".parquet", dtype_backend),
+                            dtype_backend)
+
+    df.attrs = {}
+
+    if os.path.isfile(snapshot_file + ".yml"):
+        with open(snapshot_file + ".yml", 'r', encoding="utf-8") as f:
+            snapshot_meta = yaml.safe_load(f) or {}
+
+        for attr in SNAPSHOT_ATTRS:
+            if attr in snapshot_meta:
+                df.attrs[attr] = snapshot_meta[attr]
+
+        df.attrs["snapshot_recorded"] = snapshot_meta.get("recorded")
+
+    logging.info("snapshot loaded: %s", snapshot_file)
+
+    return df
+
+
+def run_local_sql(engine_url, sql, dtype_backend=None):
+    """run sql on the local engine e.g. sqlite:///local.db, duckdb:///local.duckdb"""
+
+    engine = sqlalchemy.create_engine(engine_url)
+
+    try:
+        with engine.connect() as conn:
+            resultset = conn.execute(sqlalchemy.text(sql))
+
+            if dtype_backend == DTYPE_BACKEND_ARROW:
+                df = table_to_df(fetch_arrow_table(resultset))
+            else:
+                df = pd.DataFrame(resultset.all(), columns=resultset.keys())
+
+    finally:
+        engine.dispose()
+
+    return df_to_native_types(df, dtype_backend)
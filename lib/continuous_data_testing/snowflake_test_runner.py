@@ -1,26 +1,111 @@
 """class SnowflakeTestRunner"""
 
+from __future__ import annotations
+
 
 import os
+import copy
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from contextlib import ContextDecorator
 import re
 import logging
+import threading
 import http.client as http_client
-import importlib_metadata
-
-from sqlalchemy import text
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import create_engine
-import yaml
-
-
-import pandas as pd
 
 # from .utils import get_dict_by_path
-from .utils import get_url_from_connection_name
+from .arrow_types import DTYPE_BACKEND_ARROW
+from .arrow_types import fetch_arrow_table
+from .arrow_types import get_dtype_backend
+from .arrow_types import table_to_df
+from .lazy import lazy_import
+from .utils import get_default_yaml_filename
 from .utils import df_to_native_types
 from .utils import df_info
+from .utils import get_matrix_combinations
+from .utils import get_matrix_id
+from .utils import split_matrix_test_file
+from .utils import is_true
+from .coalesce import fetch_result_sets
+from .coalesce import is_coalesce_test
+from .coalesce import run_coalesced
+from .coalesce import unregister_test_file
+from .concurrency import CircuitOpenError
+from .dependencies import iter_dag_results
+from .config_model import CONFIG_KEY
+from .config_model import parse_test_config
+from .concurrency import get_controller
+from .engine_pool import get_engine
+from .engine_pool import track_session
+from .shared_datasets import get_shared_dataset_names
+from .preflight import get_preflight_result
+from .preflight import run_preflight
+from .single_flight import is_single_flight
+from .single_flight import run_single_flight
+from .smoke import get_smoke_sql
+from .shared_datasets import get_shared_datasets
+from .shared_datasets import materialize_shared_datasets
+from .shared_datasets import release_shared_datasets
+from .shared_datasets import replace_shared_datasets
+from .snapshot import SNAPSHOT_RECORD
+from .snapshot import SNAPSHOT_REPLAY
+from .snapshot import get_snapshot_dir
+from .snapshot import get_snapshot_key
+from .snapshot import get_snapshot_mode
+from .snapshot import load_snapshot
+from .snapshot import run_local_sql
+from .snapshot import save_snapshot
+from .timeout import QueryWatchdog
+from .timeout import get_test_timeout
+from .templating import get_basename
+from .templating import render_template
+from .timeout import set_timed_out
+
+# heavy modules are loaded on the first use
+pd = lazy_import("pandas")
+yaml = lazy_import("yaml")
+importlib_metadata = lazy_import("importlib_metadata")
+sqlalchemy = lazy_import("sqlalchemy")
+
+# partition column of the batched matrix query, lowercase cause
+# snowflake sqlalchemy returns case insensitive names in lowercase
+MATRIX_PARTITION_COLUMN = "matrix_partition"
+
+_matrix_batches_lock = threading.Lock()
+
+# batched matrix results not yet taken by the tests
+# (connection_name, session statements, batch sql) -> MatrixBatch
+_matrix_batches: dict = {}
+
+
+class MatrixBatch:
+    """batched query of the matrix combinations, run by the first test"""
+
+    def __init__(self):
+
+        self.done = threading.Event()
+        # {matrix_id: df} not yet taken, None if the batch failed
+        self.results = None
+        self.error = None
+
+
+def reset_matrix_batches():
+    """new run, the results not taken are released"""
+
+    with _matrix_batches_lock:
+        _matrix_batches.clear()
+
+
+def fetch_arrow_result(conn, resultset, sql):
+    """arrow table of the result, the connector errors of fetch_arrow_all
+    are raised like the errors of conn.execute (sqlalchemy DBAPIError)"""
+
+    try:
+        return fetch_arrow_table(resultset)
+
+    except conn.dialect.dbapi.Error as e:
+        raise sqlalchemy.exc.DBAPIError.instance(
+            sql, None, e, conn.dialect.dbapi.Error, dialect=conn.dialect) from e
 
 
 class SnowflakeTestRunner(ContextDecorator):
@@ -42,14 +127,19 @@ class SnowflakeTestRunner(ContextDecorator):
         if connection_name:
             self.params['CONNECTION_NAME'] = connection_name
 
-        if 'CONNECTION_NAME' in self.params:
+        if get_snapshot_mode(self.params) == SNAPSHOT_REPLAY:
+            # results from the snapshot, no connection
+            self.connection_name = self.params.get('CONNECTION_NAME', None)
+            self.engine = None
+            logging.info("Snapshot replay: %s", get_snapshot_dir(self.params))
+
+        elif 'CONNECTION_NAME' in self.params:
             self.connection_name = self.params['CONNECTION_NAME']
 
             logging.debug("self.connection_name: %s", self.connection_name)
 
-            connection_url = get_url_from_connection_name(self.connection_name)
-
-            self.engine = create_engine(connection_url)
+            # pooled engine, disposed at the end of the session
+            self.engine = get_engine(self.connection_name, self.params)
         else:
             self.connection_name = None
             self.engine = None
@@ -75,10 +165,8 @@ class SnowflakeTestRunner(ContextDecorator):
 
     def __exit__(self, *exc):
 
-        if self.engine:
-            self.engine.dispose()
-            logging.debug(
-                "with-statement contexts dispose")
+        # pooled engine is disposed at the end of the session (dispose_engines)
+        logging.debug("with-statement contexts exit")
 
     def get_info(self):
         """instance info"""
@@ -97,30 +185,21 @@ class SnowflakeTestRunner(ContextDecorator):
 
         return str(self.engine) + str(self.get_info())
 
-    def get_replace_regex_metadata(self, in_txt, metadata_dict: dict):
-        """replace string"""
+    def get_replace_regex_metadata(self, in_txt, metadata_dict: dict, matrix_params=None,
+                                   basename=None):
+        """replace metadata patterns and placeholders in one pass (precompiled template)
+
+        matrix_params (matrix combination) overrides self.params"""
 
-        out_txt = in_txt
+        params = self.params
+        if matrix_params:
+            params = self.params | matrix_params
 
         if metadata_dict:
             for key, value in metadata_dict.items():
-                logging.debug("%s %s", key, value)
-                logging.debug("%s %s", value.get(
-                    'pattern', None), value.get('repl', None))
-
-                pattern = value.get('pattern', None)
-                repl = value.get('repl', None)
-                repl_param = self.params.get(repl.upper(), None)
-                logging.debug("%s : %s -> %s %s", key,
-                              pattern, repl, repl_param)
+                logging.debug("%s : %s -> %s", key, value.get('pattern'), value.get('repl'))
 
-                if repl_param:
-                    out_txt = re.sub(pattern, repl_param, out_txt)
-
-                    if in_txt != out_txt:
-                        logging.info("%s : %s -> %s", key, pattern, repl_param)
-
-        return out_txt
+        return render_template(in_txt, params, metadata_dict, basename=basename)
 
     def get_sql(self, sql_file):
         """get sql from file"""
@@ -160,16 +239,9 @@ class SnowflakeTestRunner(ContextDecorator):
     def get_default_yaml_filename(self, yml_file):
         """get default yaml file if exists"""
 
-        yml_dirname = os.path.dirname(yml_file)
-        logging.debug("dir name %s ", yml_dirname)
-
-        default_yml_file = os.path.join(os.path.dirname(yml_file),
-                                        os.path.dirname(yml_file) + '.yml')
+        logging.debug("dir name %s ", os.path.dirname(yml_file))
 
-        if os.path.isfile(default_yml_file):
-            logging.debug("default yml %s ", default_yml_file)
-
-            return default_yml_file
+        return get_default_yaml_filename(yml_file)
 
     def get_yaml_file(self, yml_file):
         """get Yaml configuration """
@@ -190,14 +262,9 @@ class SnowflakeTestRunner(ContextDecorator):
         if 'sql-file' in sql_dict:
             logging.info("sql-file tag found, keys: %s", yaml_data.keys())
 
-            # the same name as the file
-            if sql_dict['sql-file'] == r'${self:basename}.sql':
-
-                self_yml_name = os.path.basename(yml_file).replace('.yml', '')
-                logging.info("self name %s -> %s",
-                             '${self:basename}', self_yml_name)
-                sql_dict['sql-file'] = sql_dict['sql-file'].replace(
-                    r'${self:basename}', self_yml_name)
+            # ${self:basename}.sql the same name as the file
+            sql_dict['sql-file'] = render_template(
+                sql_dict['sql-file'], self.params, basename=get_basename(yml_file))
 
             sql_file = os.path.join(os.path.dirname(
                 yml_file), sql_dict['sql-file'])
@@ -212,11 +279,15 @@ class SnowflakeTestRunner(ContextDecorator):
 
         return sql_dict
 
-    def get_sql_from_params(self):
-        """get parameter from metadata WAREHOUSE or SESSION_VARIABLE"""
+    def get_sql_from_params(self, sql_formatted=None):
+        """get parameter from metadata WAREHOUSE or SESSION_VARIABLE,
+        the warehouse of the test (yml, pre-flight routing) wins"""
 
         session_stmt_list = []
-        if 'WAREHOUSE' in self.params.keys():
+        if (sql_formatted or {}).get('warehouse'):
+            session_stmt_list.append(
+                f"USE WAREHOUSE {sql_formatted['warehouse']};")
+        elif 'WAREHOUSE' in self.params.keys():
             session_stmt_list.append(
                 f"USE WAREHOUSE {self.params.get('WAREHOUSE', '')};")
 
@@ -237,8 +308,153 @@ class SnowflakeTestRunner(ContextDecorator):
 
         df.attrs["log"].append(msg)
 
-    def run_sql(self, sql_stmt=None, sql_file=None, sql_formatted=None, dry_run=False):
-        """run sql"""
+    def set_query_stats(self, conn, df):
+        """bytes scanned and queued time of the last query (extra round trip)"""
+
+        try:
+            query_stats = conn.execute(sqlalchemy.text(
+                "SELECT BYTES_SCANNED, QUEUED_OVERLOAD_TIME, EXECUTION_TIME"
+                + " FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY_BY_SESSION())"
+                + " WHERE QUERY_ID = :query_id"),
+                {"query_id": df.attrs.get("query_id")}).first()
+
+            if query_stats:
+                df.attrs["bytes_scanned"] = query_stats[0]
+                df.attrs["queued_time"] = query_stats[1]
+                df.attrs["execution_time"] = query_stats[2]
+
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            logging.error("query stats error %s", str(e))
+
+    def replay_sql(self, sql_stmt=None, sql_file=None, sql_formatted=None):
+        """get result from the snapshot or run sql on the local engine"""
+
+        t1_start = datetime.now()
+
+        sql_formatted = sql_formatted or {}
+
+        run_sql_stmt = sql_stmt or sql_formatted.get(
+            'sql') or self.get_sql(sql_file)
+
+        # the routed warehouse does not change the result
+        run_session_list = list(self.get_sql_from_params())
+        run_session_list.extend(sql_formatted.get('session', None) or [])
+
+        snapshot_key = get_snapshot_key(run_sql_stmt, run_session_list)
+
+        dtype_backend = get_dtype_backend(self.params)
+
+        df = load_snapshot(get_snapshot_dir(self.params), snapshot_key, dtype_backend)
+
+        if df is None and self.params.get('REPLAY_ENGINE_URL'):
+
+            logging.info("replay engine: %s",
+                         self.params.get('REPLAY_ENGINE_URL'))
+
+            try:
+                df = run_local_sql(
+                    self.params.get('REPLAY_ENGINE_URL'), run_sql_stmt, dtype_backend)
+                df.attrs["rowcount"] = len(df)
+
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                df = pd.DataFrame()
+                logging.error(str(e))
+                self.log_df_info(df, str(e))
+                df.attrs["error_msg"] = str(e)
+                df.attrs["condition"] = False
+
+        if df is None:
+            df = pd.DataFrame()
+            df.attrs["error_msg"] = f"No snapshot: {snapshot_key}"
+            df.attrs["condition"] = False
+            logging.error("No snapshot: %s", snapshot_key)
+
+        t2_executed = datetime.now()
+
+        df.attrs["snapshot_key"] = snapshot_key
+        df.attrs["query_time"] = t2_executed - t1_start
+
+        self.log_df_info(
+            df, f"replay: {snapshot_key} query time: {(t2_executed - t1_start)}")
+
+        # description, config-file ... of the current test
+        df.attrs.update(sql_formatted)
+
+        return df
+
+    def get_controller(self, warehouse=None):
+        """concurrency controller of the connection and warehouse"""
+
+        return get_controller(self.connection_name, warehouse or self.params.get('WAREHOUSE'),
+                              self.params)
+
+    def run_sql(self, sql_stmt=None, sql_file=None, sql_formatted=None, dry_run=False,
+                result_sets: list = None):
+        """run sql, in-flight queries are limited by the concurrency controller,
+        the query fails fast if the circuit breaker is open
+
+        result_sets: result sets of the coalesced statements (coalesce-statements)
+        """
+
+        if get_snapshot_mode(self.params) == SNAPSHOT_REPLAY and not dry_run:
+            return self.replay_sql(sql_stmt=sql_stmt, sql_file=sql_file,
+                                   sql_formatted=sql_formatted)
+
+        if dry_run or not self.engine:
+            return self.execute_sql(sql_stmt=sql_stmt, sql_file=sql_file,
+                                    sql_formatted=sql_formatted, dry_run=dry_run)
+
+        controller = self.get_controller((sql_formatted or {}).get('warehouse'))
+
+        try:
+            slot = controller.acquire()
+
+        except CircuitOpenError as e:
+            df = pd.DataFrame()
+            self.log_df_info(df, str(e))
+            df.attrs["error_msg"] = str(e)
+            df.attrs["condition"] = False
+            df.attrs["circuit_open"] = True
+
+            if sql_formatted:
+                df.attrs.update(sql_formatted)
+
+                if sql_formatted.get('shared-datasets-used'):
+                    release_shared_datasets(None, sql_formatted,
+                                            sql_formatted.get('matrix-batch-ids'))
+
+            return df
+
+        # exception of the failed query, classified by the controller
+        errors = []
+
+        try:
+            df = self.execute_sql(sql_stmt=sql_stmt, sql_file=sql_file,
+                                  sql_formatted=sql_formatted, dry_run=dry_run, errors=errors,
+                                  result_sets=result_sets)
+
+        except BaseException as e:
+            # connection error
+            controller.release(slot, error=e)
+            raise
+
+        # QUERY_HISTORY times are in ms
+        queued_time = df.attrs.get("queued_time")
+        execution_time = df.attrs.get("execution_time")
+
+        controller.release(
+            slot, error=errors[-1] if errors else df.attrs.get("error_msg"),
+            queued_time=queued_time / 1000 if queued_time is not None else None,
+            execution_time=execution_time / 1000 if execution_time is not None else None,
+            timed_out=df.attrs.get("timed_out", False))
+
+        return df
+
+    def execute_sql(self, sql_stmt=None, sql_file=None, sql_formatted=None, dry_run=False,
+                    errors: list = None, result_sets: list = None):
+        """execute sql on the engine, the exception of the failed query is
+        appended to errors, the result sets of the coalesced statements to
+        result_sets (the returned df has only the attributes)"""
 
         if not self.engine:
             dry_run = True
@@ -261,6 +477,8 @@ class SnowflakeTestRunner(ContextDecorator):
             with self.engine.connect() as conn:
 
                 run_session_list = []
+                watchdog = None
+                df = pd.DataFrame()
 
                 try:
                     t2_connected = datetime.now()
@@ -268,40 +486,81 @@ class SnowflakeTestRunner(ContextDecorator):
                     run_sql_stmt = sql_stmt or sql_formatted.get(
                         'sql') or self.get_sql(sql_file)
 
-                    run_session_list.extend(self.get_sql_from_params())
+                    run_session_list.extend(self.get_sql_from_params(sql_formatted))
 
                     if 'session' in sql_formatted:
                         run_session_list.extend(sql_formatted['session'])
 
                     logging.debug("run_list: %s", str(run_session_list))
 
-                    for run_stmt in run_session_list:
-                        conn.execute(text(run_stmt))
-                        logging.info("SQL execution: %s", run_stmt)
+                    test_timeout = get_test_timeout(sql_formatted, self.params)
 
-                    if importlib_metadata.version('pandas') < "2.2.2":
+                    # running statement is canceled on the timeout or Ctrl+C, also
+                    # the session statements and the shared datasets
+                    with QueryWatchdog(self.engine, conn, test_timeout) as watchdog:
 
-                        # it keeps numpy types
-                        # ot working with sqlachemy 2.2
-                        df = pd.read_sql_query(text(run_sql_stmt), conn)
-                    else:
-                        # not sure if steam_result is working or buffer
-                        resultset = conn.execution_options(
-                            stream_results=True, max_row_buffer=10000).execute(text(run_sql_stmt))
+                        # the next test on the pooled connection gets the session reset
+                        track_session(conn, (sql_formatted or {}).get('session'),
+                                      warehouse=(sql_formatted or {}).get('warehouse'))
 
-                        df = pd.DataFrame(
-                            resultset.all(), columns=resultset.keys())
+                        for run_stmt in run_session_list:
+                            conn.execute(sqlalchemy.text(run_stmt))
+                            logging.info("SQL execution: %s", run_stmt)
 
-                    df = df_to_native_types(df)
+                        if sql_formatted and sql_formatted.get('shared-datasets-used'):
+                            materialize_shared_datasets(conn, sql_formatted)
 
-                    self.log_df_info(df, f"[run_sql] df.info {df_info(df)}")
+                        if result_sets is not None and sql_formatted.get('coalesce-statements'):
+
+                            # one request, a result set per coalesced test
+                            result_sets.extend(fetch_result_sets(
+                                conn, sql_formatted['coalesce-statements'],
+                                get_dtype_backend(self.params)))
+
+                            df = pd.DataFrame()
+
+                            t3_executed = datetime.now()
+                            t4_fetched = t3_executed
+
+                        elif importlib_metadata.version('pandas') < "2.2.2":
+
+                            # it keeps numpy types
+                            # ot working with sqlachemy 2.2
+                            df = pd.read_sql_query(sqlalchemy.text(run_sql_stmt), conn)
+
+                            t3_executed = datetime.now()
+                            t4_fetched = t3_executed
+                        else:
+                            # not sure if steam_result is working or buffer
+                            resultset = conn.execution_options(
+                                stream_results=True, max_row_buffer=10000).execute(
+                                    sqlalchemy.text(run_sql_stmt))
 
-                    t3_executed = datetime.now()
+                            t3_executed = datetime.now()
+
+                            if get_dtype_backend(self.params) == DTYPE_BACKEND_ARROW:
+                                # arrow batches, no python rows
+                                df = table_to_df(fetch_arrow_result(conn, resultset,
+                                                                    run_sql_stmt))
+                            else:
+                                df = pd.DataFrame(
+                                    resultset.all(), columns=resultset.keys())
+
+                            t4_fetched = datetime.now()
+
+                    df = df_to_native_types(df, get_dtype_backend(self.params))
+
+                    self.log_df_info(df, f"[run_sql] df.info {df_info(df)}")
 
                     df.attrs["rowcount"] = len(df)
 
                     df.attrs["query_id"] = conn.execute(
-                        "SELECT LAST_QUERY_ID() AS query_id").first()[0]
+                        sqlalchemy.text("SELECT LAST_QUERY_ID() AS query_id")).first()[0]
+
+                    df.attrs["fetch_time"] = t4_fetched - t3_executed
+
+                    if is_true(self.params.get('QUERY_STATS', False)):
+                        self.set_query_stats(conn, df)
 
                     df.attrs["connection_time"] = t2_connected - t1_start
                     df.attrs["query_time"] = t3_executed - t2_connected
@@ -314,12 +573,23 @@ class SnowflakeTestRunner(ContextDecorator):
                             + f"(\'{str(df.attrs.get('query_id'))}\'));")
                     self.log_df_info(
                         df, f"connection time: {(t2_connected - t1_start)},"
-                            + f" query time: {(t3_executed - t2_connected)}")
+                            + f" query time: {(t3_executed - t2_connected)},"
+                            + f" fetch time: {(t4_fetched - t3_executed)}")
+
+                    if get_snapshot_mode(self.params) == SNAPSHOT_RECORD:
+                        # the key of the replay, without the routed warehouse
+                        snapshot_session_list = list(self.get_sql_from_params())
+                        snapshot_session_list.extend(sql_formatted.get('session', None) or [])
+
+                        save_snapshot(get_snapshot_dir(self.params),
+                                      get_snapshot_key(
+                                          run_sql_stmt, snapshot_session_list),
+                                      df, run_sql_stmt, snapshot_session_list)
 
-                except SQLAlchemyError as e:
+                except sqlalchemy.exc.SQLAlchemyError as e:
 
-                    if 'df' not in locals():
-                        df = pd.DataFrame()
+                    if errors is not None:
+                        errors.append(e)
 
                     logging.error(str(e))
                     self.log_df_info(df, str(e))
@@ -327,7 +597,25 @@ class SnowflakeTestRunner(ContextDecorator):
                     df.attrs["condition"] = False
                     df.attrs["connection_time"] = t2_connected - t1_start
 
+                    if watchdog and watchdog.timed_out:
+                        # partial timings
+                        t5_timed_out = datetime.now()
+
+                        if 't3_executed' in locals():
+                            df.attrs["query_time"] = t3_executed - t2_connected
+                            df.attrs["fetch_time"] = t5_timed_out - t3_executed
+                        else:
+                            df.attrs["query_time"] = t5_timed_out - t2_connected
+
+                        set_timed_out(conn, df, watchdog.timeout, watchdog.cancel_error)
+                        self.log_df_info(df, df.attrs["error_msg"])
+
                 finally:
+                    # also the failed test, the next tests may not use the tables
+                    if sql_formatted and sql_formatted.get('shared-datasets-used'):
+                        release_shared_datasets(conn, sql_formatted,
+                                                sql_formatted.get('matrix-batch-ids'))
+
                     conn.close()
 
                     if sql_formatted:
@@ -338,12 +626,172 @@ class SnowflakeTestRunner(ContextDecorator):
 
         return df
 
-    def run_test(self, config_file, dry_run=False):
-        """ run test from yml or sql
+    def get_matrix_params(self, sql_formatted, matrix_id):
+        """get matrix combination params (uppercase keys) for matrix_id"""
+
+        if matrix_id is None:
+            return None
+
+        for combination in get_matrix_combinations(sql_formatted.get('matrix', None)):
+            if get_matrix_id(combination) == matrix_id:
+                return {str(k).upper(): v for k, v in combination.items()}
+
+        logging.error("Matrix combination not found: %s", matrix_id)
+
+        return None
+
+    def get_matrix_batch_sql(self, sql_template, sql_formatted):
+        """get UNION ALL query for all matrix combinations
+
+        every combination is tagged with the partition column"""
+
+        union_list = []
+
+        for combination in get_matrix_combinations(sql_formatted.get('matrix', None)):
+
+            matrix_id = get_matrix_id(combination)
+            matrix_params = {str(k).upper(): v for k, v in combination.items()}
+
+            combination_sql = self.get_replace_regex_metadata(
+                sql_template, sql_formatted.get('metadata', None), matrix_params,
+                basename=get_basename(sql_formatted.get('config-file') or ''))
+            combination_sql = replace_shared_datasets(
+                combination_sql, sql_formatted.get('default-config-file', None) or "")
+            combination_sql, _ = get_smoke_sql(combination_sql, sql_formatted[CONFIG_KEY].smoke)
+            combination_sql = combination_sql.strip().rstrip(';')
+
+            partition_value = matrix_id.replace("'", "''")
+
+            union_list.append(
+                f"SELECT '{partition_value}' AS \"{MATRIX_PARTITION_COLUMN}\", t.*\n"
+                + f"FROM (\n{combination_sql}\n) t")
+
+        return "\nUNION ALL\n".join(union_list)
+
+    def split_matrix_batch(self, df_batch: pd.DataFrame, matrix_id_list):
+        """split batched matrix result into {matrix_id: df}"""
+
+        partition_col = next((col for col in df_batch.columns
+                              if str(col).casefold() == MATRIX_PARTITION_COLUMN), None)
+
+        groups = {}
+        if partition_col is not None:
+            groups = dict(tuple(df_batch.groupby(partition_col, sort=False)))
+        else:
+            logging.debug("No partition column in the batch result")
+
+        res = {}
+
+        for matrix_id in matrix_id_list:
+
+            if matrix_id in groups:
+                df_part = groups[matrix_id].drop(
+                    columns=partition_col).reset_index(drop=True)
+            elif partition_col is not None:
+                df_part = df_batch.iloc[0:0].drop(columns=partition_col)
+            else:
+                df_part = df_batch.iloc[0:0].copy()
+
+            df_part.attrs = copy.deepcopy(df_batch.attrs)
+            df_part.attrs["rowcount"] = len(df_part)
+            df_part.attrs["matrix_batch_rowcount"] = len(df_batch)
+
+            res[matrix_id] = df_part
+
+        return res
+
+    def run_matrix_batch(self, sql_template, sql_formatted, matrix_id, sql_file=None,
+                         dry_run=False):
+        """run all matrix combinations as a single query,
+        first test runs the batch, next tests take the results"""
+
+        sql_batch = dict(sql_formatted)
+        sql_batch['sql'] = self.get_matrix_batch_sql(sql_template, sql_formatted)
+
+        matrix_id_list = [get_matrix_id(combination) for combination in
+                          get_matrix_combinations(sql_formatted.get('matrix', None))]
+
+        shared_names = get_shared_dataset_names(sql_template)
+
+        if shared_names:
+            # the batch covers the references of all combinations
+            sql_batch['shared-datasets-used'] = shared_names
+            sql_batch['matrix-batch-ids'] = matrix_id_list
+
+        session_list = list(self.get_sql_from_params(sql_formatted))
+        session_list.extend(sql_formatted.get('session', None) or [])
+
+        # the edited test (or the session) runs a new batch
+        batch_key = (self.connection_name, tuple(session_list), sql_batch['sql'])
+
+        with _matrix_batches_lock:
+            batch = _matrix_batches.get(batch_key)
+            leader = batch is None or (batch.done.is_set() and matrix_id not in batch.results)
+
+            if leader:
+                # the combination was taken (rerun of the test), the batch runs again
+                batch = _matrix_batches[batch_key] = MatrixBatch()
+
+        if leader:
+
+            logging.info("Matrix batch: %s combinations %s",
+                         str(len(matrix_id_list)), str(sql_formatted.get('config-file')))
+
+            try:
+                df_batch = self.run_sql(sql_formatted=sql_batch,
+                                        sql_file=sql_file, dry_run=dry_run)
+
+                batch.results = self.split_matrix_batch(df_batch, matrix_id_list)
+
+            except BaseException as e:
+                batch.error = str(e)
+                raise
+
+            finally:
+                if batch.results is None:
+                    with _matrix_batches_lock:
+                        if _matrix_batches.get(batch_key) is batch:
+                            del _matrix_batches[batch_key]
+
+                batch.done.set()
+
+        batch.done.wait()
+
+        with _matrix_batches_lock:
+            df = batch.results.pop(matrix_id, None) if batch.results is not None else None
+
+            if not batch.results and _matrix_batches.get(batch_key) is batch:
+                del _matrix_batches[batch_key]
+
+        if df is None:
+            df = pd.DataFrame()
+            df.attrs["error_msg"] = (f"matrix batch failed: {batch.error}" if batch.error
+                                     else f"matrix combination not in the batch: {matrix_id}")
+            df.attrs["condition"] = False
+            logging.error("%s %s", str(sql_formatted.get('config-file')), df.attrs["error_msg"])
+
+        # combination sql and params
+        df.attrs.update(sql_formatted)
+        df.attrs["matrix_batch"] = True
+
+        self.log_df_info(df, f"matrix batch: {matrix_id}")
+
+        return df
+
+    def get_test_config(self, config_file):
+        """ get test configuration from yml or sql with the sql replaced
+
+        Returns:
+            tuple: (sql_formatted, sql_template, sql_file)
         """
 
         sql_formatted = {}
 
+        # key of the pre-flight, with the matrix id
+        test_file = config_file
+
+        config_file, matrix_id = split_matrix_test_file(config_file)
+
         if config_file:
 
             logging.info("config_file: %s", str(config_file))
@@ -366,6 +814,8 @@ class SnowflakeTestRunner(ContextDecorator):
                         logging.info("YAML default: %s",
                                      str(yaml_default_file))
 
+                        sql_formatted['default-config-file'] = yaml_default_file
+
                         # sql_formatted =  sql_formatted | sql_formatted_default
 
                         for key, val in sql_formatted_default.items():
@@ -389,17 +839,42 @@ class SnowflakeTestRunner(ContextDecorator):
                     sql_formatted = self.get_yaml_file(yaml_default_file)
 
                     sql_formatted['config-file'] = config_file
+                    sql_formatted['default-config-file'] = yaml_default_file
                     config_file = None
+                else:
+                    sql_formatted['config-file'] = config_file
 
                 sql_formatted['sql'] = file_sql_stmt
 
-            # apply dates replacement
-            if 'sql' in sql_formatted and 'metadata' in sql_formatted:
-                sql_formatted['sql'] = self.get_replace_regex_metadata(
-                    sql_formatted.get('sql', None), sql_formatted.get('metadata', None))
-            else:
+            matrix_params = self.get_matrix_params(sql_formatted, matrix_id)
+
+            if matrix_params is not None:
+                logging.info("Matrix: %s", matrix_id)
+                sql_formatted['matrix_id'] = matrix_id
+                sql_formatted['matrix_params'] = matrix_params
+
+            sql_template = sql_formatted.get('sql', None)
+
+            if 'metadata' not in sql_formatted:
                 logging.info("No YML metadata tag found")
 
+            # apply dates replacement and placeholders
+            if sql_formatted.get('sql'):
+                sql_formatted['sql'] = self.get_replace_regex_metadata(
+                    sql_formatted.get('sql', None), sql_formatted.get('metadata', None),
+                    matrix_params, basename=get_basename(sql_formatted.get('config-file') or ''))
+
+            # shared datasets ${shared:NAME} -> temporary table
+            shared_names = get_shared_dataset_names(sql_formatted.get('sql', None))
+
+            if shared_names:
+                sql_formatted['shared-datasets-used'] = shared_names
+                sql_formatted['sql'] = replace_shared_datasets(
+                    sql_formatted['sql'], sql_formatted.get('default-config-file', None) or "")
+
+                # check if datasets are defined
+                get_shared_datasets(sql_formatted)
+
             logging.debug("description: %s", str(
                 sql_formatted.get('description', '')))
 
@@ -410,6 +885,24 @@ class SnowflakeTestRunner(ContextDecorator):
                 sql_formatted['description'] = self.get_doc_comment(
                     sql_formatted.get('sql', ''))
 
+            # validated once, the hot paths read the attributes
+            sql_formatted[CONFIG_KEY] = parse_test_config(sql_formatted, self.params)
+
+            # compiled before the run (--metadata preflight true)
+            preflight = get_preflight_result(test_file)
+            if preflight is not None:
+                sql_formatted['preflight_error'] = preflight.error
+                sql_formatted['estimated_bytes'] = preflight.bytes_assigned
+                sql_formatted['estimated_partitions'] = preflight.partitions_assigned
+                if preflight.warehouse and not sql_formatted.get('warehouse'):
+                    sql_formatted['warehouse'] = preflight.warehouse
+
+            # smoke run, sampled or row limited inputs
+            sql, sampled = get_smoke_sql(sql_formatted.get('sql'), sql_formatted[CONFIG_KEY].smoke)
+            if sampled:
+                sql_formatted['sql'] = sql
+                sql_formatted['sampled'] = sampled
+
             logging.debug("[run_sql_file] sql %s: ",
                           str(sql_formatted.get('sql')))
             logging.debug("[run_sql_file] session %s: ",
@@ -419,4 +912,71 @@ class SnowflakeTestRunner(ContextDecorator):
 
             logging.debug("config_file: %s DONE", str(config_file))
 
-            return self.run_sql(sql_formatted=sql_formatted, sql_file=config_file, dry_run=dry_run)
+            return sql_formatted, sql_template, config_file
+
+        return None, None, None
+
+    def run_test(self, config_file, dry_run=False):
+        """ run test from yml or sql
+
+        config_file can have matrix combination id e.g. test.yml#REGION=EU
+        """
+
+        test_file = config_file
+
+        sql_formatted, sql_template, sql_file = self.get_test_config(
+            config_file)
+
+        unregister_test_file(test_file)
+
+        if sql_formatted is None:
+            return None
+
+        if sql_formatted.get('preflight_error') and not dry_run:
+            # not compiled, fails without queueing in the warehouse
+            df = pd.DataFrame()
+            self.log_df_info(df, sql_formatted['preflight_error'])
+            df.attrs["error_msg"] = sql_formatted['preflight_error']
+            df.attrs["condition"] = False
+            df.attrs.update(sql_formatted)
+
+            if sql_formatted.get('shared-datasets-used'):
+                release_shared_datasets(None, sql_formatted)
+
+            return df
+
+        if sql_formatted.get('matrix_id') is not None and sql_formatted[CONFIG_KEY].matrix_batch:
+            return self.run_matrix_batch(sql_template, sql_formatted, sql_formatted['matrix_id'],
+                                         sql_file=sql_file, dry_run=dry_run)
+
+        if is_coalesce_test(sql_formatted, self.params):
+            return run_coalesced(self, test_file, sql_formatted,
+                                 sql_file=sql_file, dry_run=dry_run)
+
+        if not dry_run and sql_formatted.get('sql') and is_single_flight(self.params):
+            # identical queries of the session share one execution
+            return run_single_flight(self, test_file, sql_formatted, lambda: self.run_sql(
+                sql_formatted=sql_formatted, sql_file=sql_file, dry_run=dry_run))
+
+        return self.run_sql(sql_formatted=sql_formatted, sql_file=sql_file, dry_run=dry_run)
+
+    def run_tests(self, test_files, dry_run=False):
+        """run tests in parallel, in-flight queries are limited by the
+        concurrency controller, dependents of the failed tests are skipped
+
+        Returns:
+            dict: {test_file: df}
+        """
+
+        # EXPLAIN before the run (--metadata preflight true)
+        run_preflight(self, test_files)
+
+        max_workers = self.get_controller().max_limit
+
+        with ThreadPoolExecutor(max_workers=max_workers,
+                                thread_name_prefix="cdt-test") as executor:
+            # independent branches of the depends-on DAG in parallel
+            results = dict(iter_dag_results(
+                executor, test_files, lambda test_file: self.run_test(test_file, dry_run=dry_run)))
+
+            return {test_file: results.get(test_file) for test_file in test_files}
@@ -0,0 +1,226 @@
+"""class SnowflakeTestSuite, in-process run of the tests (notebook api)
+
+    from lib.continuous_data_testing.snowflake_test_suite import SnowflakeTestSuite
+
+    suite = SnowflakeTestSuite("sample_test", connection_name="dev")
+    df_index = suite.run()              # results index
+    df = suite["dual_1"]                # result of the test (test name or file)
+    suite.rerun_failed()
+    suite.rerun_changed()               # changed or new test files
+
+The pooled engine (authenticated connection) and the test manifests are
+kept in the kernel, reruns pay only the queries.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+
+from .engine_pool import dispose_engines
+from .engine_pool import warm_up_engine
+from .html_report import DEFAULT_MAX_COLS
+from .html_report import DEFAULT_MAX_ROWS
+from .html_report import write_html_report
+from .lazy import lazy_import
+from .run_history import get_seconds
+from .service import get_selected_test_files
+from .service import get_test_id
+from .service import iter_test_results
+from .snapshot import SNAPSHOT_REPLAY
+from .snapshot import get_snapshot_mode
+from .snowflake_test_runner import SnowflakeTestRunner
+from .utils import get_basename_from_testname
+from .utils import get_df_test_index
+from .utils import get_test_fingerprint
+from .utils import write_test_results_to_excel
+from .utils import write_test_results_to_parquet
+
+# heavy modules are loaded on the first use
+pd = lazy_import("pandas")
+
+
+class SnowflakeTestSuite:
+    """Class Snowflake Test Suite"""
+
+    def __init__(self, tests, connection_name=None, metadata=None, env=None, keyword=None):
+
+        # directories, test files or matrix test ids
+        self.tests = tests
+        self.keyword = keyword
+        self.connection_name = connection_name
+        self.metadata = dict(metadata or {})
+        self.env = dict(os.environ) if env is None else dict(env)
+
+        # test_file -> df
+        self.results: dict = {}
+
+        # test_file -> fingerprint of the configuration of the last run
+        self.fingerprints: dict = {}
+
+        self.runner = SnowflakeTestRunner(connection_name=connection_name,
+                                          metadata=self.metadata, env=self.env)
+
+        if self.runner.connection_name and \
+                get_snapshot_mode(self.runner.params) != SNAPSHOT_REPLAY:
+            warm_up_engine(self.runner.connection_name, self.runner.params)
+
+    def get_tests(self):
+        """selection as the list"""
+
+        return [self.tests] if isinstance(self.tests, str) else list(self.tests)
+
+    def get_test_files(self):
+        """test files of the selection"""
+
+        return get_selected_test_files(self.tests, self.keyword)
+
+    def run(self, test_files=None):
+        """run tests (all selected by default)
+
+        Returns:
+            pd.DataFrame: results index
+        """
+
+        test_files = self.get_test_files() if test_files is None else list(test_files)
+
+        logging.info("suite run: %s tests", str(len(test_files)))
+
+        # before the run, a test changed during the run is run again
+        fingerprints = {test_file: get_test_fingerprint(test_file) for test_file in test_files}
+
+        for test_file, df in iter_test_results(self.runner, test_files):
+            self.results[test_file] = df
+            self.fingerprints[test_file] = fingerprints[test_file]
+
+        return self.get_index()
+
+    def get_failed(self):
+        """failed test files of the last run"""
+
+        return [test_file for test_file in self.get_test_files()
+                if test_file in self.results and not self.results[test_file].attrs.get("condition")]
+
+    def get_changed(self):
+        """test files changed since the last run or not run yet"""
+
+        return [test_file for test_file in self.get_test_files()
+                if test_file not in self.fingerprints
+                or self.fingerprints[test_file] != get_test_fingerprint(test_file)]
+
+    def rerun_failed(self):
+        """run failed tests again
+
+        Returns:
+            pd.DataFrame: results index
+        """
+
+        return self.run(self.get_failed())
+
+    def rerun_changed(self):
+        """run changed and new tests
+
+        Returns:
+            pd.DataFrame: results index
+        """
+
+        return self.run(self.get_changed())
+
+    def discard_removed(self):
+        """forget results of the test files no longer selected (removed)
+
+        Returns:
+            list: removed test files
+        """
+
+        test_files = set(self.get_test_files())
+
+        removed = [test_file for test_file in self.results if test_file not in test_files]
+
+        for test_file in removed:
+            self.results.pop(test_file, None)
+            self.fingerprints.pop(test_file, None)
+
+        return removed
+
+    def get_test_results(self):
+        """results of the selected tests {test id: df} (like the pytest session)"""
+
+        return {get_test_id(test_file): self.results[test_file]
+                for test_file in self.get_test_files() if test_file in self.results}
+
+    def get_index(self):
+        """results index of the selected tests, the xlsx index with the test
+        file, row count and timings"""
+
+        test_files = [test_file for test_file in self.get_test_files()
+                      if test_file in self.results]
+
+        if not test_files:
+            return pd.DataFrame()
+
+        df_index = get_df_test_index(self.get_test_results())
+
+        df_index.insert(0, "Test file", test_files)
+        df_index["Row count"] = [self.results[test_file].attrs.get("rowcount")
+                                 for test_file in test_files]
+        df_index["Query id"] = [self.results[test_file].attrs.get("query_id")
+                                for test_file in test_files]
+        df_index["Query time [s]"] = [get_seconds(self.results[test_file].attrs.get("query_time"))
+                                      for test_file in test_files]
+
+        return df_index
+
+    def __getitem__(self, test):
+        """result by the test file or the test name"""
+
+        if test in self.results:
+            return self.results[test]
+
+        for test_file, df in self.results.items():
+            if get_basename_from_testname(get_test_id(test_file)) == test:
+                return df
+
+        raise KeyError(test)
+
+    def to_excel(self, output_xlsx):
+        """write the xlsx report"""
+
+        test_results = self.get_test_results()
+
+        write_test_results_to_excel(get_df_test_index(test_results), test_results, output_xlsx)
+
+        logging.info("XLSX file: %s", output_xlsx)
+
+    def to_parquet(self, output_dir):
+        """write the index and the results to the parquet files"""
+
+        test_results = self.get_test_results()
+
+        write_test_results_to_parquet(get_df_test_index(test_results), test_results, output_dir)
+
+        logging.info("Parquet directory: %s", output_dir)
+
+    def to_html(self, output_html, refresh=None):
+        """write the standalone html report"""
+
+        test_results = self.get_test_results()
+
+        write_html_report(output_html, self.get_index(), test_results,
+                          title=f"Test report {', '.join(map(str, self.get_tests()))}",
+                          max_rows=int(self.runner.params.get('HTML_MAX_ROWS') or DEFAULT_MAX_ROWS),
+                          max_cols=int(self.runner.params.get('HTML_MAX_COLS') or DEFAULT_MAX_COLS),
+                          refresh=refresh)
+
+        logging.info("HTML file: %s", output_html)
+
+    def close(self):
+        """dispose pooled engines"""
+
+        dispose_engines()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,158 @@
+"""Precompiled sql templates
+
+The yml metadata replacements (regex pattern -> parameter) and the
+placeholders are compiled into one regex per template and substituted
+in a single pass:
+
+    metadata:
+        business_date:
+            pattern: "1900-01-01"      regex
+            repl: business_date        parameter (--metadata, env, matrix value)
+
+    ${self:basename}                   test file name without the extension
+    ${param:BUSINESS_DATE}             parameter
+
+The patterns are matched on the original text once, when the template
+is compiled (a value is never matched by the next pattern); rendering
+only fills the slots. The compiled template is cached by the content
+(sql text and metadata), the matrix combinations and the reruns only
+render. The values are inserted literally (no regex escapes), a pattern
+or placeholder without the parameter value is kept. The same content and
+parameters render the same sql.
+
+${shared:NAME} is replaced by shared_datasets (temporary table names).
+"""
+
+from __future__ import annotations
+
+import functools
+import os
+import re
+
+PLACEHOLDER_PATTERN = re.compile(r"\$\{(self|param):([A-Za-z0-9_]+)\}")
+
+SLOT_METADATA = "metadata"
+SLOT_PARAM = "param"
+SLOT_SELF = "self"
+
+# compiled templates, the key is the content
+TEMPLATE_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_pattern(pattern):
+    """compiled metadata pattern"""
+
+    return re.compile(pattern)
+
+
+class SqlTemplate:
+    """compiled template: the text is scanned once, rendering fills the
+    slots of the format string (no regex at the render)
+    """
+
+    def __init__(self, text, metadata_items=()):
+
+        # (start, priority, end, slot), matches of the original text
+        matches = []
+
+        if "${" in text:
+            for m in PLACEHOLDER_PATTERN.finditer(text):
+                kind = SLOT_SELF if m.group(1) == "self" else SLOT_PARAM
+                matches.append((m.start(), -1, m.end(), (kind, m.group(2), m.group(0))))
+
+        for i, (_, pattern, repl) in enumerate(metadata_items):
+            for m in compile_pattern(pattern).finditer(text):
+                if m.end() > m.start():
+                    matches.append((m.start(), i, m.end(),
+                                    (SLOT_METADATA, str(repl).upper(), m.group(0))))
+
+        # leftmost match wins, then the placeholder and the yml order
+        matches.sort(key=lambda match: (match[0], match[1]))
+
+        # slot -> field of the format string
+        self.slots = {}
+
+        format_list = []
+        position = 0
+
+        for start, _, end, slot in matches:
+
+            if start < position:
+                continue
+
+            field = self.slots.setdefault(slot, f"f{len(self.slots)}")
+
+            format_list.append(text[position:start].replace("{", "{{").replace("}", "}}"))
+            format_list.append("{" + field + "}")
+            position = end
+
+        format_list.append(text[position:].replace("{", "{{").replace("}", "}}"))
+
+        self.text = text
+        self.format_text = "".join(format_list)
+
+    def get_values(self, params: dict, basename):
+        """values of the slots, the matched text if there is no value"""
+
+        values = {}
+
+        for (kind, name, matched), field in self.slots.items():
+
+            if kind == SLOT_METADATA:
+                value = params.get(name)
+                values[field] = str(value) if value else matched
+
+            elif kind == SLOT_PARAM:
+                value = params.get(name.upper())
+                values[field] = matched if value is None else str(value)
+
+            else:
+                values[field] = basename if name == "basename" and basename else matched
+
+        return values
+
+    def render(self, params: dict = None, basename=None):
+        """sql with the parameters"""
+
+        if not self.slots:
+            return self.text
+
+        return self.format_text.format_map(self.get_values(params or {}, basename))
+
+
+def get_metadata_items(metadata_dict: dict):
+    """hashable metadata (key, pattern, repl) in the yml order"""
+
+    if not metadata_dict:
+        return ()
+
+    return tuple((str(key), str(value.get('pattern')), str(value.get('repl')))
+                 for key, value in metadata_dict.items())
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(text, metadata_items=()):
+    """compiled template, cached by the content"""
+
+    return SqlTemplate(text, metadata_items)
+
+
+def render_template(text, params: dict = None, metadata_dict: dict = None, basename=None):
+    """render the sql (or file name) with the parameters and metadata"""
+
+    if not text:
+        return text
+
+    metadata_items = get_metadata_items(metadata_dict)
+
+    if not metadata_items and "${" not in text:
+        return text
+
+    return compile_template(text, metadata_items).render(params, basename)
+
+
+def get_basename(file):
+    """file name without the directory and the extension"""
+
+    return os.path.splitext(os.path.basename(file))[0]
@@ -0,0 +1,182 @@
+"""Per test timeout with the server side query cancellation
+
+    timeout: 600                     yml of the test or the directory default yml [s]
+    --metadata test_timeout 600      all tests
+
+When the timeout fires, the running statement of the test session is
+canceled on the server, the connection is invalidated (not returned to
+the pool) and the result is marked timed out with the partial timings.
+Interrupted run (Ctrl+C) cancels the running statement as well, so the
+query does not keep running in the warehouse.
+
+The blocked client does not know the query id of the running statement
+yet, the statements of the session are canceled
+(SYSTEM$CANCEL_ALL_QUERIES), the query id of the canceled statement is
+recorded afterwards (LAST_QUERY_ID). The cancel is sent on a dedicated
+connection outside the engine pool, it does not wait for a pooled
+connection held by the running tests. A statement finishing when the timer
+fires is not a timeout, its connection is returned to the pool.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+
+from .config_model import get_config
+from .lazy import lazy_import
+
+# heavy modules are loaded on the first use
+sqlalchemy = lazy_import("sqlalchemy")
+
+
+def get_test_timeout(sql_formatted: dict, params: dict):
+    """timeout of the test [s] from the yml or TEST_TIMEOUT, None without timeout"""
+
+    timeout = get_config(sql_formatted).timeout or params.get('TEST_TIMEOUT')
+
+    if timeout in (None, ''):
+        return None
+
+    try:
+        timeout = float(timeout)
+    except ValueError:
+        logging.error("wrong timeout: %s", str(timeout))
+        return None
+
+    return timeout if timeout > 0 else None
+
+
+def get_session_id(conn):
+    """snowflake session id of the sqlalchemy connection, None for other engines"""
+
+    dbapi_connection = getattr(conn.connection, "dbapi_connection", None)
+
+    return getattr(dbapi_connection, "session_id", None)
+
+
+def cancel_session_queries(engine, conn):
+    """cancel the running statement of the connection on the server
+
+    snowflake: SYSTEM$CANCEL_ALL_QUERIES(session) from a new connection
+    (not pooled, the pool may be exhausted by the running tests), sqlite:
+    interrupt
+    """
+
+    session_id = get_session_id(conn)
+
+    if session_id is not None:
+        # DBAPI connection of the engine url and connect args, closed after the cancel
+        cancel_connection = engine.pool._creator()
+
+        try:
+            cursor = cancel_connection.cursor()
+            cursor.execute(f"SELECT SYSTEM$CANCEL_ALL_QUERIES({int(session_id)})")
+            res = cursor.fetchone()
+            cursor.close()
+
+        finally:
+            cancel_connection.close()
+
+        logging.info("session %s canceled: %s", str(session_id), str(res[0] if res else None))
+        return
+
+    dbapi_connection = getattr(conn.connection, "dbapi_connection", None)
+
+    if hasattr(dbapi_connection, "interrupt"):
+        dbapi_connection.interrupt()
+        logging.info("connection interrupted")
+        return
+
+    logging.error("query cannot be canceled, no session id")
+
+
+class QueryWatchdog:
+    """cancel the statement of the connection running over the timeout
+
+        with QueryWatchdog(engine, conn, timeout) as watchdog:
+            conn.execute(...)
+
+        watchdog.timed_out
+    """
+
+    def __init__(self, engine, conn, timeout=None):
+
+        self.engine = engine
+        self.conn = conn
+        self.timeout = timeout
+        self.timed_out = False
+        self.cancel_error = None
+
+        self._finished = False
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def cancel(self):
+        """cancel the running statement"""
+
+        try:
+            cancel_session_queries(self.engine, self.conn)
+        except Exception as e:
+            self.cancel_error = str(e)
+            logging.error("query cancel error %s", str(e))
+
+    def on_timeout(self):
+        """timer callback, the statement does not finish during the cancel"""
+
+        with self._lock:
+            if self._finished:
+                return
+            self.timed_out = True
+
+            logging.error("timeout %s s, query canceled", str(self.timeout))
+
+            self.cancel()
+
+    def __enter__(self):
+
+        if self.timeout:
+            self._timer = threading.Timer(self.timeout, self.on_timeout)
+            self._timer.daemon = True
+            self._timer.start()
+
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+
+        # waits for the cancel started by the timer
+        with self._lock:
+            self._finished = True
+
+            if exc_type is None and self.timed_out:
+                # the statements finished before the cancel, the result is complete
+                logging.info("query finished on the timeout, not canceled")
+                self.timed_out = False
+
+        if self._timer:
+            self._timer.cancel()
+
+        if exc_type is KeyboardInterrupt and not self.timed_out:
+            logging.error("interrupted, query canceled")
+            self.cancel()
+
+        return False
+
+
+def set_timed_out(conn, df, timeout, cancel_error=None):
+    """mark the result timed out, record the query id of the canceled
+    statement and invalidate the connection (not returned to the pool)
+    """
+
+    try:
+        df.attrs["query_id"] = conn.execute(
+            sqlalchemy.text("SELECT LAST_QUERY_ID() AS query_id")).first()[0]
+    except sqlalchemy.exc.SQLAlchemyError as e:
+        logging.debug("query id of the canceled query: %s", str(e))
+
+    df.attrs["timed_out"] = True
+    df.attrs["condition"] = False
+    df.attrs["error_msg"] = f"Timeout {timeout:g} s, query canceled" + (
+        f" (cancel error: {cancel_error})" if cancel_error else "")
+
+    conn.invalidate()
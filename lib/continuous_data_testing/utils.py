@@ -1,32 +1,48 @@
 
 """Utils for pytest"""
 
+from __future__ import annotations
+
 import csv
 from datetime import datetime
+import functools
+import hashlib
 import io
 import os
 import re
 import logging
 import pathlib
 import glob
+import itertools
 import warnings
-import pandas as pd
 
-import tomlkit
-import yaml
+from .arrow_types import DTYPE_BACKEND_ARROW
+from .arrow_types import df_to_arrow_types
+from .arrow_types import get_max_str_len
+from .lazy import lazy_import
+from .sketches import get_profile_text
+
+# heavy modules are loaded on the first use
+pd = lazy_import("pandas")
+yaml = lazy_import("yaml")
+tomlkit = lazy_import("tomlkit")
 
-from snowflake.connector.constants import CONNECTIONS_FILE
-from snowflake.sqlalchemy import URL
+
+# separator between test file and matrix combination id e.g. test.yml#REGION=EU
+MATRIX_SEPARATOR = "#"
 
 
 def get_basename_from_testname(name):
     """base name from test name"""
     basename = name
-    s = re.search(r"(\[)(.*[.](sql|yml))(\])", basename)
+    s = re.search(r"(\[)(.*[.](sql|yml))(#[^\]]*)?(\])", basename)
     if s:
         basename = s.group(2)
         basename = basename.replace('.sql', '')
         basename = basename.replace('.yml', '')
+        # matrix combination id
+        if s.group(4):
+            basename = basename + s.group(4)
 
     basename = os.path.basename(basename)
     basename = basename.replace(']', '')
@@ -60,6 +76,18 @@ def get_df_test_index(test_results):
 
     index_data = []
 
+    # sketches of the failed DIFF columns (diff profile)
+    profile = any(isinstance(val, pd.DataFrame) and val.attrs.get("diff_profile_list")
+                  for val in test_results.values())
+
+    # last results of the unselected tests (smart selection)
+    reused = any(isinstance(val, pd.DataFrame) and val.attrs.get("reused")
+                 for val in test_results.values())
+
+    # smoke run, sampled or row limited inputs
+    sampled = any(isinstance(val, pd.DataFrame) and val.attrs.get("sampled")
+                  for val in test_results.values())
+
     for key, val in test_results.items():
         try:
 
@@ -76,6 +104,10 @@ def get_df_test_index(test_results):
 
                 condition = "Passed" if df_result.attrs.get(
                     "condition") else "Failed"
+
+                # upstream test failed (depends-on)
+                if df_result.attrs.get("skipped"):
+                    condition = "Skipped"
                 error_msg = df_result.attrs.get("error_msg")
 
                 sql_desc = str(df_result.attrs.get("description"))
@@ -92,6 +124,16 @@ def get_df_test_index(test_results):
                 index_data.append({"Test name": test_name, "SQL description": sql_desc,
                                    "Diff result": condition, "Error message": error_msg,
                                    "SQL statement": sql_statement})
+
+                if profile:
+                    index_data[-1]["Diff profile"] = get_profile_text(
+                        df_result.attrs.get("diff_profile_list"))
+
+                if reused:
+                    index_data[-1]["Reused"] = df_result.attrs.get("reused") or ""
+
+                if sampled:
+                    index_data[-1]["Sampled"] = df_result.attrs.get("sampled") or ""
             else:
                 logging.debug("no attrs for %s", key)
                 index_data.append({"Test name": test_name, "SQL description": "",
@@ -178,7 +220,7 @@ def write_test_results_to_excel(index_df, test_results: dict, output_xlsx):
                 column_len = 50
 
             cell_format = workbook.add_format()
-            if col in ['Test name', 'Error message', 'SQL description']:
+            if col in ['Test name', 'Error message', 'SQL description', 'Diff profile']:
                 cell_format.set_text_wrap()
 
             worksheet.set_column(i, i, column_len, cell_format)
@@ -259,7 +301,7 @@ def write_test_results_to_excel(index_df, test_results: dict, output_xlsx):
                     # A padding length of 2 is also added.
                     for i, col in enumerate(df_result.columns):
 
-                        column_len = df_result[col].astype(str).str.len().max()
+                        column_len = get_max_str_len(df_result[col])
                         logging.debug("column_len %s : %s",
                                       col, str(column_len))
 
@@ -329,9 +371,59 @@ def write_test_results_to_excel(index_df, test_results: dict, output_xlsx):
                 raise
 
 
+def write_test_results_to_parquet(index_df, test_results: dict, output_dir):
+    """Write the index and the test results to the parquet files
+    (index.parquet, <test name>.parquet), arrow columns are written as they are
+
+    Returns:
+        list: parquet files
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    output_files = []
+
+    index_file = os.path.join(output_dir, "index.parquet")
+    index_df.to_parquet(index_file, index=False)
+    output_files.append(index_file)
+
+    file_names = []
+
+    for key, df_result in test_results.items():
+
+        test_name = df_result.attrs.get("test_name") or key
+
+        file_name = "".join(c if c.isalnum() or c in "-_=." else "_"
+                            for c in get_basename_from_testname(test_name))
+
+        uniq_name = file_name
+        next_number = 1
+        while uniq_name in file_names:
+            next_number = next_number + 1
+            uniq_name = f"{file_name}.{next_number}"
+
+        file_name = uniq_name
+        file_names.append(file_name)
+
+        # result of the test is not changed, attrs are not json
+        df_export = df_to_export(df_result.copy(deep=False))
+        df_export.attrs = {}
+
+        output_file = os.path.join(output_dir, file_name + ".parquet")
+        df_export.to_parquet(output_file, index=False)
+        output_files.append(output_file)
+
+        logging.debug("parquet: %s %s", test_name, output_file)
+
+    return output_files
+
+
 def get_dict_from_connection_name(connection_name):
     """Get dict from toml file"""
 
+    # snowflake connector is loaded only for the connection
+    from snowflake.connector.constants import CONNECTIONS_FILE
+
     warnings.filterwarnings(
         action="ignore",
         message=".*Bad owner or permissions.*",
@@ -356,11 +448,34 @@ def get_dict_from_connection_name(connection_name):
 def get_url_from_connection_name(connection_name):
     """get url from connection name"""
 
+    # snowflake connector is loaded only for the connection
+    from snowflake.sqlalchemy import URL
+
     # **kwargs allows for any number of optional keyword arguments (parameters),
     # which will be in a dict named kwargs.
     return URL(**get_dict_from_connection_name(connection_name))
 
 
+def get_default_yaml_basename(file):
+    """default yml file name of the directory <dir>/<dir>.yml"""
+
+    return os.path.basename(os.path.dirname(os.path.abspath(file))) + '.yml'
+
+
+def get_default_yaml_filename(file):
+    """get default yaml file of the directory if exists"""
+
+    default_yml_file = os.path.join(os.path.dirname(file),
+                                    get_default_yaml_basename(file))
+
+    if os.path.isfile(default_yml_file):
+        logging.debug("default yml %s ", default_yml_file)
+
+        return default_yml_file
+
+    return None
+
+
 def get_files(pattern, file):
     """get file list based on pattern"""
 
@@ -399,7 +514,7 @@ def get_files(pattern, file):
             logging.debug("sql filename : %s", str(filename))
 
         if (pathlib.Path(filename).suffix == '.yml' and
-                os.path.dirname(filename) == os.path.basename(filename)):
+                os.path.basename(filename) == get_default_yaml_basename(filename)):
             skip_file = True
             logging.info(
                 "default yml file : %s sql file is skipped", str(filename))
@@ -414,47 +529,166 @@ def get_files(pattern, file):
     return res
 
 
-def get_dict_by_path(input_dict, dict_path, default=None):
-    """get dict element based on path e.g. /a/b/c/d"""
+def get_matrix_combinations(matrix_dict):
+    """expand yaml matrix {param: [values]} into the list of combinations
 
-    logging.debug(input_dict)
+    matrix:
+        BUSINESS_DATE: ['2024-01-31', '2024-02-29']
+        REGION: [EU, US]
+    """
 
-    d = input_dict
+    if not matrix_dict or not isinstance(matrix_dict, dict):
+        return []
 
-    path_keys = dict_path.split('/')
+    keys = list(matrix_dict.keys())
+    values = [val if isinstance(val, list) else [val]
+              for val in matrix_dict.values()]
 
-    logging.debug("path_keys: %s", str(path_keys))
+    combinations = [dict(zip(keys, combination))
+                    for combination in itertools.product(*values)]
 
-    # remove empty
-    path_keys = list(filter(None, path_keys))
+    logging.debug("matrix combinations: %s", str(len(combinations)))
 
-    key_found = False
-    for key in path_keys:
+    return combinations
+
+
+def get_matrix_id(combination: dict):
+    """matrix combination id e.g. BUSINESS_DATE=2024-01-31,REGION=EU"""
+
+    return ",".join(f"{key}={val}" for key, val in combination.items())
+
+
+def split_matrix_test_file(test_file):
+    """split test file into (config_file, matrix_id)"""
+
+    if test_file and MATRIX_SEPARATOR in test_file:
+        config_file, matrix_id = test_file.split(MATRIX_SEPARATOR, 1)
+        return config_file, matrix_id
 
-        logging.debug("key: %s", key)
-        logging.debug("dict d: %s", str(d))
+    return test_file, None
+
+
+def get_yaml_matrix(yml_file):
+    """get matrix tag from the yml file"""
+
+    try:
+        with open(yml_file, 'r', encoding="utf-8") as f:
+            yaml_data = yaml.full_load(f)
+
+    except Exception as e:
+        logging.error("yml file %s error %s", yml_file, str(e))
+        return None
+
+    if isinstance(yaml_data, dict):
+        return yaml_data.get('matrix', None)
+
+    return None
+
+
+def get_test_files(pattern, file):
+    """get file list based on pattern, yml files with matrix tag are
+    expanded into one test per combination e.g. test.yml#REGION=EU"""
+
+    res = []
+
+    for filename in get_files(pattern, file):
+
+        matrix_dict = None
+        if pathlib.Path(filename).suffix == '.yml':
+            matrix_dict = get_yaml_matrix(filename)
+
+        combinations = get_matrix_combinations(matrix_dict)
+
+        if combinations:
+            logging.debug("matrix file : %s %s", filename,
+                          str(len(combinations)))
+            res.extend(filename + MATRIX_SEPARATOR + get_matrix_id(combination)
+                       for combination in combinations)
+        else:
+            res.append(filename)
+
+    return res
+
+
+def get_test_config_files(test_file):
+    """files of the test configuration: the test file, the sql file of the
+    yml with the same name and the directory default yml"""
+
+    config_file, _ = split_matrix_test_file(test_file)
+
+    files = [config_file]
+
+    if config_file.endswith('.yml'):
+        sql_file = config_file[:-len('.yml')] + '.sql'
+        if os.path.isfile(sql_file):
+            files.append(sql_file)
+
+    default_yml_file = get_default_yaml_filename(config_file)
+    if default_yml_file:
+        files.append(default_yml_file)
+
+    return files
+
+
+def get_test_fingerprint(test_file):
+    """hash of the test id and the content of the test configuration files,
+    None if the test file does not exist"""
+
+    fingerprint = hashlib.sha256(test_file.encode("utf-8"))
+
+    for i, config_file in enumerate(get_test_config_files(test_file)):
+        try:
+            with open(config_file, 'rb') as f:
+                fingerprint.update(f.read())
+
+        except OSError:
+            if i == 0:
+                return None
+
+    return fingerprint.hexdigest()[:32]
+
+
+def is_true(value):
+    """yml or metadata (string) value is true"""
+
+    if isinstance(value, str):
+        return value.strip().casefold() in ('true', 'yes', 'y', '1')
+
+    return bool(value)
+
+
+@functools.lru_cache(maxsize=256)
+def get_path_keys(dict_path):
+    """keys of the path /a/b/c/d"""
+
+    return tuple(filter(None, dict_path.split('/')))
+
+
+def get_dict_by_path(input_dict, dict_path, default=None):
+    """get dict element based on path e.g. /a/b/c/d
+
+    test configuration is read by config_model.get_config
+    """
+
+    d = input_dict
+
+    key_found = False
+    for key in get_path_keys(dict_path):
 
         key_found = False
 
         # element is a dict
         if isinstance(d, dict):
-            if key in d.keys():
-                d = d.get(key)
+            if key in d:
+                d = d[key]
                 key_found = True
 
         # element is a list, cannot have duplicated keys in the list
         elif isinstance(d, list):
             for item in d:
-                logging.debug("list: %s  %s", str(type(item)), str(item))
-                if isinstance(item, dict):
-                    print("item: " + str(type(item)) + " " + str(item))
-                    if key in item.keys():
-                        logging.debug("item: %s get: %s", str(
-                            key), str(item.get(key)))
-                        d = item.get(key)
-                        key_found = True
-
-        logging.debug("selected dict d: %s", str(d))
+                if isinstance(item, dict) and key in item:
+                    d = item[key]
+                    key_found = True
 
         if not key_found:
             logging.debug("key not found: %s", key)
@@ -513,7 +747,9 @@ def safe_df_result(test_name, output_dir, df_result: pd.DataFrame):
         try:
 
             buf = io.StringIO()
-            yaml.dump(df_result.attrs, buf,
+            # the parsed configuration is not written (python object)
+            yaml.dump({key: value for key, value in df_result.attrs.items()
+                       if key != "test_config"}, buf,
                       allow_unicode=True, canonical=False)
 
             content = buf.getvalue()
@@ -537,13 +773,16 @@ def safe_df_result(test_name, output_dir, df_result: pd.DataFrame):
                      output_dir, str(df_result.attrs.keys()))
 
 
-def df_to_native_types(df: pd.DataFrame):
-    """convert to proper types
+def df_to_native_types(df: pd.DataFrame, dtype_backend=None):
+    """convert to proper types, dtype_backend arrow keeps arrow columns
 
     Returns:
         pd.DataFrame: _description_
     """
 
+    if dtype_backend == DTYPE_BACKEND_ARROW:
+        return df_to_arrow_types(df)
+
     # wrong convertin for commas and dots
     df_conv = df.convert_dtypes(convert_floating=False)
 
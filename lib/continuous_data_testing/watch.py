@@ -0,0 +1,201 @@
+"""Watch mode, the changed tests are run again
+
+    python -m lib.continuous_data_testing.watch sample_test --connection-name dev \\
+        --html reports/watch.html --xlsx reports/watch.xlsx
+
+The test directories are polled (names and modification times of the
+.sql and .yml files), a changed directory is checked by the content
+fingerprints of the tests (test file, sql of the yml, directory default
+yml), so a change of the default yml runs all tests of the directory.
+Only the changed and new tests are run, the other tests keep their last
+results. The reports are replaced in place after each run, the html
+report reloads itself in the browser.
+
+The pooled connection is kept warm, an idle connection is pinged
+(--keep-alive seconds).
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import time
+
+from .engine_pool import ping_engine
+from .service import get_manifest_signature
+from .snapshot import SNAPSHOT_REPLAY
+from .snapshot import get_snapshot_mode
+from .snowflake_test_suite import SnowflakeTestSuite
+from .utils import split_matrix_test_file
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_KEEP_ALIVE = 600.0
+
+# html report reload [s]
+DEFAULT_REFRESH = 2
+
+
+def get_watch_directories(tests):
+    """directories of the selection (directories, test files, matrix test ids)"""
+
+    directories = []
+
+    for test in tests:
+
+        if os.path.isdir(test):
+            directory = test
+        else:
+            directory = os.path.dirname(split_matrix_test_file(test)[0]) or "."
+
+        if os.path.abspath(directory) not in map(os.path.abspath, directories):
+            directories.append(directory)
+
+    return directories
+
+
+def get_tree_signature(directories):
+    """signature of the test files of the directories"""
+
+    signature = []
+
+    for directory in directories:
+        try:
+            signature.append((directory, get_manifest_signature(directory)))
+
+        except OSError:
+            signature.append((directory, None))
+
+    return tuple(signature)
+
+
+class TestWatcher:
+    """run the changed tests, write the reports"""
+
+    def __init__(self, suite: SnowflakeTestSuite, output_html=None, output_xlsx=None,
+                 interval=DEFAULT_INTERVAL, keep_alive=DEFAULT_KEEP_ALIVE):
+
+        self.suite = suite
+        self.output_html = output_html
+        self.output_xlsx = output_xlsx
+        self.interval = interval
+        self.keep_alive = keep_alive
+
+        self.directories = get_watch_directories(suite.get_tests())
+        self.signature = None
+        self.last_activity = time.monotonic()
+
+    def check(self):
+        """run the changed tests if the test tree changed
+
+        Returns:
+            list: test files run
+        """
+
+        signature = get_tree_signature(self.directories)
+
+        if signature == self.signature:
+            return []
+
+        self.signature = signature
+
+        removed = self.suite.discard_removed()
+        changed = self.suite.get_changed()
+
+        if not changed and not removed:
+            return []
+
+        t1_start = time.perf_counter()
+
+        if changed:
+            self.suite.run(changed)
+
+        failed = [test_file for test_file in changed if test_file in self.suite.get_failed()]
+
+        logging.info("watch: %s run, %s failed, %s removed, %s s", str(len(changed)),
+                     str(len(failed)), str(len(removed)),
+                     str(round(time.perf_counter() - t1_start, 3)))
+
+        for test_file in failed:
+            logging.info("watch: failed %s %s", test_file,
+                         self.suite[test_file].attrs.get("error_msg") or "")
+
+        self.write_reports()
+
+        self.last_activity = time.monotonic()
+
+        return changed
+
+    def write_reports(self):
+        """replace the reports"""
+
+        try:
+            if self.output_html:
+                self.suite.to_html(self.output_html, refresh=DEFAULT_REFRESH)
+
+            if self.output_xlsx:
+                # the open report is not overwritten half written
+                output_tmp = self.output_xlsx[:-len(".xlsx")] + ".tmp.xlsx"
+                self.suite.to_excel(output_tmp)
+                os.replace(output_tmp, self.output_xlsx)
+
+        except Exception as e:
+            logging.error("watch report error %s", str(e))
+
+    def ping(self):
+        """keep the idle connection alive"""
+
+        params = self.suite.runner.params
+
+        if not self.keep_alive or not self.suite.runner.connection_name \
+                or get_snapshot_mode(params) == SNAPSHOT_REPLAY:
+            return
+
+        if time.monotonic() - self.last_activity >= self.keep_alive:
+            ping_engine(self.suite.runner.connection_name)
+            self.last_activity = time.monotonic()
+
+    def watch(self):
+        """check the tests until interrupted"""
+
+        logging.info("watch: %s (Ctrl+C to stop)", ", ".join(self.directories))
+
+        try:
+            while True:
+                self.check()
+                self.ping()
+                time.sleep(self.interval)
+
+        except KeyboardInterrupt:
+            logging.info("watch stopped")
+
+
+def main(argv=None):
+    """command line"""
+
+    parser = argparse.ArgumentParser(description="continuous data testing watch mode")
+    parser.add_argument("tests", nargs="+", help="directories, test files")
+    parser.add_argument("-k", dest="keyword", default=None, help="test file substring")
+    parser.add_argument("--connection-name", default=None)
+    parser.add_argument("--metadata", nargs=2, action="append", default=[],
+                        metavar=("KEY", "VALUE"), help="like pytest --metadata")
+    parser.add_argument("--html", default=None, help="html report")
+    parser.add_argument("--xlsx", default=None, help="xlsx report")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL,
+                        help="poll interval [s]")
+    parser.add_argument("--keep-alive", type=float, default=DEFAULT_KEEP_ALIVE,
+                        help="ping of the idle connection [s], 0 off")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level)
+
+    with SnowflakeTestSuite(args.tests, connection_name=args.connection_name,
+                            metadata=dict(args.metadata), keyword=args.keyword) as suite:
+
+        TestWatcher(suite, output_html=args.html, output_xlsx=args.xlsx,
+                    interval=args.interval, keep_alive=args.keep_alive).watch()
+
+
+if __name__ == "__main__":
+    main()
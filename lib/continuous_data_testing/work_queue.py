@@ -0,0 +1,531 @@
+"""Shared work queue (sqlite on the shared storage), coordinator and workers
+
+The coordinator loads the collected tests (after -k, the selection)
+into the queue and runs nothing
+
+    pytest sample_test --metadata work_queue /shared/run.sqlite \\
+        --metadata work_queue_role coordinator --metadata spill_dir /shared/spill
+
+Any number of workers on any number of machines pull the tests one by
+one (the idle worker takes the next test, no static shards). The tests
+are keyed by the path relative to the pytest rootdir, the checkouts of
+the machines can be in different directories. A worker leases only the
+tests it collected, the other tests are left to the other workers.
+
+    pytest sample_test --metadata work_queue /shared/run.sqlite \\
+        --metadata connection_name dev --html=reports/worker1.html
+
+    --metadata worker_id node1           default <host>:<pid>
+    --metadata lease_timeout 600         [s] lease of a test, renewed while it runs
+    --metadata work_queue_wait 60        [s] wait for the coordinator
+
+The tests are queued longest first (median query and fetch time of the
+run history, --metadata run_history_db shared by the workers), the new
+tests first. The DAG of the tests (depends-on) is recorded in the queue:
+a test is leased only when its upstream tests are done and passed, the
+dependents of a failed test are skipped by the queue without the query.
+A test is leased by one worker, the lease is renewed while the test runs.
+The test of a dead worker (lease expired) is taken by another worker, at
+most MAX_ATTEMPTS times. The result of every test is spilled to the
+spill directory (parquet and the report attributes, like the selection
+results). The merge builds one report of the run
+
+    python -m lib.continuous_data_testing.work_queue merge /shared/run.sqlite \\
+        --html reports/run.html --xlsx reports/run.xlsx
+    python -m lib.continuous_data_testing.work_queue status /shared/run.sqlite
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from .arrow_types import get_dtype_backend
+from .dependencies import get_skip_reason
+from .html_report import DEFAULT_MAX_COLS
+from .html_report import DEFAULT_MAX_ROWS
+from .html_report import write_html_report
+from .lazy import lazy_import
+from .selection import load_result
+from .selection import save_result
+from .utils import MATRIX_SEPARATOR
+from .utils import get_df_test_index
+from .utils import split_matrix_test_file
+from .utils import write_test_results_to_excel
+
+# heavy modules are loaded on the first use
+pd = lazy_import("pandas")
+
+ROLE_COORDINATOR = "coordinator"
+ROLE_WORKER = "worker"
+
+STATE_PENDING = "pending"
+STATE_LEASED = "leased"
+STATE_DONE = "done"
+
+DEFAULT_LEASE_TIMEOUT = 600.0
+DEFAULT_WAIT = 60.0
+DEFAULT_SPILL_DIR = "spill"
+
+# leases of one test (dead workers), the test fails after them
+MAX_ATTEMPTS = 3
+
+# [s] polling of the leased tests of the other workers
+POLL_INTERVAL = 1.0
+
+CREATE_TABLES = """
+CREATE TABLE IF NOT EXISTS task (
+    task_key TEXT PRIMARY KEY,
+    test_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result_key TEXT,
+    condition INTEGER,
+    error_msg TEXT,
+    skipped TEXT,
+    started_ts TEXT,
+    finished_ts TEXT
+);
+CREATE TABLE IF NOT EXISTS upstream (
+    task_key TEXT NOT NULL,
+    upstream_key TEXT NOT NULL,
+    PRIMARY KEY (task_key, upstream_key)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def get_worker_id(params: dict):
+    """worker of the leases"""
+
+    return params.get('WORKER_ID') or f"{socket.gethostname()}:{os.getpid()}"
+
+
+def get_task_key(test_file, rootdir):
+    """key of the test in the queue, the path relative to the pytest rootdir
+    (the same on the machines with the checkout in other directories)"""
+
+    config_file, matrix_id = split_matrix_test_file(test_file)
+
+    task_key = os.path.relpath(os.path.normcase(os.path.abspath(config_file)),
+                               os.path.normcase(os.path.abspath(rootdir))).replace(os.sep, "/")
+
+    return task_key + MATRIX_SEPARATOR + matrix_id if matrix_id else task_key
+
+
+def get_queue_order(tests, durations: dict):
+    """tests without the duration (new, the longest may be among them),
+    then the longest first, the idle workers take the short tests at the end;
+    the upstream tests (depends-on) are enforced by the lease"""
+
+    return sorted(tests, key=lambda test: (test[1] in durations, -durations.get(test[1], 0)))
+
+
+class WorkQueue:
+    """tests of the run in the sqlite file, leased by the workers"""
+
+    def __init__(self, db_file, lease_timeout=DEFAULT_LEASE_TIMEOUT):
+
+        self.db_file = db_file
+        self.lease_timeout = float(lease_timeout)
+
+    def connect(self):
+        """connection in the autocommit mode, transactions are explicit"""
+
+        conn = sqlite3.connect(self.db_file, timeout=60, isolation_level=None)
+        conn.executescript(CREATE_TABLES)
+
+        return conn
+
+    def load(self, tests, spill_dir, durations: dict = None, dag: dict = None):
+        """replace the run with the tests [(task_key, test_id)], ordered by
+        the durations {test_id: seconds}, the upstream tests of the DAG
+        {task_key: [upstream task keys]}"""
+
+        db_dir = os.path.dirname(self.db_file)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        os.makedirs(spill_dir, exist_ok=True)
+
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM task")
+            conn.execute("DELETE FROM upstream")
+            conn.execute("DELETE FROM meta")
+            conn.executemany(
+                "INSERT OR IGNORE INTO task (task_key, test_id, position, state)"
+                + " VALUES (?, ?, ?, ?)",
+                [(task_key, test_id, position, STATE_PENDING)
+                 for position, (task_key, test_id)
+                 in enumerate(get_queue_order(tests, durations or {}))])
+            conn.executemany(
+                "INSERT OR IGNORE INTO upstream (task_key, upstream_key) VALUES (?, ?)",
+                [(task_key, upstream_key) for task_key, upstream_list in (dag or {}).items()
+                 for upstream_key in upstream_list])
+            conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                             [("spill_dir", os.path.abspath(spill_dir)),
+                              ("loaded_ts", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))])
+            conn.execute("COMMIT")
+
+        finally:
+            conn.close()
+
+        logging.info("work queue %s: %s tests", self.db_file, str(len(tests)))
+
+    def get_meta(self, key):
+        """value of the run, None if the run is not loaded"""
+
+        conn = self.connect()
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+
+        finally:
+            conn.close()
+
+        return row[0] if row else None
+
+    def wait_loaded(self, timeout=DEFAULT_WAIT):
+        """spill directory of the run, None if the coordinator did not load it"""
+
+        deadline = time.monotonic() + float(timeout)
+
+        while True:
+            spill_dir = self.get_meta("spill_dir")
+
+            if spill_dir or time.monotonic() >= deadline:
+                return spill_dir
+
+            time.sleep(POLL_INTERVAL)
+
+    def lease(self, worker, task_keys=None):
+        """lease the next pending (or expired) test of task_keys (the tests
+        collected by the worker, None: any test)
+
+        Returns:
+            tuple: task key, test id, None if there is no test to lease
+        """
+
+        now = time.time()
+
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+
+            # tests of the dead workers, out of attempts
+            conn.execute(
+                "UPDATE task SET state = ?, condition = 0, error_msg = ?, finished_ts = ?"
+                + " WHERE state = ? AND lease_until < ? AND attempts >= ?",
+                (STATE_DONE, f"lease expired {MAX_ATTEMPTS} times",
+                 datetime.now().strftime("%Y-%m-%d %H:%M:%S"), STATE_LEASED, now, MAX_ATTEMPTS))
+
+            skip_dependents(conn)
+
+            # pending tests with all upstream tests done (and passed, the
+            # dependents of the failed tests are skipped above)
+            row = next((row for row in conn.execute(
+                "SELECT task_key, test_id FROM task"
+                + " WHERE (state = ? AND NOT EXISTS (SELECT 1 FROM upstream"
+                + " JOIN task AS up ON up.task_key = upstream.upstream_key"
+                + " WHERE upstream.task_key = task.task_key AND up.state != ?))"
+                + " OR (state = ? AND lease_until < ?)"
+                + " ORDER BY position", (STATE_PENDING, STATE_DONE, STATE_LEASED, now))
+                        if task_keys is None or row[0] in task_keys), None)
+
+            if row:
+                conn.execute(
+                    "UPDATE task SET state = ?, worker = ?, lease_until = ?,"
+                    + " attempts = attempts + 1, started_ts = ? WHERE task_key = ?",
+                    (STATE_LEASED, worker, now + self.lease_timeout,
+                     datetime.now().strftime("%Y-%m-%d %H:%M:%S"), row[0]))
+
+            conn.execute("COMMIT")
+
+        finally:
+            conn.close()
+
+        return tuple(row) if row else None
+
+    def renew(self, task_key, worker):
+        """extend the lease of the running test, False if it was taken over"""
+
+        conn = self.connect()
+        try:
+            cursor = conn.execute(
+                "UPDATE task SET lease_until = ? WHERE task_key = ? AND worker = ? AND state = ?",
+                (time.time() + self.lease_timeout, task_key, worker, STATE_LEASED))
+
+        finally:
+            conn.close()
+
+        return cursor.rowcount == 1
+
+    def release(self, task_key, worker):
+        """return the leased test not run (the worker stops), the other
+        workers lease it without waiting for the lease timeout"""
+
+        conn = self.connect()
+        try:
+            conn.execute(
+                "UPDATE task SET state = ?, worker = NULL, lease_until = NULL,"
+                + " attempts = attempts - 1 WHERE task_key = ? AND worker = ? AND state = ?",
+                (STATE_PENDING, task_key, worker, STATE_LEASED))
+
+        finally:
+            conn.close()
+
+    def complete(self, task_key, worker, result_key, condition, error_msg=None):
+        """result of the test, the first finished result wins"""
+
+        conn = self.connect()
+        try:
+            conn.execute(
+                "UPDATE task SET state = ?, worker = ?, result_key = ?, condition = ?,"
+                + " error_msg = ?, finished_ts = ? WHERE task_key = ? AND state != ?",
+                (STATE_DONE, worker, result_key, 1 if condition else 0, error_msg,
+                 datetime.now().strftime("%Y-%m-%d %H:%M:%S"), task_key, STATE_DONE))
+
+        finally:
+            conn.close()
+
+    def get_counts(self):
+        """{state: number of tests}"""
+
+        conn = self.connect()
+        try:
+            rows = conn.execute("SELECT state, COUNT(*) FROM task GROUP BY state").fetchall()
+
+        finally:
+            conn.close()
+
+        return dict(rows)
+
+    def is_finished(self, task_keys=None):
+        """no pending and no leased test (of task_keys, None: any test)"""
+
+        if task_keys is None:
+            counts = self.get_counts()
+
+            return not counts.get(STATE_PENDING) and not counts.get(STATE_LEASED)
+
+        conn = self.connect()
+        try:
+            rows = conn.execute("SELECT task_key FROM task WHERE state IN (?, ?)",
+                                (STATE_PENDING, STATE_LEASED))
+
+            return not any(row[0] in task_keys for row in rows)
+
+        finally:
+            conn.close()
+
+    def iter_leases(self, worker, task_keys=None):
+        """lease the tests (of task_keys) until the run is finished, waits for
+        the leased tests of the other workers (taken over if the lease expires)"""
+
+        while True:
+            task = self.lease(worker, task_keys)
+
+            if task:
+                yield task
+                continue
+
+            if self.is_finished(task_keys):
+                return
+
+            time.sleep(POLL_INTERVAL)
+
+    def get_tasks(self):
+        """tests of the run in the manifest order"""
+
+        conn = self.connect()
+        try:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute("SELECT * FROM task ORDER BY position").fetchall()
+
+        finally:
+            conn.close()
+
+        return [dict(row) for row in rows]
+
+
+def skip_dependents(conn):
+    """finish the pending dependents of the failed (or skipped) tests as
+    skipped, the skipped dependents skip their dependents in turn"""
+
+    while True:
+        rows = conn.execute(
+            "SELECT upstream.task_key, upstream.upstream_key FROM upstream"
+            + " JOIN task ON task.task_key = upstream.task_key"
+            + " JOIN task AS up ON up.task_key = upstream.upstream_key"
+            + " WHERE task.state = ? AND up.state = ? AND NOT up.condition",
+            (STATE_PENDING, STATE_DONE)).fetchall()
+
+        if not rows:
+            return
+
+        failed = {}
+
+        for task_key, upstream_key in rows:
+            failed.setdefault(task_key, []).append(upstream_key)
+
+        conn.executemany(
+            "UPDATE task SET state = ?, condition = 0, error_msg = ?, skipped = ?,"
+            + " finished_ts = ? WHERE task_key = ?",
+            [(STATE_DONE, get_skip_reason(upstream_list), get_skip_reason(upstream_list),
+              datetime.now().strftime("%Y-%m-%d %H:%M:%S"), task_key)
+             for task_key, upstream_list in failed.items()])
+
+
+class LeaseKeeper:
+    """renew the lease in the background while the test runs"""
+
+    def __init__(self, work_queue: WorkQueue, task_key, worker):
+
+        self.work_queue = work_queue
+        self.task_key = task_key
+        self.worker = worker
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="cdt-lease", daemon=True)
+
+    def run(self):
+        """renew every third of the lease timeout"""
+
+        while not self.stopped.wait(self.work_queue.lease_timeout / 3):
+            try:
+                if not self.work_queue.renew(self.task_key, self.worker):
+                    logging.error("lease lost %s", self.task_key)
+                    return
+
+            except sqlite3.Error as e:
+                logging.error("lease renew error %s %s", self.task_key, str(e))
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+
+def spill_result(work_queue: WorkQueue, spill_dir, task_key, worker, df):
+    """save the result to the spill directory and finish the test"""
+
+    if not isinstance(df, pd.DataFrame):
+        work_queue.complete(task_key, worker, None, False, "No results in stash")
+        return
+
+    try:
+        result_key = save_result(spill_dir, task_key, df)
+
+    except Exception as e:  # pylint: disable=broad-except
+        logging.error("spill error %s %s", task_key, str(e))
+        work_queue.complete(task_key, worker, None, False, f"spill error: {e}")
+        return
+
+    work_queue.complete(task_key, worker, result_key, bool(df.attrs.get("condition")),
+                        df.attrs.get("error_msg"))
+
+
+def get_merged_results(work_queue: WorkQueue, dtype_backend=None):
+    """results of the run {test id: df} in the manifest order, tests
+    without a result are failed with the reason"""
+
+    spill_dir = work_queue.get_meta("spill_dir")
+
+    results = {}
+
+    for task in work_queue.get_tasks():
+
+        df = None
+
+        if task["result_key"]:
+            df = load_result(spill_dir, task["result_key"], dtype_backend)
+
+        if df is None:
+            df = pd.DataFrame()
+            df.attrs["condition"] = False
+            df.attrs["error_msg"] = task["error_msg"] or {
+                STATE_PENDING: "not run",
+                STATE_LEASED: f"running on {task['worker']}"}.get(task["state"], "no result")
+
+            if task["skipped"]:
+                df.attrs["skipped"] = task["skipped"]
+
+        df.attrs["worker"] = task["worker"]
+
+        results[task["test_id"]] = df
+
+    return results
+
+
+def merge(db_file, output_html=None, output_xlsx=None, params: dict = None):
+    """one report of the run"""
+
+    params = params or {}
+
+    work_queue = WorkQueue(db_file)
+
+    if not work_queue.is_finished():
+        logging.warning("work queue %s not finished: %s", db_file, str(work_queue.get_counts()))
+
+    test_results = get_merged_results(work_queue, get_dtype_backend(params))
+    df_index = get_df_test_index(test_results)
+    df_index["Worker"] = [df.attrs.get("worker") for df in test_results.values()]
+
+    if output_xlsx:
+        write_test_results_to_excel(df_index, test_results, output_xlsx)
+        logging.info("XLSX file: %s", output_xlsx)
+
+    if output_html:
+        write_html_report(output_html, df_index, test_results,
+                          title=f"Test report {os.path.basename(db_file)}",
+                          max_rows=int(params.get('HTML_MAX_ROWS') or DEFAULT_MAX_ROWS),
+                          max_cols=int(params.get('HTML_MAX_COLS') or DEFAULT_MAX_COLS))
+        logging.info("HTML file: %s", output_html)
+
+    return df_index
+
+
+def main(argv=None):
+    """command line"""
+
+    parser = argparse.ArgumentParser(description="continuous data testing work queue")
+    parser.add_argument("command", choices=["merge", "status"])
+    parser.add_argument("work_queue", help="sqlite file of the run")
+    parser.add_argument("--html", default=None)
+    parser.add_argument("--xlsx", default=None)
+    parser.add_argument("--metadata", nargs=2, action="append", default=[],
+                        metavar=("KEY", "VALUE"), help="like pytest --metadata")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level)
+
+    if args.command == "status":
+        print(WorkQueue(args.work_queue).get_counts())
+        return 0
+
+    df_index = merge(args.work_queue, output_html=args.html, output_xlsx=args.xlsx,
+                     params={str(k).upper(): v for k, v in args.metadata})
+
+    print(df_index["Diff result"].value_counts().to_string() if not df_index.empty else "no tests")
+
+    return 0 if not df_index.empty and (df_index["Diff result"] == "Passed").all() else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,5 @@
+/**
+ * sample test reading the shared dataset (sample_test.yml)
+ */
+select count(*) - 1 as diff_count
+from ${shared:DUAL_SNAPSHOT}
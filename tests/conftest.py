@@ -0,0 +1,52 @@
+"""fixtures of the unit tests"""
+
+import pytest
+import sqlalchemy
+
+from lib.continuous_data_testing.coalesce import reset_coalesce
+from lib.continuous_data_testing.concurrency import reset_controllers
+from lib.continuous_data_testing.preflight import reset_preflight
+from lib.continuous_data_testing.shared_datasets import reset_shared_datasets
+from lib.continuous_data_testing.single_flight import reset_single_flight
+from lib.continuous_data_testing.snowflake_test_runner import SnowflakeTestRunner
+from lib.continuous_data_testing.snowflake_test_runner import reset_matrix_batches
+
+# the plugin runs in the pytest sessions of the tests
+pytest_plugins = ["pytester"]
+
+
+@pytest.fixture(name="local_runner")
+def fixture_local_runner(tmp_path):
+    """runner on the local sqlite engine (LAST_QUERY_ID of the snowflake
+    session is a counter)"""
+
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'local.sqlite'}")
+
+    query_ids = iter(range(1, 1000000))
+
+    @sqlalchemy.event.listens_for(engine, "connect")
+    def connect(dbapi_connection, _):
+        dbapi_connection.create_function("LAST_QUERY_ID", 0, lambda: next(query_ids))
+
+    runner = SnowflakeTestRunner(env={})
+    runner.connection_name = "local"
+    runner.engine = engine
+
+    yield runner
+
+    engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+def fixture_reset_registries():
+    """the session registries of the plugin are not shared by the tests"""
+
+    yield
+
+    reset_controllers()
+    reset_single_flight()
+    reset_preflight()
+    reset_coalesce()
+    reset_matrix_batches()
+    reset_shared_datasets()
+
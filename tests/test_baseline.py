@@ -0,0 +1,117 @@
+"""golden baseline: blessed result, hash fast path, key aligned chunk diff"""
+
+import pandas as pd
+import pytest
+
+from lib.continuous_data_testing import baseline
+from lib.continuous_data_testing.baseline import apply_baseline
+from lib.continuous_data_testing.baseline import get_baseline_filename
+from lib.continuous_data_testing.baseline import get_baseline_hashes
+
+BLESS = {"BASELINE_MODE": "bless"}
+
+
+def get_result(tmp_path, rows, key=("id",)):
+    """result of the test with the baseline"""
+
+    df = pd.DataFrame(rows, columns=["id", "amount", "name"])
+    df.attrs = {"config-file": str(tmp_path / "orders.yml"),
+                "data-test": {"baseline": {"key": list(key), "chunk_size": 2}}}
+
+    return df
+
+
+ROWS = [(1, 10.0, "a"), (2, 20.0, "b"), (3, 30.0, "c"), (4, 40.0, "d"), (5, 50.0, "e")]
+
+
+def test_hash_match_does_not_read_the_baseline(tmp_path, monkeypatch):
+    """the same content in another row order, the parquet is not read"""
+
+    apply_baseline(get_result(tmp_path, ROWS), BLESS)
+
+    monkeypatch.setattr(baseline, "read_parquet", pytest.fail)
+
+    df = get_result(tmp_path, ROWS)
+    apply_baseline(df)
+
+    assert df.attrs["baseline"] == "hash match"
+    assert "error_msg" not in df.attrs
+
+
+def test_same_rows_in_other_order(tmp_path):
+    """the rows are aligned by the key, the whole numbers read back from the
+    parquet are the same values"""
+
+    apply_baseline(get_result(tmp_path, ROWS), BLESS)
+
+    df = get_result(tmp_path, list(reversed(ROWS)))
+    apply_baseline(df)
+
+    assert df.attrs["baseline"] == "row match"
+    assert "error_msg" not in df.attrs
+
+
+def test_changed_row_is_found_by_the_key(tmp_path):
+    """the changed value, the added and the missing rows"""
+
+    apply_baseline(get_result(tmp_path, ROWS), BLESS)
+
+    rows = [row for row in ROWS if row[0] != 5] + [(6, 60.0, "f")]
+    rows[1] = (2, 25.0, "b")
+
+    df = get_result(tmp_path, rows)
+    apply_baseline(df)
+
+    assert df.attrs["baseline"] == "diff"
+    assert df.attrs["condition"] is False
+    assert "rows missing: 1" in df.attrs["error_msg"]
+    assert set(df.attrs["diff_col_names_list"]) == {"id", "amount"}
+
+    summary = {row["column name"]: row for row in df.attrs["diff_summary_list"]}
+
+    assert summary["amount (baseline)"]["diff records"] == 1
+    assert summary["amount (baseline)"]["diff max"] == 5.0
+    assert summary["id (baseline)"]["diff records"] == 1
+
+
+def test_only_the_changed_chunks_are_compared(tmp_path, monkeypatch):
+    """the chunks with the same hash are skipped"""
+
+    apply_baseline(get_result(tmp_path, ROWS), BLESS)
+
+    compared = []
+    get_chunk_diff = baseline.get_chunk_diff
+
+    def count_chunk_diff(df_chunk, *args):
+        compared.append(len(df_chunk))
+        return get_chunk_diff(df_chunk, *args)
+
+    monkeypatch.setattr(baseline, "get_chunk_diff", count_chunk_diff)
+
+    rows = list(ROWS)
+    rows[0] = (1, 11.0, "a")
+    apply_baseline(get_result(tmp_path, rows))
+
+    chunk_count = get_baseline_hashes(get_result(tmp_path, ROWS), ["id"], 2)["chunk_count"]
+
+    assert chunk_count == 3
+    assert len(compared) == 1
+
+
+def test_no_baseline(tmp_path):
+    """the test fails until it is blessed"""
+
+    df = get_result(tmp_path, ROWS)
+    apply_baseline(df)
+
+    assert df.attrs["condition"] is False
+    assert df.attrs["error_msg"].startswith("No baseline")
+
+
+def test_baseline_filename_of_the_matrix_combination(tmp_path):
+    """every combination has its baseline"""
+
+    df = get_result(tmp_path, ROWS)
+    df.attrs["matrix_id"] = "region=EU/1"
+
+    assert get_baseline_filename(df) == str(tmp_path / "orders.region=EU_1.baseline")
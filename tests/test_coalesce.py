@@ -0,0 +1,130 @@
+"""coalesced tests keep their columns, a failed request is not repeated"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.continuous_data_testing.coalesce import register_test_files
+
+from .utils import write_test
+
+
+def get_tests(tmp_path):
+    """coalesced tests {test_file: expected columns}"""
+
+    return {
+        write_test(tmp_path, "scalar.yml", "coalesce: true\nsql: select 2 as z_col, 'b' as a_col\n"):
+            ["z_col", "a_col"],
+        write_test(tmp_path, "empty.yml",
+                   "coalesce: true\nsql: select 1 as diff_col, 'x' as b where 1 = 0\n"):
+            ["diff_col", "b"],
+        write_test(tmp_path, "rows.yml",
+                   "coalesce: true\nsql: select 3 as m union all select 4\n"):
+            ["m"],
+    }
+
+
+def count_group_requests(runner):
+    """requests of the coalesced groups"""
+
+    requests = []
+    run_sql = runner.run_sql
+
+    def spy(*args, **kwargs):
+        if (kwargs.get("sql_formatted") or {}).get("coalesce-statements"):
+            requests.append(kwargs["sql_formatted"]["coalesce-statements"])
+        return run_sql(*args, **kwargs)
+
+    runner.run_sql = spy
+
+    return requests
+
+
+def test_columns_are_kept(local_runner, tmp_path):
+    """order of the columns, the columns without rows, one request"""
+
+    tests = get_tests(tmp_path)
+    requests = count_group_requests(local_runner)
+
+    register_test_files(list(tests))
+
+    results = {test_file: local_runner.run_test(test_file) for test_file in tests}
+
+    assert len(requests) == 1
+
+    for test_file, columns in tests.items():
+        df = results[test_file]
+
+        assert not df.attrs.get("error_msg"), df.attrs.get("error_msg")
+        assert list(df.columns) == columns
+        assert df.attrs["coalesced"] == len(tests)
+        assert df.attrs["rowcount"] == len(df)
+
+    assert results[next(iter(tests))].iloc[0].tolist() == [2, "b"]
+
+
+def test_failed_request_is_not_repeated(local_runner, tmp_path):
+    """the tests of the failed group run separately"""
+
+    tests = get_tests(tmp_path)
+    broken = write_test(tmp_path, "broken.yml", "coalesce: true\nsql: select * from missing\n")
+
+    requests = count_group_requests(local_runner)
+
+    register_test_files([broken] + list(tests))
+
+    assert local_runner.run_test(broken).attrs["condition"] is False
+
+    for test_file, columns in tests.items():
+        df = local_runner.run_test(test_file)
+
+        assert not df.attrs.get("error_msg")
+        assert list(df.columns) == columns
+        assert "coalesced" not in df.attrs
+
+    assert len(requests) == 1
+
+
+def test_parallel_tests(local_runner, tmp_path):
+    """every test takes its own result once"""
+
+    tests = {write_test(tmp_path, f"t{i}.yml", f"coalesce: true\nsql: select {i} as v_{i}\n"): i
+             for i in range(20)}
+
+    requests = count_group_requests(local_runner)
+
+    register_test_files(list(tests))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = dict(zip(tests, executor.map(local_runner.run_test, tests)))
+
+    for test_file, i in tests.items():
+        assert results[test_file].columns.tolist() == [f"v_{i}"]
+        assert results[test_file].iloc[0, 0] == i
+
+    # every test is in one request at most
+    statements = [statement for request in requests for statement in request]
+    assert len(statements) == len(set(statements)) <= len(tests)
+
+
+def test_pending_tests_are_loaded_once(local_runner, tmp_path):
+    """every leader looks up the fingerprints, the configs are not loaded again"""
+
+    tests = [write_test(tmp_path, f"s{i}.yml",
+                        f"coalesce: true\nsession:\n    - select {i}\nsql: select {i} as v\n")
+             for i in range(8)]
+
+    loaded = []
+    get_test_config = local_runner.get_test_config
+
+    def spy(test_file):
+        loaded.append(test_file)
+        return get_test_config(test_file)
+
+    local_runner.get_test_config = spy
+
+    register_test_files(tests)
+
+    for test_file in tests:
+        assert local_runner.run_test(test_file).iloc[0, 0] == int(test_file[-5])
+
+    # own config of every test, the fingerprint of every pending test once
+    assert len(loaded) <= 2 * len(tests)
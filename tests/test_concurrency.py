@@ -0,0 +1,129 @@
+"""connection and warehouse errors open the circuit breaker, errors of
+the test sql do not"""
+
+import pytest
+import sqlalchemy
+from snowflake.connector import errors as sf_errors
+
+from lib.continuous_data_testing.concurrency import BREAKER_CLOSED
+from lib.continuous_data_testing.concurrency import BREAKER_OPEN
+from lib.continuous_data_testing.concurrency import CircuitBreaker
+from lib.continuous_data_testing.concurrency import CircuitOpenError
+from lib.continuous_data_testing.concurrency import ConcurrencyController
+from lib.continuous_data_testing.concurrency import is_breaker_error
+
+from .utils import write_test
+
+
+def wrap(orig):
+    """connector error wrapped by sqlalchemy"""
+
+    cls = (sqlalchemy.exc.ProgrammingError if isinstance(orig, sf_errors.ProgrammingError)
+           else sqlalchemy.exc.OperationalError)
+
+    return cls("select 1", {}, orig)
+
+
+CONNECTION_ERRORS = [
+    sf_errors.OperationalError(msg="Failed to connect to DB", errno=250001, sqlstate="08001"),
+    sf_errors.DatabaseError(msg="Authentication token has expired", errno=390114,
+                            sqlstate="08001"),
+    sf_errors.ProgrammingError(msg="No active warehouse selected in the current session",
+                               errno=606, sqlstate="57P03"),
+    sf_errors.OperationalError(msg="Failed to execute request: HTTP 503", errno=250003),
+]
+
+TEST_SQL_ERRORS = [
+    sf_errors.ProgrammingError(
+        msg="Object 'SALES_WAREHOUSE.PUBLIC.ORDERS' does not exist or not authorized.",
+        errno=2003, sqlstate="42S02"),
+    sf_errors.ProgrammingError(msg="SQL compilation error: error line 502 at position 7",
+                               errno=1003, sqlstate="42000"),
+    sf_errors.ProgrammingError(msg="invalid identifier 'CONNECTION_ID'", errno=904,
+                               sqlstate="42000"),
+]
+
+
+@pytest.mark.parametrize("orig", CONNECTION_ERRORS)
+def test_connection_errors(orig):
+    """connector and sqlalchemy wrapped errors"""
+
+    assert is_breaker_error(orig)
+    assert is_breaker_error(wrap(orig))
+
+
+@pytest.mark.parametrize("orig", TEST_SQL_ERRORS)
+def test_test_sql_errors(orig):
+    """the test sql is wrong, the warehouse is fine"""
+
+    assert not is_breaker_error(orig)
+    assert not is_breaker_error(wrap(orig))
+    # the error message is not classified
+    assert not is_breaker_error(str(wrap(orig)))
+
+
+def test_pool_errors():
+    """network errors, the pool checkout timeout is not a backend error"""
+
+    assert not is_breaker_error(sqlalchemy.exc.TimeoutError("QueuePool limit"))
+    assert is_breaker_error(ConnectionResetError())
+    assert is_breaker_error(TimeoutError())
+
+
+class FakeClock:
+    """monotonic clock of the test"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_test_sql_errors_keep_the_limit():
+    """broken tests do not open the breaker nor decrease the limit"""
+
+    controller = ConcurrencyController(initial=4, breaker=CircuitBreaker(threshold=3),
+                                       clock=FakeClock())
+
+    for orig in TEST_SQL_ERRORS * 2:
+        controller.release(controller.acquire(), error=wrap(orig))
+
+    assert controller.breaker.state == BREAKER_CLOSED
+    assert int(controller.limit) >= 4
+
+
+def test_connection_errors_open_the_breaker():
+    """the next queries fail fast, the trial query closes the breaker"""
+
+    clock = FakeClock()
+    controller = ConcurrencyController(initial=4, breaker=CircuitBreaker(
+        threshold=3, reset_timeout=30, clock=clock), clock=clock)
+
+    for orig in CONNECTION_ERRORS[:3]:
+        controller.release(controller.acquire(), error=wrap(orig))
+
+    assert controller.breaker.state == BREAKER_OPEN
+    assert int(controller.limit) < 4
+
+    with pytest.raises(CircuitOpenError):
+        controller.acquire()
+
+    clock.now = 31
+    controller.release(controller.acquire())
+
+    assert controller.breaker.state == BREAKER_CLOSED
+
+
+def test_runner_passes_the_exception(local_runner, tmp_path):
+    """failed test sql of the runner does not open the breaker"""
+
+    for i in range(4):
+        test_file = write_test(tmp_path, f"broken_{i}.yml", f"sql: select * from missing_{i}\n")
+
+        df = local_runner.run_test(test_file)
+
+        assert df.attrs["condition"] is False
+        assert "missing_" in df.attrs["error_msg"]
+
+    assert local_runner.get_controller().breaker.state == BREAKER_CLOSED
@@ -0,0 +1,22 @@
+"""the configuration is validated with the switches of the run"""
+
+from lib.continuous_data_testing.config_model import validate_test_files
+
+from .utils import write_test
+
+
+def test_validation_with_the_run_params(tmp_path):
+    """smoke and DIFF_PROFILE errors are found at the collection of the run"""
+
+    smoke_test = write_test(tmp_path, "smoke.yml", "smoke:\n    limit: many\nsql: select 1")
+    profile_test = write_test(tmp_path, "profile.sql", "select 1 as diff_col")
+
+    assert validate_test_files([smoke_test, profile_test]) == []
+
+    errors = validate_test_files([smoke_test, profile_test], {"SMOKE": "true"})
+
+    assert len(errors) == 1 and "smoke/limit" in errors[0]
+
+    errors = validate_test_files([profile_test], {"DIFF_PROFILE": "sometimes"})
+
+    assert len(errors) == 1 and "diff_by_column_name/profile" in errors[0]
@@ -0,0 +1,96 @@
+"""DAG of the depends-on, cycles, dependents of the failed tests are skipped"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from lib.continuous_data_testing.dependencies import DependencyError
+from lib.continuous_data_testing.dependencies import build_dag
+from lib.continuous_data_testing.dependencies import get_topological_order
+from lib.continuous_data_testing.dependencies import iter_dag_results
+
+from .utils import write_test
+
+
+def write_dag(tmp_path):
+    """keys <- parity <- totals, matrix.yml#region=EU <- regional"""
+
+    keys = write_test(tmp_path, "keys.sql", "select 0 as diff_col")
+    parity = write_test(tmp_path, "parity.yml", "depends-on: keys.sql\nsql: select 0 as diff_col")
+    totals = write_test(tmp_path, "totals.yml",
+                        "depends-on: [parity.yml]\nsql: select 0 as diff_col")
+    write_test(tmp_path, "matrix.yml", "matrix:\n    region: [EU, US]\nsql: select 0 as diff_col")
+    regional = write_test(tmp_path, "regional.yml",
+                          "depends-on: matrix.yml#region=EU\nsql: select 0 as diff_col")
+
+    return {"keys": keys, "parity": parity, "totals": totals, "regional": regional,
+            "eu": f"{tmp_path / 'matrix.yml'}#region=EU",
+            "us": f"{tmp_path / 'matrix.yml'}#region=US"}
+
+
+def test_build_dag(tmp_path):
+    """upstream tests by the relative paths, a matrix id selects one combination,
+    upstream tests not in the run are ignored"""
+
+    tests = write_dag(tmp_path)
+
+    dag = build_dag([tests["totals"], tests["parity"], tests["keys"], tests["eu"], tests["us"],
+                     tests["regional"]])
+
+    assert dag[tests["keys"]] == []
+    assert dag[tests["parity"]] == [tests["keys"]]
+    assert dag[tests["totals"]] == [tests["parity"]]
+    assert dag[tests["regional"]] == [tests["eu"]]
+
+    assert build_dag([tests["parity"]]) == {tests["parity"]: []}
+
+    order = get_topological_order(list(dag), dag)
+
+    assert order.index(tests["keys"]) < order.index(tests["parity"]) < order.index(tests["totals"])
+
+
+def test_cycle(tmp_path):
+    """a cycle is reported with its tests"""
+
+    first = write_test(tmp_path, "first.yml", "depends-on: second.yml\nsql: select 1")
+    second = write_test(tmp_path, "second.yml", "depends-on: first.yml\nsql: select 1")
+    other = write_test(tmp_path, "other.sql", "select 1")
+
+    test_files = [other, first, second]
+
+    with pytest.raises(DependencyError, match="cycle") as e:
+        get_topological_order(test_files, build_dag(test_files))
+
+    assert "first.yml" in str(e.value) and "second.yml" in str(e.value)
+    assert "other.sql" not in str(e.value)
+
+
+def test_iter_dag_results_skips_dependents(tmp_path):
+    """the dependents of a failed test (and theirs) are skipped without the run"""
+
+    tests = write_dag(tmp_path)
+    test_files = [tests["totals"], tests["parity"], tests["keys"], tests["eu"], tests["us"],
+                  tests["regional"]]
+
+    run = []
+
+    def run_test_file(test_file):
+        run.append(test_file)
+        df = pd.DataFrame({"diff_col": [0]})
+        df.attrs["condition"] = test_file != tests["keys"]
+        return df
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = dict(iter_dag_results(executor, test_files, run_test_file))
+
+    assert sorted(run) == sorted([tests["keys"], tests["eu"], tests["us"], tests["regional"]])
+    assert set(results) == set(test_files)
+
+    for skipped in ("parity", "totals"):
+        assert results[tests[skipped]].attrs["skipped"].startswith("skipped: upstream failed")
+        assert not results[tests[skipped]].attrs["condition"]
+
+    assert "keys" in results[tests["parity"]].attrs["skipped"]
+    assert "parity" in results[tests["totals"]].attrs["skipped"]
+    assert results[tests["regional"]].attrs["condition"]
@@ -0,0 +1,166 @@
+"""session of the test is reset when the pooled connection is returned, the
+pool size, the connection warm up"""
+
+import threading
+import time
+
+import pytest
+import sqlalchemy
+
+from lib.continuous_data_testing import engine_pool
+from lib.continuous_data_testing.concurrency import get_concurrency_max
+from lib.continuous_data_testing.engine_pool import SESSION_CHANGES_KEY
+from lib.continuous_data_testing.engine_pool import get_reset_statements
+from lib.continuous_data_testing.engine_pool import reset_session
+from lib.continuous_data_testing.engine_pool import track_session
+
+DEFAULTS = {"ROLE": "TESTER", "WAREHOUSE": "DEFAULT_WH", "DATABASE": "DB", "SCHEMA": "PUBLIC"}
+
+
+@pytest.mark.parametrize("changes, expected", [
+    (["USE WAREHOUSE HEAVY_WH"], ['USE WAREHOUSE "DEFAULT_WH"']),
+    (["use schema other;", "USE ROLE ADMIN"], ['USE ROLE "TESTER"', 'USE SCHEMA "DB"."PUBLIC"']),
+    (["USE other_db.other_schema"], ['USE DATABASE "DB"', 'USE SCHEMA "DB"."PUBLIC"']),
+    (["SET (x, y) = (1,2)", "/* param   */ SET z = 'a=b'"], ["UNSET (x, y, z)"]),
+    (["ALTER SESSION SET QUERY_TAG = 'a=1', TIMEZONE = 'UTC'"],
+     ["ALTER SESSION UNSET QUERY_TAG, TIMEZONE"]),
+    (["CREATE TEMPORARY TABLE t AS SELECT 1"], None),
+    (["USE SECONDARY ROLES ALL"], None),
+])
+def test_reset_statements(changes, expected):
+    """statements restoring the session, None if not restorable"""
+
+    assert get_reset_statements(changes, DEFAULTS) == expected
+
+
+def test_no_default_warehouse():
+    """the warehouse can not be unset"""
+
+    assert get_reset_statements(["USE WAREHOUSE HEAVY_WH"], DEFAULTS | {"WAREHOUSE": None}) is None
+    assert get_reset_statements(["SET x = 1"], None) == ["UNSET (x)"]
+
+
+@pytest.fixture(name="engine")
+def fixture_engine(tmp_path):
+    """pooled engine with the session reset"""
+
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'test.sqlite'}",
+                                      poolclass=sqlalchemy.pool.QueuePool, pool_size=1)
+    sqlalchemy.event.listen(engine, "reset", reset_session)
+
+    yield engine
+
+    engine.dispose()
+
+
+def get_dbapi_connection(conn):
+    """DBAPI connection of the pooled connection"""
+
+    return conn.connection.dbapi_connection
+
+
+def test_untouched_session_is_kept(engine):
+    """no session statements, the next test gets the same session"""
+
+    with engine.connect() as conn:
+        track_session(conn, [])
+        dbapi_connection = get_dbapi_connection(conn)
+
+    with engine.connect() as conn:
+        assert get_dbapi_connection(conn) is dbapi_connection
+
+
+def test_not_restorable_session_reconnects(engine):
+    """the next test gets a new session"""
+
+    with engine.connect() as conn:
+        track_session(conn, ["CREATE TEMPORARY TABLE t AS SELECT 1"])
+        dbapi_connection = get_dbapi_connection(conn)
+
+    with engine.connect() as conn:
+        assert get_dbapi_connection(conn) is not dbapi_connection
+        assert SESSION_CHANGES_KEY not in conn.info
+
+
+@pytest.mark.parametrize("params, pool_size", [({}, 16), ({"CONCURRENCY_MAX": "32"}, 32)])
+def test_pool_holds_concurrency_max(monkeypatch, tmp_path, params, pool_size):
+    """the queries within the concurrency ceiling do not wait for the pool"""
+
+    monkeypatch.setattr(engine_pool, "get_url_from_connection_name",
+                        lambda _: f"sqlite:///{tmp_path / 'test.sqlite'}")
+
+    try:
+        engine = engine_pool.get_engine("pool_test", params)
+
+        assert engine.pool.size() == pool_size
+        assert engine.pool.size() + engine.pool._max_overflow >= get_concurrency_max(params)
+
+    finally:
+        engine_pool.dispose_engines()
+
+
+@pytest.fixture(name="slow_connect")
+def fixture_slow_connect(monkeypatch, tmp_path):
+    """engines of the sqlite file, connect takes 0.2 s, threads of the connects"""
+
+    connect_threads = []
+    create_engine = sqlalchemy.create_engine
+
+    def create_slow_engine(*args, **kwargs):
+        engine = create_engine(*args, **{key: value for key, value in kwargs.items()
+                                         if key != "connect_args"})
+
+        @sqlalchemy.event.listens_for(engine, "connect")
+        def connect(*_):
+            time.sleep(0.2)
+            connect_threads.append(threading.current_thread().name)
+
+        return engine
+
+    monkeypatch.setattr(engine_pool, "get_url_from_connection_name",
+                        lambda _: f"sqlite:///{tmp_path / 'test.sqlite'}")
+    monkeypatch.setattr(engine_pool.sqlalchemy, "create_engine", create_slow_engine)
+
+    yield connect_threads
+
+    engine_pool.dispose_engines()
+
+
+def test_warm_up_in_the_background(slow_connect):
+    """the first test gets the connection authenticated by the warm up"""
+
+    start = time.monotonic()
+    engine_pool.warm_up_engine("warm")
+    engine_pool.warm_up_engine("warm")
+
+    assert time.monotonic() - start < 0.1
+
+    engine = engine_pool.get_engine("warm")
+
+    with engine.connect() as conn:
+        conn.execute(sqlalchemy.text("select 1"))
+
+    assert slow_connect == ["warm-up-warm"]
+    assert engine_pool.ping_engine("warm")
+
+
+def test_warm_up_error_is_not_raised(slow_connect, monkeypatch, caplog):
+    """the first test reports the connection error"""
+
+    monkeypatch.setattr(engine_pool, "get_url_from_connection_name",
+                        lambda _: "sqlite:////not/existing/dir/test.sqlite")
+
+    engine_pool.warm_up_engine("broken")
+    engine = engine_pool.get_engine("broken")
+
+    assert "warm up broken error" in caplog.text
+    assert not slow_connect
+
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        engine.connect()
+
+
+def test_ping_without_engine():
+    """idle ping does not create the engine"""
+
+    assert not engine_pool.ping_engine("not_created")
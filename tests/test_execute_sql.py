@@ -0,0 +1,48 @@
+"""the watchdog covers the session statements, the fetch errors are results"""
+
+import sqlite3
+import time
+
+import sqlalchemy
+
+from lib.continuous_data_testing import snowflake_test_runner
+
+from .utils import write_test
+
+SLOW_SQL = ("WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c"
+            + " WHERE x < 1000000000) SELECT count(*) FROM c")
+
+
+def test_slow_session_statement_is_canceled(local_runner, tmp_path):
+    """the timeout cancels the session statement, not only the test query"""
+
+    test_file = write_test(tmp_path, "slow_session.yml",
+                           f"timeout: 0.2\nsession:\n    - {SLOW_SQL}\nsql: select 1 as diff_col\n")
+
+    start = time.monotonic()
+    df = local_runner.run_test(test_file)
+
+    assert time.monotonic() - start < 10
+    assert df.attrs["timed_out"]
+    assert df.attrs["error_msg"].startswith("Timeout 0.2 s")
+
+
+def test_arrow_fetch_error(local_runner, tmp_path, monkeypatch):
+    """the raw driver error of the arrow fetch is the error of the test"""
+
+    def fetch_arrow_table(_):
+        raise sqlite3.OperationalError("result expired")
+
+    monkeypatch.setattr(snowflake_test_runner, "fetch_arrow_table", fetch_arrow_table)
+    local_runner.params["DTYPE_BACKEND"] = "arrow"
+
+    test_file = write_test(tmp_path, "arrow.sql", "select 1 as diff_col")
+
+    errors = []
+    df = local_runner.execute_sql(sql_formatted={"sql": "select 1 as diff_col",
+                                                 "config-file": test_file}, errors=errors)
+
+    assert "result expired" in df.attrs["error_msg"]
+    assert not df.attrs["condition"]
+    assert isinstance(errors[0], sqlalchemy.exc.OperationalError)
+    assert isinstance(errors[0].orig, sqlite3.OperationalError)
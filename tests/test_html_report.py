@@ -0,0 +1,96 @@
+"""report tables: escaped and bounded html, lazy paginated fragments"""
+
+import decimal
+import gzip
+import json
+
+import pandas as pd
+import pytest
+
+from lib.continuous_data_testing.html_report import NA_REP
+from lib.continuous_data_testing.html_report import df_to_html
+from lib.continuous_data_testing.html_report import format_value
+from lib.continuous_data_testing.html_report import get_lazy_html
+from lib.continuous_data_testing.html_report import write_fragment
+from lib.continuous_data_testing.html_report import write_html_report
+
+
+@pytest.mark.parametrize("value, expected", [
+    (1234567, "1 234 567"), (1234.5, "1 234,50"), (decimal.Decimal("0.125"), "0,12"),
+    (True, "True"), (None, NA_REP), (float("nan"), NA_REP), (pd.NA, NA_REP), ("a", "a"),
+])
+def test_format_value(value, expected):
+    """thousands separator, decimal comma, precision 2"""
+
+    assert format_value(value) == expected
+
+
+def test_df_to_html_is_escaped_and_bounded():
+    """the values and the column names are escaped, the cut table is noted"""
+
+    df = pd.DataFrame({"<b>name</b>": ["<script>x</script>"] * 5, "n": range(5), "m": range(5)})
+
+    html = df_to_html(df, max_rows=2, max_cols=1)
+
+    assert "<script>" not in html and "<b>" not in html
+    assert "&lt;script&gt;x&lt;/script&gt;" in html
+    assert html.count("<tr>") == 3
+    assert "2 of 5 rows, 1 of 3 columns" in html
+
+    assert "rows," not in df_to_html(df)
+
+
+def test_write_fragment(tmp_path):
+    """formatted rows of the lazy table, the same name is the same file"""
+
+    df = pd.DataFrame({"id": range(120), "diff_col": [0.5] * 120})
+
+    fragment_file = write_fragment(str(tmp_path / "extras"), "test::diff", df.head(1))
+
+    # rerun of the test replaces its fragment
+    assert write_fragment(str(tmp_path / "extras"), "test::diff", df,
+                          max_rows=100) == fragment_file
+
+    with gzip.open(tmp_path / "extras" / fragment_file, "rt", encoding="utf-8") as f:
+        fragment = json.load(f)
+
+    assert fragment["columns"] == ["id", "diff_col"]
+    assert len(fragment["rows"]) == 100
+    assert fragment["rows"][0] == ["0", "0,50"]
+    assert fragment["rowcount"] == 120
+
+
+def test_lazy_html_is_escaped():
+    """the fragment url and the title are attribute and text safe"""
+
+    html = get_lazy_html("report_extras/a'b.json.gz", "<Diff rows>", 120, page_size=25)
+
+    assert "data-src='report_extras/a&#x27;b.json.gz'" in html
+    assert "&lt;Diff rows&gt; (120 rows)" in html
+    assert "data-page-size='25'" in html
+
+
+def test_write_html_report(tmp_path):
+    """index and the details of the failed tests, no temporary file is left"""
+
+    df_index = pd.DataFrame({"Test name": ["ok", "failed"], "SQL statement": ["select 1"] * 2})
+
+    df_failed = pd.DataFrame({"diff_col": [0, 3]})
+    df_failed.attrs = {"test_name": "failed", "error_msg": "!!! Values > 0",
+                       "diff_summary_list": [{"column name": "diff_col", "diff records": 1}],
+                       "diff_index_list_sample": [1]}
+
+    df_ok = pd.DataFrame({"diff_col": [0]})
+    df_ok.attrs = {"test_name": "ok"}
+
+    output_html = tmp_path / "report" / "watch.html"
+    write_html_report(str(output_html), df_index, {"ok": df_ok, "failed": df_failed},
+                      refresh=5)
+
+    html = output_html.read_text(encoding="utf-8")
+
+    assert "content='5'" in html
+    assert "SQL statement" not in html
+    assert html.count("<details>") == 1
+    assert "!!! Values &gt; 0" in html
+    assert [path.name for path in output_html.parent.iterdir()] == ["watch.html"]
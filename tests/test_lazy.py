@@ -0,0 +1,85 @@
+"""heavy modules are loaded on the first use, not by the plugin import;
+every check runs in a new interpreter (pytest has loaded the modules)"""
+
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from lib.continuous_data_testing.lazy import lazy_import
+
+from .utils import ROOT_DIR
+
+
+def run_python(script):
+    """output lines of the script in a new interpreter"""
+
+    return subprocess.run([sys.executable, "-c", textwrap.dedent(script)], cwd=ROOT_DIR,
+                          capture_output=True, text=True, check=True).stdout.split()
+
+
+def test_plugin_import_does_not_load_heavy_modules():
+    """conftest, runner and diff import without pandas and sqlalchemy"""
+
+    loaded = run_python("""
+        import sys
+        import lib.continuous_data_testing.conftest
+        import lib.continuous_data_testing.snowflake_test_runner
+        import lib.continuous_data_testing.diff
+        print(*[m for m in ("pandas", "sqlalchemy", "pyarrow", "numpy", "snowflake.connector")
+                if m in sys.modules])
+    """)
+
+    assert loaded == []
+
+
+def test_first_use_imports_the_module():
+    """the module is imported once, also by the parallel first uses"""
+
+    output = run_python("""
+        import sys
+        import threading
+        from lib.continuous_data_testing.lazy import lazy_import
+
+        colorsys = lazy_import("colorsys")
+        print("colorsys" in sys.modules)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(colorsys.rgb_to_hsv))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        print(len(results) == 8 and len(set(map(id, results))) == 1)
+        print(lazy_import("colorsys") is sys.modules["colorsys"])
+    """)
+
+    assert output == ["False", "True", "True"]
+
+
+def test_sub_module_does_not_import_its_parent():
+    """the lazy sub module is found without importing its parent package,
+    both are imported on the first use"""
+
+    output = run_python("""
+        import sys
+        from lib.continuous_data_testing.lazy import lazy_import
+
+        pc = lazy_import("pyarrow.compute")
+        print("pyarrow" in sys.modules, "pyarrow.compute" in sys.modules)
+
+        pc.sum
+        print("pyarrow" in sys.modules, "pyarrow.compute" in sys.modules)
+    """)
+
+    assert output == ["False", "False", "True", "True"]
+
+
+def test_missing_module():
+    """a missing package fails at the lazy import, not at the first use"""
+
+    with pytest.raises(ModuleNotFoundError):
+        lazy_import("not_installed_package.sub")
@@ -0,0 +1,125 @@
+"""batched matrix results are keyed on the batch sql and taken once"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.continuous_data_testing.snowflake_test_runner import reset_matrix_batches
+from lib.continuous_data_testing.utils import get_test_files
+
+from .utils import write_test
+
+MATRIX_YML = """matrix:
+    region: [EU, US, APAC]
+matrix-batch: true
+metadata:
+    region:
+        pattern: "XX"
+        repl: region
+sql: select 'XX' as region, {value} as diff_col
+"""
+
+
+def write_matrix_test(tmp_path, value=0):
+    """combinations of the matrix test"""
+
+    write_test(tmp_path, "matrix.yml", MATRIX_YML.format(value=value))
+
+    return get_test_files(["matrix.yml"], file=str(tmp_path))
+
+
+def count_batches(runner):
+    """batch queries of the runner"""
+
+    batches = []
+    run_sql = runner.run_sql
+
+    def spy(*args, **kwargs):
+        if "UNION ALL" in (kwargs.get("sql_formatted") or {}).get("sql", ""):
+            batches.append(kwargs["sql_formatted"]["sql"])
+        return run_sql(*args, **kwargs)
+
+    runner.run_sql = spy
+
+    return batches
+
+
+def test_one_batch_for_the_combinations(local_runner, tmp_path):
+    """every combination takes its partition of one query"""
+
+    test_files = write_matrix_test(tmp_path)
+    batches = count_batches(local_runner)
+
+    for test_file in test_files:
+        df = local_runner.run_test(test_file)
+
+        assert df.attrs["matrix_batch"] is True
+        assert df["region"].tolist() == [test_file.rsplit("=", 1)[-1]]
+
+    assert len(batches) == 1
+
+
+def test_edited_test_runs_a_new_batch(local_runner, tmp_path):
+    """partitions of the batch before the edit are not taken"""
+
+    test_files = write_matrix_test(tmp_path, value=0)
+    batches = count_batches(local_runner)
+
+    assert local_runner.run_test(test_files[0])["diff_col"].tolist() == [0]
+
+    write_matrix_test(tmp_path, value=1)
+
+    assert local_runner.run_test(test_files[1])["diff_col"].tolist() == [1]
+    assert len(batches) == 2
+
+
+def test_rerun_runs_a_new_batch(local_runner, tmp_path):
+    """the taken combination is not returned empty"""
+
+    test_files = write_matrix_test(tmp_path)
+    batches = count_batches(local_runner)
+
+    local_runner.run_test(test_files[0])
+    df = local_runner.run_test(test_files[0])
+
+    assert not df.attrs.get("error_msg")
+    assert len(df) == 1
+    assert len(batches) == 2
+
+
+def test_reset(local_runner, tmp_path):
+    """new run, the partitions of the previous run are not taken"""
+
+    test_files = write_matrix_test(tmp_path)
+    batches = count_batches(local_runner)
+
+    local_runner.run_test(test_files[0])
+    reset_matrix_batches()
+    local_runner.run_test(test_files[1])
+
+    assert len(batches) == 2
+
+
+def test_parallel_combinations(local_runner, tmp_path):
+    """one batch for the concurrent tests"""
+
+    test_files = write_matrix_test(tmp_path)
+    batches = count_batches(local_runner)
+
+    with ThreadPoolExecutor(max_workers=len(test_files)) as executor:
+        results = list(executor.map(local_runner.run_test, test_files))
+
+    assert [df["region"].tolist() for df in results] == [
+        [test_file.rsplit("=", 1)[-1]] for test_file in test_files]
+    assert len(batches) == 1
+
+
+def test_missing_partition(local_runner, tmp_path):
+    """explicit error, not an empty passing result"""
+
+    test_file = write_matrix_test(tmp_path)[0]
+
+    sql_formatted, sql_template, _ = local_runner.get_test_config(test_file)
+
+    df = local_runner.run_matrix_batch(sql_template, sql_formatted, "region=MARS")
+
+    assert df.attrs["condition"] is False
+    assert "region=MARS" in df.attrs["error_msg"]
@@ -0,0 +1,175 @@
+"""the plugin registers only the tests left after -k, -m and --deselect (coalesce,
+shared datasets, pre-flight)"""
+
+# loaded before the in-process runs, numpy can not be reloaded
+import pandas  # noqa: F401  pylint: disable=unused-import
+import pytest
+
+from lib.continuous_data_testing import conftest as plugin
+
+PLUGIN_CONFTEST = "from lib.continuous_data_testing.conftest import *\n"
+
+RUN_TESTS = """
+import os
+
+import pytest
+
+from lib.continuous_data_testing import coalesce
+from lib.continuous_data_testing.utils import get_test_files
+
+
+@pytest.mark.parametrize("test_file", get_test_files(["*.sql"], file=__file__))
+def test_run_sql(test_file):
+    assert sorted(os.path.basename(test_file) for test_file in coalesce._pending_test_files) \\
+        == ["keep.sql"]
+"""
+
+
+def make_suite(pytester):
+    """two tests, keep.sql is selected by -k"""
+
+    pytester.makeconftest(PLUGIN_CONFTEST)
+    pytester.makepyfile(test_suite=RUN_TESTS)
+    pytester.makefile(".sql", keep="select 0 as diff_col", drop="select 0 as diff_col")
+
+
+def test_coalesce_registers_the_selected_tests(pytester):
+    """a coalesce leader does not wait for the deselected tests"""
+
+    make_suite(pytester)
+
+    result = pytester.runpytest_inprocess("-k", "keep", "-p", "no:cacheprovider")
+
+    result.assert_outcomes(passed=1, deselected=1)
+
+
+SHARED_TESTS = """
+import os
+
+import pytest
+
+from lib.continuous_data_testing import shared_datasets
+from lib.continuous_data_testing.utils import get_test_files
+
+
+@pytest.mark.parametrize("test_file", get_test_files(["*.sql"], file=__file__))
+def test_run_sql(test_file):
+    references = [os.path.basename(config_file)
+                  for references in shared_datasets._shared_refcount.values()
+                  for config_file, _ in references]
+    assert references == ["keep.sql"]
+"""
+
+
+def test_shared_references_of_the_selected_tests(pytester):
+    """the deselected tests do not hold the temporary table"""
+
+    suite = pytester.mkdir("suite")
+    pytester.makeconftest(PLUGIN_CONFTEST)
+    (suite / "suite.yml").write_text("shared-datasets:\n    S: select 1 as id\n")
+    (suite / "test_suite.py").write_text(SHARED_TESTS)
+
+    for name in ("keep", "drop"):
+        (suite / f"{name}.sql").write_text("select count(*) as diff_col from ${shared:S}")
+
+    result = pytester.runpytest_inprocess("suite", "-k", "keep", "-p", "no:cacheprovider")
+
+    result.assert_outcomes(passed=1, deselected=1)
+
+
+class NoRunner:
+    """runner of the pre-flight without the connection"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def test_preflight_of_the_selected_tests(pytester, monkeypatch):
+    """EXPLAIN only of the tests of the run"""
+
+    explained = []
+
+    monkeypatch.setenv("PREFLIGHT", "true")
+    monkeypatch.setattr(plugin, "SnowflakeTestRunner", lambda **_: NoRunner())
+    monkeypatch.setattr(plugin, "run_preflight",
+                        lambda _, test_files: explained.extend(test_files))
+
+    make_suite(pytester)
+    pytester.makepyfile(test_suite="""
+import pytest
+
+from lib.continuous_data_testing.utils import get_test_files
+
+
+@pytest.mark.parametrize("test_file", get_test_files(["*.sql"], file=__file__))
+def test_run_sql(test_file):
+    pass
+""")
+
+    result = pytester.runpytest_inprocess("--deselect", "test_suite.py::test_run_sql[drop.sql]",
+                                          "-p", "no:cacheprovider")
+
+    result.assert_outcomes(passed=1, deselected=1)
+
+    assert [test_file.rsplit("/", 1)[-1] for test_file in explained] == ["keep.sql"]
+
+
+WORKER_TESTS = """
+import pytest
+
+from lib.continuous_data_testing.utils import get_test_files
+
+SETUPS = []
+
+
+@pytest.fixture(scope="module", name="connection")
+def fixture_connection():
+    SETUPS.append(1)
+    yield
+
+
+@pytest.mark.parametrize("test_file", get_test_files(["*.sql"], file=__file__))
+def test_run_sql(test_file, connection):
+    assert len(SETUPS) == 1
+"""
+
+
+def test_worker_keeps_the_module_fixtures(pytester, monkeypatch):
+    """the worker runs the leased test with the next leased test, the module
+    fixture is set up once"""
+
+    monkeypatch.setenv("WORK_QUEUE", str(pytester.path / "run.sqlite"))
+    monkeypatch.setenv("SPILL_DIR", str(pytester.path / "spill"))
+
+    pytester.makeconftest(PLUGIN_CONFTEST)
+    pytester.makepyfile(test_suite=WORKER_TESTS)
+    pytester.makefile(".sql", a="select 0 as diff_col", b="select 0 as diff_col",
+                      c="select 0 as diff_col")
+
+    monkeypatch.setenv("WORK_QUEUE_ROLE", "coordinator")
+    pytester.runpytest_inprocess("-p", "no:cacheprovider").assert_outcomes(deselected=3)
+
+    monkeypatch.delenv("WORK_QUEUE_ROLE")
+    pytester.runpytest_inprocess("-p", "no:cacheprovider").assert_outcomes(passed=3)
+
+
+@pytest.mark.parametrize("args, warmed_up", [([], ["warm"]), (["--collect-only"], []),
+                                              (["--metadata", "preconnect", "false"], [])])
+def test_preconnect(pytester, monkeypatch, args, warmed_up):
+    """the configured connection is warmed up when the tests run"""
+
+    connected = []
+
+    monkeypatch.setenv("CONNECTION_NAME", "warm")
+    monkeypatch.setattr(plugin, "warm_up_engine",
+                        lambda connection_name, _: connected.append(connection_name))
+
+    pytester.makeconftest(PLUGIN_CONFTEST)
+    pytester.makepyfile(test_suite="def test_nothing():\n    pass\n")
+
+    pytester.runpytest_inprocess("-p", "no:cacheprovider", *args)
+
+    assert connected == warmed_up
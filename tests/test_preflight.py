@@ -0,0 +1,66 @@
+"""pre-flight results are taken by every test of the run"""
+
+import os
+
+import pytest
+
+from lib.continuous_data_testing import preflight
+from lib.continuous_data_testing.preflight import PreflightResult
+from lib.continuous_data_testing.preflight import reset_preflight
+from lib.continuous_data_testing.preflight import run_preflight
+from lib.continuous_data_testing.snowflake_test_runner import SnowflakeTestRunner
+from lib.continuous_data_testing.utils import get_test_files
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          "sample_test")
+
+
+@pytest.fixture(name="runner")
+def fixture_runner(monkeypatch):
+    """runner of the sample tests with the pre-flight of every test"""
+
+    monkeypatch.setattr(preflight, "explain_test", lambda runner, test_file: PreflightResult(
+        error=f"pre-flight: {os.path.basename(test_file)}", warehouse="HEAVY_WH"))
+
+    runner = SnowflakeTestRunner(env={"PREFLIGHT": "true"})
+    # EXPLAIN is replaced, the engine is not used
+    runner.engine = object()
+
+    yield runner
+
+    reset_preflight()
+
+
+def get_sample_test_files():
+    """sample tests, the matrix yml expanded"""
+
+    return get_test_files(["*.sql", "*.yml"], file=os.path.join(SAMPLE_DIR, "sample_test.py"))
+
+
+def test_preflight_of_every_test(runner):
+    """matrix combinations and sql tests with the directory default yml"""
+
+    test_files = get_sample_test_files()
+
+    assert len(run_preflight(runner, test_files)) == len(test_files)
+
+    for test_file in test_files:
+        sql_formatted, _, _ = runner.get_test_config(test_file)
+
+        assert sql_formatted["preflight_error"] == f"pre-flight: {os.path.basename(test_file)}"
+        assert sql_formatted["warehouse"] == "HEAVY_WH"
+
+
+@pytest.mark.parametrize("name", ["dual_3.yml#business_date=2024-02-29,region=US", "dual_1.sql"])
+def test_preflight_error_fails_the_test(runner, name):
+    """the test fails without the query"""
+
+    test_file = next(test_file for test_file in get_sample_test_files()
+                     if os.path.basename(test_file) == name)
+
+    run_preflight(runner, [test_file])
+
+    df = runner.run_test(test_file)
+
+    assert df.attrs["condition"] is False
+    assert df.attrs["error_msg"] == f"pre-flight: {name}"
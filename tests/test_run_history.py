@@ -0,0 +1,124 @@
+"""run history: metrics of every run, regressions over the rolling baseline"""
+
+from datetime import timedelta
+
+import pandas as pd
+import pytest
+
+from lib.continuous_data_testing import service
+from lib.continuous_data_testing.run_history import RUN_HISTORY_FILE
+from lib.continuous_data_testing.run_history import get_regressions
+from lib.continuous_data_testing.run_history import get_run_history_db
+from lib.continuous_data_testing.run_history import get_test_durations
+from lib.continuous_data_testing.run_history import save_run
+
+SQL = "select 0 as diff_col"
+
+
+def get_result(query_time, rowcount=100, sql=SQL, **attrs):
+    """result with the metrics of the run"""
+
+    df = pd.DataFrame({"diff_col": [0]})
+    df.attrs = {"sql": sql, "query_time": timedelta(seconds=query_time),
+                "fetch_time": timedelta(seconds=0.5), "rowcount": rowcount,
+                "condition": True} | attrs
+
+    return df
+
+
+def save_runs(db_file, query_times, **kwargs):
+    """runs of the test, run id of the last run"""
+
+    for query_time in query_times:
+        run_id = save_run(db_file, {"test_a": get_result(query_time, **kwargs)})
+
+    return run_id
+
+
+def test_query_time_regression(tmp_path):
+    """the median of the last runs is the baseline"""
+
+    db_file = str(tmp_path / "history" / "run_history.sqlite")
+
+    save_runs(db_file, [10, 11, 100, 9])
+    run_id = save_runs(db_file, [16])
+
+    regressions = get_regressions(db_file, run_id)
+
+    assert [(r["test id"], r["metric"], r["value"], r["baseline"]) for r in regressions] == \
+        [("test_a", "query_time", 16.0, 10.5)]
+    assert regressions[0]["change [%]"] == round(100 * 5.5 / 10.5, 2)
+
+    # the rolling window of the last 2 runs (100, 9)
+    assert get_regressions(db_file, run_id, window=2) == []
+    assert get_regressions(db_file, run_id, threshold=0.6) == []
+
+
+def test_small_changes_are_noise(tmp_path):
+    """+100 % of a short query is not a regression, the rowcount is"""
+
+    db_file = str(tmp_path / "run_history.sqlite")
+
+    save_runs(db_file, [0.2, 0.2])
+    run_id = save_run(db_file, {"test_a": get_result(0.9, rowcount=1000)})
+
+    assert [r["metric"] for r in get_regressions(db_file, run_id)] == ["rowcount"]
+
+
+def test_changed_sql_and_failed_queries_are_not_the_baseline(tmp_path):
+    """the baseline is the same sql, the query errors are skipped"""
+
+    db_file = str(tmp_path / "run_history.sqlite")
+
+    save_runs(db_file, [1, 1], sql="select 1 as diff_col")
+    df_failed = get_result(1, error_msg="timeout")
+    del df_failed.attrs["query_time"]
+    save_run(db_file, {"test_a": df_failed})
+    run_id = save_runs(db_file, [30])
+
+    assert get_regressions(db_file, run_id) == []
+
+    run_id = save_runs(db_file, [60])
+
+    assert [r["baseline"] for r in get_regressions(db_file, run_id)] == [30.0]
+
+
+def test_durations(tmp_path):
+    """median query + fetch time, the tests without the history are missing"""
+
+    db_file = str(tmp_path / "run_history.sqlite")
+
+    assert get_test_durations(db_file, ["test_a"]) == {}
+
+    save_runs(db_file, [1, 3, 2])
+
+    assert get_test_durations(db_file, ["test_a", "test_new"]) == {"test_a": 2.5}
+
+
+@pytest.mark.parametrize("params, expected", [
+    ({}, None),
+    ({"RUN_HISTORY": "false"}, None),
+    ({"RUN_HISTORY": "true"}, "reports/" + RUN_HISTORY_FILE),
+    ({"RUN_HISTORY_DB": "shared.sqlite"}, "shared.sqlite"),
+    ({"RUN_HISTORY": "true", "RUN_HISTORY_DB": "shared.sqlite"}, "shared.sqlite"),
+    ({"RUN_HISTORY": "false", "RUN_HISTORY_DB": "shared.sqlite"}, None),
+])
+def test_run_history_db(params, expected):
+    """off by default, on with run_history or the shared run_history_db"""
+
+    assert get_run_history_db(params, "reports") == expected
+
+
+@pytest.mark.parametrize("metadata, saved", [({}, False), ({"run_history": "true"}, True)])
+def test_service_report_dir(tmp_path, monkeypatch, metadata, saved):
+    """the report directory gets the sqlite file only with the history turned on"""
+
+    monkeypatch.delenv("RUN_HISTORY", raising=False)
+    monkeypatch.delenv("RUN_HISTORY_DB", raising=False)
+
+    test_service = service.TestService(metadata=metadata, report_dir=str(tmp_path))
+
+    artifacts, regressions = test_service.write_report("run_1", {"test_a": get_result(1)})
+
+    assert artifacts == ["run_1/report.xlsx"] and regressions == []
+    assert (tmp_path / RUN_HISTORY_FILE).exists() == saved
@@ -0,0 +1,121 @@
+"""smart selection: failed, changed and git changed tests run, the last
+results of the other tests are reused"""
+
+import subprocess
+
+import pandas as pd
+import pytest
+
+from lib.continuous_data_testing.selection import RunSelection
+from lib.continuous_data_testing.selection import SelectionError
+from lib.continuous_data_testing.selection import get_selection_modes
+
+from .utils import write_test
+
+
+def get_result(condition):
+    """result of the test"""
+
+    df = pd.DataFrame({"diff_col": [0 if condition else 1]})
+    df.attrs = {"condition": condition, "error_msg": None if condition else "!!! Values > 0"}
+
+    return df
+
+
+def run(tmp_path, tests, select, conditions=None, **params):
+    """selection of the run, the selected tests are saved with the results
+
+    Returns:
+        tuple: selected test ids, selection
+    """
+
+    selection = RunSelection({"SELECT": select, "SELECTION_DIR": str(tmp_path / "selection"),
+                              **params}, cwd=str(tmp_path))
+
+    selected, _ = selection.select([(test_id, test_file) for test_id, test_file in tests.items()])
+
+    selection.save({test_id: get_result((conditions or {}).get(test_id, True))
+                    for test_id in selected})
+
+    return selected, selection
+
+
+@pytest.fixture(name="tests")
+def fixture_tests(tmp_path):
+    """passed, failed and parametrized tests"""
+
+    return {"passed": write_test(tmp_path, "passed.sql", "select 0 as diff_col"),
+            "failed": write_test(tmp_path, "failed.sql", "select 1 as diff_col"),
+            "param": write_test(tmp_path, "param.sql", "select ${param:LIMIT} as diff_col")}
+
+
+@pytest.mark.parametrize("select, modes", [
+    ("", {}), ("failed", {"failed": ""}), (" Failed , changed ", {"failed": "", "changed": ""}),
+    ("git:origin/main", {"git": "origin/main"}),
+])
+def test_selection_modes(select, modes):
+    """modes and the git ref"""
+
+    assert get_selection_modes({"SELECT": select}) == modes
+
+
+@pytest.mark.parametrize("select", ["broken", "git", "git:"])
+def test_wrong_selection_mode(select):
+    """unknown mode or git without the ref"""
+
+    with pytest.raises(SelectionError):
+        get_selection_modes({"SELECT": select})
+
+
+def test_failed_tests_are_run(tmp_path, tests):
+    """the first run runs all, the passed tests are reused"""
+
+    selected, _ = run(tmp_path, tests, "failed", {"failed": False})
+
+    assert selected == list(tests)
+
+    selected, selection = run(tmp_path, tests, "failed")
+
+    assert selected == ["failed"]
+    assert sorted(selection.reused) == ["param", "passed"]
+    assert selection.reused["passed"].attrs["reused"]
+    assert selection.reused["passed"].attrs["condition"]
+
+    merged = selection.merge_reused({"failed": get_result(True)})
+
+    assert list(merged) == list(tests)
+
+    # the failed test passed in the last run
+    assert run(tmp_path, tests, "failed")[0] == []
+
+
+def test_changed_tests_are_run(tmp_path, tests):
+    """the changed file and the changed parameter used by the test"""
+
+    run(tmp_path, tests, "changed", LIMIT=10)
+
+    assert run(tmp_path, tests, "changed", LIMIT=10, OTHER=1)[0] == []
+
+    write_test(tmp_path, "passed.sql", "select 0 as diff_col -- changed")
+
+    assert run(tmp_path, tests, "changed", LIMIT=20)[0] == ["passed", "param"]
+
+
+def test_git_changed_tests_are_run(tmp_path, tests):
+    """test files changed since the ref, also not committed and untracked"""
+
+    def git(*args):
+        subprocess.run(["git", *args], cwd=tmp_path, check=True, capture_output=True)
+
+    git("init", "-q")
+    git("add", "passed.sql", "failed.sql", "param.sql")
+    git("-c", "user.name=test", "-c", "user.email=test@test", "commit", "-q", "-m", "tests")
+
+    run(tmp_path, tests, "failed")
+
+    write_test(tmp_path, "passed.sql", "select 0 as diff_col -- changed")
+
+    assert run(tmp_path, tests, "git:HEAD")[0] == ["passed"]
+
+    with pytest.raises(SelectionError, match="not_a_ref"):
+        run(tmp_path, tests, "git:not_a_ref")
@@ -0,0 +1,172 @@
+"""shared datasets in the smoke run, the references are released by every test"""
+
+from types import SimpleNamespace
+
+import sqlalchemy
+
+from lib.continuous_data_testing import shared_datasets
+from lib.continuous_data_testing import snowflake_test_runner
+from lib.continuous_data_testing.config_model import CONFIG_KEY
+from lib.continuous_data_testing.config_model import parse_test_config
+from lib.continuous_data_testing.shared_datasets import materialize_shared_datasets
+from lib.continuous_data_testing.shared_datasets import register_shared_references
+from lib.continuous_data_testing.smoke import get_smoke_sql
+from lib.continuous_data_testing.utils import get_test_files
+
+from .utils import write_test
+
+
+class RecordingConnection:
+    """connection of the statements, no database"""
+
+    def __init__(self):
+        self.info = {}
+        self.statements = []
+
+    def execute(self, statement):
+        self.statements.append(str(statement))
+
+
+def get_sql_formatted(params, smoke=None):
+    """test reading the shared dataset"""
+
+    sql_formatted = {"sql": "select count(*) as diff_col from ${shared:FACT}",
+                     "shared-datasets": {"FACT": "select * from fact_sales;"},
+                     "shared-datasets-used": ["FACT"],
+                     "default-config-file": "tests/tests.yml"}
+
+    if smoke is not None:
+        sql_formatted["smoke"] = smoke
+
+    sql_formatted[CONFIG_KEY] = parse_test_config(sql_formatted, params)
+
+    return sql_formatted
+
+
+def test_shared_dataset_is_sampled_in_the_smoke_run():
+    """the CTAS reads the sampled inputs, recreated for the test without smoke"""
+
+    conn = RecordingConnection()
+    smoke_params = {"SMOKE": "true", "SMOKE_SAMPLE": "10", "SMOKE_LIMIT": "100"}
+
+    materialize_shared_datasets(conn, get_sql_formatted(smoke_params))
+    materialize_shared_datasets(conn, get_sql_formatted(smoke_params))
+
+    assert len(conn.statements) == 1
+    assert "fact_sales SAMPLE (10)" in conn.statements[0]
+    assert conn.statements[0].endswith("LIMIT 100")
+
+    materialize_shared_datasets(conn, get_sql_formatted(smoke_params, smoke=False))
+    materialize_shared_datasets(conn, get_sql_formatted({}))
+
+    assert len(conn.statements) == 2
+    assert conn.statements[1].endswith("AS\nselect * from fact_sales")
+
+
+def test_shared_table_is_not_sampled_again():
+    """the test sql reads the sampled table as it is"""
+
+    sql, _ = get_smoke_sql("select * from CDT_SHARED_FACT_0123ABCD join dim on true",
+                           parse_test_config({}, {"SMOKE": "true", "SMOKE_SAMPLE": "10",
+                                                  "SMOKE_LIMIT": "0"}).smoke)
+
+    assert sql == "select * from CDT_SHARED_FACT_0123ABCD join dim SAMPLE (10) on true"
+
+
+def write_shared_tests(tmp_path, names):
+    """tests of the directory reading its shared dataset"""
+
+    test_dir = tmp_path / "shared"
+    test_dir.mkdir()
+    write_test(test_dir, "shared.yml",
+               "shared-datasets:\n    FACT: select 1 as id\n")
+
+    return [write_test(test_dir, name, "select count(*) as diff_col from ${shared:FACT}")
+            for name in names]
+
+
+def test_failed_test_releases_the_dataset(local_runner, tmp_path):
+    """the CTAS fails on sqlite, the reference is released anyway"""
+
+    test_files = write_shared_tests(tmp_path, ["first.sql"])
+    register_shared_references(test_files)
+
+    df = local_runner.run_test(test_files[0])
+
+    assert df.attrs["error_msg"]
+    assert not shared_datasets._shared_refcount
+    assert len(shared_datasets._unused_tables) == 1
+
+
+def test_single_flight_hit_releases_the_dataset(local_runner, tmp_path):
+    """the test with the result of the single flight is a use and a release"""
+
+    test_files = write_shared_tests(tmp_path, ["first.sql", "second.sql"])
+    register_shared_references(test_files)
+
+    results = [local_runner.run_test(test_file) for test_file in test_files]
+
+    assert results[1].attrs["single_flight"] == test_files[0]
+    assert not shared_datasets._shared_refcount
+
+
+def materialize_sqlite(conn, sql_formatted):
+    """temporary tables on sqlite (no CREATE OR REPLACE)"""
+
+    created = conn.info.setdefault(shared_datasets.CONNECTION_INFO_KEY, {})
+
+    for table_name, sql in shared_datasets.get_shared_datasets(sql_formatted).items():
+        if table_name not in created:
+            conn.execute(sqlalchemy.text(f"CREATE TEMP TABLE {table_name} AS {sql}"))
+            created[table_name] = sql
+
+
+def test_matrix_batch_with_shared_dataset(local_runner, tmp_path, monkeypatch):
+    """the batch reads the temporary table, released for every combination"""
+
+    monkeypatch.setattr(snowflake_test_runner, "materialize_shared_datasets", materialize_sqlite)
+
+    test_dir = tmp_path / "shared"
+    test_dir.mkdir()
+    write_test(test_dir, "shared.yml", "shared-datasets:\n    S: select 1 as id\n")
+    write_test(test_dir, "matrix.yml", "matrix:\n    region: [EU, US]\nmatrix-batch: true\n"
+               + "sql: select 'XX' as region, id - 1 as diff_col from ${shared:S}\n")
+
+    test_files = get_test_files(["matrix.yml"], file=str(test_dir))
+    register_shared_references(test_files)
+
+    batches = []
+    run_sql = local_runner.run_sql
+
+    def spy(*args, **kwargs):
+        batches.append(kwargs["sql_formatted"]["sql"])
+        return run_sql(*args, **kwargs)
+
+    local_runner.run_sql = spy
+
+    results = [local_runner.run_test(test_file) for test_file in test_files]
+
+    assert len(batches) == 1
+    assert "${shared:" not in batches[0] and "CDT_SHARED_S_" in batches[0]
+
+    for df in results:
+        assert not df.attrs.get("error_msg"), df.attrs.get("error_msg")
+        assert df["diff_col"].tolist() == [0]
+
+    assert not shared_datasets._shared_refcount
+
+
+def test_preflight_error_releases_the_dataset(local_runner, tmp_path, monkeypatch):
+    """the test failed by the pre-flight is done"""
+
+    monkeypatch.setattr(snowflake_test_runner, "get_preflight_result",
+                        lambda _: SimpleNamespace(error="compile error", bytes_assigned=None,
+                                                  partitions_assigned=None, warehouse=None))
+
+    test_files = write_shared_tests(tmp_path, ["first.sql"])
+    register_shared_references(test_files)
+
+    df = local_runner.run_test(test_files[0])
+
+    assert df.attrs["error_msg"] == "compile error"
+    assert not shared_datasets._shared_refcount
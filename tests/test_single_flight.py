@@ -0,0 +1,59 @@
+"""tests sharing a query keep their own diff, the kept results are capped"""
+
+from lib.continuous_data_testing import single_flight
+from lib.continuous_data_testing.diff import apply_diff_by_column_name
+
+from .utils import write_test
+
+DIFF_YML = """data-test:
+    diff_by_column_name:
+        limit: {limit}
+sql: select 5 as diff_col
+"""
+
+
+def test_independent_diff_results(local_runner, tmp_path):
+    """one query, the strict test fails, the tolerant test passes"""
+
+    strict = write_test(tmp_path, "strict.yml", DIFF_YML.format(limit=0))
+    tolerant = write_test(tmp_path, "tolerant.yml", DIFF_YML.format(limit=10))
+
+    results = {test_file: local_runner.run_test(test_file) for test_file in (strict, tolerant)}
+
+    for df in results.values():
+        apply_diff_by_column_name(df)
+
+    assert results[tolerant].attrs["single_flight"] == strict
+    assert "single_flight" not in results[strict].attrs
+
+    assert not results[strict].attrs["condition"]
+    assert results[strict].attrs["diff_col_names_list"] == ["diff_col"]
+
+    assert results[tolerant].attrs["condition"]
+    assert results[tolerant].attrs["diff_col_names_list"] == []
+    assert results[tolerant].attrs["config-file"] == tolerant
+
+
+def test_kept_results_are_capped(local_runner, tmp_path):
+    """the least recently used result is evicted, 0 keeps no result"""
+
+    local_runner.params["SINGLE_FLIGHT_MAX_RESULTS"] = "2"
+
+    test_files = [write_test(tmp_path, f"q{i}.sql", f"select {i} as diff_col") for i in range(3)]
+
+    for test_file in test_files[:2]:
+        local_runner.run_test(test_file)
+
+    # q0 used again, q1 is evicted by q2
+    assert local_runner.run_test(test_files[0]).attrs["single_flight"] == test_files[0]
+    local_runner.run_test(test_files[2])
+
+    assert [flight.test_file for flight in single_flight._flights.values()] == [test_files[0],
+                                                                               test_files[2]]
+
+    single_flight.reset_single_flight()
+    local_runner.params["SINGLE_FLIGHT_MAX_RESULTS"] = "0"
+
+    local_runner.run_test(test_files[0])
+
+    assert not single_flight._flights
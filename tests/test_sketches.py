@@ -0,0 +1,110 @@
+"""error bounds of the sketches against the exact quantiles and counts"""
+
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib.continuous_data_testing.sketches import DEFAULT_RELATIVE_ACCURACY
+from lib.continuous_data_testing.sketches import ColumnProfile
+from lib.continuous_data_testing.sketches import QuantileSketch
+from lib.continuous_data_testing.sketches import TopKSketch
+from lib.continuous_data_testing.sketches import profile_column
+
+QUANTILES = (0.0, 0.01, 0.25, 0.5, 0.75, 0.9, 0.99, 1.0)
+
+
+def get_exact_quantile(values, q):
+    """value of the rank q * (n - 1) like the sketch"""
+
+    values = np.sort(values)
+
+    return values[int(math.floor(q * (len(values) - 1)))]
+
+
+@pytest.mark.parametrize("chunk_rows", [100_000, 997])
+def test_quantiles_within_relative_accuracy(chunk_rows):
+    """every quantile is within the relative accuracy of the exact value,
+    also profiled in chunks"""
+
+    rng = np.random.default_rng(7)
+    values = np.concatenate([rng.lognormal(0, 2, 20_000), -rng.lognormal(3, 1, 5_000),
+                             np.zeros(500)])
+    rng.shuffle(values)
+
+    profile = profile_column(pd.Series(values), chunk_rows=chunk_rows)
+
+    # the zeros are not differences
+    differences = values[values != 0]
+
+    for q in QUANTILES:
+        exact = get_exact_quantile(differences, q)
+        estimate = profile.quantiles.quantile(q)
+
+        assert abs(estimate - exact) <= DEFAULT_RELATIVE_ACCURACY * abs(exact) + 1e-12, q
+
+    assert profile.quantiles.min == differences.min()
+    assert profile.quantiles.max == differences.max()
+    assert profile.quantiles.count == profile.diffs == len(differences)
+
+
+def test_quantile_sketch_has_fixed_size():
+    """the lowest buckets are collapsed, the high quantiles keep the accuracy"""
+
+    values = np.geomspace(1e-12, 1e12, 100_000)
+
+    sketch = QuantileSketch(max_bins=64)
+    sketch.update(values)
+
+    assert len(sketch.positive) <= 64
+
+    for q in (0.99, 0.999):
+        exact = get_exact_quantile(values, q)
+        assert abs(sketch.quantile(q) - exact) <= DEFAULT_RELATIVE_ACCURACY * exact
+
+
+@pytest.mark.parametrize("chunk_rows", [100_000, 1_000, 37])
+def test_heavy_hitters_within_error_bound(chunk_rows):
+    """counts are lower bounds within rows / (capacity + 1), the values
+    more frequent than the bound are kept"""
+
+    rng = np.random.default_rng(11)
+    values = pd.Series(rng.zipf(1.3, 50_000) % 1_000)
+
+    sketch = TopKSketch(capacity=16)
+
+    for start in range(0, len(values), chunk_rows):
+        sketch.update(values.iloc[start:start + chunk_rows])
+
+    bound = len(values) / (sketch.capacity + 1)
+    exact = values.value_counts()
+
+    assert len(sketch.counters) <= sketch.capacity
+
+    for value, count in exact.items():
+        estimate = sketch.counters.get(int(value), 0)
+
+        assert estimate <= count
+        assert count - estimate <= bound
+
+        if count > bound:
+            assert int(value) in sketch.counters
+
+    assert [value for value, _ in sketch.top(3)] == exact.index[:3].tolist()
+
+
+def test_profile_to_dict():
+    """the serialized profile gives the same summary"""
+
+    values = pd.Series([0.0, 1.5, None, -2.0, 1.5, 0.0, 3.0])
+
+    profile = profile_column(values)
+    summary = profile.get_summary("diff_col")
+
+    assert summary["rows"] == 7
+    assert summary["diff records"] == 4
+    assert summary["null [%]"] == round(100 / 7, 2)
+    assert summary["top values"].startswith("1.5 (2)")
+
+    assert ColumnProfile.from_dict(profile.to_dict()).get_summary("diff_col") == summary
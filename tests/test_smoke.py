@@ -0,0 +1,72 @@
+"""tables sampled by the smoke run, the row cap wrapper"""
+
+import pytest
+
+from lib.continuous_data_testing.smoke import get_sampled_tables
+from lib.continuous_data_testing.smoke import limit_sql
+from lib.continuous_data_testing.smoke import sample_sql
+
+
+@pytest.mark.parametrize("sql, tables", [
+    # CTE names are not sampled, their tables are
+    ("with c as (select * from a) select * from c join b on c.id = b.id", ["a", "b"]),
+    ("with recursive r(n) as (select 1 union all select n + 1 from r) select * from r", []),
+    ("with c1 as (select 1), c2 as (select * from t) select * from c1, c2", ["t"]),
+    # FROM not followed by a table
+    ("select * from a where x is distinct from y", ["a"]),
+    ("select extract(year from d) from t", ["t"]),
+    ("select trim(both ' ' from s), substring(s from 2) from t", ["t"]),
+    # comma joins, the subquery ends the list
+    ("select * from a, b x, (select 1) s", ["a", "b"]),
+    ("select * from a inner join b using (id) left join c on true", ["a", "b", "c"]),
+    # quoted and dotted names
+    ('select * from "My Db"."Sch".TAB t where 1 = 1', ['"My Db"."Sch".TAB']),
+    ("select * from db . sch . tab", ["db . sch . tab"]),
+    # literals and comments are not changed
+    ("select 'from x' as c, /* from y */ 1 -- from z\nfrom t", ["t"]),
+    ("select 'it''s from x' from t // from u", ["t"]),
+    # table functions, DUAL, the shared datasets
+    ("select * from table(flatten(x)) f, dual", []),
+    ("select * from CDT_SHARED_S_ABCD1234 s join t on 1 = 1", ["t"]),
+])
+def test_sampled_tables(sql, tables):
+    """tables after FROM / JOIN"""
+
+    assert [table for _, table in get_sampled_tables(sql)] == tables
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("select * from a x where 1 = 1", "select * from a x SAMPLE (10) SEED (1) where 1 = 1"),
+    ("select * from a, b", "select * from a SAMPLE (10) SEED (1), b SAMPLE (10) SEED (1)"),
+    ("select * from a as x join b on x.id = b.id",
+     "select * from a as x SAMPLE (10) SEED (1) join b SAMPLE (10) SEED (1) on x.id = b.id"),
+])
+def test_sample_sql(sql, expected):
+    """SAMPLE after the table and the alias"""
+
+    assert sample_sql(sql, 10, seed=1) == expected
+
+
+def test_selected_tables():
+    """only the selected tables, matched by the last part of the name"""
+
+    sql = "select * from db.sch.fact f join dim d on f.id = d.id join other o on true"
+
+    assert [table for _, table in get_sampled_tables(sql, ["FACT", "db . sch . other"])] == \
+        ["db.sch.fact", "other"]
+    assert [table for _, table in get_sampled_tables(sql, ["missing"])] == []
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("select 1", "select 1"),
+    ("select 1;;\n", "select 1"),
+    ("select 1 -- done", "select 1"),
+    ("select 1; -- done\n", "select 1"),
+    ("select 1 /* done; */ ;", "select 1"),
+    ("select ';' as c;", "select ';' as c"),
+    ("select 1 -- a;\n -- b", "select 1"),
+])
+def test_limit_sql(sql, expected):
+    """the trailing semicolons and comments are not inside the wrapper"""
+
+    assert limit_sql(sql, 5) == f"SELECT * FROM (\n{expected}\n) LIMIT 5"
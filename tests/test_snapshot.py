@@ -0,0 +1,72 @@
+"""recorded results are replayed without the connection, keyed by the sql
+and the session statements"""
+
+import pandas as pd
+
+from lib.continuous_data_testing.snapshot import get_snapshot_key
+from lib.continuous_data_testing.snowflake_test_runner import SnowflakeTestRunner
+
+from .utils import write_test
+
+
+def get_replay_runner(snapshot_dir, **params):
+    """runner of the replay, no connection"""
+
+    return SnowflakeTestRunner(env={"SNAPSHOT_MODE": "replay", "SNAPSHOT_DIR": str(snapshot_dir),
+                                    **params})
+
+
+def test_record_and_replay(local_runner, tmp_path):
+    """the replay returns the recorded result and its query id"""
+
+    snapshot_dir = tmp_path / "snapshots"
+    test_file = write_test(tmp_path, "keys.yml", "session:\n    - select 1\n"
+                           + "sql: select 0 as diff_col, 'a' as name union all select 2, 'b'\n")
+
+    local_runner.params.update({"SNAPSHOT_MODE": "record", "SNAPSHOT_DIR": str(snapshot_dir)})
+    recorded = local_runner.run_test(test_file)
+
+    assert len(list(snapshot_dir.glob("*.parquet"))) == 1
+
+    replay_runner = get_replay_runner(snapshot_dir)
+
+    assert replay_runner.engine is None
+
+    replayed = replay_runner.run_test(test_file)
+
+    pd.testing.assert_frame_equal(replayed.reset_index(drop=True),
+                                  recorded.reset_index(drop=True), check_dtype=False)
+    assert replayed.attrs["query_id"] == recorded.attrs["query_id"]
+    assert replayed.attrs["snapshot_recorded"]
+
+
+def test_snapshot_key_depends_on_the_session():
+    """other session statements, other result"""
+
+    assert get_snapshot_key("select 1", ["use schema a"]) != \
+        get_snapshot_key("select 1", ["use schema b"])
+    assert get_snapshot_key("select 1", []) == get_snapshot_key("select 1", None)
+
+
+def test_replay_without_snapshot(tmp_path):
+    """the test fails without the snapshot"""
+
+    test_file = write_test(tmp_path, "missing.sql", "select 0 as diff_col")
+
+    df = get_replay_runner(tmp_path / "snapshots").run_test(test_file)
+
+    assert df.attrs["error_msg"].startswith("No snapshot")
+    assert not df.attrs["condition"]
+
+
+def test_replay_engine(tmp_path):
+    """the local engine runs the sql without the snapshot"""
+
+    test_file = write_test(tmp_path, "missing.sql", "select 0 as diff_col")
+
+    df = get_replay_runner(tmp_path / "snapshots",
+                           REPLAY_ENGINE_URL=f"sqlite:///{tmp_path / 'local.sqlite'}"
+                           ).run_test(test_file)
+
+    assert df["diff_col"].tolist() == [0]
+    assert "error_msg" not in df.attrs
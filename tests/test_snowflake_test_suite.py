@@ -0,0 +1,84 @@
+"""suite reruns: the failed tests, the changed and new tests, removed tests"""
+
+import os
+
+import pytest
+
+from lib.continuous_data_testing.snowflake_test_suite import SnowflakeTestSuite
+
+from .utils import write_test
+
+
+@pytest.fixture(name="suite")
+def fixture_suite(local_runner, tmp_path):
+    """suite of the test directory on the local engine"""
+
+    test_dir = tmp_path / "tests"
+    test_dir.mkdir()
+
+    write_test(test_dir, "passed.sql", "select 0 as diff_col")
+    write_test(test_dir, "failed.yml", "sql: select * from missing\n")
+
+    suite = SnowflakeTestSuite(str(test_dir), env={})
+    suite.runner = local_runner
+
+    return suite
+
+
+def get_names(test_files):
+    """file names of the test files"""
+
+    return sorted(os.path.basename(test_file) for test_file in test_files)
+
+
+def get_run(suite, run):
+    """names of the tests run by the suite method"""
+
+    results = dict(suite.results)
+
+    run()
+
+    return get_names(test_file for test_file, df in suite.results.items()
+                     if results.get(test_file) is not df)
+
+
+def test_rerun_failed(suite):
+    """only the failed tests run again, the passed results are kept"""
+
+    assert get_run(suite, suite.run) == ["failed.yml", "passed.sql"]
+    assert get_names(suite.get_failed()) == ["failed.yml"]
+
+    passed = suite["passed"]
+
+    assert get_run(suite, suite.rerun_failed) == ["failed.yml"]
+    assert suite["passed"] is passed
+    assert len(suite.get_index()) == 2
+
+
+def test_rerun_changed(suite, tmp_path):
+    """changed and new tests run again, not the unchanged ones"""
+
+    suite.run()
+
+    assert get_run(suite, suite.rerun_changed) == []
+
+    write_test(tmp_path / "tests", "failed.yml", "sql: select 0 as diff_col\n")
+    write_test(tmp_path / "tests", "new.sql", "select 0 as diff_col")
+
+    assert get_run(suite, suite.rerun_changed) == ["failed.yml", "new.sql"]
+    assert suite.get_failed() == []
+    assert get_run(suite, suite.rerun_changed) == []
+
+
+def test_discard_removed(suite, tmp_path):
+    """results of the removed tests are forgotten, also not rerun as changed"""
+
+    suite.run()
+
+    (tmp_path / "tests" / "failed.yml").unlink()
+
+    assert get_names(suite.discard_removed()) == ["failed.yml"]
+    assert get_names(suite.results) == ["passed.sql"]
+    assert list(suite.get_index()["Test file"]) == suite.get_test_files()
+    assert get_run(suite, suite.rerun_changed) == []
+    assert suite.discard_removed() == []
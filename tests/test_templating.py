@@ -0,0 +1,70 @@
+"""precompiled templates: one pass over the original text, cached by the content"""
+
+import pytest
+
+from lib.continuous_data_testing.templating import compile_template
+from lib.continuous_data_testing.templating import render_template
+
+METADATA = {"business_date": {"pattern": "1900-01-01", "repl": "business_date"},
+            "region": {"pattern": r"'[A-Z]{2}'", "repl": "region"}}
+
+
+@pytest.mark.parametrize("text, params, expected", [
+    ("select '1900-01-01', 'XX'", {"BUSINESS_DATE": "2024-05-31", "REGION": "'EU'"},
+     "select '2024-05-31', 'EU'"),
+    # a pattern without the value is kept
+    ("select '1900-01-01', 'XX'", {"REGION": "'EU'"}, "select '1900-01-01', 'EU'"),
+    # the value is not matched by the next pattern
+    ("select '1900-01-01'", {"BUSINESS_DATE": "'US'", "REGION": "'EU'"}, "select ''US''"),
+    # the values are inserted literally, the braces of the sql are kept
+    ("select {fn now()}, '1900-01-01'", {"BUSINESS_DATE": r"\1 {x}"},
+     r"select {fn now()}, '\1 {x}'"),
+])
+def test_metadata_patterns(text, params, expected):
+    """regex pattern -> parameter of the yml metadata"""
+
+    assert render_template(text, params, METADATA) == expected
+
+
+@pytest.mark.parametrize("text, params, expected", [
+    ("select * from ${self:basename}_v", {}, "select * from orders_v"),
+    ("select ${param:LIMIT}, ${param:limit}", {"LIMIT": 10}, "select 10, 10"),
+    ("select ${param:MISSING}, ${self:other}", {}, "select ${param:MISSING}, ${self:other}"),
+    ("select ${shared:S}", {"S": "x"}, "select ${shared:S}"),
+])
+def test_placeholders(text, params, expected):
+    """${self:basename} and ${param:NAME}, the shared datasets are left"""
+
+    assert render_template(text, params, basename="orders") == expected
+
+
+def test_placeholder_is_matched_before_the_pattern():
+    """the leftmost match wins, the placeholder before the metadata"""
+
+    metadata = {"param": {"pattern": r"\$\{param", "repl": "other"}}
+
+    assert render_template("select ${param:A}", {"A": "1", "OTHER": "x"}, metadata) == \
+        "select 1"
+
+
+def test_template_is_compiled_once():
+    """the matrix combinations and the reruns only render"""
+
+    compile_template.cache_clear()
+
+    for region in ("'EU'", "'US'", "'EU'"):
+        render_template("select '1900-01-01', 'XX'", {"REGION": region}, METADATA)
+
+    info = compile_template.cache_info()
+
+    assert (info.misses, info.hits) == (1, 2)
+
+
+def test_text_without_templates():
+    """no metadata and no placeholder, the text is returned"""
+
+    compile_template.cache_clear()
+
+    assert render_template("select 1", {"A": 1}) == "select 1"
+    assert render_template("", {"A": 1}) == ""
+    assert compile_template.cache_info().misses == 0
@@ -0,0 +1,76 @@
+"""the cancel does not use the pool, a statement finishing on the timeout is kept"""
+
+import sqlite3
+import threading
+import time
+
+import sqlalchemy
+
+from lib.continuous_data_testing import timeout
+from lib.continuous_data_testing.timeout import QueryWatchdog
+from lib.continuous_data_testing.timeout import cancel_session_queries
+
+
+def test_cancel_with_exhausted_pool(monkeypatch, tmp_path):
+    """the running tests hold all pooled connections, the cancel connects"""
+
+    canceled = []
+
+    def connect():
+        dbapi_connection = sqlite3.connect(str(tmp_path / "test.sqlite"),
+                                           check_same_thread=False)
+        dbapi_connection.create_function(
+            "SYSTEM$CANCEL_ALL_QUERIES", 1, lambda session_id: canceled.append(session_id) or 1)
+        return dbapi_connection
+
+    engine = sqlalchemy.create_engine("sqlite://", creator=connect,
+                                      poolclass=sqlalchemy.pool.QueuePool,
+                                      pool_size=1, max_overflow=0, pool_timeout=0.1)
+    monkeypatch.setattr(timeout, "get_session_id", lambda _: 42)
+
+    try:
+        with engine.connect() as conn:
+            cancel_session_queries(engine, conn)
+
+            assert canceled == [42]
+            assert engine.pool.checkedout() == 1
+
+    finally:
+        engine.dispose()
+
+
+def test_statement_finishing_on_timeout():
+    """the cancel runs under the lock, the finished statement is not a timeout"""
+
+    cancel_started = threading.Event()
+    watchdog = QueryWatchdog(None, None, 0.01)
+
+    def cancel():
+        cancel_started.set()
+        time.sleep(0.1)
+
+    watchdog.cancel = cancel
+
+    with watchdog:
+        # the statement finishes when the timer fires
+        assert cancel_started.wait(5)
+
+    assert not watchdog.timed_out
+    assert not watchdog._timer.is_alive()
+
+
+def test_statement_canceled_on_timeout():
+    """the canceled statement raises, the watchdog is timed out"""
+
+    watchdog = QueryWatchdog(None, None, 0.01)
+    watchdog.cancel = lambda: None
+
+    try:
+        with watchdog:
+            time.sleep(0.1)
+            raise sqlalchemy.exc.OperationalError("select 1", {}, Exception("canceled"))
+
+    except sqlalchemy.exc.OperationalError:
+        pass
+
+    assert watchdog.timed_out
@@ -0,0 +1,109 @@
+"""watch mode: the changed test tree runs the changed and new tests"""
+
+import os
+
+import pytest
+
+from lib.continuous_data_testing import watch
+from lib.continuous_data_testing.snowflake_test_suite import SnowflakeTestSuite
+from lib.continuous_data_testing.watch import get_tree_signature
+
+from .utils import write_test
+
+
+def touch(test_file, mtime_ns):
+    """modification time of the test file (the same content or within the clock resolution)"""
+
+    os.utime(test_file, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture(name="test_dir")
+def fixture_test_dir(tmp_path):
+    """test directory with a passed test"""
+
+    test_dir = tmp_path / "tests"
+    test_dir.mkdir()
+
+    touch(write_test(test_dir, "passed.sql", "select 0 as diff_col"), 10 ** 18)
+
+    return test_dir
+
+
+@pytest.fixture(name="watcher")
+def fixture_watcher(local_runner, test_dir):
+    """watcher of the test directory on the local engine, without the reports"""
+
+    suite = SnowflakeTestSuite(str(test_dir), env={})
+    suite.runner = local_runner
+
+    return watch.TestWatcher(suite, keep_alive=0)
+
+
+def get_names(test_files):
+    """file names of the test files"""
+
+    return sorted(os.path.basename(test_file) for test_file in test_files)
+
+
+def test_tree_signature(test_dir, tmp_path):
+    """the signature changes with the test files, not with the other files"""
+
+    directories = [str(test_dir)]
+    signature = get_tree_signature(directories)
+
+    assert get_tree_signature(directories) == signature
+
+    (test_dir / "notes.txt").write_text("not a test", encoding="utf-8")
+    assert get_tree_signature(directories) == signature
+
+    touch(test_dir / "passed.sql", 10 ** 18 + 1)
+    assert get_tree_signature(directories) != signature
+
+    signature = get_tree_signature(directories)
+    write_test(test_dir, "new.yml", "sql: select 0 as diff_col\n")
+    assert get_tree_signature(directories) != signature
+
+    # a missing directory is watched till it is created
+    missing = str(tmp_path / "missing")
+    assert get_tree_signature([missing]) == ((missing, None),)
+
+
+def test_check_runs_the_changed_tests(watcher, test_dir):
+    """the first check runs all tests, then only the changed and new ones"""
+
+    assert get_names(watcher.check()) == ["passed.sql"]
+    assert watcher.check() == []
+
+    passed = watcher.suite["passed"]
+
+    failed = write_test(test_dir, "failed.yml", "sql: select * from missing\n")
+    touch(failed, 10 ** 18)
+
+    assert get_names(watcher.check()) == ["failed.yml"]
+    assert watcher.suite["passed"] is passed
+    assert get_names(watcher.suite.get_failed()) == ["failed.yml"]
+
+    # the same content with a new modification time does not run the test
+    touch(test_dir / "passed.sql", 10 ** 18 + 1)
+    assert watcher.check() == []
+
+    write_test(test_dir, "failed.yml", "sql: select 0 as diff_col\n")
+    touch(failed, 10 ** 18 + 1)
+
+    assert get_names(watcher.check()) == ["failed.yml"]
+    assert watcher.suite.get_failed() == []
+
+
+def test_check_removed_tests(watcher, test_dir, tmp_path):
+    """a removed test is dropped from the results and the reports"""
+
+    watcher.output_html = str(tmp_path / "watch.html")
+
+    write_test(test_dir, "other.sql", "select 0 as diff_col")
+    watcher.check()
+
+    os.remove(test_dir / "other.sql")
+
+    assert watcher.check() == []
+    assert get_names(watcher.suite.results) == ["passed.sql"]
+    assert "other" not in (tmp_path / "watch.html").read_text(encoding="utf-8")
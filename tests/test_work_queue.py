@@ -0,0 +1,199 @@
+"""leases of the work queue, takeover of the expired leases, merge"""
+
+import time
+
+import pandas as pd
+
+from lib.continuous_data_testing.work_queue import MAX_ATTEMPTS
+from lib.continuous_data_testing.work_queue import STATE_DONE
+from lib.continuous_data_testing.work_queue import STATE_PENDING
+from lib.continuous_data_testing.work_queue import WorkQueue
+from lib.continuous_data_testing.work_queue import get_merged_results
+from lib.continuous_data_testing.work_queue import get_task_key
+from lib.continuous_data_testing.work_queue import merge
+from lib.continuous_data_testing.work_queue import spill_result
+
+TESTS = [("tests/a.sql", "test_run_sql[a.sql]"),
+         ("tests/b.yml#region=EU", "test_run_sql[b.yml#region=EU]"),
+         ("tests/c.yml", "test_run_sql[c.yml]")]
+
+
+def load_queue(tmp_path, lease_timeout=600, durations=None):
+    """queue of the tests"""
+
+    work_queue = WorkQueue(str(tmp_path / "run.sqlite"), lease_timeout=lease_timeout)
+    work_queue.load(TESTS, str(tmp_path / "spill"), durations=durations)
+
+    return work_queue
+
+
+def get_states(work_queue):
+    """{task_key: state}"""
+
+    return {task["task_key"]: task["state"] for task in work_queue.get_tasks()}
+
+
+def test_task_key_does_not_depend_on_the_checkout(tmp_path):
+    """the same key on the machines with the checkout in other directories"""
+
+    keys = [get_task_key(str(tmp_path / checkout / "sample_test" / "dual_3.yml#region=EU"),
+                         str(tmp_path / checkout)) for checkout in ("node1", "node2")]
+
+    assert keys == ["sample_test/dual_3.yml#region=EU"] * 2
+
+
+def test_lease_order(tmp_path):
+    """new tests first, then the longest, one worker per test"""
+
+    work_queue = load_queue(tmp_path, durations={"test_run_sql[a.sql]": 1,
+                                                 "test_run_sql[c.yml]": 5})
+
+    leases = [work_queue.lease(worker) for worker in ("w1", "w2", "w3", "w4")]
+
+    assert [lease[0] for lease in leases[:3]] == ["tests/b.yml#region=EU", "tests/c.yml",
+                                                  "tests/a.sql"]
+    assert leases[3] is None
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    """the test of a dead worker is leased again, the dead worker lost it"""
+
+    work_queue = load_queue(tmp_path, lease_timeout=0.05)
+
+    task_key, _ = work_queue.lease("dead")
+    time.sleep(0.1)
+
+    assert work_queue.lease("alive")[0] == task_key
+    assert not work_queue.renew(task_key, "dead")
+    assert work_queue.renew(task_key, "alive")
+
+    task = next(task for task in work_queue.get_tasks() if task["task_key"] == task_key)
+
+    assert task["worker"] == "alive"
+    assert task["attempts"] == 2
+
+
+def test_lease_expired_max_attempts(tmp_path):
+    """the test failing the workers is failed"""
+
+    work_queue = load_queue(tmp_path, lease_timeout=0.01)
+
+    for attempt in range(MAX_ATTEMPTS):
+        assert work_queue.lease(f"w{attempt}", {"tests/a.sql"})[0] == "tests/a.sql"
+        time.sleep(0.02)
+
+    assert work_queue.lease("w", {"tests/a.sql"}) is None
+
+    task = next(task for task in work_queue.get_tasks() if task["task_key"] == "tests/a.sql")
+
+    assert task["state"] == STATE_DONE
+    assert not task["condition"]
+
+
+def test_not_collected_tests_are_left_pending(tmp_path):
+    """the worker without the test leaves it to the other workers"""
+
+    work_queue = load_queue(tmp_path)
+
+    task_keys = {"tests/a.sql"}
+
+    leases = []
+
+    for task_key, _ in work_queue.iter_leases("w1", task_keys):
+        leases.append(task_key)
+        work_queue.complete(task_key, "w1", None, True)
+
+    assert leases == ["tests/a.sql"]
+    assert work_queue.is_finished(task_keys)
+    assert not work_queue.is_finished()
+    assert get_states(work_queue) == {"tests/a.sql": STATE_DONE,
+                                      "tests/b.yml#region=EU": STATE_PENDING,
+                                      "tests/c.yml": STATE_PENDING}
+
+
+def test_merge(tmp_path):
+    """one report of the spilled results, the tests not run are failed"""
+
+    work_queue = load_queue(tmp_path)
+    spill_dir = work_queue.get_meta("spill_dir")
+
+    for worker, condition in (("w1", True), ("w2", False)):
+        task_key, test_id = work_queue.lease(worker)
+
+        df = pd.DataFrame({"diff_col": [0 if condition else 1]})
+        df.attrs["condition"] = condition
+        df.attrs["config-file"] = task_key
+        df.attrs["description"] = test_id
+
+        spill_result(work_queue, spill_dir, task_key, worker, df)
+
+    df_index = merge(work_queue.db_file, output_html=str(tmp_path / "run.html"),
+                     output_xlsx=str(tmp_path / "run.xlsx"))
+
+    assert df_index["Worker"].tolist() == ["w1", "w2", None]
+    assert df_index["Diff result"].tolist()[0] == "Passed"
+    assert (df_index["Diff result"] != "Passed").sum() == 2
+    assert (tmp_path / "run.html").is_file()
+    assert (tmp_path / "run.xlsx").is_file()
+
+
+def test_lease_waits_for_the_upstream_tests(tmp_path):
+    """the longest test waits for its upstream test, the others are leased"""
+
+    work_queue = WorkQueue(str(tmp_path / "run.sqlite"))
+    work_queue.load(TESTS, str(tmp_path / "spill"),
+                    durations={"test_run_sql[a.sql]": 1, "test_run_sql[c.yml]": 5},
+                    dag={"tests/c.yml": ["tests/a.sql"]})
+
+    assert work_queue.lease("w1")[0] == "tests/b.yml#region=EU"
+    assert work_queue.lease("w2")[0] == "tests/a.sql"
+    assert work_queue.lease("w3") is None
+
+    work_queue.complete("tests/a.sql", "w2", None, True)
+
+    assert work_queue.lease("w2")[0] == "tests/c.yml"
+
+
+def test_dependents_of_failed_tests_are_skipped(tmp_path):
+    """the dependents of a failed test (and theirs) are skipped by the queue"""
+
+    work_queue = WorkQueue(str(tmp_path / "run.sqlite"))
+    work_queue.load(TESTS, str(tmp_path / "spill"),
+                    dag={"tests/b.yml#region=EU": ["tests/a.sql"],
+                         "tests/c.yml": ["tests/b.yml#region=EU"]})
+
+    assert work_queue.lease("w1")[0] == "tests/a.sql"
+    assert work_queue.lease("w2") is None
+
+    work_queue.complete("tests/a.sql", "w1", None, False, "diff")
+
+    assert work_queue.lease("w2") is None
+    assert work_queue.is_finished()
+
+    tasks = {task["task_key"]: task for task in work_queue.get_tasks()}
+
+    assert tasks["tests/b.yml#region=EU"]["skipped"] == "skipped: upstream failed a.sql"
+    assert tasks["tests/c.yml"]["skipped"] == "skipped: upstream failed b.yml#region=EU"
+    assert tasks["tests/c.yml"]["attempts"] == 0
+
+    results = get_merged_results(work_queue)
+
+    assert results["test_run_sql[c.yml]"].attrs["skipped"].startswith("skipped:")
+    assert not results["test_run_sql[c.yml]"].attrs["condition"]
+
+
+def test_release(tmp_path):
+    """the released lease is pending again, without the attempt"""
+
+    work_queue = load_queue(tmp_path)
+
+    task_key, _ = work_queue.lease("w1")
+    work_queue.release(task_key, "w2")
+
+    assert get_states(work_queue)[task_key] != STATE_PENDING
+
+    work_queue.release(task_key, "w1")
+
+    assert get_states(work_queue)[task_key] == STATE_PENDING
+    assert work_queue.get_tasks()[0]["attempts"] == 0
+    assert work_queue.lease("w2")[0] == task_key
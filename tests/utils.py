@@ -0,0 +1,15 @@
+"""helpers of the unit tests"""
+
+import os
+
+# repository root, the tests import lib.continuous_data_testing
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_test(directory, name, content):
+    """test yml or sql in the directory, path of the test"""
+
+    test_file = directory / name
+    test_file.write_text(content, encoding="utf-8")
+
+    return str(test_file)